@@ -118,7 +118,7 @@ class AbstractBuildSlave(pb.Avatar, service.MultiService):
         if not self.locks:
             return True
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access):
                 return False
         return True
 
@@ -296,7 +296,7 @@ class AbstractBuildSlave(pb.Avatar, service.MultiService):
 
             return self.updateSlave()
         d.addCallback(_accept_slave)
-        d.addCallback(lambda res: self.botmaster.triggerNewBuildCheck())
+        d.addCallback(lambda res: self.botmaster.triggerNewBuildCheckForSlave(self))
 
         # Finally, the slave gets a reference to this BuildSlave. They
         # receive this later, after we've started using them.
@@ -312,6 +312,7 @@ class BonsaiPoller(base.ChangeSource):
         except EmptyResult:
             return
 
+        new_changes = []
         for cinode in result.nodes:
             files = [file.filename + ' (revision '+file.revision+')'
                      for file in cinode.files]
@@ -320,5 +321,7 @@ class BonsaiPoller(base.ChangeSource):
                                comments = cinode.log,
                                when = cinode.date,
                                branch = self.branch)
-            self.parent.addChange(c)
+            new_changes.append(c)
+        if new_changes:
+            self.parent.addChanges(new_changes)
             self.lastChange = self.lastPoll
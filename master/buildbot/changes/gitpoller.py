@@ -1,23 +1,20 @@
 import time
 import tempfile
 import os
-import subprocess
 
-import select
-import errno
-
-from twisted.python import log, failure
-from twisted.internet import reactor, utils
+from twisted.python import log
+from twisted.internet import defer, reactor, utils
 from twisted.internet.task import LoopingCall
-from twisted.web.client import getPage
 
 from buildbot.changes import base, changes
 
 class GitPoller(base.ChangeSource):
-    """This source will poll a remote git repo for changes and submit
-    them to the change master."""
+    """This source will poll a remote git repository for changes and submit
+    them to the change master. All of the branches that it watches are
+    fetched at once, and the new commits on each branch are read from a
+    single 'git log' run."""
     
-    compare_attrs = ["repourl", "branch", "workdir",
+    compare_attrs = ["repourl", "branch", "branches", "workdir",
                      "pollinterval", "gitbin", "usetimestamps",
                      "category", "project"]
                      
@@ -30,7 +27,7 @@ class GitPoller(base.ChangeSource):
     def __init__(self, repourl, branch='master', 
                  workdir=None, pollinterval=10*60, 
                  gitbin='git', usetimestamps=True,
-                 category=None, project=None):
+                 category=None, project=None, branches=None):
         """
         @type  repourl: string
         @param repourl: the url that describes the remote repository,
@@ -63,10 +60,15 @@ class GitPoller(base.ChangeSource):
         @param project       project that the changes are associated to. Attached to
                              the Change object produced by this changesource such that
                              it can be targeted by change filters.
+
+        @type  branches:     list of strings
+        @param branches:     the branches to fetch, instead of just BRANCH.
+                             They are all fetched at once.
         """
         
         self.repourl = repourl
         self.branch = branch
+        self.branches = branches
         self.pollinterval = pollinterval
         self.lastChange = time.time()
         self.lastPoll = time.time()
@@ -87,10 +89,6 @@ class GitPoller(base.ChangeSource):
             log.msg('gitpoller: creating working dir %s' % self.workdir)
             os.makedirs(self.workdir)
             
-        if not os.path.exists(self.workdir + r'/.git'):
-            log.msg('gitpoller: initializing working dir')
-            os.system(self.gitbin + ' clone ' + self.repourl + ' ' + self.workdir)
-        
         reactor.callLater(0, self.loop.start, self.pollinterval)
         
         self.running = True
@@ -105,173 +103,184 @@ class GitPoller(base.ChangeSource):
         status = ""
         if not self.running:
             status = "[STOPPED - check log]"
-        str = 'GitPoller watching the remote git repository %s, branch: %s %s' \
-                % (self.repourl, self.branch, status)
+        str = 'GitPoller watching the remote git repository %s, branches: %s %s' \
+                % (self.repourl, ', '.join(self.getBranches()), status)
         return str
 
+    def getBranches(self):
+        if self.branches:
+            return self.branches
+        return [self.branch]
+
     def poll(self):
         if self.working:
             log.msg('gitpoller: not polling git repo because last poll is still working')
-        else:
-            self.working = True
-            d = self._get_changes()
-            d.addCallback(self._process_changes)
-            d.addCallbacks(self._changes_finished_ok, self._changes_finished_failure)
-            d.addCallback(self._catch_up)
-            d.addCallbacks(self._catch_up_finished_ok, self._catch_up__finished_failure)
-        return
+            return None
+        self.working = True
+        d = self._init_workdir()
+        d.addCallback(lambda _: self._fetch())
+        d.addCallback(lambda _: self._process_branches())
+        d.addErrback(self._poll_failed)
+        def done(res):
+            self.working = False
+            return res
+        d.addBoth(done)
+        return d
 
-    def _get_git_output(self, args):
-        git_args = [self.gitbin] + args
-        
-        p = subprocess.Popen(git_args,
-                             cwd=self.workdir,
-                             stdout=subprocess.PIPE)
-        
-        # dirty hack - work around EINTR oddness on Mac builder
-        while True:
-            try:
-                output = p.communicate()[0]
-                break
-            except (OSError, select.error), e:
-                if e[0] == errno.EINTR:
-                    continue
-                else:
-                    raise
-        
-        if p.returncode != 0:
-            raise EnvironmentError('call \'%s\' exited with error \'%s\', output: \'%s\'' % 
-                                    (args, p.returncode, output))
-        return output
+    # the branches are fetched into refs/gitpoller/fetched/BRANCH, and the
+    # last revision that changes were added for is kept in
+    # refs/gitpoller/last/BRANCH
 
-    def _get_commit_comments(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%s%n%b']
-        output = self._get_git_output(args)
-        
-        if len(output.strip()) == 0:
-            raise EnvironmentError('could not get commit comment for rev %s' % rev)
-        
-        return output
+    def _fetched_ref(self, branch):
+        return 'refs/gitpoller/fetched/' + branch
 
-    def _get_commit_timestamp(self, rev):
-        # unix timestamp
-        args = ['log', rev, '--no-walk', r'--format=%ct']
-        output = self._get_git_output(args)
-        
-        try:
-            stamp = float(output)
-        except Exception, e:
-            log.msg('gitpoller: caught exception converting output \'%s\' to timestamp' % output)
-            raise e
-        
-        return stamp
-        
-    def _get_commit_files(self, rev):
-        args = ['log', rev, '--name-only', '--no-walk', r'--format=%n']
-        fileList = self._get_git_output(args).split()
-        return fileList
-            
-    def _get_commit_name(self, rev):
-        args = ['log', rev, '--no-walk', r'--format=%cn']
-        output = self._get_git_output(args)
-        
-        if len(output.strip()) == 0:
-            raise EnvironmentError('could not get commit name for rev %s' % rev)
+    def _last_ref(self, branch):
+        return 'refs/gitpoller/last/' + branch
+
+    def _get_git_output(self, args):
+        """Run git in the working directory, without blocking the reactor.
+        Returns a Deferred that fires with its output, or fails if it
+        exits with an error."""
+        d = utils.getProcessOutputAndValue(self.gitbin, args,
+                                           env=os.environ, path=self.workdir)
+        def check(res):
+            stdout, stderr, code = res
+            if code != 0:
+                raise EnvironmentError('call \'%s\' exited with error \'%s\', output: \'%s\'' %
+                                       (args, code, stderr.strip()))
+            return stdout
+        d.addCallback(check)
+        return d
 
-        return output
+    def _init_workdir(self):
+        if os.path.exists(os.path.join(self.workdir, '.git')):
+            return defer.succeed(None)
+        log.msg('gitpoller: initializing working dir')
+        return self._get_git_output(['init', '--quiet'])
 
-    def _get_changes(self):
+    def _fetch(self):
         log.msg('gitpoller: polling git repo at %s' % self.repourl)
-
         self.lastPoll = time.time()
-        os.chdir(self.workdir)
-        
-        # get a deferred object that performs the fetch
-        args = ['fetch', self.repourl, self.branch]
-        d = utils.getProcessOutput(self.gitbin, args, env={}, errortoo=1 )
+        args = ['fetch', '--quiet', self.repourl]
+        for branch in self.getBranches():
+            args.append('+%s:%s' % (branch, self._fetched_ref(branch)))
+        return self._get_git_output(args)
 
+    def _process_branches(self):
+        d = defer.succeed(None)
+        for branch in self.getBranches():
+            d.addCallback(lambda _, branch=branch: self._process_branch(branch))
         return d
 
-    def _process_changes(self, res):
-        # get the change list
-        revListArgs = ['log', 'HEAD..FETCH_HEAD', r'--format=%H']
-        revs = self._get_git_output(revListArgs);
-        revCount = 0
-        
-        # process oldest change first
-        revList = revs.split()
-        if revList:
-            revList.reverse()
-            revCount = len(revList)
-            
-        log.msg('gitpoller: processing %d changes' % revCount )
-
-        for rev in revList:
-            if self.usetimestamps:
-                commit_timestamp = self._get_commit_timestamp(rev)
-            else:
-                commit_timestamp = None # use current time
-                
-            c = changes.Change(who = self._get_commit_name(rev),
-                               revision = rev,
-                               files = self._get_commit_files(rev),
-                               comments = self._get_commit_comments(rev),
-                               when = commit_timestamp,
-                               branch = self.branch,
-                               category = self.category,
-                               project = self.project,
-                               repository = self.repourl)
-            self.parent.addChange(c)
-            self.lastChange = self.lastPoll
-            
-    def _catch_up(self, res):
-        log.msg('gitpoller: catching up to FETCH_HEAD')
-        
-        args = ['reset', '--hard', 'FETCH_HEAD']
-        d = utils.getProcessOutputAndValue(self.gitbin, args, env={})
-        return d;
+    def _get_base(self, branch):
+        # the revision that new commits are counted from. A workdir from an
+        # older GitPoller has HEAD at the last revision it processed on
+        # self.branch. Any other branch without a last ref is new to us, and
+        # is just recorded, as it is in a new workdir.
+        d = utils.getProcessOutputAndValue(self.gitbin,
+                ['rev-parse', '--verify', '--quiet', self._last_ref(branch)],
+                env=os.environ, path=self.workdir)
+        def checkLast(res):
+            stdout, stderr, code = res
+            if code == 0:
+                return stdout.strip()
+            if branch != self.branch:
+                return None
+            d = utils.getProcessOutputAndValue(self.gitbin,
+                    ['rev-parse', '--verify', '--quiet', 'HEAD'],
+                    env=os.environ, path=self.workdir)
+            def checkHead(res):
+                stdout, stderr, code = res
+                if code == 0:
+                    return stdout.strip()
+                return None
+            d.addCallback(checkHead)
+            return d
+        d.addCallback(checkLast)
+        return d
 
-    def _changes_finished_ok(self, res):
-        assert self.working
-        # check for failure -- this is probably never hit but the twisted docs
-        # are not clear enough to be sure. it is being kept "just in case"
-        if isinstance(res, failure.Failure):
-            return self._changes_finished_failure(res)
+    def _process_branch(self, branch):
+        d = self._get_base(branch)
+        def getLog(baserev):
+            if baserev is None:
+                log.msg('gitpoller: starting to watch branch %s' % branch)
+                return []
+            return self._get_commits('%s..%s' % (baserev,
+                                                 self._fetched_ref(branch)))
+        d.addCallback(getLog)
+        def addChanges(commits):
+            log.msg('gitpoller: processing %d changes on branch %s'
+                    % (len(commits), branch))
+            new_changes = []
+            for rev, who, timestamp, comments, files in commits:
+                if not self.usetimestamps:
+                    timestamp = None # use current time
+                c = changes.Change(who = who,
+                                   revision = rev,
+                                   files = files,
+                                   comments = comments,
+                                   when = timestamp,
+                                   branch = branch,
+                                   category = self.category,
+                                   project = self.project,
+                                   repository = self.repourl)
+                new_changes.append(c)
+            if new_changes:
+                self.parent.addChanges(new_changes)
+                self.lastChange = self.lastPoll
+        d.addCallback(addChanges)
+        def catchUp(_):
+            d = self._get_git_output(['update-ref', self._last_ref(branch),
+                                      self._fetched_ref(branch)])
+            d.addErrback(self._catch_up_failed)
+            return d
+        d.addCallback(catchUp)
+        return d
 
-        return res
+    # each commit starts with an empty field, which can't be mistaken for
+    # one of the file names that follow the previous commit
+    LOG_FORMAT = r'--format=%x00%H%x00%cn%x00%ct%x00%s%n%b'
 
-    def _changes_finished_failure(self, res):
-        log.msg('gitpoller: repo poll failed: %s' % res)
-        assert self.working
-        # eat the failure to continue along the defered chain 
-        # - we still want to catch up
-        return None
-        
-    def _catch_up_finished_ok(self, res):
-        assert self.working
+    def _get_commits(self, revrange):
+        args = ['log', '--reverse', '--name-only', '-z', self.LOG_FORMAT,
+                revrange]
+        d = self._get_git_output(args)
+        d.addCallback(self._parse_log)
+        return d
 
-        # check for failure -- this is probably never hit but the twisted docs
-        # are not clear enough to be sure. it is being kept "just in case"
-        if isinstance(res, failure.Failure):
-            return self._catch_up__finished_failure(res)
-            
-        elif isinstance(res, tuple):
-            (stdout, stderr, code) = res
-            if code != 0:
-                e = EnvironmentError('catch up failed with exit code: %d' % code)
-                return self._catch_up__finished_failure(failure.Failure(e))
-        
-        self.working = False
-        return res
+    def _parse_log(self, output):
+        """Parse the output of LOG_FORMAT into a list of (revision, name,
+        timestamp, comments, files) tuples, oldest first."""
+        commits = []
+        fields = output.split('\0')
+        i = 0
+        while i < len(fields):
+            if fields[i] or i + 4 >= len(fields):
+                # the rest is the empty string after the last separator
+                i += 1
+                continue
+            rev, who, timestamp, comments = fields[i+1:i+5]
+            i += 5
+            files = []
+            while i < len(fields) and fields[i]:
+                name = fields[i]
+                if not files and name.startswith('\n'):
+                    name = name[1:]
+                files.append(name)
+                i += 1
+            if not who.strip():
+                raise EnvironmentError('could not get commit name for rev %s' % rev)
+            commits.append((rev, who, float(timestamp), comments, files))
+        return commits
 
-    def _catch_up__finished_failure(self, res):
-        assert self.working
-        assert isinstance(res, failure.Failure)
-        self.working = False
+    def _poll_failed(self, why):
+        log.msg('gitpoller: repo poll failed: %s' % why)
+        return None
 
-        log.msg('gitpoller: catch up failed: %s' % res)
+    def _catch_up_failed(self, why):
+        # the changes have been added, so polling again would add them twice
+        log.msg('gitpoller: catch up failed: %s' % why)
         log.msg('gitpoller: stopping service - please resolve issues in local repo: %s' %
                 self.workdir)
         self.stopService()
-        return res
-        
+        return None
@@ -102,18 +102,27 @@ class ChangeManager(service.MultiService):
     def addChange(self, change):
         """Deliver a file change event. The event should be a Change object.
         This method will timestamp the object as it is received."""
-        msg = ("adding change, who %s, %d files, rev=%s, branch=%s, repository=%s, "
-                "comments %s, category %s" % (change.who, len(change.files),
-                                              change.revision, change.branch, change.repository,
-                                              change.comments, change.category))
-        log.msg(msg.encode('utf-8', 'replace'))
+        self.addChanges([change])
+
+    def addChanges(self, changes):
+        """Deliver several Change objects at once. They are added to the
+        database in a single transaction, and the Schedulers are woken up
+        once for all of them."""
+        if not changes:
+            return
+        for change in changes:
+            msg = ("adding change, who %s, %d files, rev=%s, branch=%s, repository=%s, "
+                    "comments %s, category %s" % (change.who, len(change.files),
+                                                  change.revision, change.branch, change.repository,
+                                                  change.comments, change.category))
+            log.msg(msg.encode('utf-8', 'replace'))
 
         # this sets change.number, if it wasn't already set (by the
         # migration-from-pickle code). It also fires a notification which
         # wakes up the Schedulers.
-        self.parent.addChange(change)
+        self.parent.addChanges(changes)
 
-        self.pruneChanges(change.number)
+        self.pruneChanges(max([change.number for change in changes]))
 
     def pruneChanges(self, last_added_changeid):
         # this is an expensive operation, so only do it once per second, in case
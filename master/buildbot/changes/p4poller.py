@@ -212,6 +212,7 @@ class P4Source(base.ChangeSource, util.ComparableMixin):
                 else:
                     branch_files[branch] = [file]
 
+        new_changes = []
         for branch in branch_files:
             c = changes.Change(who=who,
                                files=branch_files[branch],
@@ -219,6 +220,7 @@ class P4Source(base.ChangeSource, util.ComparableMixin):
                                revision=str(num),
                                when=when,
                                branch=branch)
-            self.parent.addChange(c)
+            new_changes.append(c)
+        self.parent.addChanges(new_changes)
 
         self.last_change = num
@@ -18,6 +18,20 @@ class ChangePerspective(NewCredPerspective):
 
     def perspective_addChange(self, changedict):
         log.msg("perspective_addChange called")
+        change = self.makeChange(changedict)
+        if change:
+            self.changemaster.addChanges([change])
+
+    def perspective_addChanges(self, changedicts):
+        # like addChange, but all of the changes are added together, in a
+        # single database transaction
+        log.msg("perspective_addChanges called with %d changes"
+                % len(changedicts))
+        new_changes = [self.makeChange(changedict)
+                       for changedict in changedicts]
+        self.changemaster.addChanges([c for c in new_changes if c])
+
+    def makeChange(self, changedict):
         pathnames = []
         for path in changedict['files']:
             if self.prefix:
@@ -27,20 +41,20 @@ class ChangePerspective(NewCredPerspective):
                 path = path[len(self.prefix):]
             pathnames.append(path)
 
-        if pathnames:
-            change = changes.Change(who=changedict['who'],
-                                    files=pathnames,
-                                    comments=changedict['comments'],
-                                    branch=changedict.get('branch'),
-                                    revision=changedict.get('revision'),
-                                    revlink=changedict.get('revlink', ''),
-                                    category=changedict.get('category'),
-                                    when=changedict.get('when'),
-                                    properties=changedict.get('properties', {}),
-                                    repository=changedict.get('repository', '') or '',
-                                    project=changedict.get('project', '') or '',
-                                    )
-            self.changemaster.addChange(change)
+        if not pathnames:
+            return None
+        return changes.Change(who=changedict['who'],
+                              files=pathnames,
+                              comments=changedict['comments'],
+                              branch=changedict.get('branch'),
+                              revision=changedict.get('revision'),
+                              revlink=changedict.get('revlink', ''),
+                              category=changedict.get('category'),
+                              when=changedict.get('when'),
+                              properties=changedict.get('properties', {}),
+                              repository=changedict.get('repository', '') or '',
+                              project=changedict.get('project', '') or '',
+                              )
 
 class PBChangeSource(base.ChangeSource):
     compare_attrs = ["user", "passwd", "port", "prefix"]
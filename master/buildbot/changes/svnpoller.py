@@ -482,8 +482,7 @@ class SVNPoller(base.ChangeSource, util.ComparableMixin):
         return changes
 
     def submit_changes(self, changes):
-        for c in changes:
-            self.parent.addChange(c)
+        self.parent.addChanges(changes)
 
     def finished_ok(self, res):
         log.msg("SVNPoller finished polling %s" % res)
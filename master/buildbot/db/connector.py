@@ -165,6 +165,24 @@ class DBConnector(util.ComparableMixin):
         p = self.quoteq("?")
         return "(" + ",".join([p]*count) + ")"
 
+    def _txn_select_in(self, t, q, ids, batchsize=100):
+        """
+        Run query Q, which must end with 'IN ', once for each batch of IDS,
+        appending a placeholder list for the batch, and return all of the
+        resulting rows.  Q should already have had quoteq() applied.  This is
+        used by the bulk loaders below to replace one query per object with
+        one query per batch of objects.
+        """
+        ids = list(ids)
+        rows = []
+        while ids:
+            # sqlite has a maximum of 999 parameters, but we'll try to come in
+            # far short of that
+            batch, ids = ids[:batchsize], ids[batchsize:]
+            t.execute(q + self.parmlist(len(batch)), batch)
+            rows.extend(t.fetchall())
+        return rows
+
     def get_version(self):
         """Returns None for an empty database, or a number (probably 1) for
         the database's version"""
@@ -305,10 +323,19 @@ class DBConnector(util.ComparableMixin):
     # ChangeManager methods
 
     def addChangeToDatabase(self, change):
-        self.runInteractionNow(self._txn_addChangeToDatabase, change)
-        self._change_cache.add(change.number, change)
+        self.addChangesToDatabase([change])
+
+    def addChangesToDatabase(self, changes):
+        """Add all of CHANGES to the database in a single transaction, setting
+        their .number attributes, and send a single add-change notification
+        with the first and last of the new changeids."""
+        if not changes:
+            return
+        self.runInteractionNow(self._txn_addChangesToDatabase, changes)
+        for change in changes:
+            self._change_cache.add(change.number, change)
 
-    def _txn_addChangeToDatabase(self, t, change):
+    def _txn_addChangesToDatabase(self, t, changes):
         q = self.quoteq("INSERT INTO changes"
                         " (author,"
                         "  comments, is_dir,"
@@ -318,29 +345,41 @@ class DBConnector(util.ComparableMixin):
                         " VALUES (?, ?,?, ?,?,?, ?,?, ?,?)")
         # TODO: map None to.. empty string?
 
-        values = (change.who,
-                  change.comments, change.isdir,
-                  change.branch, change.revision, change.revlink,
-                  change.when, change.category, change.repository,
-                  change.project)
-        t.execute(q, values)
-        change.number = t.lastrowid
-
-        for link in change.links:
-            t.execute(self.quoteq("INSERT INTO change_links (changeid, link) "
-                                  "VALUES (?,?)"),
-                      (change.number, link))
-        for filename in change.files:
-            t.execute(self.quoteq("INSERT INTO change_files (changeid,filename)"
-                                  " VALUES (?,?)"),
-                      (change.number, filename))
-        for propname,propvalue in change.properties.properties.items():
-            encoded_value = json.dumps(propvalue)
-            t.execute(self.quoteq("INSERT INTO change_properties"
-                                  " (changeid, property_name, property_value)"
-                                  " VALUES (?,?,?)"),
-                      (change.number, propname, encoded_value))
-        self.notify("add-change", change.number)
+        links = []
+        files = []
+        properties = []
+        for change in changes:
+            values = (change.who,
+                      change.comments, change.isdir,
+                      change.branch, change.revision, change.revlink,
+                      change.when, change.category, change.repository,
+                      change.project)
+            # each change needs its own INSERT, to learn its changeid
+            t.execute(q, values)
+            change.number = t.lastrowid
+
+            for link in change.links:
+                links.append((change.number, link))
+            for filename in change.files:
+                files.append((change.number, filename))
+            for propname,propvalue in change.properties.properties.items():
+                encoded_value = json.dumps(propvalue)
+                properties.append((change.number, propname, encoded_value))
+
+        if links:
+            t.executemany(self.quoteq("INSERT INTO change_links"
+                                      " (changeid, link) VALUES (?,?)"),
+                          links)
+        if files:
+            t.executemany(self.quoteq("INSERT INTO change_files"
+                                      " (changeid,filename) VALUES (?,?)"),
+                          files)
+        if properties:
+            t.executemany(self.quoteq("INSERT INTO change_properties"
+                                      " (changeid, property_name, property_value)"
+                                      " VALUES (?,?,?)"),
+                          properties)
+        self.notify("add-change", changes[0].number, changes[-1].number)
 
     def changeEventGenerator(self, branches=[], categories=[], committers=[], minTime=0):
         q = "SELECT changeid FROM changes"
@@ -431,9 +470,10 @@ class DBConnector(util.ComparableMixin):
         # return a Deferred that fires with a Change instance, or None if
         # there is no Change with that number
         assert changeid >= 0
-        c = self._change_cache.get(changeid)
-        if c:
-            return defer.succeed(c)
+        return self._change_cache.get_or_load(changeid,
+                                              self._getChangeByNumber_query)
+
+    def _getChangeByNumber_query(self, changeid):
         d1 = self.runQuery(self.quoteq("SELECT author, comments,"
                                        " is_dir, branch, revision, revlink,"
                                        " when_timestamp, category,"
@@ -472,7 +512,6 @@ class DBConnector(util.ComparableMixin):
                    repository=repository, project=project)
         c.properties.updateFromProperties(properties)
         c.number = changeid
-        self._change_cache.add(changeid, c)
         return c
 
     def getChangesGreaterThan(self, last_changeid, t=None):
@@ -489,8 +528,8 @@ class DBConnector(util.ComparableMixin):
     def _txn_getChangesGreaterThan(self, t, last_changeid):
         q = self.quoteq("SELECT changeid FROM changes WHERE changeid > ?")
         t.execute(q, (last_changeid,))
-        changes = [self.getChangeNumberedNow(changeid, t)
-                   for (changeid,) in t.fetchall()]
+        changeids = [changeid for (changeid,) in t.fetchall()]
+        changes = self._txn_getChangesNumbered(t, changeids).values()
         changes.sort(key=lambda c: c.number)
         return changes
 
@@ -519,6 +558,58 @@ class DBConnector(util.ComparableMixin):
         return defer.gatherResults([self.getChangeByNumber(changeid)
                                     for changeid in changeids])
 
+    def _txn_getChangesNumbered(self, t, changeids):
+        """Load many changes at once, with one query per table (per batch of
+        100 changes) instead of four per change.  Returns a dictionary
+        mapping changeid to Change; missing changes are omitted."""
+        changes = {}
+        wanted = []
+        for changeid in changeids:
+            c = self._change_cache.get(changeid)
+            if c:
+                changes[changeid] = c
+            else:
+                wanted.append(changeid)
+        if not wanted:
+            return changes
+
+        links = bbcollections.defaultdict(list)
+        for changeid, link in self._txn_select_in(t,
+                self.quoteq("SELECT changeid, link FROM change_links"
+                            " WHERE changeid IN "), wanted):
+            links[changeid].append(link)
+        files = bbcollections.defaultdict(list)
+        for changeid, filename in self._txn_select_in(t,
+                self.quoteq("SELECT changeid, filename FROM change_files"
+                            " WHERE changeid IN "), wanted):
+            files[changeid].append(filename)
+        properties = self._txn_get_properties_from_db_bulk(t,
+                "change_properties", "changeid", wanted)
+
+        for row in self._txn_select_in(t,
+                self.quoteq("SELECT changeid, author, comments,"
+                            " is_dir, branch, revision, revlink,"
+                            " when_timestamp, category,"
+                            " repository, project"
+                            " FROM changes WHERE changeid IN "), wanted):
+            (changeid, who, comments,
+             isdir, branch, revision, revlink,
+             when, category, repository, project) = row
+            c_links = links[changeid]
+            c_links.sort()
+            c_files = files[changeid]
+            c_files.sort()
+            c = Change(who=who, files=c_files, comments=comments, isdir=isdir,
+                       links=c_links, revision=str_or_none(revision),
+                       when=when, branch=str_or_none(branch),
+                       category=category, revlink=revlink,
+                       repository=repository, project=project)
+            c.properties.updateFromProperties(properties[changeid])
+            c.number = changeid
+            self._change_cache.add(changeid, c)
+            changes[changeid] = c
+        return changes
+
     # SourceStamp-manipulating methods
 
     def getSourceStampNumberedNow(self, ssid, t=None):
@@ -573,6 +664,67 @@ class DBConnector(util.ComparableMixin):
         ss.ssid = ssid
         return ss
 
+    def _txn_getSourceStampsNumbered(self, t, ssids):
+        """Bulk version of getSourceStampNumberedNow: returns a dictionary
+        mapping ssid to SourceStamp, loading any that are not cached with a
+        handful of queries."""
+        sourcestamps = {}
+        wanted = []
+        for ssid in ssids:
+            ss = self._sourcestamp_cache.get(ssid)
+            if ss:
+                sourcestamps[ssid] = ss
+            elif ssid not in wanted:
+                wanted.append(ssid)
+        if not wanted:
+            return sourcestamps
+
+        rows = self._txn_select_in(t,
+                self.quoteq("SELECT id,branch,revision,patchid,project,"
+                            "repository FROM sourcestamps WHERE id IN "),
+                wanted)
+
+        patches = {}
+        patchids = [row[3] for row in rows if row[3] is not None]
+        for (patchid, patch_level, patch_text_base64,
+             subdir_u) in self._txn_select_in(t,
+                self.quoteq("SELECT id,patchlevel,patch_base64,subdir"
+                            " FROM patches WHERE id IN "), patchids):
+            patch_text = base64.b64decode(patch_text_base64)
+            if subdir_u:
+                patches[patchid] = (patch_level, patch_text, str(subdir_u))
+            else:
+                patches[patchid] = (patch_level, patch_text)
+
+        ss_changeids = bbcollections.defaultdict(list)
+        for ssid, changeid in self._txn_select_in(t,
+                self.quoteq("SELECT sourcestampid, changeid"
+                            " FROM sourcestamp_changes"
+                            " WHERE sourcestampid IN "), wanted):
+            ss_changeids[ssid].append(changeid)
+        all_changeids = []
+        for changeids in ss_changeids.values():
+            changeids.sort()
+            all_changeids.extend(changeids)
+        changes = self._txn_getChangesNumbered(t, all_changeids)
+
+        for (ssid, branch_u, revision_u, patchid,
+             project, repository) in rows:
+            patch = None
+            if patchid is not None:
+                patch = patches[patchid]
+            ss_changes = None
+            if ss_changeids[ssid]:
+                ss_changes = [changes.get(changeid)
+                              for changeid in ss_changeids[ssid]]
+            ss = SourceStamp(str_or_none(branch_u), str_or_none(revision_u),
+                             patch, ss_changes, project=project,
+                             repository=repository)
+            ss.ssid = ssid
+            self._sourcestamp_cache.add(ssid, ss)
+            sourcestamps[ssid] = ss
+        return sourcestamps
+
     # Properties methods
 
     def get_properties_from_db(self, tablename, idname, id, t=None):
@@ -594,6 +746,19 @@ class DBConnector(util.ComparableMixin):
             retval.setProperty(str(key), value, source)
         return retval
 
+    def _txn_get_properties_from_db_bulk(self, t, tablename, idname, ids):
+        # like _txn_get_properties_from_db, but for many ids at once; returns
+        # a dictionary mapping each id to a Properties instance
+        q = self.quoteq("SELECT %s,property_name,property_value FROM %s"
+                        " WHERE %s IN " % (idname, tablename, idname))
+        retval = bbcollections.defaultdict(Properties)
+        for id in ids:
+            retval[id] = Properties()
+        for id, key, valuepair in self._txn_select_in(t, q, ids):
+            value, source = json.loads(valuepair)
+            retval[id].setProperty(str(key), value, source)
+        return retval
+
     # Scheduler manipulation methods
 
     def addSchedulers(self, added):
@@ -652,6 +817,16 @@ class DBConnector(util.ComparableMixin):
         assert state_json is not None
         return json.loads(state_json)
 
+    def scheduler_get_states(self, schedulerids, t):
+        """Return a dictionary mapping each of SCHEDULERIDS to its state,
+        with one query per batch of schedulers."""
+        states = {}
+        for schedulerid, state_json in self._txn_select_in(t,
+                self.quoteq("SELECT schedulerid, state FROM schedulers"
+                            " WHERE schedulerid IN "), schedulerids):
+            states[schedulerid] = json.loads(state_json)
+        return states
+
     def scheduler_set_state(self, schedulerid, t, state):
         state_json = json.dumps(state)
         q = self.quoteq("UPDATE schedulers SET state=? WHERE schedulerid=?")
@@ -713,6 +888,7 @@ class DBConnector(util.ComparableMixin):
             brids.append(brid)
         self.notify("add-buildset", bsid)
         self.notify("add-buildrequest", *brids)
+        self.notify("add-buildrequest-builders", *set(builderNames))
         return bsid
 
     def scheduler_classify_change(self, schedulerid, number, important, t):
@@ -721,6 +897,17 @@ class DBConnector(util.ComparableMixin):
                         " VALUES (?,?,?)")
         t.execute(q, (schedulerid, number, bool(important)))
 
+    def scheduler_classify_changes(self, classifications, t):
+        # CLASSIFICATIONS is a list of (schedulerid, changeid, important)
+        if not classifications:
+            return
+        q = self.quoteq("INSERT INTO scheduler_changes"
+                        " (schedulerid, changeid, important)"
+                        " VALUES (?,?,?)")
+        t.executemany(q, [(schedulerid, number, bool(important))
+                          for (schedulerid, number, important)
+                          in classifications])
+
     def scheduler_get_classified_changes(self, schedulerid, t):
         q = self.quoteq("SELECT changeid, important"
                         " FROM scheduler_changes"
@@ -831,8 +1018,72 @@ class DBConnector(util.ComparableMixin):
             q += " LIMIT %s" % limit
         t.execute(self.quoteq(q),
                 (buildername, old, master_name, master_incarnation))
-        requests = [self.getBuildRequestWithNumber(brid, t)
-                    for (brid,) in t.fetchall()]
+        brids = [brid for (brid,) in t.fetchall()]
+        return self.getBuildRequestsWithNumbers(brids, t)
+
+    def get_unclaimed_buildrequest_summary(self, old, master_name,
+                                           master_incarnation):
+        """Return a dictionary mapping the name of each builder that has
+        unclaimed build requests to a tuple of (submit time of its oldest
+        request, highest priority of its requests), using a single query."""
+        return self.runInteractionNow(
+                self._txn_get_unclaimed_buildrequest_summary, old,
+                master_name, master_incarnation)
+    def _txn_get_unclaimed_buildrequest_summary(self, t, old, master_name,
+                                                master_incarnation):
+        q = ("SELECT br.buildername, MIN(bs.submitted_at), MAX(br.priority)"
+             " FROM buildrequests AS br, buildsets AS bs"
+             " WHERE br.complete=0"
+             " AND br.buildsetid=bs.id"
+             " AND (br.claimed_at<?"
+             "      OR (br.claimed_by_name=?"
+             "          AND br.claimed_by_incarnation!=?))"
+             " GROUP BY br.buildername")
+        t.execute(self.quoteq(q), (old, master_name, master_incarnation))
+        summary = {}
+        for (buildername, oldest, priority) in t.fetchall():
+            summary[buildername] = (oldest, priority)
+        return summary
+
+    def getBuildRequestsWithNumbers(self, brids, t=None):
+        """Load the BuildRequests with the given ids, in the same order,
+        using a fixed number of queries (per batch of 100 requests) rather
+        than several per request.  Missing requests are omitted."""
+        if t:
+            return self._txn_getBuildRequestsWithNumbers(t, brids)
+        return self.runInteractionNow(self._txn_getBuildRequestsWithNumbers,
+                                      brids)
+
+    def _txn_getBuildRequestsWithNumbers(self, t, brids):
+        rows = self._txn_select_in(t,
+                self.quoteq("SELECT br.id, br.buildsetid, bs.reason,"
+                            " bs.sourcestampid, br.buildername,"
+                            " bs.submitted_at, br.priority"
+                            " FROM buildrequests AS br, buildsets AS bs"
+                            " WHERE br.buildsetid=bs.id AND br.id IN "),
+                brids)
+        rows = dict([(row[0], row) for row in rows])
+        bsids = set([row[1] for row in rows.values()])
+        ssids = set([row[3] for row in rows.values()])
+        sourcestamps = self._txn_getSourceStampsNumbered(t, ssids)
+        properties = self._txn_get_properties_from_db_bulk(t,
+                "buildset_properties", "buildsetid", bsids)
+
+        requests = []
+        for brid in brids:
+            if brid not in rows:
+                continue
+            (brid, bsid, reason, ssid, builder_name,
+             submitted_at, priority) = rows[brid]
+            # BuildRequest copies the properties, so requests from the same
+            # buildset do not share them
+            br = BuildRequest(reason, sourcestamps.get(ssid), builder_name,
+                              properties[bsid])
+            br.submittedAt = submitted_at
+            br.priority = priority
+            br.id = brid
+            br.bsid = bsid
+            requests.append(br)
         return requests
 
     def claim_buildrequests(self, now, master_name, master_incarnation, brids,
@@ -903,14 +1154,21 @@ class DBConnector(util.ComparableMixin):
     def _txn_resubmit_buildreqs(self, t, brids):
         # the interrupted build that gets resubmitted will still have the
         # same submitted_at value, so it should be re-started first
-        while brids:
-            batch, brids = brids[:100], brids[100:]
+        buildernames = set()
+        remaining = brids
+        while remaining:
+            batch, remaining = remaining[:100], remaining[100:]
             q = self.quoteq("UPDATE buildrequests"
                             " SET claimed_at=0,"
                             "     claimed_by_name=NULL, claimed_by_incarnation=NULL"
                             " WHERE id IN " + self.parmlist(len(batch)))
             t.execute(q, batch)
+            q = self.quoteq("SELECT DISTINCT buildername FROM buildrequests"
+                            " WHERE id IN " + self.parmlist(len(batch)))
+            t.execute(q, batch)
+            buildernames.update([bn for (bn,) in t.fetchall()])
         self.notify("add-buildrequest", *brids)
+        self.notify("add-buildrequest-builders", *buildernames)
 
     def retire_buildrequests(self, brids, results):
         return self.runInteractionNow(self._txn_retire_buildreqs, brids,results)
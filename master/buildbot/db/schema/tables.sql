@@ -32,6 +32,12 @@ CREATE TABLE buildrequests (
 
     `complete_at` INTEGER
 );
+CREATE INDEX `buildrequests_buildsetid` ON `buildrequests` (`buildsetid`);
+CREATE INDEX `buildrequests_complete` ON `buildrequests` (`complete`);
+CREATE INDEX `buildrequests_claimed_at` ON `buildrequests` (`claimed_at`);
+CREATE INDEX `buildrequests_claimed_by_name` ON `buildrequests` (`claimed_by_name`);
+CREATE INDEX `buildrequests_buildername_complete_claimed_at` ON `buildrequests` (`buildername`, `complete`, `claimed_at`);
+CREATE INDEX `buildrequests_buildsetid_complete` ON `buildrequests` (`buildsetid`, `complete`);
 CREATE TABLE builds (
     `id` INTEGER PRIMARY KEY AUTOINCREMENT,
     `number` INTEGER NOT NULL, -- BuilderStatus.getBuild(number)
@@ -40,11 +46,14 @@ CREATE TABLE builds (
     `start_time` INTEGER NOT NULL,
     `finish_time` INTEGER
 );
+CREATE INDEX `builds_number` ON `builds` (`number`);
+CREATE INDEX `builds_brid` ON `builds` (`brid`);
 CREATE TABLE buildset_properties (
     `buildsetid` INTEGER NOT NULL,
     `property_name` VARCHAR(256) NOT NULL,
     `property_value` VARCHAR(1024) NOT NULL -- too short?
 );
+CREATE INDEX `buildset_properties_buildsetid` ON `buildset_properties` (`buildsetid`);
 CREATE TABLE buildsets (
     `id` INTEGER PRIMARY KEY AUTOINCREMENT,
     `external_idstring` VARCHAR(256),
@@ -56,19 +65,24 @@ CREATE TABLE buildsets (
     `results` SMALLINT -- 0=SUCCESS,2=FAILURE, from status/builder.py
      -- results is NULL until complete==1
 );
+CREATE INDEX `buildsets_complete` ON `buildsets` (`complete`);
+CREATE INDEX `buildsets_submitted_at` ON `buildsets` (`submitted_at`);
 CREATE TABLE change_files (
     `changeid` INTEGER NOT NULL,
     `filename` VARCHAR(1024) NOT NULL
 );
+CREATE INDEX `change_files_changeid` ON `change_files` (`changeid`);
 CREATE TABLE change_links (
     `changeid` INTEGER NOT NULL,
     `link` VARCHAR(1024) NOT NULL
 );
+CREATE INDEX `change_links_changeid` ON `change_links` (`changeid`);
 CREATE TABLE change_properties (
     `changeid` INTEGER NOT NULL,
     `property_name` VARCHAR(256) NOT NULL,
     `property_value` VARCHAR(1024) NOT NULL -- too short?
 );
+CREATE INDEX `change_properties_changeid` ON `change_properties` (`changeid`);
 CREATE TABLE changes (
     `changeid` INTEGER PRIMARY KEY AUTOINCREMENT, -- also serves as 'change number'
     `author` VARCHAR(1024) NOT NULL,
@@ -88,6 +102,11 @@ CREATE TABLE changes (
     -- later to filter changes
     `project` text not null default ''
 );
+CREATE INDEX `changes_branch` ON `changes` (`branch`);
+CREATE INDEX `changes_revision` ON `changes` (`revision`);
+CREATE INDEX `changes_author` ON `changes` (`author`);
+CREATE INDEX `changes_category` ON `changes` (`category`);
+CREATE INDEX `changes_when_timestamp` ON `changes` (`when_timestamp`);
 
 CREATE TABLE patches (
     `id` INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -99,6 +118,7 @@ CREATE TABLE sourcestamp_changes (
     `sourcestampid` INTEGER NOT NULL,
     `changeid` INTEGER NOT NULL
 );
+CREATE INDEX `sourcestamp_changes_sourcestampid_changeid` ON `sourcestamp_changes` (`sourcestampid`, `changeid`);
 CREATE TABLE sourcestamps (
     `id` INTEGER PRIMARY KEY AUTOINCREMENT,
     `branch` VARCHAR(256) default NULL,
@@ -133,6 +153,8 @@ CREATE TABLE scheduler_changes (
     `changeid` INTEGER,
     `important` SMALLINT
 );
+CREATE INDEX `scheduler_changes_changeid` ON `scheduler_changes` (`changeid`);
+CREATE INDEX `scheduler_changes_schedulerid_changeid` ON `scheduler_changes` (`schedulerid`, `changeid`);
 
 -- This stores buildsets in which a particular scheduler is interested.
 -- On every run, a scheduler checks its upstream buildsets for completion
@@ -143,6 +165,9 @@ CREATE TABLE scheduler_upstream_buildsets (
     `schedulerid` INTEGER,
     `active` SMALLINT
 );
+CREATE INDEX `scheduler_upstream_buildsets_buildsetid` ON `scheduler_upstream_buildsets` (`buildsetid`);
+CREATE INDEX `scheduler_upstream_buildsets_active` ON `scheduler_upstream_buildsets` (`active`);
+CREATE INDEX `scheduler_upstream_buildsets_schedulerid_active` ON `scheduler_upstream_buildsets` (`schedulerid`, `active`);
 
 --
 -- Schema Information
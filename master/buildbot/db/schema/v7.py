@@ -0,0 +1,64 @@
+from buildbot.db.schema import base
+
+class Upgrader(base.Upgrader):
+    def upgrade(self):
+        # get_unclaimed_buildrequests and get_pending_brids_for_builder look
+        # up requests by builder, and only want the incomplete ones
+        self.add_index("buildrequests",
+                       [("buildername", 255), "complete", "claimed_at"])
+        self.drop_index("buildrequests", "buildername")
+
+        # _check_buildset and examine_buildset look at the completion of
+        # every request in a buildset
+        self.add_index("buildrequests", ["buildsetid", "complete"])
+
+        # scheduler_get_classified_changes selects by scheduler, and
+        # scheduler_retire_changes deletes by scheduler and change
+        self.add_index("scheduler_changes", ["schedulerid", "changeid"])
+        self.drop_index("scheduler_changes", "schedulerid")
+
+        # scheduler_get_subscribed_buildsets only wants active subscriptions
+        self.add_index("scheduler_upstream_buildsets",
+                       ["schedulerid", "active"])
+        self.drop_index("scheduler_upstream_buildsets", "schedulerid")
+
+        # _txn_getSourceStampNumbered can be answered from the index alone
+        self.add_index("sourcestamp_changes", ["sourcestampid", "changeid"])
+        self.drop_index("sourcestamp_changes", "sourcestampid")
+
+        self.set_version()
+
+    def add_index(self, table, columns):
+        # each column is either a name, or a (name, length) tuple; the length
+        # is used as a prefix length on MySQL, which cannot index all of a
+        # long VARCHAR
+        colnames = []
+        colspecs = []
+        for col in columns:
+            length = None
+            if isinstance(col, tuple):
+                col, length = col
+            colnames.append(col)
+            if length is not None and self.dbapiName == 'MySQLdb':
+                colspecs.append("`%s` (%i)" % (col, length))
+            else:
+                colspecs.append("`%s`" % col)
+        name = "%s_%s" % (table, "_".join(colnames))
+        q = "CREATE INDEX `%s` ON `%s` (%s)" % (name, table, ", ".join(colspecs))
+        cursor = self.conn.cursor()
+        cursor.execute(q)
+
+    def drop_index(self, table, column):
+        # remove a v5 single-column index that is now a prefix of one of the
+        # composite indexes above, so it no longer slows down inserts
+        name = "%s_%s" % (table, column)
+        if self.dbapiName == 'MySQLdb':
+            q = "DROP INDEX `%s` ON `%s`" % (name, table)
+        else:
+            q = "DROP INDEX `%s`" % name
+        cursor = self.conn.cursor()
+        cursor.execute(q)
+
+    def set_version(self):
+        c = self.conn.cursor()
+        c.execute("""UPDATE version set version = 7 where version = 6""")
@@ -32,6 +32,11 @@ class IChangeSource(Interface):
     and pass it through::
 
       self.changemaster.addChange(change)
+
+    Several Changes that arrive together should be passed through at once,
+    so that they are added to the database in a single transaction::
+
+      self.changemaster.addChanges(changes)
     """
 
     def start():
@@ -446,6 +451,31 @@ class IBuilderStatus(Interface):
                            of builds that will be examined.
         """
 
+    def getBuildSummary(number):
+        """Return a L{buildbot.status.summary.BuildSummary} describing the
+        given build, or None if it does not exist. Negative numbers count
+        back from the most recent build, as for getBuild(). A summary holds
+        the number, times, results, branch, revisions, slavename and text of
+        a build, and is much cheaper to get than the IBuildStatus itself."""
+
+    def generateBuildSummaries(max_search=None):
+        """Return a generator of BuildSummary objects, starting with the most
+        recent build and progressing backwards. Builds that no longer exist
+        are represented by None. If max_search is given, at most that many
+        builds are examined."""
+
+    def getSourceStampIndex():
+        """Return a L{buildbot.status.ssindex.SourceStampIndex} of the most
+        recent sourcestamps this builder has built on each branch, with the
+        numbers of the builds that built them. It is kept up to date as builds start and
+        finish."""
+
+    def getStatusVersion():
+        """Return a counter that is incremented whenever this builder's
+        status (its state, or its current, cached or pending builds)
+        changes. It is only meaningful within a single run of the
+        buildmaster."""
+
     def subscribe(receiver):
         """Register an IStatusReceiver to receive new status events. The
         receiver will be given builderChangedState, buildStarted, and
@@ -598,6 +628,12 @@ class IBuildStatus(Interface):
         objects. This may return an empty or partially-filled dictionary
         until the build has completed."""
 
+    def getStatusVersion():
+        """Return a counter that is incremented whenever the status of this
+        build or of one of its steps changes. It stops changing once the
+        build has finished. It is only meaningful within a single run of the
+        buildmaster."""
+
     # subscription interface
 
     def subscribe(receiver, updateInterval=None):
@@ -712,6 +748,11 @@ class IBuildStepStatus(Interface):
         successful Steps do not usually contribute any text to the overall
         build."""
 
+    def getLockWaitTimes():
+        """Return a dictionary mapping lock names to the number of seconds
+        this step spent waiting to acquire that lock. Locks that were
+        available immediately do not appear."""
+
     # subscription interface
 
     def subscribe(receiver, updateInterval=10):
@@ -852,17 +893,38 @@ class IStatusLog(Interface):
     def readlines(channel=LOG_CHANNEL_STDOUT):
         """Read lines from one channel of the logfile. This returns an
         iterator that will provide single lines of text (including the
-        trailing newline).
+        trailing newline). The logfile is read incrementally as the iterator
+        is consumed, so this is suitable for very large logs.
+
+        'channel' may also be a list of channels, whose text is then split
+        into lines as if it had been joined together.
         """
 
     def getTextWithHeaders():
         """Return one big string with the contents of the Log. This merges
         all chunks (including headers) together."""
 
-    def getChunks():
+    def getChunks(channels=[], onlyText=False, start=None, end=None):
         """Generate a list of (channel, text) tuples. 'channel' is a number,
         0 for stdout, 1 for stderr, 2 for header. (note that stderr is merged
-        into stdout if PTYs are in use)."""
+        into stdout if PTYs are in use).
+
+        If 'channels' is non-empty, only chunks from those channels are
+        produced. If 'onlyText' is True, the bare text of each chunk is
+        produced instead of a tuple.
+
+        'start' and 'end' are byte offsets into the text of the whole log
+        (all channels together, as returned by getTextWithHeaders), and
+        limit the output to that range. Logs with a chunk index can seek
+        straight to 'start' without reading what comes before it."""
+
+    def getLength():
+        """Return the number of bytes of text (in all channels, including
+        headers) that have been added to the log so far."""
+
+    def tail(nbytes, channels=[], onlyText=False):
+        """Like getChunks, but only produce the last 'nbytes' bytes of the
+        log."""
 
 class IStatusLogConsumer(Interface):
     """I am an object which can be passed to IStatusLog.subscribeConsumer().
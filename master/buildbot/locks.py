@@ -1,4 +1,6 @@
-# -*- test-case-name: buildbot.test.test_locks -*-
+# -*- test-case-name: buildbot.test.unit.test_locks -*-
+
+import collections
 
 from twisted.python import log
 from twisted.internet import reactor, defer
@@ -14,60 +16,101 @@ class BaseLock:
     Class handling claiming and releasing of L{self}, and keeping track of
     current and waiting owners.
 
-    @note: Ideally, we'd like to maintain FIFO order. The place to do that
-           would be the L{isAvailable()} function. However, this function is
-           called by builds/steps both for the first time, and after waking
-           them up by L{self} from the L{self.waiting} queue. There is
-           currently no way of distinguishing between them.
+    Waiters are served in order of decreasing priority, and in FIFO order
+    among waiters of the same priority. When a release makes room for the
+    waiter at the head of the queue, that room is reserved for it before its
+    deferred fires, so that nobody can slip in between the wakeup and the
+    waiter's claim. Newcomers never overtake a non-empty queue.
+
+    A waiter that is woken up but then finds that it has to wait for some
+    other lock must give the reservation back, with L{cancelReservation}
+    (or L{stopWaitingUntilAvailable}), so that no owner holds on to one
+    lock while waiting for another.
     """
     description = "<BaseLock>"
 
     def __init__(self, name, maxCount=1):
         self.name = name          # Name of the lock
-        self.waiting = []         # Current queue, tuples (LockAccess, deferred)
         self.owners = []          # Current owners, tuples (owner, LockAccess)
         self.maxCount = maxCount  # maximal number of counting owners
 
+        # running counts of exclusive and counting slots in use, including
+        # those reserved for woken-up waiters
+        self.numExclusive = 0
+        self.numCounting = 0
+        self.reserved = {}        # owner -> LockAccess, handed over on wakeup
+
+        # waiting queues, one deque of (owner, LockAccess, deferred, time)
+        # per priority, and the priorities in decreasing order
+        self.waiting = {}
+        self.priorities = []
+        self.numWaiting = 0
+
+        # lock-wait statistics
+        self.waitCount = 0
+        self.totalWaitTime = 0
+        self.maxWaitTime = 0
+
     def __repr__(self):
         return self.description
 
     def _getOwnersCount(self):
-        """ Return the number of current exclusive and counting owners.
+        """ Return the number of current exclusive and counting owners,
+            including reservations.
 
             @return: Tuple (number exclusive owners, number counting owners)
         """
-        num_excl, num_counting = 0, 0
-        for owner in self.owners:
-            if owner[1].mode == 'exclusive':
-                num_excl = num_excl + 1
-            else: # mode == 'counting'
-                num_counting = num_counting + 1
-
-        assert (num_excl == 1 and num_counting == 0) \
-                or (num_excl == 0 and num_counting <= self.maxCount)
-        return num_excl, num_counting
-
-
-    def isAvailable(self, access):
-        """ Return a boolean whether the lock is available for claiming """
-        debuglog("%s isAvailable(%s): self.owners=%r"
-                                            % (self, access, self.owners))
-        num_excl, num_counting = self._getOwnersCount()
+        assert (self.numExclusive == 1 and self.numCounting == 0) \
+                or (self.numExclusive == 0
+                    and self.numCounting <= self.maxCount)
+        return self.numExclusive, self.numCounting
+
+    def _hasRoomFor(self, access):
         if access.mode == 'counting':
             # Wants counting access
-            return num_excl == 0 and num_counting < self.maxCount
+            return self.numExclusive == 0 and self.numCounting < self.maxCount
         else:
             # Wants exclusive access
-            return num_excl == 0 and num_counting == 0
+            return self.numExclusive == 0 and self.numCounting == 0
+
+    def _take(self, access):
+        if access.mode == 'counting':
+            self.numCounting = self.numCounting + 1
+        else:
+            self.numExclusive = self.numExclusive + 1
+        self._getOwnersCount()
+
+    def _give(self, access):
+        if access.mode == 'counting':
+            self.numCounting = self.numCounting - 1
+        else:
+            self.numExclusive = self.numExclusive - 1
+        assert self.numCounting >= 0 and self.numExclusive >= 0
+
+    def isAvailable(self, owner, access):
+        """ Return a boolean whether the lock is available for claiming by
+        OWNER """
+        debuglog("%s isAvailable(%s, %s): self.owners=%r"
+                                    % (self, owner, access, self.owners))
+        if self.reserved.get(owner) == access:
+            return True
+        if self.numWaiting:
+            # be fair to those who were here first
+            return False
+        return self._hasRoomFor(access)
 
     def claim(self, owner, access):
         """ Claim the lock (lock must be available) """
         debuglog("%s claim(%s, %s)" % (self, owner, access.mode))
         assert owner is not None
-        assert self.isAvailable(access), "ask for isAvailable() first"
+        assert self.isAvailable(owner, access), "ask for isAvailable() first"
 
         assert isinstance(access, LockAccess)
         assert access.mode in ['counting', 'exclusive']
+        if self.reserved.get(owner) == access:
+            del self.reserved[owner]
+        else:
+            self._take(access)
         self.owners.append((owner, access))
         debuglog(" %s is claimed '%s'" % (self, access.mode))
 
@@ -79,51 +122,104 @@ class BaseLock:
         entry = (owner, access)
         assert entry in self.owners
         self.owners.remove(entry)
+        self._give(access)
+        self._wakeWaiters()
+
+    def _wakeWaiters(self):
         # who can we wake up?
         # After an exclusive access, we may need to wake up several waiting.
-        # Break out of the loop when the first waiting client should not be awakened.
-        num_excl, num_counting = self._getOwnersCount()
-        while len(self.waiting) > 0:
-            access, d = self.waiting[0]
-            if access.mode == 'counting':
-                if num_excl > 0 or num_counting == self.maxCount:
-                    break
-                else:
-                    num_counting = num_counting + 1
-            else:
-                # access.mode == 'exclusive'
-                if num_excl > 0 or num_counting > 0:
-                    break
-                else:
-                    num_excl = num_excl + 1
-
-            del self.waiting[0]
-            reactor.callLater(0, d.callback, self)
-
-    def waitUntilMaybeAvailable(self, owner, access):
+        # Break out of the loop when the first waiting client should not be
+        # awakened.
+        now = util.now()
+        while self.numWaiting:
+            priority = self.priorities[0]
+            queue = self.waiting[priority]
+            owner, access, d, started = queue[0]
+            if not self._hasRoomFor(access):
+                break
+            queue.popleft()
+            if not queue:
+                del self.waiting[priority]
+                del self.priorities[0]
+            self.numWaiting = self.numWaiting - 1
+
+            # hand the room over to the waiter
+            self._take(access)
+            self.reserved[owner] = access
+
+            waited = now - started
+            self.waitCount = self.waitCount + 1
+            self.totalWaitTime = self.totalWaitTime + waited
+            self.maxWaitTime = max(self.maxWaitTime, waited)
+            reactor.callLater(0, self._fireWaiter, d)
+
+    def _fireWaiter(self, d):
+        # the waiter may have been interrupted in the meantime
+        if not d.called:
+            d.callback(self)
+
+    def waitUntilMaybeAvailable(self, owner, access, priority=0):
         """Fire when the lock *might* be available. The caller will need to
         check with isAvailable() when the deferred fires. This loose form is
         used to avoid deadlocks. If we were interested in a stronger form,
         this would be named 'waitUntilAvailable', and the deferred would fire
         after the lock had been claimed.
+
+        Waiters with a higher PRIORITY are woken before those with a lower
+        one.
         """
         debuglog("%s waitUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        if self.isAvailable(access):
+        if self.isAvailable(owner, access):
             return defer.succeed(self)
         d = defer.Deferred()
-        self.waiting.append((access, d))
+        if priority not in self.waiting:
+            self.waiting[priority] = collections.deque()
+            # keep the priorities sorted in decreasing order; there are
+            # only ever a handful of them
+            self.priorities.append(priority)
+            self.priorities.sort()
+            self.priorities.reverse()
+        self.waiting[priority].append((owner, access, d, util.now()))
+        self.numWaiting = self.numWaiting + 1
         return d
 
     def stopWaitingUntilAvailable(self, owner, access, d):
         debuglog("%s stopWaitingUntilAvailable(%s)" % (self, owner))
         assert isinstance(access, LockAccess)
-        assert (access, d) in self.waiting
-        self.waiting.remove( (access, d) )
+        for priority in self.priorities:
+            queue = self.waiting[priority]
+            for entry in queue:
+                if entry[0] == owner and entry[1] == access and entry[2] == d:
+                    queue.remove(entry)
+                    if not queue:
+                        del self.waiting[priority]
+                        self.priorities.remove(priority)
+                    self.numWaiting = self.numWaiting - 1
+                    # it may have been holding up those behind it
+                    self._wakeWaiters()
+                    return
+        # we were already woken up, but the deferred hasn't fired yet
+        assert self.reserved.get(owner) == access
+        self.cancelReservation(owner, access)
+
+    def cancelReservation(self, owner, access):
+        """Give back room that was handed over to OWNER when it was woken
+        up, if it has not been claimed yet."""
+        if self.reserved.get(owner) != access:
+            return
+        del self.reserved[owner]
+        self._give(access)
+        self._wakeWaiters()
 
     def isOwner(self, owner, access):
         return (owner, access) in self.owners
 
+    def getWaitStatistics(self):
+        """Return a tuple (number of waits, total seconds spent waiting,
+        longest wait) for the owners that have had to wait for this lock."""
+        return (self.waitCount, self.totalWaitTime, self.maxWaitTime)
+
 
 class RealMasterLock(BaseLock):
     def __init__(self, lockid):
@@ -72,6 +72,8 @@ class BotMaster(service.MultiService):
         # self.prioritizeBuilders is the callable override for builder order
         # traversal
         self.prioritizeBuilders = None
+        self._prioritizing = False
+        self._requestSummary = None
 
         self.loop = DelegateLoop(self._get_processors)
         self.loop.setServiceParent(self)
@@ -130,39 +132,73 @@ class BotMaster(service.MultiService):
         log.msg("Cancelling clean shutdown")
         self.shuttingDown = False
 
-    def _sortfunc(self, b1, b2):
-        t1 = b1.getOldestRequestTime()
-        t2 = b2.getOldestRequestTime()
-        # If t1 or t2 is None, then there are no build requests,
-        # so sort it at the end
-        if t1 is None:
-            return 1
-        if t2 is None:
-            return -1
-        return cmp(t1, t2)
+    def getRequestSummary(self):
+        """Return a dictionary mapping the name of each builder that has
+        unclaimed build requests to a tuple of (submit time of its oldest
+        request, highest priority of its requests). This is fetched with a
+        single query, which is shared by everything that asks for it while
+        the builders are being prioritized, so prioritizeBuilders functions
+        can use it (or Builder.getOldestRequestTime, which uses it) freely."""
+        if self._requestSummary is not None:
+            return self._requestSummary
+        old = now() - Builder.RECLAIM_INTERVAL
+        summary = self.db.get_unclaimed_buildrequest_summary(old,
+                self.master_name, self.master_incarnation)
+        if self._prioritizing:
+            self._requestSummary = summary
+        return summary
 
     def _sort_builders(self, parent, builders):
-        return sorted(builders, self._sortfunc)
+        if len(builders) < 2:
+            return builders
+        summary = self.getRequestSummary()
+        def key(b):
+            # builders without any build requests sort at the end
+            if b.name not in summary:
+                return (1, None)
+            return (0, summary[b.name][0])
+        return sorted(builders, key=key)
 
     def _get_processors(self):
         if self.shuttingDown:
             return []
         builders = self.builders.values()
         sorter = self.prioritizeBuilders or self._sort_builders
+        # the request summary is fetched at most once while sorting
+        self._prioritizing = True
         try:
-            builders = sorter(self.parent, builders)
-        except:
-            log.msg("Exception prioritizing builders")
-            log.err(Failure())
-            # leave them in the original order
+            try:
+                builders = sorter(self.parent, builders)
+            except:
+                log.msg("Exception prioritizing builders")
+                log.err(Failure())
+                # leave them in the original order
+        finally:
+            self._prioritizing = False
+            self._requestSummary = None
         return [b.run for b in builders]
 
-    def trigger_add_buildrequest(self, category, *brids):
-        # a buildrequest has been added or resubmitted
-        self.loop.trigger()
-    def triggerNewBuildCheck(self):
-        # called when a build finishes, or a slave attaches
-        self.loop.trigger()
+    def trigger_add_buildrequest(self, category, *buildernames):
+        # buildrequests have been added or resubmitted for these builders
+        self.triggerNewBuildCheck(buildernames)
+    def triggerNewBuildCheck(self, buildernames=None):
+        # called when a build finishes, or a slave attaches. Only the named
+        # builders are checked for work, or all of them if none are named.
+        if buildernames is None:
+            self.loop.trigger()
+            return
+        processors = [self.builders[name].run for name in buildernames
+                      if name in self.builders]
+        if processors:
+            self.loop.trigger_processors(processors)
+    def triggerNewBuildCheckForSlave(self, slave):
+        # called when a slave may be able to take on a new build
+        if slave.locks:
+            # the locks it has released may be shared with other slaves
+            self.triggerNewBuildCheck()
+        else:
+            self.triggerNewBuildCheck([b.name for b in
+                                       self.getBuildersForSlave(slave.slavename)])
 
     # these four are convenience functions for testing
 
@@ -990,7 +1026,7 @@ class BuildMaster(service.MultiService):
         self.botmaster.db = self.db
         self.status.setDB(self.db)
 
-        self.db.subscribe_to("add-buildrequest",
+        self.db.subscribe_to("add-buildrequest-builders",
                              self.botmaster.trigger_add_buildrequest)
 
         sm = SchedulerManager(self, self.db, self.change_svc)
@@ -1140,8 +1176,12 @@ class BuildMaster(service.MultiService):
 
 
     def addChange(self, change):
-        self.db.addChangeToDatabase(change)
-        self.status.changeAdded(change)
+        self.addChanges([change])
+
+    def addChanges(self, changes):
+        self.db.addChangesToDatabase(changes)
+        for change in changes:
+            self.status.changeAdded(change)
 
     def triggerSlaveManager(self):
         self.botmaster.triggerNewBuildCheck()
@@ -79,6 +79,12 @@ class Build:
     def getSourceStamp(self):
         return self.source
 
+    def getPriority(self):
+        """Return the highest priority of the requests in this build; this
+        is used to order builds waiting for the same lock."""
+        return max([getattr(req, 'priority', None) or 0
+                    for req in self.requests])
+
     def setProperty(self, propname, value, source):
         """Set a property on this build. This may only be called after the
         build has started, so that it has a BuildStatus object where the
@@ -243,9 +249,13 @@ class Build:
             return defer.succeed(None)
         log.msg("acquireLocks(build %s, locks %s)" % (self, self.locks))
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access):
                 log.msg("Build %s waiting for lock %s" % (self, lock))
-                d = lock.waitUntilMaybeAvailable(self, access)
+                # don't hold on to locks handed over to us while we wait
+                for l, la in self.locks:
+                    l.cancelReservation(self, la)
+                d = lock.waitUntilMaybeAvailable(self, access,
+                                                 self.getPriority())
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
                 return d
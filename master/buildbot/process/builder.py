@@ -75,7 +75,7 @@ class AbstractSlaveBuilder(pb.Referenceable):
 
     def buildFinished(self):
         self.state = IDLE
-        self.builder.triggerNewBuildCheck()
+        self.builder.triggerNewBuildCheck(self.slave)
 
     def attached(self, slave, remote, commands):
         """
@@ -229,7 +229,7 @@ class SlaveBuilder(AbstractSlaveBuilder):
         self.state = IDLE
         if self.slave:
             d = self.slave.buildFinished(self)
-            d.addCallback(lambda x: self.builder.triggerNewBuildCheck())
+            d.addCallback(lambda x: self.builder.triggerNewBuildCheck(self.slave))
         else:
             self.builder.triggerNewBuildCheck()
 
@@ -461,8 +461,13 @@ class Builder(pb.Referenceable, service.MultiService):
     def __repr__(self):
         return "<Builder '%r' at %d>" % (self.name, id(self))
 
-    def triggerNewBuildCheck(self):
-        self.botmaster.triggerNewBuildCheck()
+    def triggerNewBuildCheck(self, slave=None):
+        """Have the botmaster check me for work. If SLAVE is given, it has
+        just become free, so the other builders that use it are checked
+        too."""
+        self.botmaster.triggerNewBuildCheck([self.name])
+        if slave:
+            self.botmaster.triggerNewBuildCheckForSlave(slave)
 
     def run(self):
         """Check for work to be done. This should be called any time I might
@@ -503,10 +508,16 @@ class Builder(pb.Referenceable, service.MultiService):
         # return a dict mapping slave -> (brid,ssid)
         now = util.now()
         old = now - self.RECLAIM_INTERVAL
+        # unless requests may be merged, or a nextBuild function wants to
+        # see all of them, we can only start one build per available slave,
+        # so there is no need to load any more requests than that.
+        limit = None
+        if not self.mergeRequests and not self.nextBuild:
+            limit = len(available_slaves)
         requests = self.db.get_unclaimed_buildrequests(self.name, old,
                                                        self.master_name,
                                                        self.master_incarnation,
-                                                       t)
+                                                       t, limit=limit)
 
         assignments = {}
         while requests and available_slaves:
@@ -588,11 +599,12 @@ class Builder(pb.Referenceable, service.MultiService):
     def getOldestRequestTime(self):
         """Returns the timestamp of the oldest build request for this builder.
 
-        If there are no build requests, None is returned."""
-        buildable = self.getBuildable(1)
-        if buildable:
-            # TODO: this is sorted by priority first, not strictly reqtime
-            return buildable[0].getSubmitTime()
+        If there are no build requests, None is returned. This comes from the
+        botmaster's request summary, which is only fetched once while the
+        builders are being prioritized."""
+        summary = self.botmaster.getRequestSummary()
+        if self.name in summary:
+            return summary[self.name][0]
         return None
 
     def cancelBuildRequest(self, brid):
@@ -841,7 +853,7 @@ class Builder(pb.Referenceable, service.MultiService):
                 self._resubmit_buildreqs(build).addErrback(log.err)
 
                 sb.slave.releaseLocks()
-                self.triggerNewBuildCheck()
+                self.triggerNewBuildCheck(sb.slave)
 
                 return d
 
@@ -931,7 +943,7 @@ class Builder(pb.Referenceable, service.MultiService):
         if sb.slave:
             sb.slave.releaseLocks()
 
-        self.triggerNewBuildCheck()
+        self.triggerNewBuildCheck(sb.slave)
 
     def _resubmit_buildreqs(self, build):
         brids = [br.id for br in build.requests]
@@ -1,6 +1,8 @@
 # -*- test-case-name: buildbot.test.test_steps -*-
 
 import re
+import struct
+import zlib
 
 from zope.interface import implements
 from twisted.internet import reactor, defer, error
@@ -10,7 +12,7 @@ from twisted.python import log
 from twisted.python.failure import Failure
 from twisted.web.util import formatFailure
 
-from buildbot import interfaces, locks
+from buildbot import interfaces, locks, util
 from buildbot.status import progress
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
      EXCEPTION, RETRY, worst_status
@@ -20,6 +22,11 @@ BuildStep and RemoteCommand classes for master-side representation of the
 build process
 """
 
+# the header of each record in a version 2 update; see
+# LoggedRemoteCommand.remoteFrames
+FRAME_HEADER = ">cHI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
 class RemoteCommand(pb.Referenceable):
     """
     I represent a single command to be run on the slave. I handle the details
@@ -47,6 +54,9 @@ class RemoteCommand(pb.Referenceable):
     """
     commandCounter = [0] # we use a list as a poor man's singleton
     active = False
+    # the highest slave update format we understand; see
+    # LoggedRemoteCommand.remoteFrames
+    updateFormat = 1
 
     def __init__(self, remote_command, args):
         """
@@ -104,6 +114,13 @@ class RemoteCommand(pb.Referenceable):
             properties = self.step.build.getProperties()
             cmd_args["logfiles"] = properties.render(cmd_args["logfiles"])
 
+        # offer the slave a newer update format; slaves that don't know about
+        # it will ignore this argument and keep sending dictionaries
+        if self.updateFormat > 1:
+            if cmd_args is self.args:
+                cmd_args = cmd_args.copy()
+            cmd_args["update_format"] = self.updateFormat
+
         # This method only initiates the remote command.
         # We will receive remote_update messages as the command runs.
         # We will get a single remote_complete when it finishes.
@@ -254,6 +271,7 @@ class LoggedRemoteCommand(RemoteCommand):
 
     rc = None
     debug = False
+    updateFormat = 2
 
     def __init__(self, *args, **kwargs):
         self.logs = {}
@@ -334,6 +352,38 @@ class LoggedRemoteCommand(RemoteCommand):
         else:
             log.msg("%s.addToLog: no such log %s" % (self, logname))
 
+    def remoteFrames(self, frames):
+        """
+        Handle a batch of output in the version 2 update format: a string of
+        records, each a header packed as L{FRAME_HEADER} (the kind of output,
+        the length of the log name and the length of the data), followed by
+        the log name (only present for 'l' records) and the data. The kinds
+        are 'o' (stdout), 'e' (stderr), 'h' (header) and 'l' (a named log).
+        Records are in the order the output was produced, so stdout and
+        stderr may be interleaved within one update.
+        """
+        offset = 0
+        end = len(frames)
+        while offset < end:
+            kind, namelen, datalen = struct.unpack(FRAME_HEADER,
+                    frames[offset:offset+FRAME_HEADER_SIZE])
+            offset += FRAME_HEADER_SIZE
+            logname = frames[offset:offset+namelen]
+            offset += namelen
+            data = frames[offset:offset+datalen]
+            offset += datalen
+            if kind == 'o':
+                self.addStdout(data)
+            elif kind == 'e':
+                self.addStderr(data)
+            elif kind == 'h':
+                self.addHeader(data)
+            elif kind == 'l':
+                self.addToLog(logname, data)
+            else:
+                log.msg("%s: ignoring update record of unknown kind %r"
+                        % (self, kind))
+
     def remoteUpdate(self, update):
         if self.debug:
             for k,v in update.items():
@@ -351,13 +401,18 @@ class LoggedRemoteCommand(RemoteCommand):
             # 'log': (logname, data)
             logname, data = update['log']
             self.addToLog(logname, data)
+        if update.has_key('frames'):
+            self.remoteFrames(update['frames'])
+        if update.has_key('frames_z'):
+            self.remoteFrames(zlib.decompress(update['frames_z']))
         if update.has_key('rc'):
             rc = self.rc = update['rc']
             log.msg("%s rc=%s" % (self, rc))
             self.addHeader("program finished with exit code %d\n" % rc)
 
         for k in update:
-            if k not in ('stdout', 'stderr', 'header', 'rc'):
+            if k not in ('stdout', 'stderr', 'header', 'rc',
+                         'frames', 'frames_z'):
                 if k not in self.updates:
                     self.updates[k] = []
                 self.updates[k].append(update[k])
@@ -729,6 +784,10 @@ class BuildStep:
         return self.deferred
 
     def acquireLocks(self, res=None):
+        if self._acquiringLock:
+            lock = self._acquiringLock[0]
+            self.step_status.addLockWait(lock.name,
+                                         util.now() - self._lockWaitStarted)
         self._acquiringLock = None
         if not self.locks:
             return defer.succeed(None)
@@ -736,12 +795,17 @@ class BuildStep:
             return defer.succeed(None)
         log.msg("acquireLocks(step %s, locks %s)" % (self, self.locks))
         for lock, access in self.locks:
-            if not lock.isAvailable(access):
+            if not lock.isAvailable(self, access):
                 self.step_status.setWaitingForLocks(True)
                 log.msg("step %s waiting for lock %s" % (self, lock))
-                d = lock.waitUntilMaybeAvailable(self, access)
+                # don't hold on to locks handed over to us while we wait
+                for l, la in self.locks:
+                    l.cancelReservation(self, la)
+                d = lock.waitUntilMaybeAvailable(self, access,
+                                                 self.build.getPriority())
                 d.addCallback(self.acquireLocks)
                 self._acquiringLock = (lock, access, d)
+                self._lockWaitStarted = util.now()
                 return d
         # all locks are available, claim them all
         for lock, access in self.locks:
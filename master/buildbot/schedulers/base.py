@@ -36,6 +36,7 @@
 # ***** END LICENSE BLOCK *****
 
 from zope.interface import implements
+from twisted.internet import defer
 from twisted.application import service
 
 from buildbot import interfaces
@@ -127,6 +128,27 @@ class ClassifierMixin:
         if categories: cfargs['category'] = categories
         self.change_filter = filter.ChangeFilter(**cfargs)
 
+    def wants_changes(self):
+        # override this if the scheduler only sometimes pays attention to
+        # Changes
+        return True
+
+    def classify_change(self, c):
+        """Return None if this scheduler isn't interested in Change C, or
+        else whether it is important."""
+        if not self.change_filter.filter_change(c):
+            return None
+        if self.fileIsImportant:
+            return bool(self.fileIsImportant(c))
+        return True
+
+    def maybe_classify_changes(self):
+        """Classify any new changes, unless my parent has already done so
+        for all of its schedulers at once. Returns a Deferred."""
+        if getattr(self.parent, "classifies_changes", False):
+            return defer.succeed(None)
+        return self.parent.db.runInteraction(self.classify_changes)
+
     def classify_changes(self, t):
         db = self.parent.db
         cm = self.parent.change_svc
@@ -140,12 +162,10 @@ class ClassifierMixin:
 
         changes = cm.getChangesGreaterThan(last_processed, t)
         for c in changes:
-            if self.change_filter.filter_change(c):
-                important = True
-                if self.fileIsImportant:
-                    important = self.fileIsImportant(c)
+            important = self.classify_change(c)
+            if important is not None:
                 db.scheduler_classify_change(self.schedulerid, c.number,
-                                             bool(important), t)
+                                             important, t)
         # now that we've recorded a decision about each, we can update the
         # last_processed record
         if changes:
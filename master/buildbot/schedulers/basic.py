@@ -99,7 +99,7 @@ class Scheduler(base.BaseScheduler, base.ClassifierMixin):
 
     def run(self):
         db = self.parent.db
-        d = db.runInteraction(self.classify_changes)
+        d = self.maybe_classify_changes()
         d.addCallback(lambda ign: db.runInteraction(self._process_changes))
         return d
 
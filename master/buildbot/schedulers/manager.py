@@ -40,8 +40,13 @@ from twisted.python import log
 from buildbot.util import loop
 from buildbot.util import collections
 from buildbot.util.eventual import eventually
+from buildbot.schedulers.base import ClassifierMixin
 
 class SchedulerManager(loop.MultiServiceLoop):
+    # new changes are classified for all of the schedulers at once, at the
+    # start of each pass, rather than by each scheduler when it runs
+    classifies_changes = True
+
     def __init__(self, master, db, change_svc):
         loop.MultiServiceLoop.__init__(self)
         self.master = master
@@ -105,8 +110,78 @@ class SchedulerManager(loop.MultiServiceLoop):
             for s in self.upstream_subscribers[upstream_name]:
                 s.buildSetSubmitted(bsid, t)
 
-    def trigger_add_change(self, category, changenumber):
-        self.trigger()
+    def get_processors(self):
+        return ([self.classify_changes] +
+                loop.MultiServiceLoop.get_processors(self))
+
+    def classify_changes(self):
+        """Load the changes that are new to any of the schedulers, once, and
+        classify them for all of the schedulers in a single transaction. The
+        schedulers that have been given new changes are then run."""
+        schedulers = [s for s in self
+                      if isinstance(s, ClassifierMixin) and s.wants_changes()]
+        if not schedulers:
+            return None
+        d = self.db.runInteraction(self._txn_classify_changes, schedulers)
+        def _classified(classified):
+            if classified:
+                self.trigger_processors([s.run for s in classified])
+        d.addCallback(_classified)
+        return d
+
+    def _txn_classify_changes(self, t, schedulers):
+        states = self.db.scheduler_get_states(
+                [s.schedulerid for s in schedulers], t)
+        changed_states = set()
+        latest = None
+        for s in schedulers:
+            state = states[s.schedulerid]
+            if state.get("last_processed", None) is None:
+                if latest is None:
+                    latest = self.change_svc.getLatestChangeNumberNow(t) or 0
+                state["last_processed"] = latest
+                changed_states.add(s)
+        oldest = min([states[s.schedulerid]["last_processed"]
+                      for s in schedulers])
+        changes = self.change_svc.getChangesGreaterThan(oldest, t)
+
+        classifications = []
+        classified = []
+        for s in schedulers:
+            state = states[s.schedulerid]
+            new = [c for c in changes if c.number > state["last_processed"]]
+            if not new:
+                continue
+            try:
+                decisions = [(c, s.classify_change(c)) for c in new]
+            except:
+                # don't let one scheduler's filter hold up the others; this
+                # one will try again next time
+                log.msg("Exception classifying changes for %s" % s.name)
+                log.err()
+                continue
+            for c, important in decisions:
+                if important is not None:
+                    classifications.append((s.schedulerid, c.number,
+                                            important))
+                    if s not in classified:
+                        classified.append(s)
+            # now that we've recorded a decision about each, we can update
+            # the last_processed record
+            state["last_processed"] = max([c.number for c in new])
+            changed_states.add(s)
+
+        self.db.scheduler_classify_changes(classifications, t)
+        for s in changed_states:
+            s.set_state(t, states[s.schedulerid])
+        return classified
+
+    def trigger_add_change(self, category, first_changeid, last_changeid):
+        # schedulers that classify changes are run once they have been given
+        # some; the others might be looking for changes in their own way
+        self.trigger_processors([self.classify_changes] +
+                                [s.run for s in self
+                                 if not isinstance(s, ClassifierMixin)])
     def trigger_modify_buildset(self, category, *bsids):
         # TODO: this could just run the schedulers that have subscribed to
         # scheduler_upstream_buildsets, or even just the ones that subscribed
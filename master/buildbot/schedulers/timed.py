@@ -211,6 +211,9 @@ class Nightly(base.BaseScheduler, base.ClassifierMixin, TimedBuildMixin):
         # filter anyway
         self.make_filter()
 
+    def wants_changes(self):
+        return self.onlyIfChanged
+
     def get_initial_state(self, max_changeid):
         return {
             "last_build": None,
@@ -229,7 +232,7 @@ class Nightly(base.BaseScheduler, base.ClassifierMixin, TimedBuildMixin):
         if self.onlyIfChanged:
             # call classify_changes, so that we can keep last_processed
             # up to date, in case we are configured with onlyIfChanged.
-            d.addCallback(lambda ign: db.runInteraction(self.classify_changes))
+            d.addCallback(lambda ign: self.maybe_classify_changes())
         d.addCallback(lambda ign: db.runInteraction(self._check_timer))
         return d
 
@@ -8,11 +8,16 @@ from twisted.protocols import basic
 from buildbot.process.properties import Properties
 from buildbot.util import collections
 from buildbot.util.eventual import eventually
+from buildbot.status.summary import BuildSummary, BuildSummaryStore
+from buildbot.status.ssindex import SourceStampIndex
 
 import weakref
-import os, shutil, re, urllib, itertools
+import os, shutil, re, urllib
 import gc
 import time
+import struct
+import bisect
+import bz2
 from cPickle import load, dump
 from cStringIO import StringIO
 from bz2 import BZ2File
@@ -198,6 +203,151 @@ class LogFileProducer:
             self.consumer.finish()
             self.consumer = None
 
+class LogFileIndex:
+    """A LogFileIndex is a sidecar table describing where each chunk of a
+    L{LogFile} lives on disk. It is kept next to the logfile (with an '.idx'
+    suffix) and is appended to by L{LogFile.merge} as each netstring is
+    written.
+
+    Each record is a fixed-width (channel, data offset, text offset, size)
+    tuple. 'data offset' is the position of the chunk's text in the
+    (uncompressed) logfile, skipping the netstring header, and 'text offset'
+    is the position of that text within the concatenation of every chunk in
+    the log, across all channels. Since records are fixed-width and text
+    offsets only grow, a chunk can be found with a binary search over the
+    file, without parsing the log itself."""
+
+    RECORD = struct.Struct(">BQQL")
+
+    def __init__(self, f):
+        self.f = f
+
+    def __len__(self):
+        self.f.seek(0, 2)
+        return self.f.tell() // self.RECORD.size
+
+    def append(self, channel, offset, textoffset, size):
+        self.f.seek(0, 2)
+        self.f.write(self.RECORD.pack(channel, offset, textoffset, size))
+
+    def get(self, i):
+        self.f.seek(i * self.RECORD.size)
+        return self.RECORD.unpack(self.f.read(self.RECORD.size))
+
+    def getTextLength(self, nrecords=None):
+        """Return the number of bytes of text covered by the first
+        'nrecords' records (or by all of them)."""
+        if nrecords is None:
+            nrecords = len(self)
+        if not nrecords:
+            return 0
+        channel, offset, textoffset, size = self.get(nrecords - 1)
+        return textoffset + size
+
+    def find(self, textoffset, nrecords=None):
+        """Return the number of the record that contains the text at
+        'textoffset', or 'nrecords' if it lies beyond the end of the
+        index."""
+        if nrecords is None:
+            nrecords = len(self)
+        lo, hi = 0, nrecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            c, o, t, size = self.get(mid)
+            if t + size <= textoffset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+class BlockCompressedFile:
+    """A read-only, seekable file-like view of a logfile that
+    L{LogFile.compressLog} compressed in independent blocks: a sequence of
+    bz2 streams or gzip members, each holding L{LogFile.compressBlockSize}
+    bytes of the log. A sidecar table (with a '.blocks' suffix) holds the
+    fixed-width (uncompressed offset, compressed offset) record of each
+    block, plus a final one for the end of the file, so that a seek only
+    has to decompress the block it lands in, rather than everything before
+    it as BZ2File and GzipFile do."""
+
+    RECORD = struct.Struct(">QQ")
+
+    def __init__(self, f, table, method):
+        self.f = f
+        self.method = method
+        data = table.read()
+        table.close()
+        self.offsets = [] # uncompressed offset of each block, and the end
+        self.coffsets = [] # compressed offset of each block, and the end
+        for i in range(len(data) // self.RECORD.size):
+            offset, coffset = self.RECORD.unpack_from(data,
+                                                      i * self.RECORD.size)
+            self.offsets.append(offset)
+            self.coffsets.append(coffset)
+        self.pos = 0
+        self.block = (None, None) # the last block decompressed, and its data
+
+    def writeBlocks(cls, infile, f, table, method, blockSize):
+        """Compress the contents of INFILE into F in blocks of BLOCKSIZE
+        bytes, and write their offsets to TABLE."""
+        offset = 0
+        while True:
+            data = infile.read(blockSize)
+            table.write(cls.RECORD.pack(offset, f.tell()))
+            if not data:
+                break
+            if method == "bz2":
+                f.write(bz2.compress(data))
+            else:
+                buf = StringIO()
+                gz = GzipFile(fileobj=buf, mode="wb")
+                gz.write(data)
+                gz.close()
+                f.write(buf.getvalue())
+            offset += len(data)
+    writeBlocks = classmethod(writeBlocks)
+
+    def _getBlock(self, i):
+        if self.block[0] != i:
+            self.f.seek(self.coffsets[i])
+            data = self.f.read(self.coffsets[i+1] - self.coffsets[i])
+            if self.method == "bz2":
+                data = bz2.decompress(data)
+            else:
+                data = GzipFile(fileobj=StringIO(data), mode="rb").read()
+            self.block = (i, data)
+        return self.block[1]
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.offsets[-1]
+        self.pos = max(offset, 0)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        if not self.offsets:
+            return ""
+        end = self.offsets[-1]
+        if size is not None and size >= 0:
+            end = min(end, self.pos + size)
+        pieces = []
+        while self.pos < end:
+            i = bisect.bisect_right(self.offsets, self.pos) - 1
+            start = self.pos - self.offsets[i]
+            piece = self._getBlock(i)[start:start + end - self.pos]
+            if not piece:
+                break
+            pieces.append(piece)
+            self.pos += len(piece)
+        return "".join(pieces)
+
+    def close(self):
+        self.f.close()
+
 def _tryremove(filename, timeout, retries):
     """Try to remove a file, and if failed, try again in timeout.
     Increases the timeout by a factor of 4, and only keeps trying for
@@ -245,7 +395,11 @@ class LogFile:
     BUFFERSIZE = 2048
     filename = None # relative to the Builder's basedir
     openfile = None
+    openindex = None
     compressMethod = "bz2"
+    # compressed logs are written in blocks of this much log, so that
+    # reading part of one only needs a single block to be decompressed
+    compressBlockSize = 256*1024
 
     def __init__(self, parent, name, logfilename):
         """
@@ -270,6 +424,7 @@ class LogFile:
         if not os.path.exists(dirname):
             os.makedirs(dirname)
         self.openfile = open(fn, "w+")
+        self.openindex = open(self.getIndexFilename(), "w+b")
         self.runEntries = []
         self.watchers = []
         self.finishedWatchers = []
@@ -278,6 +433,9 @@ class LogFile:
     def getFilename(self):
         return os.path.join(self.step.build.builder.basedir, self.filename)
 
+    def getIndexFilename(self):
+        return self.getFilename() + ".idx"
+
     def hasContents(self):
         return os.path.exists(self.getFilename() + '.bz2') or \
             os.path.exists(self.getFilename() + '.gz') or \
@@ -307,15 +465,39 @@ class LogFile:
         # otherwise they get their own read-only handle
         # try a compressed log first
         try:
-            return BZ2File(self.getFilename() + ".bz2", "r")
+            return self._openCompressed(self.getFilename() + ".bz2", "bz2")
         except IOError:
             pass
         try:
-            return GzipFile(self.getFilename() + ".gz", "r")
+            return self._openCompressed(self.getFilename() + ".gz", "gz")
         except IOError:
             pass
         return open(self.getFilename(), "r")
 
+    def _openCompressed(self, filename, method):
+        f = open(filename, "rb")
+        try:
+            table = open(filename + ".blocks", "rb")
+        except IOError:
+            # compressed in one piece, before block tables existed
+            f.close()
+            if method == "bz2":
+                return BZ2File(filename, "r")
+            return GzipFile(filename, "r")
+        return BlockCompressedFile(f, table, method)
+
+    def getIndex(self):
+        """Return a L{LogFileIndex} for this log, or None if the log was
+        written before chunk indexes existed (or the index has been
+        removed)."""
+        if self.openindex:
+            # shared with merge(), just like self.openfile
+            return LogFileIndex(self.openindex)
+        try:
+            return LogFileIndex(open(self.getIndexFilename(), "rb"))
+        except IOError:
+            return None
+
     def getText(self):
         # this produces one ginormous string
         return "".join(self.getChunks([STDOUT, STDERR], onlyText=True))
@@ -323,7 +505,7 @@ class LogFile:
     def getTextWithHeaders(self):
         return "".join(self.getChunks(onlyText=True))
 
-    def getChunks(self, channels=[], onlyText=False):
+    def getChunks(self, channels=[], onlyText=False, start=None, end=None):
         # generate chunks for everything that was logged at the time we were
         # first called, so remember how long the file was when we started.
         # Don't read beyond that point. The current contents of
@@ -336,7 +518,37 @@ class LogFile:
         # data, you must insure that nothing will be added to the log during
         # yield() calls.
 
+        # 'start' and 'end' are offsets into the text of the whole log (all
+        # channels, headers included), and restrict the output to that
+        # range. Chunks straddling either boundary are trimmed. If the log
+        # has an index, this seeks straight to the first chunk rather than
+        # scanning from the beginning of the file. Compressed logs are
+        # stored in blocks, so only the blocks holding the range are
+        # decompressed (except for logs compressed in one piece by older
+        # versions, which are still decompressed from the start).
+
         f = self.getFile()
+
+        leftover = None
+        if self.runEntries and (not channels or
+                                (self.runEntries[0][0] in channels)):
+            leftover = (self.runEntries[0][0],
+                        "".join([c[1] for c in self.runEntries]))
+
+        if start is not None or end is not None:
+            index = self.getIndex()
+            if index is not None:
+                nrecords = len(index)
+                if leftover:
+                    leftover = (index.getTextLength(nrecords),) + leftover
+                return self._generateIndexedChunks(f, index, nrecords,
+                                                   start, end, leftover,
+                                                   channels, onlyText)
+            # no index, so scan the whole log and throw most of it away.
+            # The offsets count every channel, so all of them are read.
+            return self._sliceChunks(self.getChunks(), start, end,
+                                     channels, onlyText)
+
         if not self.finished:
             offset = 0
             f.seek(0, 2)
@@ -345,12 +557,6 @@ class LogFile:
             offset = 0
             remaining = None
 
-        leftover = None
-        if self.runEntries and (not channels or
-                                (self.runEntries[0][0] in channels)):
-            leftover = (self.runEntries[0][0],
-                        "".join([c[1] for c in self.runEntries]))
-
         # freeze the state of the LogFile by passing a lot of parameters into
         # a generator
         return self._generateChunks(f, offset, remaining, leftover,
@@ -391,15 +597,115 @@ class LogFile:
             else:
                 yield leftover
 
+    def _generateIndexedChunks(self, f, index, nrecords, start, end,
+                               leftover, channels, onlyText):
+        if start is None:
+            start = 0
+        if end is not None and end <= start:
+            return
+        i = index.find(start, nrecords)
+        while i < nrecords:
+            channel, offset, textoffset, size = index.get(i)
+            i += 1
+            if end is not None and textoffset >= end:
+                return
+            if channels and channel not in channels:
+                continue
+            lo = max(start - textoffset, 0)
+            hi = size
+            if end is not None:
+                hi = min(end - textoffset, size)
+            f.seek(offset + lo)
+            text = f.read(hi - lo)
+            if onlyText:
+                yield text
+            else:
+                yield (channel, text)
+        del f
+
+        if leftover:
+            textoffset, channel, text = leftover
+            if end is not None:
+                text = text[:max(end - textoffset, 0)]
+            text = text[max(start - textoffset, 0):]
+            if text:
+                if onlyText:
+                    yield text
+                else:
+                    yield (channel, text)
+
+    def _sliceChunks(self, chunks, start, end, channels, onlyText):
+        if start is None:
+            start = 0
+        textoffset = 0
+        for channel, text in chunks:
+            if end is not None and textoffset >= end:
+                return
+            size = len(text)
+            if (textoffset + size > start
+                and (not channels or channel in channels)):
+                lo = max(start - textoffset, 0)
+                hi = size
+                if end is not None:
+                    hi = min(end - textoffset, size)
+                if onlyText:
+                    yield text[lo:hi]
+                else:
+                    yield (channel, text[lo:hi])
+            textoffset += size
+
+    def getLength(self):
+        """Return the number of bytes of text (in all channels) currently in
+        the log."""
+        index = self.getIndex()
+        if index is None:
+            return sum([len(text) for text in self.getChunks(onlyText=True)])
+        length = index.getTextLength()
+        if self.runEntries:
+            length += self.runLength
+        return length
+
+    def tail(self, nbytes, channels=[], onlyText=False):
+        """Return an iterator over the chunks making up the last 'nbytes'
+        bytes of the log. Like getChunks, this only covers what had been
+        logged at the time it was called."""
+        return self.getChunks(channels, onlyText,
+                              start=max(self.getLength() - nbytes, 0))
+
     def readlines(self, channel=STDOUT):
         """Return an iterator that produces newline-terminated lines,
-        excluding header chunks."""
-        # TODO: make this memory-efficient, by turning it into a generator
-        # that retrieves chunks as necessary, like a pull-driven version of
-        # twisted.protocols.basic.LineReceiver
-        alltext = "".join(self.getChunks([channel], onlyText=True))
-        io = StringIO(alltext)
-        return io.readlines()
+        excluding header chunks. CHANNEL may also be a list of channels, in
+        which case their text is split into lines as if it had been joined
+        together, just like getText() does for [STDOUT, STDERR].
+
+        Chunks are read from the file as the iterator is consumed, so only
+        the current chunk and any partial line are held in memory."""
+        if isinstance(channel, (list, tuple)):
+            channels = list(channel)
+        else:
+            channels = [channel]
+        return self._generateLines(self.getChunks(channels, onlyText=True))
+
+    def _generateLines(self, chunks):
+        # a pull-driven version of twisted.protocols.basic.LineReceiver
+        partial = [] # pieces of a line that spans several chunks
+        for text in chunks:
+            start = 0
+            while True:
+                end = text.find("\n", start) + 1
+                if not end:
+                    break
+                if partial:
+                    partial.append(text[start:end])
+                    yield "".join(partial)
+                    partial = []
+                else:
+                    yield text[start:end]
+                start = end
+            if start < len(text):
+                partial.append(text[start:])
+        if partial:
+            yield "".join(partial)
 
     def subscribe(self, receiver, catchup):
         if self.finished:
@@ -431,10 +737,16 @@ class LogFile:
         assert channel < 10
         f = self.openfile
         f.seek(0, 2)
+        index = None
+        if self.openindex:
+            index = LogFileIndex(self.openindex)
+            textoffset = index.getTextLength()
         offset = 0
         while offset < len(text):
             size = min(len(text)-offset, self.chunkSize)
             f.write("%d:%d" % (1 + size, channel))
+            if index is not None:
+                index.append(channel, f.tell(), textoffset + offset, size)
             f.write(text[offset:offset+size])
             f.write(",")
             offset += size
@@ -510,6 +822,9 @@ class LogFile:
             # filehandle will be released and automatically closed.
             self.openfile.flush()
             del self.openfile
+        if self.openindex:
+            self.openindex.flush()
+            del self.openindex
         self.finished = True
         watchers = self.finishedWatchers
         self.finishedWatchers = []
@@ -531,16 +846,12 @@ class LogFile:
 
     def _compressLog(self, compressed):
         infile = self.getFile()
-        if self.compressMethod == "bz2":
-            cf = BZ2File(compressed, 'w')
-        elif self.compressMethod == "gz":
-            cf = GzipFile(compressed, 'w')
-        bufsize = 1024*1024
-        while True:
-            buf = infile.read(bufsize)
-            cf.write(buf)
-            if len(buf) < bufsize:
-                break
+        cf = open(compressed, 'wb')
+        table = open(compressed + '.blocks', 'wb')
+        BlockCompressedFile.writeBlocks(infile, cf, table,
+                                        self.compressMethod,
+                                        self.compressBlockSize)
+        table.close()
         cf.close()
     def _renameCompressedLog(self, rv, compressed):
         if self.compressMethod == "bz2":
@@ -552,14 +863,20 @@ class LogFile:
             # fall back to delete-first. There are ways this can fail and
             # lose the builder's history, so we avoid using it in the
             # general (non-windows) case
-            if os.path.exists(filename):
-                os.unlink(filename)
+            for fn in (filename + '.blocks', filename):
+                if os.path.exists(fn):
+                    os.unlink(fn)
+        # the block table goes first: it is ignored until the compressed
+        # log exists, while a compressed log without one would be misread
+        # as a single block
+        os.rename(compressed + '.blocks', filename + '.blocks')
         os.rename(compressed, filename)
         _tryremove(self.getFilename(), 1, 5)
     def _cleanupFailedCompress(self, failure, compressed):
         log.msg("failed to compress %s" % self.getFilename())
-        if os.path.exists(compressed):
-            _tryremove(compressed, 1, 5)
+        for fn in (compressed, compressed + '.blocks'):
+            if os.path.exists(fn):
+                _tryremove(fn, 1, 5)
         failure.trap() # reraise the failure
 
     # persistence stuff
@@ -573,6 +890,8 @@ class LogFile:
             del d['finished']
         if d.has_key('openfile'):
             del d['openfile']
+        if d.has_key('openindex'):
+            del d['openindex']
         return d
 
     def __setstate__(self, d):
@@ -589,6 +908,7 @@ class LogFile:
         self.filename = logfilename
         if not os.path.exists(self.getFilename()):
             self.openfile = open(self.getFilename(), "w")
+            self.openindex = open(self.getIndexFilename(), "w+b")
             self.finished = False
             for channel,text in self.entries:
                 self.addEntry(channel, text)
@@ -812,7 +1132,7 @@ class BuildStepStatus(styles.Versioned):
     # note that these are created when the Build is set up, before each
     # corresponding BuildStep has started.
     implements(interfaces.IBuildStepStatus, interfaces.IStatusEvent)
-    persistenceVersion = 2
+    persistenceVersion = 3
 
     started = None
     finished = None
@@ -824,6 +1144,7 @@ class BuildStepStatus(styles.Versioned):
     updates = {}
     finishedWatchers = []
     statistics = {}
+    lockWaits = {}
 
     def __init__(self, parent):
         assert interfaces.IBuildStatus(parent)
@@ -834,6 +1155,7 @@ class BuildStepStatus(styles.Versioned):
         self.updates = {}
         self.finishedWatchers = []
         self.statistics = {}
+        self.lockWaits = {}
 
         self.waitingForLocks = False
 
@@ -965,6 +1287,7 @@ class BuildStepStatus(styles.Versioned):
 
     def setProgress(self, stepprogress):
         self.progress = stepprogress
+        self._statusChanged()
 
     def stepStarted(self):
         self.started = util.now()
@@ -1008,9 +1331,11 @@ class BuildStepStatus(styles.Versioned):
 
     def addURL(self, name, url):
         self.urls[name] = url
+        self._statusChanged()
 
     def setText(self, text):
         self.text = text
+        self._statusChanged()
         for w in self.watchers:
             w.stepTextChanged(self.build, self, text)
     def setText2(self, text):
@@ -1022,6 +1347,12 @@ class BuildStepStatus(styles.Versioned):
         """Set the given statistic.  Usually called by subclasses.
         """
         self.statistics[name] = value
+        self._statusChanged()
+
+    def _statusChanged(self):
+        # our status is part of our build's
+        if self.build:
+            self.build.statusChanged()
 
     def stepFinished(self, results):
         self.finished = util.now()
@@ -1062,6 +1393,14 @@ class BuildStepStatus(styles.Versioned):
     def setWaitingForLocks(self, waiting):
         self.waitingForLocks = waiting
 
+    def addLockWait(self, lockname, seconds):
+        """Record that this step spent SECONDS waiting for the named lock.
+        """
+        self.lockWaits[lockname] = self.lockWaits.get(lockname, 0) + seconds
+
+    def getLockWaitTimes(self):
+        return self.lockWaits
+
     # persistence
 
     def __getstate__(self):
@@ -1090,6 +1429,10 @@ class BuildStepStatus(styles.Versioned):
         if not hasattr(self, "statistics"):
             self.statistics = {}
 
+    def upgradeToVersion3(self):
+        if not hasattr(self, "lockWaits"):
+            self.lockWaits = {}
+
     def asDict(self):
         result = {}
         # Constant
@@ -1126,6 +1469,7 @@ class BuildStatus(styles.Versioned):
     text = []
     results = None
     slavename = "???"
+    statusVersion = 0
 
     # these lists/dicts are defined here so that unserialized instances have
     # (empty) values. They are set in __init__ to new objects to make sure
@@ -1264,6 +1608,9 @@ class BuildStatus(styles.Versioned):
     def getSlavename(self):
         return self.slavename
 
+    def getStatusVersion(self):
+        return self.statusVersion
+
     def getTestResults(self):
         return self.testResults
 
@@ -1316,10 +1663,12 @@ class BuildStatus(styles.Versioned):
         s = BuildStepStatus(self)
         s.setName(name)
         self.steps.append(s)
+        self.statusChanged()
         return s
 
     def setProperty(self, propname, value, source):
         self.properties.setProperty(propname, value, source)
+        self.statusChanged()
 
     def addTestResult(self, result):
         self.testResults[result.getName()] = result
@@ -1327,11 +1676,14 @@ class BuildStatus(styles.Versioned):
     def setSourceStamp(self, sourceStamp):
         self.source = sourceStamp
         self.changes = self.source.changes
+        self.statusChanged()
 
     def setReason(self, reason):
         self.reason = reason
+        self.statusChanged()
     def setBlamelist(self, blamelist):
         self.blamelist = blamelist
+        self.statusChanged()
     def setProgress(self, progress):
         self.progress = progress
 
@@ -1340,22 +1692,32 @@ class BuildStatus(styles.Versioned):
         be safely queried, so it is time to announce the new build."""
 
         self.started = util.now()
+        self.statusChanged()
         # now that we're ready to report status, let the BuilderStatus tell
         # the world about us
         self.builder.buildStarted(self)
 
     def setSlavename(self, slavename):
         self.slavename = slavename
+        self.statusChanged()
 
     def setText(self, text):
         assert isinstance(text, (list, tuple))
         self.text = text
+        self.statusChanged()
     def setResults(self, results):
         self.results = results
+        self.statusChanged()
+
+    def statusChanged(self):
+        """Something about this build, or one of its steps, has changed:
+        bump our status version."""
+        self.statusVersion += 1
 
     def buildFinished(self):
         self.currentStep = None
         self.finished = util.now()
+        self.statusChanged()
 
         for r in self.updates.keys():
             if self.updates[r] is not None:
@@ -1371,6 +1733,7 @@ class BuildStatus(styles.Versioned):
 
     def stepStarted(self, step):
         self.currentStep = step
+        self.statusChanged()
         for w in self.watchers:
             receiver = w.stepStarted(self, step)
             if receiver:
@@ -1385,6 +1748,7 @@ class BuildStatus(styles.Versioned):
 
     def _stepFinished(self, step):
         results = step.getResults()
+        self.statusChanged()
         for w in self.watchers:
             w.stepFinished(self, step, results)
 
@@ -1393,6 +1757,7 @@ class BuildStatus(styles.Versioned):
     def pruneSteps(self):
         # this build is very old: remove the build steps too
         self.steps = []
+        self.statusChanged()
 
     # persistence stuff
 
@@ -1433,7 +1798,8 @@ class BuildStatus(styles.Versioned):
             # was interrupted. The builder will have a 'shutdown' event, but
             # someone looking at just this build will be confused as to why
             # the last log is truncated.
-        for k in 'builder', 'watchers', 'updates', 'finishedWatchers':
+        for k in ('builder', 'watchers', 'updates', 'finishedWatchers',
+                  'statusVersion'):
             if k in d: del d[k]
         return d
 
@@ -1509,6 +1875,12 @@ class BuildStatus(styles.Versioned):
             log.msg("unable to save build %s-#%d" % (self.builder.name,
                                                      self.number))
             log.err()
+        try:
+            self.builder.getSummaryStore().addBuild(self)
+        except:
+            log.msg("unable to record summary of build %s-#%d"
+                    % (self.builder.name, self.number))
+            log.err()
 
     def asDict(self):
         result = {}
@@ -1571,9 +1943,15 @@ class BuilderStatus(styles.Versioned):
     logHorizon = 40 # forget logs in steps in builds beyond this
     buildHorizon = 100 # forget builds beyond this
 
+    # the number of recent sourcestamps to index for the grid displays
+    sourceStampIndexSize = 100
+
     category = None
     currentBigState = "offline" # or idle/waiting/interlocked/building
     basedir = None # filled in by our parent
+    summaryStore = None # created on demand by getSummaryStore
+    sourceStampIndex = None # created on demand by getSourceStampIndex
+    statusVersion = 0 # bumped whenever the status in asDict() changes
 
     def __init__(self, buildername, category=None):
         self.name = buildername
@@ -1590,7 +1968,7 @@ class BuilderStatus(styles.Versioned):
         self.nextBuild = None
         self.watchers = []
         self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCache_LRU = util.LRUCache(self.buildCacheSize)
         self.logCompressionLimit = False # default to no compression for tests
         self.logCompressionMethod = "bz2"
         self.logMaxSize = None # No default limit
@@ -1607,6 +1985,9 @@ class BuilderStatus(styles.Versioned):
         d['watchers'] = []
         del d['buildCache']
         del d['buildCache_LRU']
+        d.pop('summaryStore', None)
+        d.pop('sourceStampIndex', None)
+        d.pop('statusVersion', None)
         for b in self.currentBuilds:
             b.saveYourself()
             # TODO: push a 'hey, build was interrupted' event
@@ -1623,7 +2004,7 @@ class BuilderStatus(styles.Versioned):
         # upgradeToVersion1 and such will be called after this finishes.
         styles.Versioned.__setstate__(self, d)
         self.buildCache = weakref.WeakValueDictionary()
-        self.buildCache_LRU = []
+        self.buildCache_LRU = util.LRUCache(self.buildCacheSize)
         self.currentBuilds = []
         self.watchers = []
         self.slavenames = []
@@ -1635,6 +2016,7 @@ class BuilderStatus(styles.Versioned):
         # gets pickled and unpickled.
         if buildmaster.buildCacheSize:
             self.buildCacheSize = buildmaster.buildCacheSize
+            self.buildCache_LRU.setMaxSize(self.buildCacheSize)
 
     def upgradeToVersion1(self):
         if hasattr(self, 'slavename'):
@@ -1696,12 +2078,90 @@ class BuilderStatus(styles.Versioned):
         return os.path.join(self.basedir, "%d" % number)
 
     def touchBuildCache(self, build):
+        if build.number not in self.buildCache:
+            # it is listed in asDict()
+            self.statusChanged()
         self.buildCache[build.number] = build
-        if build in self.buildCache_LRU:
-            self.buildCache_LRU.remove(build)
-        self.buildCache_LRU = self.buildCache_LRU[-(self.buildCacheSize-1):] + [ build ]
+        # the LRU cache holds strong references to the most recently used
+        # builds; buildCache itself only holds weak references
+        self.buildCache_LRU.add(build.number, build)
         return build
 
+    def getSummaryStore(self):
+        if self.summaryStore is None:
+            self.summaryStore = BuildSummaryStore(
+                os.path.join(self.basedir, "summaries.sqlite"))
+        return self.summaryStore
+
+    def getBuildSummary(self, number):
+        """Return a L{BuildSummary} for the given build, or None if there is
+        no such build. This only unpickles the build if it is not already in
+        memory and was saved before summaries were recorded."""
+        if number < 0:
+            number = self.nextBuildNumber + number
+        if number < 0 or number >= self.nextBuildNumber:
+            return None
+
+        for b in self.currentBuilds:
+            if b.number == number:
+                return BuildSummary.fromBuild(b)
+        if number in self.buildCache:
+            return BuildSummary.fromBuild(self.buildCache[number])
+
+        summary = self.getSummaryStore().getSummary(self, number)
+        if summary is None:
+            summary = self._backfillSummary(number)
+        return summary
+
+    def _backfillSummary(self, number):
+        # a build saved before we started recording summaries: load it, and
+        # record it now so that we don't have to load it next time
+        build = self.getBuild(number)
+        if build is None:
+            return None
+        if build.isFinished():
+            self.getSummaryStore().addBuild(build)
+        return BuildSummary.fromBuild(build)
+
+    def getSourceStampIndex(self):
+        """Return the L{SourceStampIndex} of this builder's recent
+        sourcestamps. The first call fills it from the summaries of the most
+        recent builds; after that it is kept up to date as builds start and
+        finish."""
+        if self.sourceStampIndex is None:
+            index = SourceStampIndex(self.sourceStampIndexSize)
+            # summaries are cheap, but don't search forever for distinct
+            # sourcestamps
+            for summary in self.generateBuildSummaries(
+                    max_search=10*index.size):
+                if summary is not None:
+                    index.addBuild(summary)
+            self.sourceStampIndex = index
+        return self.sourceStampIndex
+
+    def generateBuildSummaries(self, max_search=None, batchSize=100):
+        """Generate L{BuildSummary} records for this builder's builds,
+        starting with the most recent and progressing backwards. Builds that
+        no longer exist are skipped (a None is generated in their place),
+        so that callers can count how far back they have searched."""
+        number = self.nextBuildNumber - 1
+        lowest = 0
+        if max_search is not None:
+            lowest = max(self.nextBuildNumber - max_search, 0)
+        store = self.getSummaryStore()
+        while number >= lowest:
+            low = max(number - batchSize + 1, lowest)
+            batch = dict([(s.number, s) for s in
+                          store.getSummaries(self, max_buildnum=number,
+                                             min_buildnum=low)])
+            current = [b.number for b in self.currentBuilds]
+            for n in range(number, low - 1, -1):
+                if n in batch and n not in current:
+                    yield batch[n]
+                else:
+                    yield self.getBuildSummary(n)
+            number = low - 1
+
     def getBuildByNumber(self, number):
         # first look in currentBuilds
         for b in self.currentBuilds:
@@ -1756,6 +2216,12 @@ class BuilderStatus(styles.Versioned):
         if earliest_build == 0:
             return
 
+        try:
+            self.getSummaryStore().pruneBefore(earliest_build)
+        except:
+            log.msg("unable to prune build summaries for %s" % self.name)
+            log.err()
+
         # skim the directory and delete anything that shouldn't be there anymore
         build_re = re.compile(r"^([0-9]+)$")
         build_log_re = re.compile(r"^([0-9]+)-.*$")
@@ -1833,27 +2299,27 @@ class BuilderStatus(styles.Versioned):
                                max_buildnum=None,
                                finished_before=None,
                                max_search=200):
+        # the filtering is done against build summaries, so only the builds
+        # that are actually generated need to be loaded
         got = 0
-        for Nb in itertools.count(1):
-            if Nb > self.nextBuildNumber:
-                break
-            if Nb > max_search:
-                break
-            build = self.getBuild(-Nb)
-            if build is None:
+        for summary in self.generateBuildSummaries(max_search=max_search):
+            if summary is None:
                 continue
             if max_buildnum is not None:
-                if build.getNumber() > max_buildnum:
+                if summary.getNumber() > max_buildnum:
                     continue
-            if not build.isFinished():
+            if not summary.isFinished():
                 continue
             if finished_before is not None:
-                start, end = build.getTimes()
+                start, end = summary.getTimes()
                 if end >= finished_before:
                     continue
             if branches:
-                if build.getSourceStamp().branch not in branches:
+                if summary.getBranch() not in branches:
                     continue
+            build = self.getBuild(summary.getNumber())
+            if build is None:
+                continue
             got += 1
             yield build
             if num_builds is not None:
@@ -1874,25 +2340,33 @@ class BuilderStatus(styles.Versioned):
         # interleave two event streams (one from self.getBuild and the other
         # from self.getEvent), which would be simpler than this control flow
 
+        # builds are filtered using their summaries, and only loaded if
+        # their steps are needed
+
         eventIndex = -1
         e = self.getEvent(eventIndex)
-        for Nb in range(1, self.nextBuildNumber+1):
-            b = self.getBuild(-Nb)
-            if not b:
+        Nb = 0
+        for summary in self.generateBuildSummaries():
+            Nb += 1
+            if not summary:
                 # HACK: If this is the first build we are looking at, it is
                 # possible it's in progress but locked before it has written a
                 # pickle; in this case keep looking.
                 if Nb == 1:
                     continue
                 break
-            if b.getTimes()[0] < minTime:
+            if summary.getTimes()[0] < minTime:
                 break
-            if branches and not b.getSourceStamp().branch in branches:
+            if branches and not summary.getBranch() in branches:
                 continue
-            if categories and not b.getBuilder().getCategory() in categories:
+            if categories and not self.getCategory() in categories:
                 continue
-            if committers and not [True for c in b.getChanges() if c.who in committers]:
+            if committers and not [True for c in summary.getCommitters()
+                                   if c in committers]:
                 continue
+            b = self.getBuild(summary.getNumber())
+            if not b:
+                break
             steps = b.getSteps()
             for Ns in range(1, len(steps)+1):
                 if steps[-Ns].started:
@@ -1928,6 +2402,15 @@ class BuilderStatus(styles.Versioned):
 
     def setSlavenames(self, names):
         self.slavenames = names
+        self.statusChanged()
+
+    def statusChanged(self):
+        """Something about this builder has changed: bump our status
+        version."""
+        self.statusVersion += 1
+
+    def getStatusVersion(self):
+        return self.statusVersion
 
     def addEvent(self, text=[]):
         # this adds a duration event. When it is done, the user should call
@@ -1954,6 +2437,7 @@ class BuilderStatus(styles.Versioned):
         needToUpdate = state != self.currentBigState
         self.currentBigState = state
         if needToUpdate:
+            self.statusChanged()
             self.publishState()
 
     def publishState(self, target=None):
@@ -1993,7 +2477,10 @@ class BuilderStatus(styles.Versioned):
         assert s.number == self.nextBuildNumber - 1
         assert s not in self.currentBuilds
         self.currentBuilds.append(s)
+        self.statusChanged()
         self.touchBuildCache(s)
+        if self.sourceStampIndex is not None:
+            self.sourceStampIndex.addBuild(s)
 
         # now that the BuildStatus is prepared to answer queries, we can
         # announce the new build to all our watchers
@@ -2016,6 +2503,10 @@ class BuilderStatus(styles.Versioned):
         assert s in self.currentBuilds
         s.saveYourself()
         self.currentBuilds.remove(s)
+        self.statusChanged()
+        if self.sourceStampIndex is not None:
+            # got_revision may have changed the build's sourcestamp
+            self.sourceStampIndex.addBuild(s)
 
         name = self.getName()
         results = s.getResults()
@@ -2606,6 +3097,9 @@ class Status:
     def _handle_buildrequest_event(self, mode, brids):
         for brid in brids:
             buildername = self.db.get_buildername_for_brid(brid)
+            if buildername in self.botmaster.builders:
+                # its pending builds have changed
+                self.getBuilder(buildername).statusChanged()
             if buildername in self._builder_observers:
                 brs = BuildRequestStatus(brid, self, self.db)
                 for observer in self._builder_observers[buildername]:
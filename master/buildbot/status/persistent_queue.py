@@ -7,6 +7,7 @@ except ImportError:
     deque = None
 import os
 import pickle
+import struct
 
 from zope.interface import implements, Interface
 
@@ -294,6 +295,317 @@ class DiskQueue(object):
             self.lastItemId = files[-1]
 
 
+class SegmentedDiskQueue(object):
+    """Keeps a list of abstract items on disk, in a few large segment files.
+
+    Items are appended to the newest segment as length-prefixed records, and
+    a new segment is started once it grows past segmentSize bytes. A small
+    cursor file records where the oldest item is. Unlike DiskQueue, pushing
+    and popping items doesn't create or delete a file per item, so a large
+    backlog is cheap to build up and to drain.
+
+    Writes are fsync'ed in groups, every syncItems operations and on save(),
+    so a crash can lose the last few items pushed, or send the last few items
+    popped a second time.
+
+    Use pickle for serialization."""
+    implements(IQueue)
+
+    # Each record is its length followed by the pickled item.
+    header = '>I'
+    headerSize = struct.calcsize(header)
+
+    def __init__(self, path, maxItems=None, pickleFn=pickle.dumps,
+                 unpickleFn=pickle.loads, segmentSize=2**20, syncItems=100):
+        """
+        @path: directory to save the items.
+        @maxItems: maximum number of items to keep on disk, flush the
+        older ones.
+        @pickleFn: function used to pack the items to disk.
+        @unpickleFn: function used to unpack items from disk.
+        @segmentSize: size at which a new segment file is started.
+        @syncItems: number of items pushed or popped between fsyncs.
+        """
+        self.path = path
+        self._maxItems = maxItems
+        if self._maxItems is None:
+            self._maxItems = 100000
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        self.pickleFn = pickleFn
+        self.unpickleFn = unpickleFn
+        self.segmentSize = segmentSize
+        self.syncItems = syncItems
+
+        # Total number of items.
+        self._nbItems = 0
+        # Numbers of the segment files, oldest first.
+        self._segments = []
+        # Position of the oldest item.
+        self.headSegment = 0
+        self.headOffset = 0
+        # Open files for the oldest and newest segments.
+        self._reader = None
+        self._writer = None
+        self._unsynced = 0
+        self._loadFromDisk()
+
+    def pushItem(self, item):
+        ret = None
+        if self._nbItems == self._maxItems:
+            ret = self.unpickleFn(self._readRecords(1)[0])
+        self._appendRecord(self.pickleFn(item))
+        self._nbItems += 1
+        self._synced(1)
+        return ret
+
+    def insertBackChunk(self, chunk):
+        ret = None
+        excess = self._nbItems + len(chunk) - self._maxItems
+        if excess > 0:
+            ret = chunk[0:excess]
+            chunk = chunk[excess:]
+        if not chunk:
+            return ret
+        if not self._segments:
+            for i in chunk:
+                self._appendRecord(self.pickleFn(i))
+            self._nbItems += len(chunk)
+            self.save()
+            return ret
+        # Records can only be appended to a segment, so write the chunk
+        # followed by what is left of the oldest segment to a new segment
+        # that sorts before it, and replace the oldest segment with it.
+        records = []
+        for i in chunk:
+            data = self.pickleFn(i)
+            records.append(struct.pack(self.header, len(data)))
+            records.append(data)
+        old = self.headSegment
+        new = old - 1
+        self._closeReader()
+        if self._writer:
+            self._writer.flush()
+        f = open(self._segmentPath(old), 'rb')
+        try:
+            f.seek(self.headOffset)
+            records.append(f.read())
+        finally:
+            f.close()
+        self._writeSegment(new, ''.join(records))
+        self._segments.insert(0, new)
+        self._nbItems += len(chunk)
+        self.headSegment = new
+        self.headOffset = 0
+        if self._segments[-1] == old:
+            # it was also the newest segment, continue appending to the new one
+            self._closeWriter()
+            self._segments.pop()
+            self._writer = open(self._segmentPath(new), 'ab')
+        else:
+            self._segments.remove(old)
+        self.save()
+        os.remove(self._segmentPath(old))
+        return ret
+
+    def popChunk(self, nbItems=None):
+        if nbItems is None:
+            nbItems = self._maxItems
+        ret = [self.unpickleFn(data) for data in self._readRecords(nbItems)]
+        self._synced(len(ret))
+        return ret
+
+    def save(self):
+        if self._writer:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        self._writeCursor()
+        self._unsynced = 0
+
+    def items(self):
+        """Warning, slow."""
+        if self._writer:
+            self._writer.flush()
+        ret = []
+        offset = self.headOffset
+        for segment in self._segments:
+            f = open(self._segmentPath(segment), 'rb')
+            try:
+                f.seek(offset)
+                for data in self._iterRecords(f):
+                    ret.append(self.unpickleFn(data))
+            finally:
+                f.close()
+            offset = 0
+        return ret
+
+    def nbItems(self):
+        return self._nbItems
+
+    def maxItems(self):
+        return self._maxItems
+
+    #### Protected functions
+
+    def _segmentPath(self, segment):
+        return os.path.join(self.path, 'segment.%d' % segment)
+
+    def _iterRecords(self, f):
+        """Yields the complete records from f, leaving f positioned after
+        the last of them."""
+        while True:
+            pos = f.tell()
+            head = f.read(self.headerSize)
+            if len(head) == self.headerSize:
+                length = struct.unpack(self.header, head)[0]
+                data = f.read(length)
+                if len(data) == length:
+                    yield data
+                    continue
+            f.seek(pos)
+            return
+
+    def _readRecords(self, nbItems):
+        ret = []
+        if self._writer:
+            self._writer.flush()
+        while len(ret) < nbItems and self._nbItems:
+            if self._reader is None:
+                self._reader = open(self._segmentPath(self.headSegment), 'rb')
+                self._reader.seek(self.headOffset)
+            for data in self._iterRecords(self._reader):
+                ret.append(data)
+                self._nbItems -= 1
+                if len(ret) == nbItems:
+                    break
+            self.headOffset = self._reader.tell()
+            if len(ret) < nbItems and self._nbItems:
+                # This segment is exhausted, move on to the next one.
+                self._closeReader()
+                os.remove(self._segmentPath(self._segments.pop(0)))
+                self.headSegment = self._segments[0]
+                self.headOffset = 0
+        return ret
+
+    def _appendRecord(self, data):
+        if self._writer is None or self._writer.tell() >= self.segmentSize:
+            if self._writer is None and self._segments:
+                segment = self._segments[-1]
+            else:
+                if self._writer:
+                    self.save()
+                    self._closeWriter()
+                segment = 0
+                if self._segments:
+                    segment = self._segments[-1] + 1
+                self._segments.append(segment)
+                if len(self._segments) == 1:
+                    self.headSegment = segment
+                    self.headOffset = 0
+            self._writer = open(self._segmentPath(segment), 'ab')
+        self._writer.write(struct.pack(self.header, len(data)))
+        self._writer.write(data)
+
+    def _synced(self, nbItems):
+        self._unsynced += nbItems
+        if self._unsynced >= self.syncItems:
+            self.save()
+
+    def _closeReader(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+    def _closeWriter(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+    def _writeSegment(self, segment, data):
+        path = self._segmentPath(segment)
+        f = open(path + '.tmp', 'wb')
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+
+    def _writeCursor(self):
+        path = os.path.join(self.path, 'cursor')
+        f = open(path + '.tmp', 'w')
+        try:
+            f.write('%d %d\n' % (self.headSegment, self.headOffset))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if os.path.exists(path) and os.name == 'nt':
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def _loadFromDisk(self):
+        """Finds the segments and the oldest item, and counts the items."""
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith('segment.') and not name.endswith('.tmp'):
+                try:
+                    segments.append(int(name[len('segment.'):]))
+                except ValueError:
+                    pass
+        segments.sort()
+
+        cursor = os.path.join(self.path, 'cursor')
+        if os.path.isfile(cursor):
+            self.headSegment, self.headOffset = [int(x) for x in
+                                                 ReadFile(cursor).split()]
+            # Segments that were emptied before the cursor was updated.
+            while segments and segments[0] < self.headSegment:
+                os.remove(self._segmentPath(segments.pop(0)))
+            if not segments or segments[0] != self.headSegment:
+                self.headOffset = 0
+        if segments:
+            self.headSegment = segments[0]
+        self._segments = segments
+
+        # Count the items, and drop any partly-written record at the end.
+        offset = self.headOffset
+        for segment in segments:
+            f = open(self._segmentPath(segment), 'r+b')
+            try:
+                f.seek(offset)
+                for data in self._iterRecords(f):
+                    self._nbItems += 1
+                f.truncate(f.tell())
+            finally:
+                f.close()
+            offset = 0
+        self._importItemFiles()
+
+    def _importItemFiles(self):
+        """Moves any items left by a DiskQueue in the same directory to the
+        end of this queue."""
+        def SafeInt(item):
+            try:
+                return int(item)
+            except ValueError:
+                return None
+
+        files = filter(None, [SafeInt(x) for x in os.listdir(self.path)])
+        files.sort()
+        for id in files:
+            path = os.path.join(self.path, str(id))
+            self._appendRecord(ReadFile(path))
+            self._nbItems += 1
+        if files:
+            self.save()
+            for id in files:
+                os.remove(os.path.join(self.path, str(id)))
+        while self._nbItems > self._maxItems:
+            self._readRecords(self._nbItems - self._maxItems)
+
+
 class PersistentQueue(object):
     """Keeps a list of abstract items and serializes it to the disk.
 
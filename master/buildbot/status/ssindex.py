@@ -0,0 +1,129 @@
+# -*- test-case-name: buildbot.test.unit.test_status_ssindex -*-
+
+"""An in-memory index of the sourcestamps each builder has built recently,
+used by the grid displays so that they do not have to walk (and unpickle)
+a builder's entire build history on every page render."""
+
+def getSourceStampKey(ss):
+    """Two sourcestamps are assigned to the same grid row if they have the
+    same key, even if they differ in minor detail."""
+    return (ss.branch, ss.revision, ss.patch)
+
+class _Entry:
+    # only the most recent builds of each sourcestamp are remembered, since
+    # some (forced or nightly rebuilds, or builds without a revision) are
+    # built over and over
+    maxBuilds = 5
+
+    def __init__(self, ss):
+        self.ss = ss
+        self.builds = {} # build number -> start time, for recent builds
+        self.oldStart = None # earliest start of the forgotten builds
+
+    def addBuild(self, number, start):
+        """Remember a build, and return the number of a build that was
+        forgotten to make room for it (possibly NUMBER itself), or None."""
+        self.builds[number] = start
+        if len(self.builds) <= self.maxBuilds:
+            return None
+        oldest = min(self.builds.keys())
+        start = self.builds.pop(oldest)
+        if self.oldStart is None or start < self.oldStart:
+            self.oldStart = start
+        return oldest
+
+    def getStart(self):
+        starts = self.builds.values()
+        if self.oldStart is not None:
+            starts.append(self.oldStart)
+        return min(starts)
+
+    def getLatestBuildNumber(self):
+        return max(self.builds.keys())
+
+class SourceStampIndex:
+    """
+    I hold the L{size} most recent sourcestamps on each branch built by a
+    single builder, ordered by the earliest start time of any build of each,
+    and the numbers of the builds that ran them. The bound is per branch so
+    that a busy branch does not push a rarely built one out of the index.
+
+    Builds (or L{buildbot.status.summary.BuildSummary} records) are added as
+    they start, and added again when they finish, since a build's absolute
+    sourcestamp can change while it runs (when it discovers its
+    got_revision).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = {} # key -> _Entry
+        self.branches = {} # branch -> {key: _Entry}
+        self.buildKeys = {} # build number -> key
+
+    def addBuild(self, build):
+        start = build.getTimes()[0]
+        if not start:
+            return
+        number = build.getNumber()
+        ss = build.getSourceStamp(absolute=True)
+        key = getSourceStampKey(ss)
+
+        oldkey = self.buildKeys.get(number)
+        if oldkey is not None and oldkey != key:
+            self._removeBuild(oldkey, number)
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = _Entry(ss)
+            self.branches.setdefault(ss.branch, {})[key] = entry
+        self.buildKeys[number] = key
+        forgotten = entry.addBuild(number, start)
+        if forgotten is not None:
+            del self.buildKeys[forgotten]
+
+        if len(self.branches[ss.branch]) > self.size:
+            self._evict(ss.branch)
+
+    def _removeEntry(self, key):
+        entry = self.entries.pop(key)
+        branch = self.branches[entry.ss.branch]
+        del branch[key]
+        if not branch:
+            del self.branches[entry.ss.branch]
+
+    def _removeBuild(self, key, number):
+        entry = self.entries.get(key)
+        if entry is not None:
+            del entry.builds[number]
+            if not entry.builds:
+                self._removeEntry(key)
+        del self.buildKeys[number]
+
+    def _evict(self, branch):
+        entries = self.branches[branch]
+        byage = [(e.getStart(), key) for key, e in entries.iteritems()]
+        byage.sort()
+        for start, key in byage[:len(entries) - self.size]:
+            for number in self.entries[key].builds:
+                del self.buildKeys[number]
+            self._removeEntry(key)
+
+    def getSourceStamps(self, branches=None):
+        """Return a list of (key, sourcestamp, earliest start) tuples for
+        the indexed sourcestamps, in no particular order. If BRANCHES is
+        given, only sourcestamps on those branches are included."""
+        if branches is None:
+            branches = self.branches.keys()
+        result = []
+        for branch in branches:
+            for key, entry in self.branches.get(branch, {}).iteritems():
+                result.append((key, entry.ss, entry.getStart()))
+        return result
+
+    def getBuildNumber(self, key):
+        """Return the number of the most recent build of the sourcestamp with
+        the given key, or None if it is not in the index."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry.getLatestBuildNumber()
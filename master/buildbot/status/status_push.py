@@ -17,7 +17,7 @@ except ImportError:
 
 from buildbot.status.base import StatusReceiverMultiService
 from buildbot.status.persistent_queue import DiskQueue, IndexedQueue, \
-        MemoryQueue, PersistentQueue
+        MemoryQueue, PersistentQueue, SegmentedDiskQueue
 from buildbot.status.web.status_json import FilterOut
 from twisted.internet import defer, reactor
 from twisted.python import log
@@ -313,7 +313,7 @@ class HttpStatusPush(StatusPush):
 
     def __init__(self, serverUrl, debug=None, maxMemoryItems=None,
                  maxDiskItems=None, chunkSize=200, maxHttpRequestSize=2**20,
-                 **kwargs):
+                 segmentedDiskQueue=False, **kwargs):
         """
         @serverUrl: Base URL to be used to push events notifications.
         @maxMemoryItems: Maximum number of items to keep queued in memory.
@@ -323,6 +323,9 @@ class HttpStatusPush(StatusPush):
         @chunkSize: maximum number of items to send in each at each HTTP POST.
         @maxHttpRequestSize: limits the size of encoded data for AE, the default
         is 1MB.
+        @segmentedDiskQueue: buffer to disk with a SegmentedDiskQueue, which
+        keeps the items in a few large files, instead of a DiskQueue, which
+        uses one file per item. Items left by a DiskQueue are picked up.
         """
         # Parameters.
         self.serverUrl = serverUrl
@@ -334,9 +337,13 @@ class HttpStatusPush(StatusPush):
             # The queue directory is determined by the server url.
             path = ('events_' +
                     urlparse.urlparse(self.serverUrl)[1].split(':')[0])
+            if segmentedDiskQueue:
+                diskQueue = SegmentedDiskQueue(path, maxItems=maxDiskItems)
+            else:
+                diskQueue = DiskQueue(path, maxItems=maxDiskItems)
             queue = PersistentQueue(
                         primaryQueue=MemoryQueue(maxItems=maxMemoryItems),
-                        secondaryQueue=DiskQueue(path, maxItems=maxDiskItems))
+                        secondaryQueue=diskQueue)
         else:
             path = None
             queue = MemoryQueue(maxItems=maxMemoryItems)
@@ -0,0 +1,230 @@
+# -*- test-case-name: buildbot.test.unit.test_status_summary -*-
+
+import os
+
+from buildbot.util import json
+from buildbot.sourcestamp import SourceStamp
+
+def _get_sqlite():
+    # prefer pysqlite2.dbapi2 if it is available, just like
+    # buildbot.db.dbspec does
+    try:
+        from pysqlite2 import dbapi2 as sqlite3
+    except ImportError:
+        import sqlite3
+    return sqlite3
+
+class BuildSummary:
+    """I am a lightweight record of a finished build, holding just the
+    fields that build listings (waterfall, grids, feeds, one-line-per-build
+    pages) need. I can be produced without unpickling the L{BuildStatus};
+    use L{getBuild} when the full build (steps, logs, properties) is
+    actually required."""
+
+    def __init__(self, builder, number, started=None, finished=None,
+                 results=None, branch=None, revision=None, got_revision=None,
+                 repository='', slavename=None, text=[], committers=[],
+                 reason=None):
+        self.builder = builder
+        self.number = number
+        self.started = started
+        self.finished = finished
+        self.results = results
+        self.branch = branch
+        self.revision = revision
+        self.got_revision = got_revision
+        self.repository = repository
+        self.slavename = slavename
+        self.text = text
+        self.committers = committers
+        self.reason = reason
+
+    def fromBuild(cls, build):
+        """Summarize a L{BuildStatus}"""
+        ss = build.getSourceStamp()
+        got_revision = build.getProperties().getProperty('got_revision')
+        return cls(build.getBuilder(), build.getNumber(),
+                   started=build.started, finished=build.finished,
+                   results=build.getResults(),
+                   branch=ss and ss.branch, revision=ss and ss.revision,
+                   got_revision=got_revision,
+                   repository=ss and ss.repository or '',
+                   slavename=build.getSlavename(), text=build.getText(),
+                   committers=[c.who for c in build.getChanges()],
+                   reason=build.getReason())
+    fromBuild = classmethod(fromBuild)
+
+    def __repr__(self):
+        return "<%s #%s>" % (self.__class__.__name__, self.number)
+
+    def getBuilder(self):
+        return self.builder
+
+    def getNumber(self):
+        return self.number
+
+    def getTimes(self):
+        return (self.started, self.finished)
+
+    def isFinished(self):
+        return self.finished is not None
+
+    def getResults(self):
+        return self.results
+
+    def getBranch(self):
+        return self.branch
+
+    def getRevision(self):
+        return self.revision
+
+    def getGotRevision(self):
+        return self.got_revision
+
+    def getRepository(self):
+        return self.repository
+
+    def getSourceStamp(self, absolute=False):
+        """Return a L{SourceStamp} for this build, using its got_revision if
+        ABSOLUTE is true and it has one. Patches and changes are not
+        summarized, so the sourcestamp has neither."""
+        revision = self.revision
+        if absolute and self.got_revision is not None:
+            revision = self.got_revision
+        return SourceStamp(branch=self.branch, revision=revision,
+                           repository=self.repository)
+
+    def getSlavename(self):
+        return self.slavename
+
+    def getText(self):
+        return self.text
+
+    def getCommitters(self):
+        return self.committers
+
+    def getReason(self):
+        return self.reason
+
+    def getBuild(self):
+        """Load the full L{BuildStatus} for this build, or return None if it
+        is no longer available."""
+        return self.builder.getBuild(self.number)
+
+class BuildSummaryStore:
+    """I keep a table of L{BuildSummary} records for a single builder, in an
+    SQLite database next to the builder's pickles. Rows are written when a
+    build is saved, and read back by the listing paths in L{BuilderStatus}
+    so that they do not have to unpickle every build they look at."""
+
+    columns = ('number', 'started', 'finished', 'results', 'branch',
+               'revision', 'got_revision', 'repository', 'slavename', 'text',
+               'committers', 'reason')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = None
+
+    def _getConnection(self):
+        if self.conn is None:
+            sqlite3 = _get_sqlite()
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self.conn = sqlite3.connect(self.filename)
+            self.conn.text_factory = str
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS builds (
+                    `number` INTEGER PRIMARY KEY,
+                    `started` REAL,
+                    `finished` REAL,
+                    `results` INTEGER,
+                    `branch` TEXT,
+                    `revision` TEXT,
+                    `got_revision` TEXT,
+                    `repository` TEXT,
+                    `slavename` TEXT,
+                    `text` TEXT,
+                    `committers` TEXT,
+                    `reason` TEXT
+                )""")
+            self.conn.commit()
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def addBuild(self, build):
+        """Record (or replace) the summary of the given L{BuildStatus}"""
+        s = BuildSummary.fromBuild(build)
+        finished = s.finished
+        if finished is None:
+            # an interrupted build being saved at shutdown; once pickled it
+            # is considered finished, so record it as finishing now
+            finished = s.started
+        row = (s.number, s.started, finished, s.results,
+               s.branch, s.revision, s.got_revision and str(s.got_revision),
+               s.repository, s.slavename, json.dumps(s.text),
+               json.dumps(s.committers), s.reason)
+        conn = self._getConnection()
+        conn.execute("INSERT OR REPLACE INTO builds VALUES (%s)"
+                     % ",".join(["?"] * len(row)), row)
+        conn.commit()
+
+    def _makeSummary(self, builder, row):
+        d = dict(zip(self.columns, row))
+        d['text'] = json.loads(d['text'])
+        d['committers'] = json.loads(d['committers'])
+        return BuildSummary(builder, **d)
+
+    def getSummary(self, builder, number):
+        """Return the L{BuildSummary} for build NUMBER, or None if it has not
+        been recorded."""
+        conn = self._getConnection()
+        rows = conn.execute("SELECT %s FROM builds WHERE number = ?"
+                            % ",".join(self.columns), (number,)).fetchall()
+        if not rows:
+            return None
+        return self._makeSummary(builder, rows[0])
+
+    def getSummaries(self, builder, max_buildnum=None, min_buildnum=None,
+                     branches=[], finished_before=None, limit=None):
+        """Return a list of L{BuildSummary} records, most recent first,
+        filtered by the given arguments."""
+        where = []
+        args = []
+        if max_buildnum is not None:
+            where.append("number <= ?")
+            args.append(max_buildnum)
+        if min_buildnum is not None:
+            where.append("number >= ?")
+            args.append(min_buildnum)
+        if finished_before is not None:
+            where.append("finished < ?")
+            args.append(finished_before)
+        if branches:
+            clauses = []
+            for b in branches:
+                if b is None:
+                    clauses.append("branch IS NULL")
+                else:
+                    clauses.append("branch = ?")
+                    args.append(b)
+            where.append("(%s)" % " OR ".join(clauses))
+        q = "SELECT %s FROM builds" % ",".join(self.columns)
+        if where:
+            q += " WHERE " + " AND ".join(where)
+        q += " ORDER BY number DESC"
+        if limit is not None:
+            q += " LIMIT %d" % limit
+        conn = self._getConnection()
+        return [self._makeSummary(builder, row)
+                for row in conn.execute(q, args).fetchall()]
+
+    def pruneBefore(self, number):
+        """Forget the summaries of builds numbered below NUMBER"""
+        conn = self._getConnection()
+        conn.execute("DELETE FROM builds WHERE number < ?", (number,))
+        conn.commit()
@@ -15,6 +15,7 @@ from buildbot.status.web.feeds import Rss20StatusResource, \
      Atom10StatusResource
 from buildbot.status.web.waterfall import WaterfallStatusResource
 from buildbot.status.web.console import ConsoleStatusResource
+from buildbot.status.web.eventstream import EventStreamResource
 from buildbot.status.web.olpb import OneLinePerBuild
 from buildbot.status.web.grid import GridStatusResource, TransposedGridStatusResource
 from buildbot.status.web.changes import ChangesResource
@@ -81,6 +82,7 @@ class WebStatus(service.MultiService):
      /one_line_per_build : summarize the last few builds, one line each
      /one_line_per_build/BUILDERNAME : same, but only for a single builder
      /about : describe this buildmaster (Buildbot and support library versions)
+     /eventstream : a live stream of build events, as lines of json
      /change_hook[/DIALECT] : accepts changes from external sources, optionally
                               choosing the dialect that will be permitted
                               (i.e. github format, etc..)
@@ -132,13 +134,17 @@ class WebStatus(service.MultiService):
     # not (we'd have to do a recursive traversal of all children to discover
     # all the changes).
 
+    eventStream = None # the /eventstream resource, set by setupUsualPages
+    waterfall = None # the /waterfall resource, likewise
+    console = None # the /console resource, likewise
+
     def __init__(self, http_port=None, distrib_port=None, allowForce=None,
                  public_html="public_html", site=None, numbuilds=20,
                  num_events=200, num_events_max=None, auth=None,
                  order_console_by_time=False, changecommentlink=None,
                  revlink=None, projects=None, repositories=None,
                  authz=None, logRotateLength=None, maxRotatedFiles=None,
-                 change_hook_dialects = {}):
+                 change_hook_dialects = {}, console_max_revisions=100):
         """Run a web server that provides Buildbot status.
 
         @type  http_port: int or L{twisted.application.strports} string
@@ -211,6 +217,10 @@ class WebStatus(service.MultiService):
                      view according to the time they were created (for VCS like Git) or
                      according to their integer revision numbers (for VCS like SVN).
 
+        @type console_max_revisions: int
+        @param console_max_revisions: The number of most recent revisions for
+                     which the console keeps each builder's builds in memory.
+
         @type changecommentlink: callable, dict, tuple (2 or 3 strings) or C{None}
         @param changecommentlink: adds links to ticket/bug ids in change comments,
             see buildbot.status.web.base.changecommentlink for details
@@ -291,6 +301,7 @@ class WebStatus(service.MultiService):
         self.authz = authz
 
         self.orderConsoleByTime = order_console_by_time
+        self.consoleMaxRevisions = console_max_revisions
 
         # If we were given a site object, go ahead and use it. (if not, we add one later)
         self.site = site
@@ -320,11 +331,14 @@ class WebStatus(service.MultiService):
 
     def setupUsualPages(self, numbuilds, num_events, num_events_max):
         #self.putChild("", IndexOrWaterfallRedirection())
-        self.putChild("waterfall", WaterfallStatusResource(num_events=num_events,
-                                        num_events_max=num_events_max))
+        self.waterfall = WaterfallStatusResource(num_events=num_events,
+                                        num_events_max=num_events_max)
+        self.putChild("waterfall", self.waterfall)
         self.putChild("grid", GridStatusResource())
-        self.putChild("console", ConsoleStatusResource(
-                orderByTime=self.orderConsoleByTime))
+        self.console = ConsoleStatusResource(
+                orderByTime=self.orderConsoleByTime,
+                maxRevisions=self.consoleMaxRevisions)
+        self.putChild("console", self.console)
         self.putChild("tgrid", TransposedGridStatusResource())
         self.putChild("builders", BuildersResource()) # has builds/steps/logs
         self.putChild("one_box_per_builder", Redirect("builders"))
@@ -337,6 +351,8 @@ class WebStatus(service.MultiService):
         self.putChild("about", AboutBuildbot())
         self.putChild("authfail", AuthFailResource())
         self.putChild("changelog", Changelog())
+        self.eventStream = EventStreamResource()
+        self.putChild("eventstream", self.eventStream)
 
 
     def __repr__(self):
@@ -443,6 +459,12 @@ class WebStatus(service.MultiService):
         self.channels[channel] = 1 # weakrefs
 
     def stopService(self):
+        if self.eventStream:
+            self.eventStream.stop()
+        if self.waterfall:
+            self.waterfall.timelines.unsubscribe()
+        if self.console:
+            self.console.matrix.unsubscribe()
         for channel in self.channels:
             try:
                 channel.transport.loseConnection()
@@ -95,7 +95,7 @@ class ChangeHookResource(resource.Resource):
         changeMaster = request.site.buildbot_service.master.change_svc
         for onechange in changes:
             msg("injecting change %s" % onechange)
-            changeMaster.addChange( onechange )
+        changeMaster.addChanges( changes )
         
     
     
\ No newline at end of file
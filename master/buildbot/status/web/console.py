@@ -7,6 +7,7 @@ import urllib
 
 from buildbot import util
 from buildbot.status import builder
+from buildbot.status.base import StatusReceiver
 from buildbot.status.web.base import HtmlResource
 
 def getResultsClass(results, prevResults, inProgress):
@@ -66,10 +67,205 @@ class DevBuild:
         self.number = build.getNumber()
         self.isFinished = build.isFinished()
         self.text = build.getText()
-        self.eta = build.getETA()
+        self.eta = None
+        if not self.isFinished:
+            self.eta = build.getETA()
         self.details = details
         self.when = build.getTimes()[0]
-        self.source = build.getSourceStamp()
+
+
+def getBuildDetails(builderName, build):
+    """Returns a dictionary describing the failures of a given build. The
+    logs are given by their path relative to the root of the web status."""
+    details = {}
+    if not build.getLogs():
+        return details
+
+    for step in build.getSteps():
+        (result, reason) = step.getResults()
+        if result == builder.FAILURE:
+            name = step.getName()
+
+            # Remove html tags from the error text.
+            stripHtml = re.compile(r'<.*?>')
+            strippedDetails = stripHtml.sub('', ' '.join(step.getText()))
+
+            details['buildername'] = builderName
+            details['status'] = strippedDetails
+            details['reason'] = reason
+            logs = details['logs'] = []
+
+            if step.getLogs():
+                for log in step.getLogs():
+                    logname = log.getName()
+                    path = "builders/%s/builds/%s/steps/%s/logs/%s" % (
+                        urllib.quote(builderName),
+                        build.getNumber(),
+                        urllib.quote(name),
+                        urllib.quote(logname))
+                    logs.append(dict(path=path, name=logname))
+    return details
+
+
+class ConsoleMatrix(StatusReceiver):
+    """I hold the revision x builder matrix that the console displays: for
+    each builder, a L{DevBuild} for each of its recent builds, ordered by
+    revision (using the given L{RevisionComparator}), most recent first.
+
+    Each builder's builds are loaded from its build summaries the first time
+    they are asked for, and are then kept up to date as builds start and
+    finish, so that drawing the console does not need to walk (and unpickle)
+    the builders' history. Only builds of the L{maxRevisions} most recent
+    revisions are kept for each builder."""
+
+    def __init__(self, comparator, maxRevisions=100):
+        self.comparator = comparator
+        self.maxRevisions = maxRevisions
+        self.status = None
+        self.builds = {} # builderName -> [DevBuild], newest revision first
+        self.running = {} # builderName -> {number: BuildStatus}
+        self.lastResults = {} # builderName -> results of last finished build
+
+    def subscribe(self, status):
+        if self.status is None:
+            self.status = status
+            status.subscribe(self)
+
+    def unsubscribe(self):
+        if self.status is None:
+            return
+        self.status.unsubscribe(self)
+        for name in self.status.getBuilderNames():
+            try:
+                self.status.getBuilder(name).unsubscribe(self)
+            except ValueError:
+                pass
+        self.status = None
+        # nothing keeps the builds up to date any more
+        self.builds = {}
+        self.running = {}
+        self.lastResults = {}
+
+    def getRevision(self, got_revision, revision):
+        """Return the revision a build was built from, preferring its
+        got_revision, or None if neither looks like a revision."""
+        for rev in (got_revision, revision):
+            if rev and self.comparator.isValidRevision(rev):
+                return rev
+        return None
+
+    def getBuilds(self, builderName):
+        """Return the L{DevBuild}s for the given builder, newest revision
+        first."""
+        builds = self.builds.get(builderName)
+        if builds is None:
+            builds = self.builds[builderName] = []
+            self.running[builderName] = {}
+            self._fill(builderName)
+        # running builds change as they go: they may discover their
+        # got_revision, and their text and ETA are updated
+        for build in self.running[builderName].values():
+            self._addBuild(builderName, build)
+        return builds
+
+    def getLastResults(self, builderName):
+        """Return the results of the most recent finished build of the given
+        builder, or None."""
+        self.getBuilds(builderName)
+        return self.lastResults.get(builderName)
+
+    def getDetails(self, builderName, devBuild):
+        """Return the failure details of the given build. These are only
+        known for builds that finished while we were watching; for older
+        builds, the build is loaded the first time they are needed."""
+        if devBuild.details is None:
+            devBuild.details = {}
+            build = self.status.getBuilder(builderName).getBuild(devBuild.number)
+            if build:
+                devBuild.details = getBuildDetails(builderName, build)
+        return devBuild.details
+
+    def _fill(self, builderName):
+        bs = self.status.getBuilder(builderName)
+        builds = self.builds[builderName]
+        for summary in bs.generateBuildSummaries(
+                        max_search=self.maxRevisions * 2):
+            if summary is None:
+                continue
+            if not summary.isFinished():
+                build = bs.getBuild(summary.getNumber())
+                if build and not build.isFinished():
+                    self.running[builderName][build.getNumber()] = build
+                continue
+            if builderName not in self.lastResults:
+                self.lastResults[builderName] = summary.getResults()
+            rev = self.getRevision(summary.getGotRevision(),
+                                   summary.getRevision())
+            if rev is None:
+                continue
+            self._insert(builds, DevBuild(rev, summary, None))
+            self._trim(builds)
+
+    def _addBuild(self, builderName, build, details=None):
+        builds = self.builds[builderName]
+        number = build.getNumber()
+        for i in range(len(builds)):
+            if builds[i].number == number:
+                del builds[i]
+                break
+        got_rev = build.getProperties().getProperty('got_revision')
+        ss = build.getSourceStamp()
+        rev = self.getRevision(got_rev, ss and ss.revision)
+        # We ignore all builds that don't have last revisions.
+        # TODO(nsylvain): If the build is over, maybe it was a problem
+        # with the update source step. We need to find a way to tell the
+        # user that his change might have broken the source update.
+        if rev is not None:
+            self._insert(builds, DevBuild(rev, build, details))
+            self._trim(builds)
+
+    def _compare(self, first, second):
+        if self.comparator.isRevisionEarlier(first, second):
+            return -1
+        if self.comparator.isRevisionEarlier(second, first):
+            return 1
+        return cmp(first.number, second.number)
+
+    def _insert(self, builds, devBuild):
+        i = 0
+        while i < len(builds) and self._compare(builds[i], devBuild) > 0:
+            i += 1
+        builds.insert(i, devBuild)
+
+    def _trim(self, builds):
+        revisions = {}
+        for i in range(len(builds)):
+            revisions[builds[i].revision] = 1
+            if len(revisions) > self.maxRevisions:
+                del builds[i:]
+                return
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        return self
+
+    def builderRemoved(self, builderName):
+        self.builds.pop(builderName, None)
+        self.running.pop(builderName, None)
+        self.lastResults.pop(builderName, None)
+
+    def buildStarted(self, builderName, build):
+        if builderName in self.builds:
+            self.running[builderName][build.getNumber()] = build
+            self._addBuild(builderName, build)
+
+    def buildFinished(self, builderName, build, results):
+        if builderName in self.builds:
+            self.running[builderName].pop(build.getNumber(), None)
+            self.lastResults[builderName] = results
+            self._addBuild(builderName, build,
+                           getBuildDetails(builderName, build))
 
 
 class ConsoleStatusResource(HtmlResource):
@@ -77,7 +273,7 @@ class ConsoleStatusResource(HtmlResource):
     Every change is a line in the page, and it shows the result of the first
     build with this change for each slave."""
 
-    def __init__(self, orderByTime=False):
+    def __init__(self, orderByTime=False, maxRevisions=100):
         HtmlResource.__init__(self)
 
         self.status = None
@@ -87,6 +283,8 @@ class ConsoleStatusResource(HtmlResource):
         else:
             self.comparator = IntegerRevisionComparator()
 
+        self.matrix = ConsoleMatrix(self.comparator, maxRevisions)
+
     def getTitle(self, request):
         status = self.getStatus(request)
         projectName = status.getProjectName()
@@ -203,114 +401,14 @@ class ConsoleStatusResource(HtmlResource):
 
         return revisions
 
-    def getBuildDetails(self, request, builderName, build):
-        """Returns an HTML list of failures for a given build."""
-        details = {}
-        if not build.getLogs():
-            return details
-        
-        for step in build.getSteps():
-            (result, reason) = step.getResults()
-            if result == builder.FAILURE:
-                name = step.getName()
-
-                # Remove html tags from the error text.
-                stripHtml = re.compile(r'<.*?>')
-                strippedDetails = stripHtml.sub('', ' '.join(step.getText()))
-                
-                details['buildername'] = builderName
-                details['status'] = strippedDetails
-                details['reason'] = reason
-                logs = details['logs'] = []
-
-                if step.getLogs():
-                    for log in step.getLogs():
-                        logname = log.getName()
-                        logurl = request.childLink(
-                          "../builders/%s/builds/%s/steps/%s/logs/%s" % 
-                            (urllib.quote(builderName),
-                             build.getNumber(),
-                             urllib.quote(name),
-                             urllib.quote(logname)))
-                        logs.append(dict(url=logurl, name=logname))
-        return details
-
-    def getBuildsForRevision(self, request, builder, builderName, lastRevision,
-                             numBuilds, debugInfo):
-        """Return the list of all the builds for a given builder that we will
-        need to be able to display the console page. We start by the most recent
-        build, and we go down until we find a build that was built prior to the
-        last change we are interested in."""
-
-        revision = lastRevision 
-
-        builds = []
-        build = self.getHeadBuild(builder)
-        number = 0
-        while build and number < numBuilds:
-            debugInfo["builds_scanned"] += 1
-            number += 1
-
-            # Get the last revision in this build.
-            # We first try "got_revision", but if it does not work, then
-            # we try "revision".
-            got_rev = -1
-            try:
-                got_rev = build.getProperty("got_revision")
-                if not self.comparator.isValidRevision(got_rev):
-                    got_rev = -1
-            except KeyError:
-                pass
-
-            try:
-                if got_rev == -1:
-                    got_rev = build.getProperty("revision")
-                if not self.comparator.isValidRevision(got_rev):
-                    got_rev = -1
-            except:
-                pass
-
-            # We ignore all builds that don't have last revisions.
-            # TODO(nsylvain): If the build is over, maybe it was a problem
-            # with the update source step. We need to find a way to tell the
-            # user that his change might have broken the source update.
-            if got_rev and got_rev != -1:
-                details = self.getBuildDetails(request, builderName, build)
-                devBuild = DevBuild(got_rev, build, details)
-                builds.append(devBuild)
-
-                # Now break if we have enough builds.
-                current_revision = self.getChangeForBuild(
-                    build, revision)
-                if self.comparator.isRevisionEarlier(
-                    devBuild, current_revision):
-                    break
-
-            build = build.getPreviousBuild()
-
-        return builds
-
-    def getChangeForBuild(self, build, revision):
-        if not build or not build.getChanges(): # Forced build
-            return DevBuild(revision, build, None)
-        
-        for change in build.getChanges():
-            if change.revision == revision:
-                return change
-
-        # No matching change, return the last change in build.
-        changes = list(build.getChanges())
-        changes.sort(key=self.comparator.getSortingKey())
-        return changes[-1]
-    
-    def getAllBuildsForRevision(self, status, request, lastRevision, numBuilds,
-                                categories, builders, debugInfo):
+    def getAllBuildsForRevision(self, status, categories, builders,
+                                debugInfo):
         """Returns a dictionnary of builds we need to inspect to be able to
         display the console page. The key is the builder name, and the value is
-        an array of build we care about. We also returns a dictionnary of
-        builders we care about. The key is it's category.
+        an array of build we care about, taken from the console matrix. We
+        also returns a dictionnary of builders we care about. The key is it's
+        category.
  
-        lastRevision is the last revision we want to display in the page.
         categories is a list of categories to display. It is coming from the
             HTTP GET parameters.
         builders is a list of builders to display. It is coming from the HTTP
@@ -348,12 +446,8 @@ class ConsoleStatusResource(HtmlResource):
             # Append this builder to the dictionnary of builders.
             builderList[category].append(builderName)
             # Set the list of builds for this builder.
-            allBuilds[builderName] = self.getBuildsForRevision(request,
-                                                               builder,
-                                                               builderName,
-                                                               lastRevision,
-                                                               numBuilds,
-                                                               debugInfo)
+            allBuilds[builderName] = self.matrix.getBuilds(builderName)
+            debugInfo["builds_scanned"] += len(allBuilds[builderName])
 
         return (builderList, allBuilds)
 
@@ -423,13 +517,9 @@ class ConsoleStatusResource(HtmlResource):
                 else:
                     # If not offline, then display the result of the last
                     # finished build.
-                    build = self.getHeadBuild(status.getBuilder(builder))
-                    while build and not build.isFinished():
-                        build = build.getPreviousBuild()
-
-                    if build:
-                        s["color"] = getResultsClass(build.getResults(), None,
-                                                      False)
+                    results = self.matrix.getLastResults(builder)
+                    if results is not None:
+                        s["color"] = getResultsClass(results, None, False)
 
                 slaves[category].append(s)
 
@@ -485,9 +575,7 @@ class ConsoleStatusResource(HtmlResource):
                 url = "./waterfall"
                 title = builder
                 tag = ""
-                current_details = {}
                 if introducedIn:
-                    current_details = introducedIn.details or ""
                     url = "./buildstatus?builder=%s&number=%s" % (urllib.quote(builder),
                                                                   introducedIn.number)
                     title += " "
@@ -514,11 +602,25 @@ class ConsoleStatusResource(HtmlResource):
 
                 # If the box is red, we add the explaination in the details
                 # section.
-                if current_details and resultsClass == "failure":
-                    details.append(current_details)
+                if introducedIn and resultsClass == "failure":
+                    current_details = self.matrix.getDetails(builder,
+                                                             introducedIn)
+                    if current_details:
+                        details.append(current_details)
 
         return (builds, details)
 
+    def linkDetails(self, request, details):
+        """Add the URLs of the failed logs to the given build details."""
+        linked = []
+        for d in details:
+            d = d.copy()
+            d['logs'] = [dict(url=request.childLink("../" + l['path']),
+                              name=l['name'])
+                         for l in d.get('logs', [])]
+            linked.append(d)
+        return linked
+
     def displayPage(self, request, status, builderList, allBuilds, revisions,
                     categories, branch, debugInfo):
         """Display the console page."""
@@ -559,7 +661,7 @@ class ConsoleStatusResource(HtmlResource):
                                             revision,
                                             debugInfo)
             r['builds'] = builds
-            r['details'] = details
+            r['details'] = self.linkDetails(request, details)
 
             # Calculate the td span for the comment and the details.
             r["span"] = len(builderList) + 2            
@@ -625,24 +727,19 @@ class ConsoleStatusResource(HtmlResource):
         numRevs = 40
         if devName:
             numRevs *= 2
-        numBuilds = numRevs
-
 
         revisions = self.stripRevisions(allChanges, numRevs, branch, devName)
         debugInfo["revision_final"] = len(revisions)
 
-        # Fetch all the builds for all builders until we get the next build
-        # after lastRevision.
+        # Fetch the builds of all builders from the console matrix.
         builderList = None
         allBuilds = None
         if revisions:
             lastRevision = revisions[len(revisions) - 1].revision
             debugInfo["last_revision"] = lastRevision
 
+            self.matrix.subscribe(status)
             (builderList, allBuilds) = self.getAllBuildsForRevision(status,
-                                                request,
-                                                lastRevision,
-                                                numBuilds,
                                                 categories,
                                                 builders,
                                                 debugInfo)
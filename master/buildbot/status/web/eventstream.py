@@ -0,0 +1,215 @@
+# -*- test-case-name: buildbot.test.unit.test_status_web_eventstream -*-
+
+"""A live stream of build events, pushed to web clients over long-lived
+HTTP responses so that dashboards don't have to poll."""
+
+from zope.interface import implements
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+from twisted.web import resource, server
+
+from buildbot.status.base import StatusReceiver
+from buildbot.util import json
+
+# the events a client gets unless it asks for others with ?event=
+DEFAULT_EVENTS = ('buildStarted', 'stepFinished', 'buildFinished')
+ALL_EVENTS = DEFAULT_EVENTS + ('logChunk',)
+
+class EventStreamClient:
+    """I am a single client of the event stream. Events are written to my
+    request as lines of json. If the client falls behind, and more than
+    maxBufferSize bytes of events are waiting to be sent to it, it is
+    disconnected."""
+    implements(IPushProducer)
+
+    def __init__(self, hub, request, builders=[], categories=[],
+                 events=DEFAULT_EVENTS, maxBufferSize=2**20):
+        self.hub = hub
+        self.request = request
+        self.builders = builders
+        self.categories = categories
+        self.events = events
+        self.maxBufferSize = maxBufferSize
+        self.paused = False
+        self.buffer = []
+        self.bufferSize = 0
+
+    def wants(self, event, builderName, category):
+        if event not in self.events:
+            return False
+        if self.builders and builderName not in self.builders:
+            return False
+        if self.categories and category not in self.categories:
+            return False
+        return True
+
+    def send(self, data):
+        if self.paused or self.buffer:
+            self.buffer.append(data)
+            self.bufferSize += len(data)
+            if self.bufferSize > self.maxBufferSize:
+                log.msg("event stream client is too slow, disconnecting it")
+                self.close()
+        else:
+            self.request.write(data)
+
+    def close(self):
+        self.hub.removeClient(self)
+        self.request.unregisterProducer()
+        self.request.finish()
+
+    # IPushProducer: the transport tells us when its buffer is full
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        while self.buffer and not self.paused:
+            data = self.buffer.pop(0)
+            self.bufferSize -= len(data)
+            self.request.write(data)
+
+    def stopProducing(self):
+        self.hub.removeClient(self)
+
+
+class EventStreamHub(StatusReceiver):
+    """I subscribe to the status once, and send the events I hear about to
+    each of the clients that want them. Every build, step and log is
+    subscribed to, even while nobody is listening, so that a client which
+    connects in the middle of a build still hears about the rest of it;
+    events that nobody wants are dropped cheaply."""
+
+    def __init__(self):
+        self.status = None
+        self.clients = []
+
+    def subscribe(self, status):
+        if self.status is None:
+            self.status = status
+            status.subscribe(self)
+
+    def unsubscribe(self):
+        if self.status is None:
+            return
+        self.status.unsubscribe(self)
+        for name in self.status.getBuilderNames():
+            try:
+                self.status.getBuilder(name).unsubscribe(self)
+            except ValueError:
+                pass
+        self.status = None
+        for client in self.clients[:]:
+            client.close()
+
+    def addClient(self, client):
+        self.clients.append(client)
+
+    def removeClient(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def wanted(self, event):
+        for client in self.clients:
+            if event in client.events:
+                return True
+        return False
+
+    def publish(self, event, builder, data):
+        if not self.clients:
+            return
+        builderName = builder.getName()
+        category = builder.getCategory()
+        data['event'] = event
+        data['builder'] = builderName
+        line = None
+        for client in self.clients[:]:
+            if client.wants(event, builderName, category):
+                if line is None:
+                    line = json.dumps(data, sort_keys=True,
+                                      separators=(',',':')) + '\n'
+                client.send(line)
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        return self
+
+    def buildStarted(self, builderName, build):
+        self.publish('buildStarted', build.getBuilder(),
+                     dict(number=build.getNumber(),
+                          reason=build.getReason(),
+                          slave=build.getSlavename(),
+                          time=build.getTimes()[0]))
+        return self
+
+    def stepStarted(self, build, step):
+        return self
+
+    def logStarted(self, build, step, log):
+        return self
+
+    def logChunk(self, build, step, log, channel, text):
+        if not self.wanted('logChunk'):
+            return
+        if isinstance(text, str):
+            # logs are bytes, but json is unicode
+            text = text.decode('utf-8', 'replace')
+        self.publish('logChunk', build.getBuilder(),
+                     dict(number=build.getNumber(),
+                          step=step.getName(),
+                          log=log.getName(),
+                          channel=channel,
+                          text=text))
+
+    def stepFinished(self, build, step, results):
+        self.publish('stepFinished', build.getBuilder(),
+                     dict(number=build.getNumber(),
+                          step=step.getName(),
+                          results=results[0],
+                          text=step.getText()))
+
+    def buildFinished(self, builderName, build, results):
+        self.publish('buildFinished', build.getBuilder(),
+                     dict(number=build.getNumber(),
+                          results=results,
+                          text=build.getText(),
+                          time=build.getTimes()[1]))
+
+
+# /eventstream
+class EventStreamResource(resource.Resource):
+    """Streams build events as lines of json, for as long as the client stays
+    connected. The events can be filtered with the query arguments
+    builder=, category= and event= (one of buildStarted, stepFinished,
+    logChunk or buildFinished), each of which may be given several times.
+    logChunk events are only sent if they are asked for."""
+
+    isLeaf = True
+
+    def __init__(self, maxBufferSize=2**20):
+        resource.Resource.__init__(self)
+        self.maxBufferSize = maxBufferSize
+        self.hub = EventStreamHub()
+
+    def render_GET(self, request):
+        events = [e for e in request.args.get('event', [])
+                  if e in ALL_EVENTS] or DEFAULT_EVENTS
+        client = EventStreamClient(self.hub, request,
+                                   builders=request.args.get('builder', []),
+                                   categories=request.args.get('category', []),
+                                   events=events,
+                                   maxBufferSize=self.maxBufferSize)
+        self.hub.subscribe(request.site.buildbot_service.getStatus())
+        self.hub.addClient(client)
+        request.setHeader("content-type", "text/plain")
+        request.setHeader("cache-control", "no-cache")
+        request.registerProducer(client, True)
+        request.notifyFinish().addBoth(lambda _: self.hub.removeClient(client))
+        # get the headers out now
+        request.write("")
+        return server.NOT_DONE_YET
+
+    def stop(self):
+        self.hub.unsubscribe()
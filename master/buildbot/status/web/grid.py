@@ -3,6 +3,7 @@ from __future__ import generators
 from buildbot.status.web.base import HtmlResource
 from buildbot.status.web.base import build_get_class, path_to_builder, path_to_build
 from buildbot.sourcestamp import SourceStamp
+from buildbot.status.ssindex import getSourceStampKey
 
 class ANYBRANCH: pass # a flag value, used below
 
@@ -81,32 +82,27 @@ class GridStatusMixin(object):
 
         This function returns an appropriate comparison key for that.
         """
-        return (ss.branch, ss.revision, ss.patch)
+        return getSourceStampKey(ss)
 
     def getRecentSourcestamps(self, status, numBuilds, categories, branch):
         """
         get a list of the most recent NUMBUILDS SourceStamp tuples, sorted
-        by the earliest start we've seen for them
+        by the earliest start we've seen for them. Only the sourcestamps in
+        each builder's L{SourceStampIndex} are considered, so each builder
+        contributes at most its index size per branch, however large
+        NUMBUILDS is.
         """
-        # TODO: use baseweb's getLastNBuilds?
-        sourcestamps = { } # { ss-tuple : earliest time }
+        branches = None
+        if branch != ANYBRANCH:
+            branches = [branch]
+        sourcestamps = { } # { ss-tuple : (ss, earliest time) }
         for bn in status.getBuilderNames():
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
-            build = builder.getBuild(-1)
-            while build:
-                ss = build.getSourceStamp(absolute=True)
-                start = build.getTimes()[0]
-                build = build.getPreviousBuild()
-
-                # skip un-started builds
-                if not start: continue
-
-                # skip non-matching branches
-                if branch != ANYBRANCH and ss.branch != branch: continue
-
-                key= self.getSourceStampKey(ss)
+            index = builder.getSourceStampIndex()
+            for ignored, ss, start in index.getSourceStamps(branches):
+                key = self.getSourceStampKey(ss)
                 if key not in sourcestamps or sourcestamps[key][1] > start:
                     sourcestamps[key] = (ss, start)
 
@@ -118,6 +114,21 @@ class GridStatusMixin(object):
 
         return sourcestamps
 
+    def getBuildsForStamps(self, builder, stamps):
+        """
+        get a list of the most recent build of each of STAMPS on BUILDER, or
+        None where the builder has not built a stamp recently
+        """
+        index = builder.getSourceStampIndex()
+        builds = []
+        for ss in stamps:
+            number = index.getBuildNumber(getSourceStampKey(ss))
+            if number is None:
+                builds.append(None)
+            else:
+                builds.append(builder.getBuild(number))
+        return builds
+
 class GridStatusResource(HtmlResource, GridStatusMixin):
     # TODO: docs
     status = None
@@ -152,20 +163,11 @@ class GridStatusResource(HtmlResource, GridStatusMixin):
         cxt['builders'] = []
 
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key= self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(builder, stamps)
 
             b = self.builder_cxt(request, builder)
             b['builds'] = []
@@ -221,20 +223,11 @@ class TransposedGridStatusResource(HtmlResource, GridStatusMixin):
             cxt['range'].reverse()
         
         for bn in sortedBuilderNames:
-            builds = [None] * len(stamps)
-
             builder = status.getBuilder(bn)
             if categories and builder.category not in categories:
                 continue
 
-            build = builder.getBuild(-1)
-            while build and None in builds:
-                ss = build.getSourceStamp(absolute=True)
-                key = self.getSourceStampKey(ss)
-                for i in range(len(stamps)):
-                    if key == self.getSourceStampKey(stamps[i]) and builds[i] is None:
-                        builds[i] = build
-                build = build.getPreviousBuild()
+            builds = self.getBuildsForStamps(builder, stamps)
 
             builders.append(self.builder_cxt(request, builder))
             builder_builds.append(map(lambda b: self.build_cxt(request, b), builds))
@@ -98,9 +98,38 @@ class TextLog(Resource):
             data = data.encode('utf-8')                   
             req.write(data)
 
+        chunks = self._getRequestedChunks(req)
+        if chunks is not None:
+            # a slice of the log was requested: send just that, rather than
+            # following the log as it grows
+            for chunk in chunks:
+                formatted = self.content([chunk])
+                if isinstance(formatted, unicode):
+                    formatted = formatted.encode('utf-8')
+                req.write(formatted)
+            self.finished()
+            return server.NOT_DONE_YET
+
         self.original.subscribeConsumer(ChunkConsumer(req, self))
         return server.NOT_DONE_YET
 
+    def _getRequestedChunks(self, req):
+        """Handle ?tail=N (the last N bytes of the log) and ?start=N&end=M
+        (a byte range of the log), returning an iterator over the requested
+        chunks, or None if the whole log should be sent."""
+        def getint(name):
+            try:
+                return int(req.args[name][0])
+            except (KeyError, IndexError, ValueError):
+                return None
+        tail = getint("tail")
+        if tail is not None:
+            return self.original.tail(tail)
+        start, end = getint("start"), getint("end")
+        if start is None and end is None:
+            return None
+        return self.original.getChunks(start=start, end=end)
+
     def _setContentType(self, req):
         if self.asText:
             req.setHeader("content-type", "text/plain; charset=utf-8")
@@ -1,4 +1,4 @@
-# -*- test-case-name: buildbot.test.test_web_status_json -*-
+# -*- test-case-name: buildbot.test.unit.test_status_web_status_json -*-
 # Original Copyright (c) 2010 The Chromium Authors.
 
 """Simple JSON exporter."""
@@ -6,8 +6,16 @@
 import datetime
 import os
 import re
+import time
+import weakref
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
-from twisted.web import error, html, resource
+from zope.interface import implements
+from twisted.internet.interfaces import IPullProducer
+from twisted.web import error, html, http, resource, server
 
 from buildbot.status.web.base import HtmlResource
 from buildbot.util import json
@@ -15,6 +23,10 @@ from buildbot.util import json
 
 _IS_INT = re.compile('^[-+]?\d+$')
 
+# Distinguishes the ETags of different runs of the master, since status
+# versions start back at 0.
+_ETAG_SALT = str(time.time())
+
 
 FLAGS = """\
   - as_text
@@ -124,6 +136,111 @@ def FilterOut(data):
         return data
 
 
+class JsonFragment:
+    """The json data of a finished build or step, as of status VERSION.
+    Since it rarely changes anymore, it is only serialized once (for each of
+    the filtered and unfiltered variants), and the result is spliced into
+    the documents that include it."""
+
+    def __init__(self, data, version=None):
+        self.data = data
+        self.version = version
+        self.encoded = {}
+
+    def getData(self, filtered):
+        if filtered:
+            return FilterOut(self.data)
+        return self.data
+
+    def getJson(self, filtered):
+        if filtered not in self.encoded:
+            self.encoded[filtered] = json.dumps(self.getData(filtered),
+                                                sort_keys=True,
+                                                separators=(',',':'))
+        return self.encoded[filtered]
+
+
+# status object -> JsonFragment; entries go away with the status objects.
+_fragments = weakref.WeakKeyDictionary()
+
+def FinishedAsDict(status, version=None):
+    """Returns the json data of a build or step status, as a cached
+    JsonFragment once it has finished. The fragment is rebuilt if the
+    status VERSION has changed since it was cached."""
+    if not status.isFinished():
+        return status.asDict()
+    fragment = _fragments.get(status)
+    if fragment is None or fragment.version != version:
+        fragment = _fragments[status] = JsonFragment(status.asDict(), version)
+    return fragment
+
+
+def EncodeJson(data, compact=True, filtered=False):
+    """json.dumps() that understands JsonFragment."""
+    if not compact:
+        return json.dumps(data, sort_keys=True, indent=2,
+                          default=lambda o: o.getData(filtered))
+    # Let json encode placeholder strings for the fragments, then substitute
+    # the encoded fragments.
+    fragments = []
+    tag = '\0%x:' % id(fragments)
+    def default(o):
+        if not isinstance(o, JsonFragment):
+            raise TypeError(repr(o) + " is not JSON serializable")
+        fragments.append(o.getJson(filtered))
+        return '%s%d\0' % (tag, len(fragments) - 1)
+    text = json.dumps(data, sort_keys=True, separators=(',',':'),
+                      default=default)
+    if fragments:
+        pattern = re.compile(r'"%s(\d+)\\u0000"' %
+                             re.escape(json.dumps(tag)[1:-1]))
+        text = pattern.sub(lambda m: fragments[int(m.group(1))], text)
+    return text
+
+
+class JsonProducer:
+    """Writes a json dictionary to a request one entry at a time, as the
+    client reads it, instead of encoding it in one string."""
+    implements(IPullProducer)
+
+    def __init__(self, data, filtered):
+        self.data = data
+        self.keys = data.keys()
+        self.keys.sort()
+        self.keys.reverse()
+        self.filtered = filtered
+        self.request = None
+        self.separator = '{'
+
+    def start(self, request):
+        self.request = request
+        request.registerProducer(self, False)
+        request.notifyFinish().addErrback(lambda f: self.stopProducing())
+
+    def resumeProducing(self):
+        if not self.request:
+            return
+        if not self.keys:
+            if self.separator == '{':
+                self.request.write('{')
+            self.request.write('}')
+            self.request.unregisterProducer()
+            self.request.finish()
+            self.request = None
+            return
+        key = self.keys.pop()
+        chunk = '%s%s:%s' % (self.separator, json.dumps(str(key)),
+                             EncodeJson(self.data.pop(key),
+                                        filtered=self.filtered))
+        self.separator = ','
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        self.request.write(chunk)
+
+    def stopProducing(self):
+        self.request = None
+
+
 class JsonResource(resource.Resource):
     """Base class for json data."""
 
@@ -167,6 +284,13 @@ class JsonResource(resource.Resource):
 
     def render_GET(self, request):
         """Renders a HTTP GET at the http request level."""
+        etag = self.getETag(request)
+        if etag:
+            request.setHeader("ETag", etag)
+            match = request.getHeader("If-None-Match") or ''
+            if etag in [t.strip() for t in match.split(',')]:
+                request.setResponseCode(http.NOT_MODIFIED)
+                return ''
         data = self.content(request)
         if isinstance(data, unicode):
             data = data.encode("utf-8")
@@ -183,8 +307,70 @@ class JsonResource(resource.Resource):
             request.setHeader("Expires",
                               expires.strftime("%a, %d %b %Y %H:%M:%S GMT"))
             request.setHeader("Pragma", "no-cache")
+        if isinstance(data, JsonProducer):
+            data.start(request)
+            return server.NOT_DONE_YET
         return data
 
+    def getETag(self, request):
+        """Returns a strong ETag for the response to this request, computed
+        from the status versions of everything it shows, or None if it
+        includes things that don't have a status version."""
+        select = request.args.get('select')
+        if select is not None:
+            versions = []
+            for item in select:
+                path, child = self.walkSelect(request, item.strip('/'))
+                versions.append(child.getVersion(request))
+        else:
+            versions = [self.getVersion(request)]
+        if None in versions:
+            return None
+        args = request.args.items()
+        args.sort()
+        key = repr((_ETAG_SALT, id(self.status), request.path, args,
+                    versions))
+        return '"%s"' % md5(key).hexdigest()
+
+    def getVersion(self, request):
+        """Returns something that changes whenever asDict() would return
+        something different, or None if that can't be known cheaply.
+
+        By default, combines the versions of the children."""
+        if not self.children:
+            return None
+        versions = []
+        for name in self.children:
+            child = self.getChildWithDefault(name, request)
+            if isinstance(child, JsonResource):
+                version = child.getVersion(request)
+                if version is None:
+                    return None
+                versions.append((name, version))
+        versions.sort()
+        return tuple(versions)
+
+    def walkSelect(self, request, item):
+        """Returns the path elements and the child resource for the sub-url
+        ITEM of a select= argument."""
+        # Implementation similar to twisted.web.resource.getChildForRequest
+        # but with a hacked up request.
+        child = self
+        path = []
+        prepath = request.prepath[:]
+        postpath = request.postpath[:]
+        request.postpath = filter(None, item.split('/'))
+        try:
+            while request.postpath and not child.isLeaf:
+                pathElement = request.postpath.pop(0)
+                path.append(pathElement)
+                request.prepath.append(pathElement)
+                child = child.getChildWithDefault(pathElement, request)
+        finally:
+            request.prepath = prepath
+            request.postpath = postpath
+        return path, child
+
     def content(self, request):
         """Renders the json dictionaries."""
         # Implement filtering at global level and every child.
@@ -198,33 +384,32 @@ class JsonResource(resource.Resource):
             select.sort(cmp=lambda x,y: cmp(x.count('/'), y.count('/')),
                         reverse=True)
             for item in select:
+                path, child = self.walkSelect(request, item)
                 # Start back at root.
+                parent = None
                 node = data
-                # Implementation similar to twisted.web.resource.getChildForRequest
-                # but with a hacked up request.
-                child = self
-                prepath = request.prepath[:]
-                postpath = request.postpath[:]
-                request.postpath = filter(None, item.split('/'))
-                while request.postpath and not child.isLeaf:
-                    pathElement = request.postpath.pop(0)
+                for pathElement in path:
+                    parent = node
                     node[pathElement] = {}
                     node = node[pathElement]
-                    request.prepath.append(pathElement)
-                    child = child.getChildWithDefault(pathElement, request)
-                node.update(child.asDict(request))
-                request.prepath = prepath
-                request.postpath = postpath
+                value = child.asDict(request)
+                if isinstance(value, JsonFragment):
+                    if parent is not None:
+                        parent[path[-1]] = value
+                        continue
+                    value = value.data
+                node.update(value)
         else:
             data = self.asDict(request)
         as_text = RequestArgToBool(request, 'as_text', False)
         filter_out = RequestArgToBool(request, 'filter', as_text)
         if filter_out:
             data = FilterOut(data)
-        if RequestArgToBool(request, 'compact', not as_text):
-            return json.dumps(data, sort_keys=True, separators=(',',':'))
-        else:
-            return json.dumps(data, sort_keys=True, indent=2)
+        compact = RequestArgToBool(request, 'compact', not as_text)
+        if select is not None and compact:
+            # Can be large, stream it.
+            return JsonProducer(data, filter_out)
+        return EncodeJson(data, compact, filter_out)
 
     def asDict(self, request):
         """Generates the json dictionary.
@@ -331,6 +516,9 @@ class BuilderJsonResource(JsonResource):
         # buildbot.status.builder.BuilderStatus
         return self.builder_status.asDict()
 
+    def getVersion(self, request):
+        return self.builder_status.getStatusVersion()
+
 
 class BuildersJsonResource(JsonResource):
     help = """List of all the builders defined on a master.
@@ -373,7 +561,10 @@ class BuildJsonResource(JsonResource):
         self.putChild('steps', BuildStepsJsonResource(status, build_status))
 
     def asDict(self, request):
-        return self.build_status.asDict()
+        return FinishedAsDict(self.build_status, self.getVersion(request))
+
+    def getVersion(self, request):
+        return self.build_status.getStatusVersion()
 
 
 class AllBuildsJsonResource(JsonResource):
@@ -415,6 +606,12 @@ class AllBuildsJsonResource(JsonResource):
             results[child.build_status.getNumber()] = child.asDict(request)
         return results
 
+    def getVersion(self, request):
+        # Finished builds don't change, so only the current ones matter.
+        return (self.builder_status.getStatusVersion(),
+                tuple([b.getStatusVersion()
+                       for b in self.builder_status.getCurrentBuilds()]))
+
 
 class BuildsJsonResource(AllBuildsJsonResource):
     help = """Builds that were run on a builder.
@@ -441,6 +638,9 @@ class BuildsJsonResource(AllBuildsJsonResource):
         ])
         return builds
 
+    def getVersion(self, request):
+        return self.builder_status.getStatusVersion()
+
 
 class BuildStepJsonResource(JsonResource):
     help = """A single build step.
@@ -454,7 +654,11 @@ class BuildStepJsonResource(JsonResource):
         # TODO self.putChild('logs', LogsJsonResource())
 
     def asDict(self, request):
-        return self.build_step_status.asDict()
+        return FinishedAsDict(self.build_step_status,
+                              self.getVersion(request))
+
+    def getVersion(self, request):
+        return self.build_step_status.getBuild().getStatusVersion()
 
 
 class BuildStepsJsonResource(JsonResource):
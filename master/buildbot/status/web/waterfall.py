@@ -1,4 +1,4 @@
-# -*- test-case-name: buildbot.test.test_web -*-
+# -*- test-case-name: buildbot.test.unit.test_status_web_waterfall -*-
 
 from zope.interface import implements
 from twisted.python import log, components
@@ -9,6 +9,7 @@ import operator
 
 from buildbot import interfaces, util
 from buildbot.status import builder
+from buildbot.status.base import StatusReceiver
 
 from buildbot.status.web.base import Box, HtmlResource, IBox, ICurrentBox, \
      ITopBox, build_get_class, path_to_build, path_to_step, path_to_root, \
@@ -248,6 +249,333 @@ def insertGaps(g, showEvents, lastEventTime, idleGap=2):
         if debug: log.msg(" fES1", starts)
 
 
+class _EventGatherer:
+    """I walk backwards in time through the events of several sources (the
+    change source and some builders) at once, producing one row of events
+    for each span of time in which any of them has something to show. Each
+    row has one (possibly empty) list of events per source, newest first.
+
+    If CUTOFF is given, I stop at the first event which started at or
+    before that time."""
+
+    def __init__(self, sources, branches, categories, committers,
+                 showEvents, minTime, spanLength, cutoff=None):
+        self.showEvents = showEvents
+        self.minTime = minTime
+        self.spanLength = spanLength
+        self.cutoff = cutoff
+        self.finished = False
+
+        now = util.now()
+        self.generators = []
+        self.tableau = [] # the next (older) event from each source
+        for s in sources:
+            gen = insertGaps(s.eventGenerator(branches, categories,
+                                              committers, minTime),
+                             showEvents, now)
+            self.generators.append(gen)
+            self.tableau.append(self._nextEvent(gen))
+
+        lastEventTime = 0
+        for e in self.tableau:
+            if e and e.getTimes()[0] > lastEventTime:
+                lastEventTime = e.getTimes()[0]
+        if lastEventTime == 0:
+            lastEventTime = now
+        self.spanStart = lastEventTime - spanLength
+
+    def _nextEvent(self, g):
+        try:
+            while True:
+                e = g.next()
+                # e might be builder.BuildStepStatus,
+                # builder.BuildStatus, builder.Event,
+                # waterfall.Spacer(builder.Event), or changes.Change .
+                # The showEvents=False flag means we should hide
+                # builder.Event .
+                if not self.showEvents and isinstance(e, builder.Event):
+                    continue
+                break
+            event = interfaces.IStatusEvent(e)
+        except StopIteration:
+            return None
+        if self.cutoff is not None and event.getTimes()[0] <= self.cutoff:
+            return None
+        return event
+
+    def nextRow(self):
+        """Return (timestamp, row) for the next span back in time that has
+        any events, or None if there are no more."""
+        while not self.finished:
+            # the tableau of potential events is in self.tableau. The
+            # window crawls backwards, and we examine one source at a time.
+            # If the source's top-most event is in the window, is it pushed
+            # onto the row and the tableau is refilled. This continues until
+            # the tableau event is not in the window (or is missing).
+            spanEvents = [] # for all sources, in this span
+            firstTimestamp = None # timestamp of first event in the span
+            lastTimestamp = None # last pre-span event, for next span
+
+            for c in range(len(self.generators)):
+                events = [] # for this source, in this span
+                event = self.tableau[c]
+                while event and self.spanStart < event.getTimes()[0]:
+                    if not IBox(event, None):
+                        log.msg("BAD EVENT", event, event.getText())
+                        assert 0
+                    events.append(event)
+                    starts, finishes = event.getTimes()
+                    firstTimestamp = earlier(firstTimestamp, starts)
+                    event = self._nextEvent(self.generators[c])
+                if event:
+                    # this is the last pre-span event for this source
+                    lastTimestamp = later(lastTimestamp,
+                                          event.getTimes()[0])
+                self.tableau[c] = event # refill the tableau
+                spanEvents.append(events)
+
+            if lastTimestamp:
+                self.spanStart = lastTimestamp - self.spanLength
+                if self.minTime is not None and lastTimestamp < self.minTime:
+                    self.finished = True
+            else:
+                # no more events
+                self.finished = True
+
+            if firstTimestamp is not None:
+                return (firstTimestamp, spanEvents)
+        return None
+
+
+class EventTimeline:
+    """
+    I hold the waterfall's merged event history for one set of event sources
+    and one combination of filters, as rows of events in ten-second spans,
+    newest first. Rows are gathered lazily, only as far back as the pages
+    being displayed need them.
+
+    Status events do not invalidate the whole history: L{markDirty} records
+    the earliest time that may have changed, and L{refresh} regenerates only
+    the rows from that time on.
+    """
+
+    spanLength = 10 # ten-second chunks
+
+    def __init__(self, sources, branches, categories, committers,
+                 showEvents, minTime):
+        self.sources = sources
+        self.filters = (branches, categories, committers)
+        self.showEvents = showEvents
+        self.minTime = minTime
+        self.dirtyTime = None
+        self.lastUsed = 0
+        self._reset()
+
+    def _makeGatherer(self, cutoff=None):
+        branches, categories, committers = self.filters
+        return _EventGatherer(self.sources, branches, categories, committers,
+                              self.showEvents, self.minTime, self.spanLength,
+                              cutoff)
+
+    def _reset(self):
+        self.timestamps = []
+        self.eventGrid = []
+        self.gatherer = self._makeGatherer()
+        self.lastEvents = self._getLastEvents()
+
+    def _getLastEvents(self):
+        # builders add Events (slave connects and the like) without telling
+        # anyone, so we remember the most recent one to notice new ones
+        return [b.getEvent(-1) for b in self.sources[1:]]
+
+    def _checkLastEvents(self):
+        for b, last in zip(self.sources[1:], self.lastEvents):
+            e = b.getEvent(-1)
+            if e is last:
+                continue
+            # mark everything since the oldest new event dirty
+            i = -1
+            while True:
+                older = b.getEvent(i - 1)
+                if older is None or older is last:
+                    break
+                i -= 1
+            self.markDirty(b.getEvent(i).getTimes()[0])
+        self.lastEvents = self._getLastEvents()
+
+    def markDirty(self, when):
+        """Note that events starting at or after WHEN may have been added or
+        changed."""
+        self.dirtyTime = earlier(self.dirtyTime, when)
+
+    def refresh(self):
+        """Regenerate the rows that may have changed since they were
+        gathered."""
+        self._checkLastEvents()
+        if self.dirtyTime is None:
+            return
+        dirty = self.dirtyTime - 1
+        self.dirtyTime = None
+
+        # rows are in strictly descending time order, so everything after
+        # the first row that is entirely older than the dirty time can be
+        # kept. A row that straddles the dirty time is dropped as a whole,
+        # and regenerated along with everything newer than the kept rows.
+        keep = 0
+        cutoff = None
+        while keep < len(self.eventGrid):
+            newest = [c[0].getTimes()[0] for c in self.eventGrid[keep] if c]
+            if max(newest) <= dirty:
+                cutoff = max(newest)
+                break
+            keep += 1
+        if keep == len(self.eventGrid) and not self.gatherer.finished:
+            # the dirty region goes back beyond what we have gathered, so
+            # the gatherer's position is stale too: start over
+            self._reset()
+            return
+
+        head = self._makeGatherer(cutoff)
+        timestamps = []
+        eventGrid = []
+        while True:
+            row = head.nextRow()
+            if row is None:
+                break
+            timestamps.append(row[0])
+            eventGrid.append(row[1])
+        self.timestamps = timestamps + self.timestamps[keep:]
+        self.eventGrid = eventGrid + self.eventGrid[keep:]
+
+    def getPage(self, maxTime, minTime, maxPageLen):
+        """Return (timestamps, eventGrid, sourceEvents) for a page of at
+        most maxPageLen+1 rows no newer than MAXTIME, stopping at MINTIME.
+        sourceEvents has the next older event (if any) after the page for
+        each source."""
+        first = 0
+        while (first < len(self.timestamps)
+               and self.timestamps[first] > maxTime):
+            first += 1
+        end = first
+        while True:
+            if end == len(self.timestamps):
+                row = self.gatherer.nextRow()
+                if row is None:
+                    break
+                self.timestamps.append(row[0])
+                self.eventGrid.append(row[1])
+                if row[0] > maxTime:
+                    first += 1
+                    end += 1
+                    continue
+            end += 1
+            if self.timestamps[end-1] < minTime:
+                break
+            if end - first > maxPageLen:
+                break
+
+        sourceEvents = [None] * len(self.sources)
+        missing = len(self.sources)
+        for row in self.eventGrid[end:]:
+            for c in range(len(row)):
+                if row[c] and sourceEvents[c] is None:
+                    sourceEvents[c] = row[c][0]
+                    missing -= 1
+            if not missing:
+                break
+        for c in range(len(self.sources)):
+            if sourceEvents[c] is None:
+                sourceEvents[c] = self.gatherer.tableau[c]
+
+        return (self.timestamps[first:end], self.eventGrid[first:end],
+                sourceEvents)
+
+
+class EventTimelineCache(StatusReceiver):
+    """I keep the L{EventTimeline}s of recently-displayed waterfall views,
+    so that they can be shared between viewers and page refreshes, and
+    tell them which parts of the history status events have changed."""
+
+    maxTimelines = 20
+
+    def __init__(self):
+        self.status = None
+        self.timelines = {}
+
+    def subscribe(self, status):
+        if self.status is None:
+            self.status = status
+            status.subscribe(self)
+
+    def unsubscribe(self):
+        if self.status is None:
+            return
+        self.status.unsubscribe(self)
+        for name in self.status.getBuilderNames():
+            try:
+                self.status.getBuilder(name).unsubscribe(self)
+            except ValueError:
+                pass
+        self.status = None
+        self.timelines = {}
+
+    def getTimeline(self, sources, branches, categories, committers,
+                    showEvents, minTime):
+        key = (tuple([b.getName() for b in sources[1:]]), tuple(branches),
+               tuple(categories), tuple(committers), showEvents)
+        timeline = self.timelines.get(key)
+        if timeline is not None:
+            if ([id(s) for s in timeline.sources] != [id(s) for s in sources]
+                or minTime < timeline.minTime):
+                # reconfigured, or asking for more history than the
+                # timeline was set up to gather
+                timeline = None
+        if timeline is None:
+            if len(self.timelines) >= self.maxTimelines:
+                self._evict()
+            timeline = EventTimeline(sources, branches, categories,
+                                     committers, showEvents, minTime)
+            self.timelines[key] = timeline
+        timeline.lastUsed = util.now()
+        return timeline
+
+    def _evict(self):
+        byage = [(t.lastUsed, key) for key, t in self.timelines.items()]
+        byage.sort()
+        del self.timelines[byage[0][1]]
+
+    def markDirty(self, when):
+        for timeline in self.timelines.values():
+            timeline.markDirty(when)
+
+    # IStatusReceiver
+
+    def builderAdded(self, builderName, builder):
+        return self
+
+    def builderRemoved(self, builderName):
+        self.timelines.clear()
+
+    def builderChangedState(self, builderName, state):
+        self.markDirty(util.now())
+
+    def buildStarted(self, builderName, build):
+        self.markDirty(build.getTimes()[0])
+        return self
+
+    def stepStarted(self, build, step):
+        self.markDirty(build.getTimes()[0])
+
+    def stepFinished(self, build, step, results):
+        self.markDirty(build.getTimes()[0])
+
+    def buildFinished(self, builderName, build, results):
+        self.markDirty(build.getTimes()[0])
+
+    def changeAdded(self, change):
+        self.markDirty(change.when or util.now())
+
+
 class WaterfallHelp(HtmlResource):
     title = "Waterfall Help"
 
@@ -299,6 +627,7 @@ class WaterfallStatusResource(HtmlResource):
         self.categories = categories
         self.num_events=num_events
         self.num_events_max=num_events_max
+        self.timelines = EventTimelineCache()
         self.putChild("help", WaterfallHelp(categories))
 
     def getTitle(self, request):
@@ -455,9 +784,6 @@ class WaterfallStatusResource(HtmlResource):
         return data
     
     def buildGrid(self, request, builders):
-        debug = False
-        # TODO: see if we can use a cached copy
-
         showEvents = False
         if request.args.get("show_events", ["false"])[0].lower() == "true":
             showEvents = True
@@ -474,135 +800,34 @@ class WaterfallStatusResource(HtmlResource):
             minTime = util.now() - 24 * 60 * 60
         else:
             minTime = 0
-        spanLength = 10  # ten-second chunks
         req_events=int(request.args.get("num_events", [self.num_events])[0])
         if self.num_events_max and req_events > self.num_events_max:
             maxPageLen = self.num_events_max
         else:
             maxPageLen = req_events
 
-        # first step is to walk backwards in time, asking each column
-        # (commit, all builders) if they have any events there. Build up the
-        # array of events, and stop when we have a reasonable number.
+        # the events of the commit source and all builders are merged into
+        # a timeline, which is shared with other requests using the same
+        # filters and kept up to date as status events happen; we only need
+        # to take the right slice of it.
 
         commit_source = self.getChangeManager(request)
-
-        lastEventTime = util.now()
         sources = [commit_source] + builders
         changeNames = ["changes"]
         builderNames = map(lambda builder: builder.getName(), builders)
-        sourceNames = changeNames + builderNames
-        sourceEvents = []
-        sourceGenerators = []
 
-        def get_event_from(g):
-            try:
-                while True:
-                    e = g.next()
-                    # e might be builder.BuildStepStatus,
-                    # builder.BuildStatus, builder.Event,
-                    # waterfall.Spacer(builder.Event), or changes.Change .
-                    # The showEvents=False flag means we should hide
-                    # builder.Event .
-                    if not showEvents and isinstance(e, builder.Event):
-                        continue
-                    break
-                event = interfaces.IStatusEvent(e)
-                if debug:
-                    log.msg("gen %s gave1 %s" % (g, event.getText()))
-            except StopIteration:
-                event = None
-            return event
-
-        for s in sources:
-            gen = insertGaps(s.eventGenerator(filterBranches,
+        self.timelines.subscribe(self.getStatus(request))
+        timeline = self.timelines.getTimeline(sources, filterBranches,
                                               filterCategories,
-                                              filterCommitters,
-                                              minTime),
-                             showEvents,
-                             lastEventTime)
-            sourceGenerators.append(gen)
-            # get the first event
-            sourceEvents.append(get_event_from(gen))
-        eventGrid = []
-        timestamps = []
-
-        lastEventTime = 0
-        for e in sourceEvents:
-            if e and e.getTimes()[0] > lastEventTime:
-                lastEventTime = e.getTimes()[0]
-        if lastEventTime == 0:
-            lastEventTime = util.now()
-
-        spanStart = lastEventTime - spanLength
-        debugGather = 0
-
-        while 1:
-            if debugGather: log.msg("checking (%s,]" % spanStart)
-            # the tableau of potential events is in sourceEvents[]. The
-            # window crawls backwards, and we examine one source at a time.
-            # If the source's top-most event is in the window, is it pushed
-            # onto the events[] array and the tableau is refilled. This
-            # continues until the tableau event is not in the window (or is
-            # missing).
-
-            spanEvents = [] # for all sources, in this span. row of eventGrid
-            firstTimestamp = None # timestamp of first event in the span
-            lastTimestamp = None # last pre-span event, for next span
+                                              filterCommitters, showEvents,
+                                              minTime)
+        timeline.refresh()
+        (timestamps, eventGrid, sourceEvents) = \
+            timeline.getPage(maxTime, minTime, maxPageLen)
 
-            for c in range(len(sourceGenerators)):
-                events = [] # for this source, in this span. cell of eventGrid
-                event = sourceEvents[c]
-                while event and spanStart < event.getTimes()[0]:
-                    # to look at windows that don't end with the present,
-                    # condition the .append on event.time <= spanFinish
-                    if not IBox(event, None):
-                        log.msg("BAD EVENT", event, event.getText())
-                        assert 0
-                    if debug:
-                        log.msg("pushing", event.getText(), event)
-                    events.append(event)
-                    starts, finishes = event.getTimes()
-                    firstTimestamp = earlier(firstTimestamp, starts)
-                    event = get_event_from(sourceGenerators[c])
-                if debug:
-                    log.msg("finished span")
-
-                if event:
-                    # this is the last pre-span event for this source
-                    lastTimestamp = later(lastTimestamp,
-                                               event.getTimes()[0])
-                if debugGather:
-                    log.msg(" got %s from %s" % (events, sourceNames[c]))
-                sourceEvents[c] = event # refill the tableau
-                spanEvents.append(events)
-
-            # only show events older than maxTime. This makes it possible to
-            # visit a page that shows what it would be like to scroll off the
-            # bottom of this one.
-            if firstTimestamp is not None and firstTimestamp <= maxTime:
-                eventGrid.append(spanEvents)
-                timestamps.append(firstTimestamp)
-
-            if lastTimestamp:
-                spanStart = lastTimestamp - spanLength
-            else:
-                # no more events
-                break
-            if minTime is not None and lastTimestamp < minTime:
-                break
-
-            if len(timestamps) > maxPageLen:
-                break
-            
-            
-            # now loop
-            
-        # loop is finished. now we have eventGrid[] and timestamps[]
-        if debugGather: log.msg("finished loop")
         assert(len(timestamps) == len(eventGrid))
         return (changeNames, builderNames, timestamps, eventGrid, sourceEvents)
-    
+
     def phase2(self, request, sourceNames, timestamps, eventGrid,
                sourceEvents):
 
@@ -4,6 +4,7 @@ from twisted.python import log
 
 from buildbot.status import builder
 from buildbot.status.builder import SUCCESS, FAILURE, WARNINGS, SKIPPED
+from buildbot.status.builder import STDOUT, STDERR
 from buildbot.process.buildstep import LogLineObserver, OutputProgressObserver
 from buildbot.process.buildstep import RemoteShellCommand
 from buildbot.steps.shell import ShellCommand
@@ -65,7 +66,7 @@ class HLint(ShellCommand):
         # submitted to hlint) because it is available in the logfile and
         # mostly exists to give the user an idea of how long the step will
         # take anyway).
-        lines = cmd.logs['stdio'].getText().split("\n")
+        lines = cmd.logs['stdio'].readlines([STDOUT, STDERR])
         warningLines = filter(lambda line:':' in line, lines)
         if warningLines:
             self.addCompleteLog("warnings", "".join(warningLines))
@@ -437,7 +438,9 @@ class Trial(ShellCommand):
 
         # 'cmd' is the original trial command, so cmd.logs['stdio'] is the
         # trial output. We don't have access to test.log from here.
-        output = cmd.logs['stdio'].getText()
+        # countFailedTests only looks at the end of the output
+        output = "".join(cmd.logs['stdio'].tail(10000, [STDOUT, STDERR],
+                                                onlyText=True))
         counts = countFailedTests(output)
 
         total = counts['total']
@@ -519,14 +522,10 @@ class Trial(ShellCommand):
         self.build.build_status.addTestResult(tr)
 
     def createSummary(self, loog):
-        output = loog.getText()
         problems = ""
-        sio = StringIO.StringIO(output)
+        lines = loog.readlines([STDOUT, STDERR])
         warnings = {}
-        while 1:
-            line = sio.readline()
-            if line == "":
-                break
+        for line in lines:
             if line.find(" exceptions.DeprecationWarning: ") != -1:
                 # no source
                 warning = line # TODO: consider stripping basedir prefix here
@@ -534,7 +533,11 @@ class Trial(ShellCommand):
             elif (line.find(" DeprecationWarning: ") != -1 or
                 line.find(" UserWarning: ") != -1):
                 # next line is the source
-                warning = line + sio.readline()
+                warning = line
+                try:
+                    warning += lines.next()
+                except StopIteration:
+                    pass
                 warnings[warning] = warnings.get(warning, 0) + 1
             elif line.find("Warning: ") != -1:
                 warning = line
@@ -542,7 +545,7 @@ class Trial(ShellCommand):
 
             if line.find("=" * 60) == 0 or line.find("-" * 60) == 0:
                 problems += line
-                problems += sio.read()
+                problems += "".join(lines)
                 break
 
         if problems:
@@ -4,7 +4,7 @@ import re
 from twisted.python import log
 from twisted.spread import pb
 from buildbot.process.buildstep import LoggingBuildStep, RemoteShellCommand
-from buildbot.process.buildstep import RemoteCommand
+from buildbot.process.buildstep import RemoteCommand, LogObserver
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, STDOUT, STDERR
 from buildbot.interfaces import BuildSlaveTooOldError
 
@@ -334,6 +334,49 @@ class SilentRemoteCommand(RemoteCommand):
     def remoteUpdate(self, update):
         pass
 
+class WarningCounter(LogObserver):
+    """I feed each line of a L{WarningCountingShellCommand}'s stdio log to
+    the step's L{processLine} as the output arrives, so that the warnings
+    are found while the command runs rather than all at once when it
+    finishes.
+
+    Only the unterminated end of each channel is buffered, and lines longer
+    than L{maxLineLength} are truncated, so that output without newlines
+    can't use up unbounded memory."""
+
+    maxLineLength = 2**20
+
+    def __init__(self):
+        self.partial = {'out': '', 'err': ''}
+
+    def outReceived(self, data):
+        self._dataReceived('out', data)
+
+    def errReceived(self, data):
+        self._dataReceived('err', data)
+
+    def _dataReceived(self, channel, data):
+        lines = data.split("\n")
+        if len(lines) > 1:
+            self._lineReceived(self.partial[channel] + lines[0])
+            for line in lines[1:-1]:
+                self._lineReceived(line)
+            self.partial[channel] = ''
+        # keep the start of an overlong line, and drop the rest of it
+        room = self.maxLineLength - len(self.partial[channel])
+        if room > 0:
+            self.partial[channel] += lines[-1][:room]
+
+    def _lineReceived(self, line):
+        self.step.processLine(line[:self.maxLineLength])
+
+    def flush(self):
+        """Process the final line of each channel, if it had no newline."""
+        for channel in ('out', 'err'):
+            if self.partial[channel]:
+                self._lineReceived(self.partial[channel])
+                self.partial[channel] = ''
+
 class WarningCountingShellCommand(ShellCommand):
     warnCount = 0
     warningPattern = '.*warning[: ].*'
@@ -341,6 +384,9 @@ class WarningCountingShellCommand(ShellCommand):
     directoryEnterPattern = "make.*: Entering directory [\"`'](.*)['`\"]"
     directoryLeavePattern = "make.*: Leaving directory"
     suppressionFile = None
+    # at most this many warnings are kept for the 'warnings' log; the rest
+    # are only counted
+    maxWarningsLogLines = 10000
 
     commentEmptyLineRe = re.compile(r"^\s*(\#.*)?$")
     suppressionLineRe = re.compile(r"^\s*(.+?)\s*:\s*(.+?)\s*(?:[:]\s*([0-9]+)(?:-([0-9]+))?\s*)?$")
@@ -376,6 +422,21 @@ class WarningCountingShellCommand(ShellCommand):
                                  suppressionFile=suppressionFile)
         self.suppressions = []
         self.directoryStack = []
+        self.warnings = []
+
+        # compile regular expressions from whichever patterns we're using
+        self.warningRe = self.warningPattern
+        if isinstance(self.warningRe, str):
+            self.warningRe = re.compile(self.warningRe)
+        self.directoryEnterRe = self.directoryEnterPattern
+        if isinstance(self.directoryEnterRe, str):
+            self.directoryEnterRe = re.compile(self.directoryEnterRe)
+        self.directoryLeaveRe = self.directoryLeavePattern
+        if isinstance(self.directoryLeaveRe, str):
+            self.directoryLeaveRe = re.compile(self.directoryLeaveRe)
+
+        self.warningCounter = WarningCounter()
+        self.addLogObserver('stdio', self.warningCounter)
 
     def setDefaultWorkdir(self, workdir):
         if self.workdir is None:
@@ -444,9 +505,31 @@ class WarningCountingShellCommand(ShellCommand):
                       (lineNo != None and start <= lineNo and end >= lineNo)) ):
                     return
 
-        warnings.append(line)
+        if len(warnings) < self.maxWarningsLogLines:
+            warnings.append(line)
         self.warnCount += 1
 
+    def processLine(self, line):
+        """
+        Check a single line of output against our warnings regular
+        expression, keeping track of the current directory. This is called
+        by our L{WarningCounter} as the log arrives."""
+        if not self.warningRe:
+            return
+
+        if self.directoryEnterRe:
+            match = self.directoryEnterRe.search(line)
+            if match:
+                self.directoryStack.append(match.group(1))
+            if (self.directoryLeaveRe and
+                self.directoryStack and
+                self.directoryLeaveRe.search(line)):
+                    self.directoryStack.pop()
+
+        match = self.warningRe.match(line)
+        if match:
+            self.maybeAddWarning(self.warnings, line, match)
+
     def start(self):
         if self.suppressionFile == None:
             return ShellCommand.start(self)
@@ -496,53 +579,25 @@ class WarningCountingShellCommand(ShellCommand):
 
     def createSummary(self, log):
         """
-        Match log lines against warningPattern.
+        Report the warnings found in the log.
 
         Warnings are collected into another log for this step, and the
         build-wide 'warnings-count' is updated."""
 
-        self.warnCount = 0
-
-        # Now compile a regular expression from whichever warning pattern we're
-        # using
         if not self.warningPattern:
             return
 
-        wre = self.warningPattern
-        if isinstance(wre, str):
-            wre = re.compile(wre)
-
-        directoryEnterRe = self.directoryEnterPattern
-        if directoryEnterRe != None and isinstance(directoryEnterRe, str):
-            directoryEnterRe = re.compile(directoryEnterRe)
-
-        directoryLeaveRe = self.directoryLeavePattern
-        if directoryLeaveRe != None and isinstance(directoryLeaveRe, str):
-            directoryLeaveRe = re.compile(directoryLeaveRe)
-
-        # Check if each line in the output from this command matched our
-        # warnings regular expressions. If did, bump the warnings count and
-        # add the line to the collection of lines with warnings
-        warnings = []
-        # TODO: use log.readlines(), except we need to decide about stdout vs
-        # stderr
-        for line in log.getText().split("\n"):
-            if directoryEnterRe:
-                match = directoryEnterRe.search(line)
-                if match:
-                    self.directoryStack.append(match.group(1))
-                if (directoryLeaveRe and
-                    self.directoryStack and
-                    directoryLeaveRe.search(line)):
-                        self.directoryStack.pop()
-
-            match = wre.match(line)
-            if match:
-                self.maybeAddWarning(warnings, line, match)
+        # the log has already been scanned as it arrived, except for a
+        # final line without a trailing newline
+        self.warningCounter.flush()
 
         # If there were any warnings, make the log if lines with warnings
         # available
         if self.warnCount:
+            warnings = self.warnings
+            if self.warnCount > len(warnings):
+                warnings = warnings + ["(%d more warnings not shown)"
+                                       % (self.warnCount - len(warnings))]
             self.addCompleteLog("warnings", "\n".join(warnings) + "\n")
 
         warnings_stat = self.step_status.getStatistic('warnings', 0)
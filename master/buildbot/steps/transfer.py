@@ -5,9 +5,14 @@ try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    # For Python 2.4 compatibility
+    from md5 import md5
 from twisted.internet import reactor
 from twisted.spread import pb
-from twisted.python import log
+from twisted.python import log, runtime
 from buildbot.process.buildstep import RemoteCommand, BuildStep
 from buildbot.process.buildstep import SUCCESS, FAILURE, SKIPPED
 from buildbot.interfaces import BuildSlaveTooOldError
@@ -17,9 +22,15 @@ from buildbot.util import json
 class _FileWriter(pb.Referenceable):
     """
     Helper class that acts as a file-object with write access
+
+    If C{resume} is true, data is written to C{destfile + '.partial'}, which
+    is kept around if the transfer is cut short so that a later transfer of
+    the same file can pick up where this one left off. The slave checks that
+    the partial file is a prefix of the file it is sending before resuming,
+    and starts over otherwise.
     """
 
-    def __init__(self, destfile, maxsize, mode):
+    def __init__(self, destfile, maxsize, mode, resume=False):
         # Create missing directories.
         destfile = os.path.abspath(destfile)
         dirname = os.path.dirname(destfile)
@@ -27,34 +38,95 @@ class _FileWriter(pb.Referenceable):
             os.makedirs(dirname)
 
         self.destfile = destfile
-        fd, self.tmpname = tempfile.mkstemp(dir=dirname)
-        self.fp = os.fdopen(fd, 'wb')
+        self.resume = resume
+        self.md5 = md5()
+        self.offset = 0
+        if resume:
+            self.tmpname = destfile + ".partial"
+            if os.path.exists(self.tmpname):
+                self.fp = open(self.tmpname, 'r+b')
+                self._hashPrefix(os.path.getsize(self.tmpname))
+            else:
+                self.fp = open(self.tmpname, 'w+b')
+        else:
+            fd, self.tmpname = tempfile.mkstemp(dir=dirname)
+            self.fp = os.fdopen(fd, 'w+b')
         if mode is not None:
             os.chmod(self.tmpname, mode)
         self.remaining = maxsize
+        if self.remaining is not None:
+            self.remaining = max(0, self.remaining - self.offset)
+
+    def _hashPrefix(self, length):
+        # (re)start the checksum, covering the first LENGTH bytes already
+        # in the file, and position the file just after them
+        self.md5 = md5()
+        self.fp.seek(0)
+        self.offset = 0
+        while self.offset < length:
+            data = self.fp.read(min(length - self.offset, 64*1024))
+            if not data:
+                break
+            self.md5.update(data)
+            self.offset += len(data)
+        self.fp.seek(self.offset)
+        self.fp.truncate()
+
+    def remote_resume(self):
+        """
+        Called by remote slave before sending any data, to find out how much
+        of the file was already received by an earlier, interrupted transfer
 
-    def remote_write(self, data):
+        @return: a tuple (offset, checksum) of the offset at which the slave
+                 should continue and the hex MD5 digest of the data before
+                 it, which the slave compares with its own file; if they
+                 differ, the slave sends everything again from offset 0
+        """
+        return (self.offset, self.md5.hexdigest())
+
+    def remote_write(self, data, offset=None):
         """
         Called from remote slave to write L{data} to L{fp} within boundaries
         of L{maxsize}
 
         @type  data: C{string}
         @param data: String of data to write
+        @type  offset: C{integer}
+        @param offset: position of L{data} in the file, if the slave is
+                       using windowed transfers
         """
+        if offset is not None and offset != self.offset:
+            # the slave is re-sending from an earlier position
+            if self.remaining is not None:
+                self.remaining = self.remaining + self.offset - offset
+            self._hashPrefix(offset)
         if self.remaining is not None:
             if len(data) > self.remaining:
                 data = data[:self.remaining]
-            self.fp.write(data)
             self.remaining = self.remaining - len(data)
-        else:
-            self.fp.write(data)
+        self.fp.write(data)
+        self.md5.update(data)
+        self.offset += len(data)
 
-    def remote_close(self):
+    def remote_close(self, checksum=None):
         """
         Called by remote slave to state that no more data will be transfered
+
+        @type  checksum: C{string}
+        @param checksum: hex MD5 digest of the data the slave sent; if given
+                         and the received data does not match, the file is
+                         discarded and an exception is raised
         """
         self.fp.close()
         self.fp = None
+        if checksum is not None and checksum != self.md5.hexdigest():
+            os.unlink(self.tmpname)
+            self.tmpname = None
+            raise ValueError("checksum mismatch for '%s': slave sent %s, "
+                             "master received %s" % (self.destfile, checksum,
+                                                     self.md5.hexdigest()))
+        if runtime.platformType == 'win32' and os.path.exists(self.destfile):
+            os.unlink(self.destfile)
         os.rename(self.tmpname, self.destfile)
         self.tmpname = None
 
@@ -64,6 +136,9 @@ class _FileWriter(pb.Referenceable):
         fp = getattr(self, "fp", None)
         if fp:
             fp.close()
+            if getattr(self, "resume", False):
+                # keep the partial file, for the next attempt to resume
+                return
             os.unlink(self.destfile)
             if self.tmpname and os.path.exists(self.tmpname):
                 os.unlink(self.tmpname)
@@ -119,12 +194,12 @@ class _DirectoryWriter(_FileWriter):
 
         _FileWriter.__init__(self, self.tarname, maxsize, mode)
 
-    def remote_unpack(self):
+    def remote_unpack(self, checksum=None):
         """
         Called by remote slave to state that no more data will be transfered
         """
         # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
+        self.remote_close(checksum)
 
         # Map configured compression to a TarFile setting
         if self.compress == 'bz2':
@@ -159,6 +234,20 @@ class StatusRemoteCommand(RemoteCommand):
         if 'stderr' in update:
             self.stderr = self.stderr + update['stderr'] + '\n'
 
+def _setWindowArgs(step, command, args, resume=False):
+    """
+    Ask the slave for a windowed transfer, with STEP.window blocks in flight
+    and an end-to-end checksum, if it is new enough to know about them.
+    Older slaves get the one-block-at-a-time protocol.
+    """
+    if not step.window or step.window <= 1:
+        return
+    if step.slaveVersionIsOlderThan(command, "2.13"):
+        return
+    args['window'] = step.window
+    if resume:
+        args['resume'] = True
+
 class _TransferBuildStep(BuildStep):
     """
     Base class for FileUpload and FileDownload to factor out common
@@ -207,6 +296,12 @@ class FileUpload(_TransferBuildStep):
     - ['mode']       file access mode for the resulting master-side file.
                      The default (=None) is to leave it up to the umask of
                      the buildmaster process.
+    - ['window']     number of blocks the slave may send before waiting for
+                     the master to acknowledge them, default 8. 1 disables
+                     windowed transfers.
+    - ['resume']     if true, keep a partial file at the master when the
+                     transfer is interrupted, and continue from it next
+                     time, default False
 
     """
 
@@ -214,7 +309,7 @@ class FileUpload(_TransferBuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=8, resume=False, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(slavesrc=slavesrc,
                                  masterdest=masterdest,
@@ -222,6 +317,8 @@ class FileUpload(_TransferBuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  mode=mode,
+                                 window=window,
+                                 resume=resume,
                                  )
 
         self.slavesrc = slavesrc
@@ -231,6 +328,8 @@ class FileUpload(_TransferBuildStep):
         self.blocksize = blocksize
         assert isinstance(mode, (int, type(None)))
         self.mode = mode
+        self.window = window
+        self.resume = resume
 
     def start(self):
         version = self.slaveVersion("uploadFile")
@@ -252,17 +351,19 @@ class FileUpload(_TransferBuildStep):
 
         self.step_status.setText(['uploading', os.path.basename(source)])
 
-        # we use maxsize to limit the amount of data on both sides
-        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode)
-
         # default arguments
         args = {
             'slavesrc': source,
             'workdir': self._getWorkdir(),
-            'writer': fileWriter,
             'maxsize': self.maxsize,
             'blocksize': self.blocksize,
             }
+        _setWindowArgs(self, "uploadFile", args, self.resume)
+
+        # we use maxsize to limit the amount of data on both sides
+        fileWriter = _FileWriter(masterdest, self.maxsize, self.mode,
+                                 resume=args.get('resume', False))
+        args['writer'] = fileWriter
 
         self.cmd = StatusRemoteCommand('uploadFile', args)
         d = self.runCommand(self.cmd)
@@ -283,6 +384,8 @@ class DirectoryUpload(BuildStep):
                      whole directory
     - ['blocksize']  maximum size of each block being transfered
     - ['compress']   compression type to use: one of [None, 'gz', 'bz2']
+    - ['window']     number of blocks the slave may send before waiting for
+                     the master to acknowledge them, default 8
 
     """
 
@@ -290,7 +393,7 @@ class DirectoryUpload(BuildStep):
 
     def __init__(self, slavesrc, masterdest,
                  workdir="build", maxsize=None, blocksize=16*1024,
-                 compress=None, **buildstep_kwargs):
+                 compress=None, window=8, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(slavesrc=slavesrc,
                                  masterdest=masterdest,
@@ -298,6 +401,7 @@ class DirectoryUpload(BuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  compress=compress,
+                                 window=window,
                                  )
 
         self.slavesrc = slavesrc
@@ -307,6 +411,7 @@ class DirectoryUpload(BuildStep):
         self.blocksize = blocksize
         assert compress in (None, 'gz', 'bz2')
         self.compress = compress
+        self.window = window
 
     def start(self):
         version = self.slaveVersion("uploadDirectory")
@@ -340,6 +445,7 @@ class DirectoryUpload(BuildStep):
             'blocksize': self.blocksize,
             'compress': self.compress
             }
+        _setWindowArgs(self, "uploadDirectory", args)
 
         self.cmd = StatusRemoteCommand('uploadDirectory', args)
         d = self.runCommand(self.cmd)
@@ -368,13 +474,32 @@ class _FileReader(pb.Referenceable):
 
     def __init__(self, fp):
         self.fp = fp
-
-    def remote_read(self, maxlength):
+        self.md5 = md5()
+        # number of bytes (from the start of the file) covered by md5
+        self.hashed = 0
+        # file position
+        self.offset = 0
+
+    def _hashUpTo(self, end):
+        # bring the checksum up to END, re-reading any data that the slave
+        # skipped (e.g., because it resumed an earlier transfer)
+        self.fp.seek(self.hashed)
+        while self.hashed < end:
+            data = self.fp.read(min(end - self.hashed, 64*1024))
+            if not data:
+                break
+            self.md5.update(data)
+            self.hashed += len(data)
+
+    def remote_read(self, maxlength, offset=None):
         """
         Called from remote slave to read at most L{maxlength} bytes of data
 
         @type  maxlength: C{integer}
         @param maxlength: Maximum number of data bytes that can be returned
+        @type  offset: C{integer}
+        @param offset: position to read from, if the slave is using windowed
+                       transfers
 
         @return: Data read from L{fp}
         @rtype: C{string} of bytes read from file
@@ -382,16 +507,45 @@ class _FileReader(pb.Referenceable):
         if self.fp is None:
             return ''
 
+        if offset is None:
+            offset = self.offset
+        if offset > self.hashed:
+            self._hashUpTo(offset)
+        self.fp.seek(offset)
         data = self.fp.read(maxlength)
+        self.offset = offset + len(data)
+        if offset == self.hashed:
+            self.md5.update(data)
+            self.hashed = self.offset
         return data
 
+    def remote_checksum(self, length):
+        """
+        Called by remote slave before reading any data, to check that the
+        first L{length} bytes of a partial file it kept from an earlier,
+        interrupted transfer are the same as those of L{fp}
+
+        @return: hex MD5 digest of the first L{length} bytes of L{fp}, or
+                 None if it is shorter than that
+        """
+        if self.fp is None:
+            return None
+        if self.hashed < length:
+            self._hashUpTo(length)
+        if self.hashed != length:
+            return None
+        return self.md5.hexdigest()
+
     def remote_close(self):
         """
         Called by remote slave to state that no more data will be transfered
+
+        @return: hex MD5 digest of the data sent to the slave
         """
         if self.fp is not None:
             self.fp.close()
             self.fp = None
+        return self.md5.hexdigest()
 
 
 class FileDownload(_TransferBuildStep):
@@ -414,13 +568,18 @@ class FileDownload(_TransferBuildStep):
                    the buildslave account, or 0755 to be world-executable.
                    The default (=None) is to leave it up to the umask of
                    the buildslave process.
+     ['window']    number of blocks the slave may request before the first
+                   one arrives, default 8. 1 disables windowed transfers.
+     ['resume']    if true, keep a partial file at the slave when the
+                   transfer is interrupted, and continue from it next time,
+                   default False
 
     """
     name = 'download'
 
     def __init__(self, mastersrc, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=8, resume=False, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(mastersrc=mastersrc,
                                  slavedest=slavedest,
@@ -428,6 +587,8 @@ class FileDownload(_TransferBuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  mode=mode,
+                                 window=window,
+                                 resume=resume,
                                  )
 
         self.mastersrc = mastersrc
@@ -437,6 +598,8 @@ class FileDownload(_TransferBuildStep):
         self.blocksize = blocksize
         assert isinstance(mode, (int, type(None)))
         self.mode = mode
+        self.window = window
+        self.resume = resume
 
     def start(self):
         properties = self.build.getProperties()
@@ -478,6 +641,7 @@ class FileDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        _setWindowArgs(self, "downloadFile", args, self.resume)
 
         self.cmd = StatusRemoteCommand('downloadFile', args)
         d = self.runCommand(self.cmd)
@@ -503,12 +667,14 @@ class StringDownload(_TransferBuildStep):
                    the buildslave account, or 0755 to be world-executable.
                    The default (=None) is to leave it up to the umask of
                    the buildslave process.
+     ['window']    number of blocks the slave may request before the first
+                   one arrives, default 8
     """
     name = 'string_download'
 
     def __init__(self, s, slavedest,
                  workdir=None, maxsize=None, blocksize=16*1024, mode=None,
-                 **buildstep_kwargs):
+                 window=8, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.addFactoryArguments(s=s,
                                  slavedest=slavedest,
@@ -516,6 +682,7 @@ class StringDownload(_TransferBuildStep):
                                  maxsize=maxsize,
                                  blocksize=blocksize,
                                  mode=mode,
+                                 window=window,
                                  )
 
         self.s = s
@@ -525,6 +692,7 @@ class StringDownload(_TransferBuildStep):
         self.blocksize = blocksize
         assert isinstance(mode, (int, type(None)))
         self.mode = mode
+        self.window = window
 
     def start(self):
         properties = self.build.getProperties()
@@ -555,6 +723,7 @@ class StringDownload(_TransferBuildStep):
             'workdir': self._getWorkdir(),
             'mode': self.mode,
             }
+        _setWindowArgs(self, "downloadFile", args)
 
         self.cmd = StatusRemoteCommand('downloadFile', args)
         d = self.runCommand(self.cmd)
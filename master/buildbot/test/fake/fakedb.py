@@ -64,11 +64,15 @@ class FakeDBConn:
         return i
 
     def runInteraction(self, f, *args):
-        return f(None, *args)
+        return defer.maybeDeferred(f, None, *args)
 
     def scheduler_get_state(self, schedulerid, t):
         return self.scheduler_states.get(schedulerid, {"last_processed": 0, "last_build": time.time()+100})
 
+    def scheduler_get_states(self, schedulerids, t):
+        return dict([(schedulerid, self.scheduler_get_state(schedulerid, t))
+                     for schedulerid in schedulerids])
+
     def scheduler_set_state(self, schedulerid, t, state):
         self.scheduler_states[schedulerid] = state
 
@@ -90,6 +94,10 @@ class FakeDBConn:
         else:
             self.classified_changes[schedulerid][1].append(self.changes[changeid])
 
+    def scheduler_classify_changes(self, classifications, t):
+        for schedulerid, changeid, important in classifications:
+            self.scheduler_classify_change(schedulerid, changeid, important, t)
+
     def scheduler_retire_changes(self, schedulerid, changeids, t):
         if schedulerid not in self.classified_changes:
             return
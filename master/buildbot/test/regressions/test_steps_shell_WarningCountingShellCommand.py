@@ -3,6 +3,8 @@ from twisted.trial import unittest
 import re
 from buildbot.steps.shell import WarningCountingShellCommand
 
+from mock import Mock
+
 class TestWarningCountingShellCommand(unittest.TestCase):
 
     # Makes sure that it is possible to supress warnings even if the
@@ -31,3 +33,58 @@ class TestWarningCountingShellCommand(unittest.TestCase):
         # list of warnings
         expectedWarnings = 0
         self.assertEquals(len(warnings), expectedWarnings)
+
+    def makeStep(self, **kwargs):
+        w = WarningCountingShellCommand(**kwargs)
+        logs = {}
+        w.addCompleteLog = lambda name, text: logs.__setitem__(name, text)
+        w.step_status = Mock()
+        w.step_status.getStatistic.return_value = 0
+        props = {}
+        def getProperty(name):
+            return props[name]
+        w.getProperty = getProperty
+        w.setProperty = lambda name, value, source: \
+                props.__setitem__(name, value)
+        return w, logs, props
+
+    def testStreamingWarnings(self):
+        w, logs, props = self.makeStep(
+            warningPattern="^(.*?):([0-9]+): [Ww]arning: (.*)$",
+            warningExtractor=WarningCountingShellCommand.warnExtractFromRegexpGroups)
+        w.addSuppression([("sub/a.c", None, None, None)])
+        # lines arrive in arbitrary chunks, and the last has no newline
+        w.warningCounter.outReceived("make: Entering directory `sub'\na.c:1")
+        w.warningCounter.outReceived(": warning: x\nb.c:2: warning: y\n")
+        w.warningCounter.errReceived("make: Leaving directory `sub'\n")
+        w.warningCounter.outReceived("a.c:3: warning: z")
+        self.assertEqual(w.warnCount, 1)
+        w.createSummary(None)
+        self.assertEqual(w.warnCount, 2)
+        self.assertEqual(logs['warnings'],
+                         "b.c:2: warning: y\na.c:3: warning: z\n")
+        self.assertEqual(props['warnings-count'], 2)
+
+    def testWarningsLogIsBounded(self):
+        w, logs, props = self.makeStep()
+        w.maxWarningsLogLines = 2
+        w.warningCounter.outReceived("warning: 1\nwarning: 2\nwarning: 3\n")
+        w.createSummary(None)
+        self.assertEqual(w.warnCount, 3)
+        self.assertEqual(logs['warnings'],
+                         "warning: 1\nwarning: 2\n"
+                         "(1 more warnings not shown)\n")
+
+    def testLongLinesAreBounded(self):
+        w, logs, props = self.makeStep()
+        w.warningCounter.maxLineLength = 20
+        # output that never ends its line only keeps the start of it
+        for i in range(100):
+            w.warningCounter.outReceived("warning: " + "x" * 10)
+        self.assertEqual(len(w.warningCounter.partial['out']), 20)
+        w.warningCounter.outReceived("\nwarning: short\nwarn")
+        w.warningCounter.outReceived("ing: last")
+        w.createSummary(None)
+        self.assertEqual(logs['warnings'],
+                         "warning: xxxxxxxxxxw\nwarning: short\n"
+                         "warning: last\n")
@@ -0,0 +1,38 @@
+from twisted.trial import unittest
+
+from buildbot.changes import pb
+
+class FakeChangeMaster:
+    def __init__(self):
+        self.added = []
+    def addChanges(self, changes):
+        self.added.append(changes)
+
+class ChangePerspective(unittest.TestCase):
+
+    def setUp(self):
+        self.changemaster = FakeChangeMaster()
+        self.perspective = pb.ChangePerspective(self.changemaster, 'trunk/')
+
+    def changedict(self, *files):
+        return dict(who='me', files=list(files), comments='c',
+                    branch='b', revision='1')
+
+    def test_addChange(self):
+        self.perspective.perspective_addChange(self.changedict('trunk/a',
+                                                                'other/b'))
+        [[change]] = self.changemaster.added
+        self.assertEqual(change.files, ['a'])
+        self.assertEqual(change.who, 'me')
+
+    def test_addChange_no_files(self):
+        self.perspective.perspective_addChange(self.changedict('other/b'))
+        self.assertEqual(self.changemaster.added, [])
+
+    def test_addChanges(self):
+        self.perspective.perspective_addChanges([self.changedict('trunk/a'),
+                                                 self.changedict('other/b'),
+                                                 self.changedict('trunk/c')])
+        # added together, without the change that had no files of interest
+        [changes] = self.changemaster.added
+        self.assertEqual([c.files for c in changes], [['a'], ['c']])
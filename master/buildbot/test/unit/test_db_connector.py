@@ -1,7 +1,17 @@
+import os
+import shutil
+
 from twisted.trial import unittest
 
+from buildbot import util
+from buildbot.changes.changes import Change
 from buildbot.db import dbspec, connector
+from buildbot.db.schema import manager
+from buildbot.process.properties import Properties
+from buildbot.schedulers import basic
+from buildbot.sourcestamp import SourceStamp
 from buildbot.test.util import threads
+from buildbot.util import eventual
 
 class DBConnector_Basic(threads.ThreadLeakMixin, unittest.TestCase):
     """
@@ -70,3 +80,170 @@ class DBConnector_Basic(threads.ThreadLeakMixin, unittest.TestCase):
             self.assertEqual(res, [(1,)])
         d.addCallback(cb)
         return d
+
+class DBConnector_BuildRequests(unittest.TestCase):
+    """
+    Tests of the bulk loaders, against a real (upgraded) schema
+    """
+
+    def setUp(self):
+        self.basedir = "DBConnector_BuildRequests"
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager.DBSchemaManager(spec, self.basedir).upgrade(quiet=True)
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def make_buildset(self, ss, builderNames, **props):
+        p = Properties(**props)
+        def txn(t):
+            ssid = self.dbc.get_sourcestampid(ss, t)
+            bsid = self.dbc.create_buildset(ssid, "reason", p, builderNames, t)
+            t.execute(self.dbc.quoteq("SELECT id FROM buildrequests"
+                                      " WHERE buildsetid=? ORDER BY id"),
+                      (bsid,))
+            return [brid for (brid,) in t.fetchall()]
+        return self.dbc.runInteractionNow(txn)
+
+    def test_getBuildRequestsWithNumbers(self):
+        c = Change(who="me", files=["a", "b"], comments="c", branch="br",
+                   links=["http://x"])
+        c.properties.setProperty("cp", "cv", "Change")
+        self.dbc.addChangeToDatabase(c)
+        ss1 = SourceStamp(branch="br", revision="1", changes=[c])
+        ss2 = SourceStamp(branch="trunk", revision="2",
+                          patch=(1, "--- patch"))
+        brids = (self.make_buildset(ss1, ["b1", "b2"], foo="bar") +
+                 self.make_buildset(ss2, ["b1"]))
+
+        # compare the bulk loader with the one-at-a-time loader, with cold
+        # caches
+        self.dbc._change_cache = util.LRUCache()
+        self.dbc._sourcestamp_cache = util.LRUCache()
+        brids.reverse()
+        bulk = self.dbc.getBuildRequestsWithNumbers(brids + [9999])
+        self.assertEqual([br.id for br in bulk], brids)
+        self.dbc._change_cache = util.LRUCache()
+        self.dbc._sourcestamp_cache = util.LRUCache()
+        for br in bulk:
+            single = self.dbc.getBuildRequestWithNumber(br.id)
+            self.assertEqual(br.bsid, single.bsid)
+            self.assertEqual(br.builderName, single.builderName)
+            self.assertEqual(br.reason, single.reason)
+            self.assertEqual(br.submittedAt, single.submittedAt)
+            self.assertEqual(br.properties, single.properties)
+            self.assertEqual(br.source.ssid, single.source.ssid)
+            self.assertEqual(br.source.asDict(), single.source.asDict())
+            self.assertEqual(br.source.patch, single.source.patch)
+            self.assertEqual([ch.number for ch in br.source.changes],
+                             [ch.number for ch in single.source.changes])
+
+        # requests in the same buildset don't share a Properties instance
+        self.failIf(bulk[1].properties is bulk[2].properties)
+        self.assertEqual(bulk[1].properties.getProperty("foo"), "bar")
+        change = bulk[1].source.changes[0]
+        self.assertEqual(change.files, ["a", "b"])
+        self.assertEqual(change.links, ["http://x"])
+        self.assertEqual(change.properties.getProperty("cp"), "cv")
+
+    def test_get_unclaimed_buildrequest_summary(self):
+        ss = SourceStamp(branch="br", revision="1")
+        brids = (self.make_buildset(ss, ["b1", "b2"]) +
+                 self.make_buildset(ss, ["b1"]))
+        def txn(t):
+            # the second buildset was submitted first
+            t.execute(self.dbc.quoteq("UPDATE buildsets SET submitted_at=?"
+                                      " WHERE id=(SELECT buildsetid FROM"
+                                      " buildrequests WHERE id=?)"),
+                      (10, brids[2]))
+            t.execute(self.dbc.quoteq("UPDATE buildsets SET submitted_at=?"
+                                      " WHERE id=(SELECT buildsetid FROM"
+                                      " buildrequests WHERE id=?)"),
+                      (20, brids[0]))
+            t.execute(self.dbc.quoteq("UPDATE buildrequests SET priority=5"
+                                      " WHERE id=?"), (brids[0],))
+        self.dbc.runInteractionNow(txn)
+        self.dbc.claim_buildrequests(100, "master", "inc", [brids[1]])
+
+        summary = self.dbc.get_unclaimed_buildrequest_summary(50, "master",
+                                                              "inc")
+        # b2's only request is claimed
+        self.assertEqual(summary, {"b1": (10, 5)})
+
+    def test_buildrequest_builders_notification(self):
+        notified = []
+        def observer(category, *buildernames):
+            notified.append(sorted(buildernames))
+        self.dbc.subscribe_to("add-buildrequest-builders", observer)
+        ss = SourceStamp(branch="br", revision="1")
+        brids = self.make_buildset(ss, ["b1", "b2", "b1"])
+        d = self.dbc.resubmit_buildrequests([brids[1]])
+        d.addCallback(lambda _: eventual.flushEventualQueue())
+        def check(_):
+            self.assertEqual(notified, [["b1", "b2"], ["b2"]])
+        d.addCallback(check)
+        return d
+
+    def test_scheduler_bulk_classification(self):
+        a = basic.Scheduler(name="a", treeStableTimer=None, builderNames=["x"])
+        b = basic.Scheduler(name="b", treeStableTimer=None, builderNames=["x"])
+        self.dbc.runInteractionNow(self.dbc._addSchedulers, [a, b])
+        c = Change(who="me", files=["a"], comments="c")
+        self.dbc.addChangeToDatabase(c)
+        self.dbc._change_cache = util.LRUCache()
+
+        def txn(t):
+            self.assertEqual(len(self.dbc.getChangesGreaterThan(0, t)), 1)
+            self.dbc.scheduler_set_state(b.schedulerid, t,
+                                         {"last_processed": 7})
+            states = self.dbc.scheduler_get_states(
+                    [a.schedulerid, b.schedulerid], t)
+            self.dbc.scheduler_classify_changes(
+                    [(a.schedulerid, c.number, True),
+                     (b.schedulerid, c.number, False)], t)
+            return (states,
+                    self.dbc.scheduler_get_classified_changes(a.schedulerid, t),
+                    self.dbc.scheduler_get_classified_changes(b.schedulerid, t))
+        states, a_changes, b_changes = self.dbc.runInteractionNow(txn)
+        self.assertEqual(states[b.schedulerid], {"last_processed": 7})
+        self.assertEqual(states[a.schedulerid]["last_processed"], 0)
+        self.assertEqual([[ch.number for ch in l] for l in a_changes],
+                         [[c.number], []])
+        self.assertEqual([[ch.number for ch in l] for l in b_changes],
+                         [[], [c.number]])
+
+    def test_addChangesToDatabase(self):
+        notified = []
+        def observer(category, *changeids):
+            notified.append(changeids)
+        self.dbc.subscribe_to("add-change", observer)
+        added = []
+        for i in range(3):
+            c = Change(who="me", files=["f%d" % i, "g"], comments="c%d" % i,
+                       links=["http://x/%d" % i])
+            c.properties.setProperty("p", i, "Change")
+            added.append(c)
+        self.dbc.addChangesToDatabase(added)
+        numbers = [c.number for c in added]
+        self.assertEqual(numbers, range(numbers[0], numbers[0] + 3))
+
+        self.dbc._change_cache = util.LRUCache()
+        loaded = self.dbc.getChangesGreaterThan(0)
+        self.assertEqual([c.number for c in loaded], numbers)
+        self.assertEqual([c.files for c in loaded],
+                         [["f0", "g"], ["f1", "g"], ["f2", "g"]])
+        self.assertEqual(loaded[2].links, ["http://x/2"])
+        self.assertEqual(loaded[2].properties.getProperty("p"), 2)
+
+        d = eventual.flushEventualQueue()
+        def check(_):
+            # one notification, with the range of new changeids
+            self.assertEqual(notified, [(numbers[0], numbers[-1])])
+        d.addCallback(check)
+        return d
@@ -169,7 +169,7 @@ class DBSchemaManager(unittest.TestCase):
     def test_get_current_version(self):
         # this is as much a reminder to write tests for the new version
         # as a test of the (very trivial) method
-        self.assertEqual(self.sm.get_current_version(), 6)
+        self.assertEqual(self.sm.get_current_version(), 7)
 
     def test_get_db_version_empty(self):
         self.assertEqual(self.sm.get_db_version(), 0)
@@ -197,6 +197,30 @@ class DBSchemaManager(unittest.TestCase):
         self.sm.upgrade(quiet=True)
         self.assertDatabaseOKFull()
 
+    def test_v7_indexes(self):
+        self.sm.upgrade(quiet=True)
+        indexes = self.get_index_names()
+        for idx in ('buildrequests_buildername_complete_claimed_at',
+                    'buildrequests_buildsetid_complete',
+                    'scheduler_changes_schedulerid_changeid',
+                    'scheduler_upstream_buildsets_schedulerid_active',
+                    'sourcestamp_changes_sourcestampid_changeid',
+                    # v5 indexes that v7 keeps
+                    'buildrequests_buildsetid', 'builds_brid',
+                    'change_files_changeid', 'change_properties_changeid'):
+            self.assertTrue(idx in indexes, idx)
+        # these are prefixes of the composite indexes, so v7 drops them
+        for idx in ('buildrequests_buildername',
+                    'scheduler_changes_schedulerid',
+                    'scheduler_upstream_buildsets_schedulerid',
+                    'sourcestamp_changes_sourcestampid'):
+            self.assertFalse(idx in indexes, idx)
+
+    def get_index_names(self):
+        c = self.spec.get_sync_connection().cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type='index'")
+        return [row[0] for row in c.fetchall()]
+
     def test_scheduler_name_uniqueness(self):
         self.sm.upgrade(quiet=True)
         c = self.spec.get_sync_connection().cursor()
@@ -226,6 +250,13 @@ class MySQLDBSchemaManager(DBSchemaManager):
 
         self.sm = manager.DBSchemaManager(self.spec, self.basedir)
 
+    def get_index_names(self):
+        c = self.spec.get_sync_connection().cursor()
+        c.execute("SELECT DISTINCT index_name"
+                  " FROM information_schema.statistics"
+                  " WHERE table_schema = DATABASE()")
+        return [row[0] for row in c.fetchall()]
+
 try:
     import MySQLdb
     conn = MySQLdb.connect(user="buildbot_test", db="buildbot_test", passwd="buildbot_test", use_unicode=True, charset='utf8')
@@ -1,74 +1,164 @@
-from twisted.trial import unittest
-from exceptions import Exception
-from buildbot.changes import gitpoller
-
-class GitOutputHelper:
-    """just used to keep shared vars out of the global namespace"""
-    desiredOutput = None
+import os
+import shutil
+import subprocess
 
-# single instance
-helper = GitOutputHelper()
-
-# the following methods are used in place of 
-# GitPoller._get_git_output(self, args)
-def produce_desired_git_output(args):
-    return helper.desiredOutput
-    
-def produce_empty_git_output(args):
-    return ''
+from twisted.trial import unittest
+from twisted.python import procutils
 
-def produce_exception_git_output(args):
-   raise Exception('fake')
+from buildbot.changes import gitpoller
 
 class GitOutputParsing(unittest.TestCase):
-    """Test GitPoller methods that rely on GitPoller._get_git_output()"""
+    """Test GitPoller._parse_log()"""
     gp = None
     
     def setUp(self):
         self.gp = gitpoller.GitPoller('git@example.com:foo/baz.git')
-        
-    def _perform_git_output_test(self, methodToTest,
-                                 desiredGoodOutput, desiredGoodResult,
-                                 emptyRaisesException=True):
-        """
-        This method will monkey-patch the GitPoller instance's _get_git_output() 
-        method to produce different scenarios for testing methods which
-        """
-        dummyRevStr = '12345abcde'
-
-        # we should get an Exception with empty output from git
-        self.gp._get_git_output = produce_empty_git_output
-        
-        if emptyRaisesException:
-            self.assertRaises(Exception, methodToTest, dummyRevStr)
-        else:
-            try:
-                methodToTest(dummyRevStr)
-            except Exception, e:
-                self.fail('unexpected exception \'%s\' from empty output' % e)
-        
-        # and the method shouldn't supress any exceptions
-        self.gp._get_git_output = produce_exception_git_output
-        self.assertRaises(Exception, methodToTest, dummyRevStr)
-        
-        # finally we should get what's expected from good output
-        helper.desiredOutput = desiredGoodOutput
-        self.gp._get_git_output = produce_desired_git_output
-        self.assertEquals(methodToTest(dummyRevStr), desiredGoodResult)
-        
-    def test_get_commit_name(self):
-        nameStr = 'Sammy Jankis'
-        self._perform_git_output_test(self.gp._get_commit_name, nameStr, nameStr)
-        
-    def test_get_commit_comments(self):
-        commentStr = 'this is a commit message\n\nthat is multiline'
-        self._perform_git_output_test(self.gp._get_commit_comments, commentStr, commentStr)
-        
-    def test_get_commit_files(self):
-        filesStr = 'file1\nfile2'
-        self._perform_git_output_test(self.gp._get_commit_files, filesStr, 
-                                      filesStr.split(), emptyRaisesException=False)    
-        
-    def test_get_commit_timestamp(self):
-        stampStr = '1273258009'
-        self._perform_git_output_test(self.gp._get_commit_timestamp, stampStr, float(stampStr))
+
+    def test_parse_log(self):
+        # what LOG_FORMAT gives for a commit with two files (one of which
+        # looks like a revision), followed by one that changed no files
+        output = ('\0aaaa\0Sammy Jankis\x001273258009\0'
+                  'this is a commit message\n\nthat is multiline\n\0'
+                  '\nfile1\0bbbb\0'
+                  '\0bbbb\0Sammy Jankis\x001273258010\0merge\n\0')
+        self.assertEqual(self.gp._parse_log(output),
+            [('aaaa', 'Sammy Jankis', 1273258009.0,
+              'this is a commit message\n\nthat is multiline\n',
+              ['file1', 'bbbb']),
+             ('bbbb', 'Sammy Jankis', 1273258010.0, 'merge\n', [])])
+
+    def test_parse_log_empty(self):
+        self.assertEqual(self.gp._parse_log(''), [])
+
+    def test_parse_log_no_name(self):
+        output = '\0aaaa\0\x001273258009\0comment\n\0'
+        self.assertRaises(EnvironmentError, self.gp._parse_log, output)
+
+    def test_parse_log_bad_timestamp(self):
+        output = '\0aaaa\0Sammy Jankis\0yesterday\0comment\n\0'
+        self.assertRaises(ValueError, self.gp._parse_log, output)
+
+def git(path, *args):
+    p = subprocess.Popen(['git'] + list(args), cwd=path,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    return out.strip()
+
+class FakeChangeManager:
+    def __init__(self):
+        self.changes = []
+    def addChanges(self, changes):
+        self.changes.extend(changes)
+
+class Polling(unittest.TestCase):
+
+    def setUp(self):
+        if not procutils.which('git'):
+            raise unittest.SkipTest("git is not installed")
+        self.basedir = os.path.abspath("gitpoller")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.origin = os.path.join(self.basedir, "origin")
+        os.makedirs(self.origin)
+        git(self.origin, 'init', '-q')
+        git(self.origin, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        self.commit('one', 'file')
+        git(self.origin, 'branch', 'feature')
+        self.workdir = os.path.join(self.basedir, "workdir")
+        self.cm = FakeChangeManager()
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def commit(self, data, *files):
+        for name in files:
+            open(os.path.join(self.origin, name), "w").write(data)
+            git(self.origin, 'add', name)
+        git(self.origin, '-c', 'user.name=Sammy', '-c', 'user.email=s@x',
+            'commit', '-q', '--allow-empty', '-m', data)
+        return git(self.origin, 'rev-parse', 'HEAD')
+
+    def makePoller(self, **kwargs):
+        gp = gitpoller.GitPoller(self.origin, workdir=self.workdir, **kwargs)
+        gp.parent = self.cm
+        if not os.path.exists(self.workdir):
+            os.makedirs(self.workdir)
+        return gp
+
+    def test_branches(self):
+        gp = self.makePoller(branches=['master', 'feature'])
+        d = gp.poll()
+        def checkFirst(_):
+            # nothing is reported the first time a branch is seen
+            self.assertEqual(self.cm.changes, [])
+            self.revs = [self.commit('two', 'file', 'other'),
+                         self.commit('three')]
+            git(self.origin, 'checkout', '-q', 'feature')
+            self.revs.append(self.commit('four', 'feature file'))
+            git(self.origin, 'checkout', '-q', 'master')
+            return gp.poll()
+        d.addCallback(checkFirst)
+        def checkChanges(_):
+            self.assertEqual([(c.revision, c.branch, c.files, c.who)
+                              for c in self.cm.changes],
+                             [(self.revs[0], 'master', ['file', 'other'],
+                               'Sammy'),
+                              (self.revs[1], 'master', [], 'Sammy'),
+                              (self.revs[2], 'feature', ['feature file'],
+                               'Sammy')])
+            self.assertEqual(self.cm.changes[0].comments, 'two\n')
+            self.assertEqual(self.cm.changes[0].repository, self.origin)
+            self.failIf(gp.working)
+            return gp.poll()
+        d.addCallback(checkChanges)
+        def checkNoMore(_):
+            self.assertEqual(len(self.cm.changes), 3)
+        d.addCallback(checkNoMore)
+        return d
+
+    def test_old_workdir(self):
+        # an older GitPoller left the last revision it processed in HEAD
+        git(self.basedir, 'clone', '-q', self.origin, self.workdir)
+        rev = self.commit('two', 'file')
+        gp = self.makePoller()
+        d = gp.poll()
+        def check(_):
+            self.assertEqual([c.revision for c in self.cm.changes], [rev])
+        d.addCallback(check)
+        return d
+
+    def test_old_workdir_new_branch(self):
+        # HEAD only says where the old poller's branch had got to
+        git(self.basedir, 'clone', '-q', self.origin, self.workdir)
+        git(self.origin, 'checkout', '-q', 'feature')
+        self.commit('two', 'feature file')
+        git(self.origin, 'checkout', '-q', 'master')
+        rev = self.commit('three', 'file')
+        gp = self.makePoller(branches=['master', 'feature'])
+        d = gp.poll()
+        def check(_):
+            self.assertEqual([(c.revision, c.branch) for c in self.cm.changes],
+                             [(rev, 'master')])
+            self.revs = [self.commit('four', 'file')]
+            git(self.origin, 'checkout', '-q', 'feature')
+            self.revs.append(self.commit('five', 'feature file'))
+            git(self.origin, 'checkout', '-q', 'master')
+            return gp.poll()
+        d.addCallback(check)
+        def checkSecond(_):
+            # the new branch is followed from where it was first seen
+            self.assertEqual([c.revision for c in self.cm.changes[1:]],
+                             self.revs)
+        d.addCallback(checkSecond)
+        return d
+
+    def test_fetch_failure(self):
+        gp = self.makePoller(branch='nosuchbranch')
+        d = gp.poll()
+        def check(_):
+            self.assertEqual(self.cm.changes, [])
+            self.failIf(gp.working)
+        d.addCallback(check)
+        return d
@@ -0,0 +1,125 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, task
+
+from buildbot.locks import BaseLock, MasterLock
+
+class Owner:
+    def __init__(self, name):
+        self.name = name
+    def __repr__(self):
+        return "<Owner %s>" % self.name
+
+class TestBaseLock(unittest.TestCase):
+
+    def setUp(self):
+        self.lockid = MasterLock('lock', maxCount=2)
+        self.counting = self.lockid.access('counting')
+        self.exclusive = self.lockid.access('exclusive')
+
+    def test_counting(self):
+        lock = BaseLock('lock', maxCount=2)
+        a, b, c = Owner('a'), Owner('b'), Owner('c')
+        lock.claim(a, self.counting)
+        lock.claim(b, self.counting)
+        self.failIf(lock.isAvailable(c, self.counting))
+        self.failIf(lock.isAvailable(c, self.exclusive))
+        self.assertEqual(lock._getOwnersCount(), (0, 2))
+        lock.release(a, self.counting)
+        self.failUnless(lock.isAvailable(c, self.counting))
+        self.failIf(lock.isAvailable(c, self.exclusive))
+        lock.release(b, self.counting)
+        self.failUnless(lock.isAvailable(c, self.exclusive))
+        self.assertEqual(lock._getOwnersCount(), (0, 0))
+
+    def test_fifo_handover(self):
+        lock = BaseLock('lock', maxCount=1)
+        owners = [Owner(n) for n in 'abcd']
+        lock.claim(owners[0], self.exclusive)
+        woken = []
+        for o in owners[1:3]:
+            d = lock.waitUntilMaybeAvailable(o, self.exclusive)
+            d.addCallback(lambda l, o=o: woken.append(o))
+        lock.release(owners[0], self.exclusive)
+        # the lock is handed over to the first waiter, and nobody else may
+        # take it in the meantime
+        self.failUnless(lock.isAvailable(owners[1], self.exclusive))
+        self.failIf(lock.isAvailable(owners[2], self.exclusive))
+        self.failIf(lock.isAvailable(owners[3], self.exclusive))
+        def check():
+            self.assertEqual(woken, [owners[1]])
+            lock.claim(owners[1], self.exclusive)
+            lock.release(owners[1], self.exclusive)
+            self.failUnless(lock.isAvailable(owners[2], self.exclusive))
+            self.failIf(lock.isAvailable(owners[3], self.exclusive))
+        return task.deferLater(reactor, 0, check)
+
+    def test_exclusive_not_starved(self):
+        lock = BaseLock('lock', maxCount=2)
+        a, b, c = Owner('a'), Owner('b'), Owner('c')
+        lock.claim(a, self.counting)
+        lock.waitUntilMaybeAvailable(b, self.exclusive)
+        # there is room for another counting owner, but b was here first
+        self.failIf(lock.isAvailable(c, self.counting))
+        lock.release(a, self.counting)
+        self.failUnless(lock.isAvailable(b, self.exclusive))
+
+    def test_priority(self):
+        lock = BaseLock('lock', maxCount=1)
+        a, lo, hi = Owner('a'), Owner('lo'), Owner('hi')
+        lock.claim(a, self.exclusive)
+        lock.waitUntilMaybeAvailable(lo, self.exclusive, priority=0)
+        lock.waitUntilMaybeAvailable(hi, self.exclusive, priority=10)
+        lock.release(a, self.exclusive)
+        self.failUnless(lock.isAvailable(hi, self.exclusive))
+        self.failIf(lock.isAvailable(lo, self.exclusive))
+
+    def test_stopWaiting_after_wakeup(self):
+        lock = BaseLock('lock', maxCount=1)
+        a, b, c = Owner('a'), Owner('b'), Owner('c')
+        lock.claim(a, self.exclusive)
+        d = lock.waitUntilMaybeAvailable(b, self.exclusive)
+        lock.waitUntilMaybeAvailable(c, self.exclusive)
+        lock.release(a, self.exclusive)
+        # b is interrupted before it gets a chance to claim the lock, so the
+        # lock moves on to c
+        lock.stopWaitingUntilAvailable(b, self.exclusive, d)
+        d.callback(None)
+        self.failIf(lock.isAvailable(b, self.exclusive))
+        self.failUnless(lock.isAvailable(c, self.exclusive))
+
+    def test_stopWaiting_in_queue(self):
+        lock = BaseLock('lock', maxCount=1)
+        a, b = Owner('a'), Owner('b')
+        lock.claim(a, self.exclusive)
+        d = lock.waitUntilMaybeAvailable(b, self.exclusive)
+        lock.stopWaitingUntilAvailable(b, self.exclusive, d)
+        self.assertEqual(lock.numWaiting, 0)
+        lock.release(a, self.exclusive)
+        self.assertEqual(lock.reserved, {})
+        self.assertEqual(lock._getOwnersCount(), (0, 0))
+
+    def test_stopWaiting_head_wakes_next(self):
+        lock = BaseLock('lock', maxCount=2)
+        a, b, c = Owner('a'), Owner('b'), Owner('c')
+        lock.claim(a, self.counting)
+        d = lock.waitUntilMaybeAvailable(b, self.exclusive)
+        woken = []
+        lock.waitUntilMaybeAvailable(c, self.counting).addCallback(
+                woken.append)
+        # c only waits because b is ahead of it
+        lock.stopWaitingUntilAvailable(b, self.exclusive, d)
+        self.failUnless(lock.isAvailable(c, self.counting))
+        def check():
+            self.assertEqual(woken, [lock])
+        return task.deferLater(reactor, 0, check)
+
+    def test_wait_statistics(self):
+        lock = BaseLock('lock', maxCount=1)
+        a, b = Owner('a'), Owner('b')
+        self.assertEqual(lock.getWaitStatistics(), (0, 0, 0))
+        lock.claim(a, self.exclusive)
+        lock.waitUntilMaybeAvailable(b, self.exclusive)
+        lock.release(a, self.exclusive)
+        count, total, longest = lock.getWaitStatistics()
+        self.assertEqual(count, 1)
+        self.failUnless(total >= 0 and longest == total)
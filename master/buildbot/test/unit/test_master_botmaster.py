@@ -0,0 +1,91 @@
+from twisted.trial import unittest
+from mock import Mock
+
+from buildbot.master import BotMaster
+from buildbot.process.builder import Builder
+
+class FakeDB:
+    def __init__(self, summary):
+        self.summary = summary
+        self.queries = 0
+    def get_unclaimed_buildrequest_summary(self, old, master_name,
+                                           master_incarnation):
+        self.queries += 1
+        return self.summary
+
+class TestPrioritizeBuilders(unittest.TestCase):
+
+    def setUp(self):
+        self.botmaster = BotMaster()
+        self.botmaster.setMasterName("master", "inc")
+        self.botmaster.db = FakeDB({'b': (30, 0), 'c': (10, 5)})
+        for name in 'abc':
+            b = Builder({'name': name, 'slavenames': ['s'],
+                         'builddir': name, 'slavebuilddir': name,
+                         'factory': None}, Mock())
+            b.setBotmaster(self.botmaster)
+            self.botmaster.builders[name] = b
+
+    def names(self, processors):
+        return [p.im_self.name for p in processors]
+
+    def test_sort_builders(self):
+        # builders without requests go last
+        self.assertEqual(self.names(self.botmaster._get_processors()),
+                         ['c', 'b', 'a'])
+        self.assertEqual(self.botmaster.db.queries, 1)
+
+    def test_custom_prioritizer(self):
+        def prioritizeBuilders(buildmaster, builders):
+            summary = self.botmaster.getRequestSummary()
+            builders.sort(key=lambda b: (-summary.get(b.name, (0, -1))[1],
+                                         b.getOldestRequestTime()))
+            return builders
+        self.botmaster.prioritizeBuilders = prioritizeBuilders
+        self.assertEqual(self.names(self.botmaster._get_processors())[0], 'c')
+        # one query, however many times the summary was asked for
+        self.assertEqual(self.botmaster.db.queries, 1)
+        # outside a pass, it is fetched afresh
+        self.assertEqual(self.botmaster.builders['b'].getOldestRequestTime(),
+                         30)
+        self.assertEqual(self.botmaster.db.queries, 2)
+
+class FakeSlave:
+    def __init__(self, slavename, locks=[]):
+        self.slavename = slavename
+        self.locks = locks
+
+class TestTriggerNewBuildCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.botmaster = BotMaster()
+        self.botmaster.setMasterName("master", "inc")
+        self.botmaster.db = FakeDB({})
+        self.botmaster.loop = Mock()
+        for name, slavename in [('a', 's1'), ('b', 's1'), ('c', 's2')]:
+            b = Builder({'name': name, 'slavenames': [slavename],
+                         'builddir': name, 'slavebuilddir': name,
+                         'factory': None}, Mock())
+            b.setBotmaster(self.botmaster)
+            self.botmaster.builders[name] = b
+
+    def triggered(self):
+        args, kwargs = self.botmaster.loop.trigger_processors.call_args
+        return sorted([p.im_self.name for p in args[0]])
+
+    def test_add_buildrequest(self):
+        # builders that no longer exist are ignored
+        self.botmaster.trigger_add_buildrequest('add-buildrequest-builders',
+                                                'c', 'gone')
+        self.assertEqual(self.triggered(), ['c'])
+        self.failIf(self.botmaster.loop.trigger.called)
+
+    def test_slave(self):
+        self.botmaster.triggerNewBuildCheckForSlave(FakeSlave('s1'))
+        self.assertEqual(self.triggered(), ['a', 'b'])
+        self.failIf(self.botmaster.loop.trigger.called)
+
+    def test_slave_with_locks(self):
+        # the locks may be shared by builders on other slaves
+        self.botmaster.triggerNewBuildCheckForSlave(FakeSlave('s1', ['lock']))
+        self.failUnless(self.botmaster.loop.trigger.called)
@@ -5,29 +5,10 @@ import shutil
 from twisted.trial import unittest
 
 from buildbot.status.persistent_queue import DequeMemoryQueue, DiskQueue, \
-    IQueue, ListMemoryQueue, MemoryQueue, PersistentQueue, WriteFile
-
-class test_Queues(unittest.TestCase):
-    def setUp(self):
-        if os.path.isdir('fake_dir'):
-            shutil.rmtree('fake_dir')
-
-    def tearDown(self):
-        if os.path.isdir('fake_dir'):
-            self.assertEqual([], os.listdir('fake_dir'))
-
-    def testQueued(self):
-        # Verify behavior when starting up with queued items on disk.
-        os.mkdir('fake_dir')
-        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
-        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
-        WriteFile(os.path.join('fake_dir', '8'), 'foo8')
-        queue = PersistentQueue(MemoryQueue(3),
-            DiskQueue('fake_dir', 5, pickleFn=str, unpickleFn=str))
-        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.items())
-        self.assertEqual(3, queue.nbItems())
-        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.popChunk())
+    IQueue, ListMemoryQueue, MemoryQueue, PersistentQueue, WriteFile, \
+    SegmentedDiskQueue
 
+class QueueTestMixin:
     def _test_helper(self, q):
         self.assertTrue(IQueue.providedBy(q))
         self.assertEqual(8, q.maxItems())
@@ -121,6 +102,28 @@ class test_Queues(unittest.TestCase):
             self.assertEqual([], q.primaryQueue.items())
             self.assertEqual([], q.secondaryQueue.items())
 
+
+class test_Queues(QueueTestMixin, unittest.TestCase):
+    def setUp(self):
+        if os.path.isdir('fake_dir'):
+            shutil.rmtree('fake_dir')
+
+    def tearDown(self):
+        if os.path.isdir('fake_dir'):
+            self.assertEqual([], os.listdir('fake_dir'))
+
+    def testQueued(self):
+        # Verify behavior when starting up with queued items on disk.
+        os.mkdir('fake_dir')
+        WriteFile(os.path.join('fake_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_dir', '5'), 'foo5')
+        WriteFile(os.path.join('fake_dir', '8'), 'foo8')
+        queue = PersistentQueue(MemoryQueue(3),
+            DiskQueue('fake_dir', 5, pickleFn=str, unpickleFn=str))
+        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.items())
+        self.assertEqual(3, queue.nbItems())
+        self.assertEqual(['foo3', 'foo5', 'foo8'], queue.popChunk())
+
     def testListMemoryQueue(self):
         self._test_helper(ListMemoryQueue(maxItems=8))
 
@@ -135,4 +138,78 @@ class test_Queues(unittest.TestCase):
         self._test_helper(PersistentQueue(MemoryQueue(3),
                                           DiskQueue('fake_dir', 5)))
 
+class test_SegmentedDiskQueue(QueueTestMixin, unittest.TestCase):
+    def setUp(self):
+        if os.path.isdir('fake_seg_dir'):
+            shutil.rmtree('fake_seg_dir')
+
+    def segments(self):
+        return [x for x in os.listdir('fake_seg_dir')
+                if x.startswith('segment.')]
+
+    def makeQueue(self, maxItems=None, **kwargs):
+        return SegmentedDiskQueue('fake_seg_dir', maxItems, pickleFn=str,
+                                  unpickleFn=str, **kwargs)
+
+    def testSegmentedDiskQueue(self):
+        self._test_helper(SegmentedDiskQueue('fake_seg_dir', maxItems=8))
+
+    def testPersistentQueue(self):
+        self._test_helper(PersistentQueue(MemoryQueue(3),
+                          SegmentedDiskQueue('fake_seg_dir', 5)))
+
+    def testReload(self):
+        q = self.makeQueue(segmentSize=20)
+        for i in range(10):
+            q.pushItem('item%d' % i)
+        self.assertEqual(['item0', 'item1', 'item2', 'item3'], q.popChunk(4))
+        q.save()
+        # items are grouped in a few segments, and emptied ones are removed
+        self.assertEqual(3, len(self.segments()))
+
+        q = self.makeQueue()
+        self.assertEqual(6, q.nbItems())
+        self.assertEqual(['item%d' % i for i in range(4, 10)], q.items())
+        self.assertEqual(None, q.insertBackChunk(['item1', 'item2', 'item3']))
+        q.save()
+
+        q = self.makeQueue()
+        self.assertEqual(['item%d' % i for i in range(1, 10)], q.popChunk())
+        self.assertEqual([], q.popChunk())
+
+    def testPartialRecord(self):
+        q = self.makeQueue()
+        q.pushItem('foo')
+        q.pushItem('bar')
+        q.save()
+        f = open(os.path.join('fake_seg_dir', self.segments()[0]), 'ab')
+        f.write('\0\0\0\x10ba')
+        f.close()
+        q = self.makeQueue()
+        self.assertEqual(['foo', 'bar'], q.items())
+        q.pushItem('baz')
+        self.assertEqual(['foo', 'bar', 'baz'], q.popChunk())
+
+    def testUnsynced(self):
+        # items pushed after the last sync are found again from the segment
+        q = self.makeQueue(syncItems=100)
+        q.pushItem('foo')
+        q.save()
+        self.assertEqual(['foo'], q.popChunk())
+        q.pushItem('bar')
+        q._writer.flush()
+        q = self.makeQueue()
+        # the pop wasn't synced, so foo is seen again
+        self.assertEqual(['foo', 'bar'], q.items())
+
+    def testImportDiskQueueItems(self):
+        os.mkdir('fake_seg_dir')
+        WriteFile(os.path.join('fake_seg_dir', '3'), 'foo3')
+        WriteFile(os.path.join('fake_seg_dir', '5'), 'foo5')
+        WriteFile(os.path.join('fake_seg_dir', '8'), 'foo8')
+        q = self.makeQueue(maxItems=2)
+        self.assertEqual(['foo5', 'foo8'], q.items())
+        self.assertEqual(['cursor'] + self.segments(),
+                         sorted(os.listdir('fake_seg_dir')))
+
 # vim: set ts=4 sts=4 sw=4 et:
@@ -1,8 +1,11 @@
 import re
+import struct
+import zlib
 
 from twisted.trial import unittest
 
 from buildbot.process.buildstep import LoggingBuildStep, regex_log_evaluator
+from buildbot.process.buildstep import LoggedRemoteCommand, FRAME_HEADER
 from buildbot.status.builder import FAILURE, SUCCESS, WARNINGS, EXCEPTION
 
 class FakeLogFile:
@@ -72,3 +75,49 @@ class TestLoggingBuildStep(unittest.TestCase):
         lbs = LoggingBuildStep(log_eval_func=eval)
         status = lbs.evaluateCommand(cmd)
         self.assertEqual(status, WARNINGS, "evaluateCommand didn't call log_eval_func or overrode its results")
+
+class TestLoggedRemoteCommand(unittest.TestCase):
+
+    def makeCommand(self):
+        cmd = LoggedRemoteCommand('shell', {})
+        self.output = output = []
+        cmd.addStdout = lambda data: output.append(('o', data))
+        cmd.addStderr = lambda data: output.append(('e', data))
+        cmd.addHeader = lambda data: output.append(('h', data))
+        cmd.addToLog = lambda name, data: output.append((name, data))
+        cmd.updates = {}
+        return cmd
+
+    def frame(self, kind, name, data):
+        return struct.pack(FRAME_HEADER, kind, len(name), len(data)) \
+                + name + data
+
+    def test_remoteUpdate_frames(self):
+        cmd = self.makeCommand()
+        frames = (self.frame('o', '', 'hello ') + self.frame('e', '', 'oops')
+                  + self.frame('l', 'foo', 'logdata')
+                  + self.frame('h', '', 'hdr') + self.frame('o', '', 'world'))
+        cmd.remoteUpdate({'frames': frames})
+        self.assertEqual(self.output, [('o', 'hello '), ('e', 'oops'),
+                                       ('foo', 'logdata'), ('h', 'hdr'),
+                                       ('o', 'world')])
+        self.assertEqual(cmd.updates, {})
+
+    def test_remoteUpdate_frames_z(self):
+        cmd = self.makeCommand()
+        frames = self.frame('o', '', 'x' * 10000) + self.frame('e', '', 'y')
+        cmd.remoteUpdate({'frames_z': zlib.compress(frames)})
+        self.assertEqual(self.output, [('o', 'x' * 10000), ('e', 'y')])
+
+    def test_start_offers_updateFormat(self):
+        cmd = LoggedRemoteCommand('shell', {'command': 'true'})
+        calls = []
+        class FakeRemote:
+            def callRemote(self, *args):
+                calls.append(args)
+        cmd.remote = FakeRemote()
+        cmd.commandID = "1"
+        cmd.start()
+        self.assertEqual(calls[0][4], {'command': 'true', 'update_format': 2})
+        # the command's own arguments are left alone
+        self.assertEqual(cmd.args, {'command': 'true'})
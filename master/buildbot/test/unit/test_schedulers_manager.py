@@ -0,0 +1,88 @@
+from twisted.trial import unittest
+
+from buildbot.schedulers import basic, timed, manager
+from buildbot.changes.manager import ChangeManager
+from buildbot.changes.changes import Change
+from buildbot.test.fake.fakedb import FakeDBConn
+
+class DummyMaster:
+    def __init__(self, dbconn):
+        self.db = dbconn
+
+class SchedulerManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dbc = FakeDBConn()
+        self.queries = 0
+        getChangesGreaterThan = self.dbc.getChangesGreaterThan
+        def counting(last_changeid, t):
+            self.queries += 1
+            return getChangesGreaterThan(last_changeid, t)
+        self.dbc.getChangesGreaterThan = counting
+        change_svc = ChangeManager()
+        change_svc.parent = DummyMaster(self.dbc)
+        self.sm = manager.SchedulerManager(None, self.dbc, change_svc)
+
+    def addSchedulers(self, *schedulers):
+        self.dbc.addSchedulers(schedulers)
+        for s in schedulers:
+            s.setServiceParent(self.sm)
+
+    def addChange(self, branch, files=['file']):
+        c = Change(who='me', files=files, comments='', branch=branch)
+        self.dbc.addChangeToDatabase(c)
+        return c
+
+    def classified(self, s):
+        return self.dbc.classified_changes.get(s.schedulerid, ([], []))
+
+    def test_classify_changes(self):
+        a = basic.Scheduler(name='a', branch='a', treeStableTimer=None,
+                            builderNames=['x'])
+        b = basic.Scheduler(name='b', branch='b', treeStableTimer=None,
+                            builderNames=['x'],
+                            fileIsImportant=lambda c: 'important' in c.files)
+        # it doesn't look at changes
+        n = timed.Nightly(name='n', builderNames=['x'])
+        self.addSchedulers(a, b, n)
+        self.addChange('a') # already processed
+        c1 = self.addChange('a')
+        c2 = self.addChange('b', ['important'])
+        c3 = self.addChange('b')
+
+        d = self.sm.classify_changes()
+        def check(_):
+            # the changes were loaded once, for all of the schedulers
+            self.assertEqual(self.queries, 1)
+            self.assertEqual(self.classified(a), ([c1], []))
+            self.assertEqual(self.classified(b), ([c2], [c3]))
+            self.assertEqual(self.classified(n), ([], []))
+            self.assertEqual(self.dbc.scheduler_states[a.schedulerid]
+                                                ['last_processed'], 3)
+            self.assertEqual(self.dbc.scheduler_states[b.schedulerid]
+                                                ['last_processed'], 3)
+            self.failIf(n.schedulerid in self.dbc.scheduler_states)
+        d.addCallback(check)
+        return d
+
+    def test_classify_changes_error(self):
+        def fileIsImportant(c):
+            raise ZeroDivisionError
+        bad = basic.Scheduler(name='bad', branch='a', treeStableTimer=None,
+                              builderNames=['x'],
+                              fileIsImportant=fileIsImportant)
+        good = basic.Scheduler(name='good', branch='a', treeStableTimer=None,
+                               builderNames=['x'])
+        self.addSchedulers(bad, good)
+        self.addChange('a')
+        c1 = self.addChange('a')
+
+        d = self.sm.classify_changes()
+        def check(_):
+            self.assertEqual(len(self.flushLoggedErrors(ZeroDivisionError)), 1)
+            self.assertEqual(self.classified(good), ([c1], []))
+            # it will try again next time
+            self.assertEqual(self.classified(bad), ([], []))
+            self.failIf(bad.schedulerid in self.dbc.scheduler_states)
+        d.addCallback(check)
+        return d
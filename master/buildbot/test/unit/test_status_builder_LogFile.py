@@ -0,0 +1,176 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.status import builder
+
+class FakeBuilder:
+    basedir = 'logfile_basedir'
+
+class FakeBuild:
+    builder = FakeBuilder()
+
+class FakeStep:
+    build = FakeBuild()
+
+class TestLogFile(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.isdir(FakeBuilder.basedir):
+            shutil.rmtree(FakeBuilder.basedir)
+        self.log = builder.LogFile(FakeStep(), 'stdio', '1-log-compile-stdio')
+        self.log.chunkSize = 10
+
+    def fill(self):
+        self.log.addHeader("header\n")
+        self.log.addStdout("0123456789abcdefghij")
+        self.log.addStderr("ERR")
+        self.log.addStdout("klmnop")
+
+    def test_index_written(self):
+        self.fill()
+        self.log.finish()
+        self.failUnless(os.path.exists(self.log.getIndexFilename()))
+        index = self.log.getIndex()
+        # header, two 10-byte stdout chunks, stderr, and the last stdout
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index.getTextLength(), 36)
+        self.assertEqual(index.get(1)[0], builder.STDOUT)
+        self.assertEqual(index.get(1)[2], 7)
+        self.assertEqual(index.find(0), 0)
+        self.assertEqual(index.find(17), 2)
+        self.assertEqual(index.find(36), 5)
+
+    def test_getChunks_range(self):
+        self.fill()
+        self.log.finish()
+        self.assertEqual(list(self.log.getChunks(start=5, end=12)),
+                         [(builder.HEADER, "r\n"),
+                          (builder.STDOUT, "01234")])
+        self.assertEqual("".join(self.log.getChunks(start=15, onlyText=True)),
+                         "89abcdefghijERRklmnop")
+        self.assertEqual(list(self.log.getChunks([builder.STDERR],
+                                                 start=10)),
+                         [(builder.STDERR, "ERR")])
+        self.assertEqual(list(self.log.getChunks(start=20, end=20)), [])
+
+    def test_getChunks_range_unfinished(self):
+        self.fill()
+        # the trailing "klmnop" hasn't been merged yet
+        self.assertEqual("".join(self.log.getChunks(start=30, onlyText=True)),
+                         "klmnop")
+        self.assertEqual("".join(self.log.getChunks(start=25, end=32,
+                                                    onlyText=True)),
+                         "ijERRkl")
+
+    def test_getChunks_range_matches_full(self):
+        self.fill()
+        self.log.finish()
+        full = self.log.getTextWithHeaders()
+        for start in range(len(full)):
+            for end in range(start, len(full) + 2):
+                self.assertEqual(
+                    "".join(self.log.getChunks(start=start, end=end,
+                                               onlyText=True)),
+                    full[start:end])
+
+    def test_tail(self):
+        self.fill()
+        self.assertEqual(self.log.getLength(), 36)
+        self.assertEqual(list(self.log.tail(8)),
+                         [(builder.STDERR, "RR"),
+                          (builder.STDOUT, "klmnop")])
+        self.log.finish()
+        self.assertEqual("".join(self.log.tail(100, onlyText=True)),
+                         self.log.getTextWithHeaders())
+
+    def test_no_index(self):
+        # logs written before indexes existed are scanned instead
+        self.fill()
+        self.log.finish()
+        os.unlink(self.log.getIndexFilename())
+        self.assertEqual(self.log.getIndex(), None)
+        self.assertEqual(self.log.getLength(), 36)
+        self.assertEqual("".join(self.log.getChunks(start=5, end=12,
+                                                    onlyText=True)),
+                         "r\n01234")
+        self.assertEqual("".join(self.log.tail(6, onlyText=True)), "klmnop")
+        # offsets still count all channels when only some are wanted
+        self.assertEqual(list(self.log.getChunks([builder.STDERR],
+                                                 start=10)),
+                         [(builder.STDERR, "ERR")])
+        self.assertEqual(list(self.log.tail(8, [builder.STDOUT])),
+                         [(builder.STDOUT, "klmnop")])
+
+    def test_readlines(self):
+        self.log.addHeader("header\n")
+        self.log.addStdout("line one\nline ")
+        self.log.addStderr("err\n")
+        self.log.addStdout("two is long enough to span chunks\nlast")
+        lines = self.log.readlines()
+        self.failIf(isinstance(lines, list))
+        self.assertEqual(list(lines),
+                         ["line one\n",
+                          "line two is long enough to span chunks\n",
+                          "last"])
+        self.assertEqual(list(self.log.readlines(builder.STDERR)), ["err\n"])
+        self.log.finish()
+        self.assertEqual(list(self.log.readlines([builder.STDOUT,
+                                                  builder.STDERR])),
+                         ["line one\n", "line err\n",
+                          "two is long enough to span chunks\n", "last"])
+
+    def compress(self, method):
+        self.fill()
+        self.log.finish()
+        self.log.compressMethod = method
+        self.log.compressBlockSize = 8
+        full = self.log.getTextWithHeaders()
+        d = self.log.compressLog()
+        def check(_):
+            self.failIf(os.path.exists(self.log.getFilename()))
+            f = self.log.getFile()
+            self.failUnless(isinstance(f, builder.BlockCompressedFile))
+            # reading the tail only decompresses the blocks it needs
+            decompressed = []
+            getBlock = f._getBlock
+            def tracking_getBlock(i):
+                if f.block[0] != i:
+                    decompressed.append(i)
+                return getBlock(i)
+            f._getBlock = tracking_getBlock
+            self.log.getFile = lambda: f
+            self.assertEqual("".join(self.log.tail(6, onlyText=True)),
+                             "klmnop")
+            # (the text spans the last two 8-byte blocks of the file)
+            self.assertEqual(decompressed,
+                             [len(f.offsets) - 3, len(f.offsets) - 2])
+            for start in range(0, len(full), 5):
+                self.assertEqual(
+                    "".join(self.log.getChunks(start=start, end=start + 9,
+                                               onlyText=True)),
+                    full[start:start + 9])
+            self.assertEqual("".join(self.log.getChunks(onlyText=True)),
+                             full)
+        d.addCallback(check)
+        return d
+
+    def test_compressed_bz2(self):
+        return self.compress("bz2")
+
+    def test_compressed_gz(self):
+        return self.compress("gz")
+
+    def test_compressed_in_one_piece(self):
+        # logs compressed by older versions have no block table
+        self.fill()
+        self.log.finish()
+        full = self.log.getTextWithHeaders()
+        data = open(self.log.getFilename()).read()
+        f = builder.BZ2File(self.log.getFilename() + ".bz2", "w")
+        f.write(data)
+        f.close()
+        os.unlink(self.log.getFilename())
+        self.assertEqual("".join(self.log.getChunks(start=30,
+                                                    onlyText=True)),
+                         full[30:])
@@ -0,0 +1,159 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.status import builder, ssindex
+from buildbot.sourcestamp import SourceStamp
+
+class FakeBuild:
+    def __init__(self, number, start, branch=None, revision=None):
+        self.number = number
+        self.start = start
+        self.ss = SourceStamp(branch=branch, revision=revision)
+    def getNumber(self):
+        return self.number
+    def getTimes(self):
+        return (self.start, None)
+    def getSourceStamp(self, absolute=False):
+        return self.ss
+
+class TestSourceStampIndex(unittest.TestCase):
+
+    def keys(self, index, branches=None):
+        stamps = index.getSourceStamps(branches)
+        stamps.sort(lambda x, y: cmp(x[2], y[2]))
+        return [ss.revision for key, ss, start in stamps]
+
+    def test_earliest_start(self):
+        index = ssindex.SourceStampIndex(10)
+        index.addBuild(FakeBuild(0, 100, revision='a'))
+        index.addBuild(FakeBuild(1, 200, revision='b'))
+        index.addBuild(FakeBuild(2, 300, revision='a'))
+        self.assertEqual(self.keys(index), ['a', 'b'])
+        # the most recent build of each sourcestamp is found
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), 2)
+        self.assertEqual(index.getBuildNumber((None, 'b', None)), 1)
+        self.assertEqual(index.getBuildNumber((None, 'c', None)), None)
+
+    def test_unstarted(self):
+        index = ssindex.SourceStampIndex(10)
+        index.addBuild(FakeBuild(0, None, revision='a'))
+        self.assertEqual(self.keys(index), [])
+
+    def test_bounded(self):
+        index = ssindex.SourceStampIndex(3)
+        for i, rev in enumerate('abcde'):
+            index.addBuild(FakeBuild(i, 100 + i, revision=rev))
+        self.assertEqual(self.keys(index), ['c', 'd', 'e'])
+        self.assertEqual(sorted(index.buildKeys.keys()), [2, 3, 4])
+
+    def test_bounded_per_branch(self):
+        index = ssindex.SourceStampIndex(2)
+        index.addBuild(FakeBuild(0, 100, branch='rare', revision='a'))
+        for i, rev in enumerate('bcde'):
+            index.addBuild(FakeBuild(i + 1, 200 + i, revision=rev))
+        # the busy branch doesn't push the rarely built one out
+        self.assertEqual(self.keys(index), ['a', 'd', 'e'])
+        self.assertEqual(self.keys(index, ['rare']), ['a'])
+        self.assertEqual(index.getBuildNumber(('rare', 'a', None)), 0)
+
+    def test_rebuilt_bounded(self):
+        index = ssindex.SourceStampIndex(10)
+        for i in range(1000):
+            index.addBuild(FakeBuild(i, 100 + i, revision='a'))
+            index.addBuild(FakeBuild(i + 1000, 100 + i))
+        # only a few builds of each sourcestamp are remembered..
+        for key in [(None, 'a', None), (None, None, None)]:
+            self.failUnless(len(index.entries[key].builds) <= 5)
+        self.failUnless(len(index.buildKeys) <= 10)
+        # ..but the earliest start and the latest build are kept
+        self.assertEqual(index.entries[(None, 'a', None)].getStart(), 100)
+        self.assertEqual(index.entries[(None, None, None)].getStart(), 100)
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), 999)
+        self.assertEqual(index.getBuildNumber((None, None, None)), 1999)
+
+    def test_rebuilt_filled_newest_first(self):
+        index = ssindex.SourceStampIndex(10)
+        for i in range(99, -1, -1):
+            index.addBuild(FakeBuild(i, 100 + i, revision='a'))
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), 99)
+        self.assertEqual(index.getSourceStamps()[0][2], 100)
+        self.failUnless(len(index.buildKeys) <= 5)
+
+    def test_branches(self):
+        index = ssindex.SourceStampIndex(10)
+        index.addBuild(FakeBuild(0, 100, branch='x', revision='a'))
+        index.addBuild(FakeBuild(1, 200, branch=None, revision='b'))
+        index.addBuild(FakeBuild(2, 300, branch='y', revision='c'))
+        self.assertEqual(self.keys(index, ['x']), ['a'])
+        self.assertEqual(self.keys(index, [None, 'y']), ['b', 'c'])
+
+    def test_rekey(self):
+        # a build's absolute sourcestamp changes when it learns its
+        # got_revision
+        index = ssindex.SourceStampIndex(10)
+        b = FakeBuild(0, 100)
+        index.addBuild(b)
+        self.assertEqual(self.keys(index), [None])
+        b.ss = SourceStamp(revision='a')
+        index.addBuild(b)
+        self.assertEqual(self.keys(index), ['a'])
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), 0)
+
+class TestBuilderStatusIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('ssindex_basedir')
+        if os.path.isdir(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.bs = builder.BuilderStatus('bldr')
+        self.bs.basedir = self.basedir
+        self.bs.nextBuildNumber = 0
+        self.bs.buildHorizon = None
+        self.bs.logHorizon = None
+
+    def tearDown(self):
+        self.bs.getSummaryStore().close()
+
+    def makeBuild(self, revision, finish=True):
+        b = self.bs.newBuild()
+        b.setSourceStamp(SourceStamp(revision=revision))
+        b.buildStarted(None)
+        if finish:
+            b.buildFinished()
+        return b
+
+    def test_fill_and_update(self):
+        for rev in ['a', 'b', 'a']:
+            self.makeBuild(rev)
+        self.bs.buildCache.clear()
+        index = self.bs.getSourceStampIndex()
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), 2)
+        self.assertEqual(index.getBuildNumber((None, 'b', None)), 1)
+
+        b = self.makeBuild(None, finish=False)
+        self.assertEqual(index.getBuildNumber((None, None, None)), 3)
+        b.setProperty('got_revision', 'c', 'test')
+        b.buildFinished()
+        self.assertEqual(index.getBuildNumber((None, None, None)), None)
+        self.assertEqual(index.getBuildNumber((None, 'c', None)), 3)
+
+    def test_fill_bounded(self):
+        self.bs.sourceStampIndexSize = 2
+        for rev in ['a', 'b', 'c', 'd']:
+            self.makeBuild(rev)
+        self.bs.buildCache.clear()
+        loaded = []
+        getBuild = self.bs.getBuild
+        def tracking_getBuild(number):
+            loaded.append(number)
+            return getBuild(number)
+        self.bs.getBuild = tracking_getBuild
+        index = self.bs.getSourceStampIndex()
+        # the index is filled from the build summaries, without loading
+        # any builds
+        self.assertEqual(loaded, [])
+        self.assertEqual(index.getBuildNumber((None, 'a', None)), None)
+        self.assertEqual(index.getBuildNumber((None, 'c', None)), 2)
+        self.assertEqual(index.getBuildNumber((None, 'd', None)), 3)
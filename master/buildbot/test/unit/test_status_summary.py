@@ -0,0 +1,108 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.status import builder, summary
+from buildbot.sourcestamp import SourceStamp
+
+class TestBuildSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('summary_basedir')
+        if os.path.isdir(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.bs = builder.BuilderStatus('bldr')
+        self.bs.basedir = self.basedir
+        self.bs.nextBuildNumber = 0
+        self.bs.buildHorizon = None
+        self.bs.logHorizon = None
+
+    def tearDown(self):
+        self.bs.getSummaryStore().close()
+
+    def makeBuild(self, branch=None, results=builder.SUCCESS):
+        b = self.bs.newBuild()
+        b.setSourceStamp(SourceStamp(branch=branch, revision='r%d' % b.number))
+        b.setSlavename('slave1')
+        b.setText(['build', str(b.number)])
+        b.setReason('because')
+        b.setProperty('got_revision', 'got%d' % b.number, 'test')
+        b.buildStarted(None)
+        b.setResults(results)
+        b.buildFinished()
+        return b
+
+    def test_store_roundtrip(self):
+        b = self.makeBuild(branch='br')
+        s = self.bs.getSummaryStore().getSummary(self.bs, 0)
+        self.assertEqual(s.getNumber(), 0)
+        self.assertEqual(s.getBranch(), 'br')
+        self.assertEqual(s.getRevision(), 'r0')
+        self.assertEqual(s.getGotRevision(), 'got0')
+        self.assertEqual(s.getSlavename(), 'slave1')
+        self.assertEqual(s.getText(), ['build', '0'])
+        self.assertEqual(s.getResults(), builder.SUCCESS)
+        self.assertEqual(s.getReason(), 'because')
+        self.assertEqual(s.getTimes(), b.getTimes())
+        self.failUnless(s.isFinished())
+        self.assertEqual(s.getSourceStamp().revision, 'r0')
+        ss = s.getSourceStamp(absolute=True)
+        self.assertEqual((ss.branch, ss.revision), ('br', 'got0'))
+
+    def test_getSummaries_filters(self):
+        for br in ['a', 'b', None, 'a']:
+            self.makeBuild(branch=br)
+        store = self.bs.getSummaryStore()
+        self.assertEqual([s.number for s in store.getSummaries(self.bs)],
+                         [3, 2, 1, 0])
+        self.assertEqual([s.number for s in
+                          store.getSummaries(self.bs, branches=['a'])],
+                         [3, 0])
+        self.assertEqual([s.number for s in
+                          store.getSummaries(self.bs, branches=[None, 'b'])],
+                         [2, 1])
+        self.assertEqual([s.number for s in
+                          store.getSummaries(self.bs, max_buildnum=2,
+                                             min_buildnum=1)],
+                         [2, 1])
+        self.assertEqual([s.number for s in
+                          store.getSummaries(self.bs, limit=1)],
+                         [3])
+
+    def test_generateFinishedBuilds_loads_only_matches(self):
+        for br in ['a', 'b', 'b', 'a']:
+            self.makeBuild(branch=br)
+        loaded = []
+        getBuild = self.bs.getBuild
+        def tracking_getBuild(number):
+            loaded.append(number)
+            return getBuild(number)
+        self.bs.getBuild = tracking_getBuild
+        self.bs.buildCache.clear()
+        builds = list(self.bs.generateFinishedBuilds(branches=['a']))
+        self.assertEqual([b.getNumber() for b in builds], [3, 0])
+        self.assertEqual(loaded, [3, 0])
+
+    def test_backfill(self):
+        # builds saved before summaries existed are summarized on demand
+        self.makeBuild(branch='a')
+        self.bs.getSummaryStore().pruneBefore(1)
+        self.bs.buildCache.clear()
+        self.assertEqual(self.bs.getSummaryStore().getSummary(self.bs, 0),
+                         None)
+        s = self.bs.getBuildSummary(0)
+        self.assertEqual(s.getBranch(), 'a')
+        self.assertEqual(
+            self.bs.getSummaryStore().getSummary(self.bs, 0).getBranch(), 'a')
+
+    def test_generateBuildSummaries_current_build(self):
+        self.makeBuild()
+        b = self.bs.newBuild()
+        b.setSourceStamp(SourceStamp())
+        b.buildStarted(None)
+        summaries = list(self.bs.generateBuildSummaries())
+        self.assertEqual([s.getNumber() for s in summaries], [1, 0])
+        self.failIf(summaries[0].isFinished())
+        self.failUnless(summaries[1].isFinished())
+        self.failUnless(isinstance(summaries[1], summary.BuildSummary))
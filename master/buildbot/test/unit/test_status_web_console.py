@@ -0,0 +1,115 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.status import builder
+from buildbot.status.web import console
+from buildbot.sourcestamp import SourceStamp
+
+class FakeStatus:
+    def __init__(self, bs):
+        self.bs = bs
+        self.watchers = []
+    def getBuilder(self, name):
+        return self.bs
+    def getBuilderNames(self):
+        return ['bldr']
+    def subscribe(self, receiver):
+        self.watchers.append(receiver)
+        self.bs.watchers.append(receiver.builderAdded('bldr', self.bs))
+    def unsubscribe(self, receiver):
+        self.watchers.remove(receiver)
+    def _builder_unsubscribe(self, name, receiver):
+        pass
+
+class TestConsoleMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('console_basedir')
+        if os.path.isdir(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.bs = builder.BuilderStatus('bldr')
+        self.bs.basedir = self.basedir
+        self.bs.nextBuildNumber = 0
+        self.bs.buildHorizon = None
+        self.bs.logHorizon = None
+        self.matrix = console.ConsoleMatrix(
+                console.IntegerRevisionComparator())
+        self.bs.status = FakeStatus(self.bs)
+        self.matrix.subscribe(self.bs.status)
+
+    def tearDown(self):
+        self.bs.getSummaryStore().close()
+
+    def makeBuild(self, revision, results=builder.SUCCESS, finish=True):
+        b = self.bs.newBuild()
+        b.setSourceStamp(SourceStamp(revision=revision))
+        b.buildStarted(None)
+        if finish:
+            self.finishBuild(b, results)
+        return b
+
+    def finishBuild(self, b, results=builder.SUCCESS):
+        b.setResults(results)
+        b.buildFinished()
+
+    def revisions(self):
+        return [(b.revision, b.number)
+                for b in self.matrix.getBuilds('bldr')]
+
+    def test_fill_ordered_by_revision(self):
+        # a forced build of an older revision
+        for rev in ['3', '1', '2', '3']:
+            self.makeBuild(rev)
+        self.bs.buildCache.clear()
+        loaded = []
+        getBuild = self.bs.getBuild
+        def tracking_getBuild(number):
+            loaded.append(number)
+            return getBuild(number)
+        self.bs.getBuild = tracking_getBuild
+        self.assertEqual(self.revisions(),
+                         [('3', 3), ('3', 0), ('2', 2), ('1', 1)])
+        self.assertEqual(loaded, [])
+
+    def test_updated_by_builds(self):
+        self.makeBuild('1')
+        self.assertEqual(self.revisions(), [('1', 0)])
+
+        b = self.makeBuild(None, finish=False)
+        # not shown until it knows its revision
+        self.assertEqual(self.revisions(), [('1', 0)])
+        b.setProperty('got_revision', '2', 'test')
+        self.assertEqual(self.revisions(), [('2', 1), ('1', 0)])
+        self.failIf(self.matrix.getBuilds('bldr')[0].isFinished)
+
+        self.finishBuild(b, builder.FAILURE)
+        devBuild = self.matrix.getBuilds('bldr')[0]
+        self.failUnless(devBuild.isFinished)
+        self.assertEqual(devBuild.results, builder.FAILURE)
+        self.assertEqual(self.matrix.getDetails('bldr', devBuild), {})
+        self.assertEqual(self.matrix.getLastResults('bldr'), builder.FAILURE)
+
+    def test_bounded(self):
+        self.matrix.maxRevisions = 2
+        for rev in ['1', '2', '2', '3']:
+            self.makeBuild(rev)
+        self.assertEqual(self.revisions(), [('3', 3), ('2', 2), ('2', 1)])
+        self.makeBuild('4')
+        self.assertEqual(self.revisions(), [('4', 4), ('3', 3)])
+
+    def test_invalid_revisions_ignored(self):
+        self.makeBuild('abc')
+        self.makeBuild('1')
+        self.assertEqual(self.revisions(), [('1', 1)])
+        self.assertEqual(self.matrix.getLastResults('bldr'), builder.SUCCESS)
+
+    def test_unsubscribe(self):
+        status = self.matrix.status
+        self.makeBuild('1')
+        self.assertEqual(self.revisions(), [('1', 0)])
+        self.matrix.unsubscribe()
+        self.assertEqual(status.watchers, [])
+        self.assertEqual(self.bs.watchers, [])
+        self.assertEqual(self.matrix.builds, {})
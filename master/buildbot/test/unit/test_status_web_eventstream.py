@@ -0,0 +1,171 @@
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.web import server
+
+from buildbot.status.web import eventstream
+from buildbot.util import json
+
+class FakeStatus:
+    def __init__(self):
+        self.watchers = []
+    def subscribe(self, target):
+        self.watchers.append(target)
+
+class FakeService:
+    def __init__(self, status):
+        self.status = status
+    def getStatus(self):
+        return self.status
+
+class FakeSite:
+    def __init__(self, status):
+        self.buildbot_service = FakeService(status)
+
+class FakeRequest:
+    def __init__(self, status, args={}):
+        self.args = args
+        self.site = FakeSite(status)
+        self.headers = {}
+        self.producer = None
+        self.written = []
+        self.finished = False
+        self.finishDeferred = defer.Deferred()
+    def setHeader(self, name, value):
+        self.headers[name.lower()] = value
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+    def unregisterProducer(self):
+        self.producer = None
+    def notifyFinish(self):
+        return self.finishDeferred
+    def write(self, data):
+        if data:
+            self.written.append(json.loads(data))
+    def finish(self):
+        self.finished = True
+
+class FakeBuilder:
+    def __init__(self, name, category=None):
+        self.name = name
+        self.category = category
+    def getName(self):
+        return self.name
+    def getCategory(self):
+        return self.category
+
+class FakeBuild:
+    def __init__(self, builder, number):
+        self.builder = builder
+        self.number = number
+    def getBuilder(self):
+        return self.builder
+    def getNumber(self):
+        return self.number
+    def getReason(self):
+        return 'forced'
+    def getSlavename(self):
+        return 'slave1'
+    def getTimes(self):
+        return (100, 200)
+    def getText(self):
+        return ['build', 'successful']
+
+class FakeStep:
+    def getName(self):
+        return 'compile'
+    def getText(self):
+        return ['compile']
+
+class FakeLog:
+    def getName(self):
+        return 'stdio'
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.status = FakeStatus()
+        self.resource = eventstream.EventStreamResource(maxBufferSize=200)
+        self.hub = self.resource.hub
+        self.linux = FakeBuilder('linux', 'unix')
+        self.win = FakeBuilder('win', 'windows')
+
+    def connect(self, **args):
+        request = FakeRequest(self.status, args)
+        self.assertEqual(self.resource.render_GET(request),
+                         server.NOT_DONE_YET)
+        return request
+
+    def test_filters(self):
+        everything = self.connect()
+        linux = self.connect(builder=['linux'])
+        windows = self.connect(category=['windows'])
+        finished = self.connect(event=['buildFinished'])
+        # the status is subscribed to once
+        self.assertEqual(self.status.watchers, [self.hub])
+
+        build = FakeBuild(self.linux, 3)
+        self.assertEqual(self.hub.buildStarted('linux', build), self.hub)
+        self.hub.buildFinished('linux', build, 0)
+        self.hub.buildFinished('win', FakeBuild(self.win, 4), 0)
+
+        self.assertEqual([(e['event'], e['builder'], e['number'])
+                          for e in everything.written],
+                         [('buildStarted', 'linux', 3),
+                          ('buildFinished', 'linux', 3),
+                          ('buildFinished', 'win', 4)])
+        self.assertEqual(len(linux.written), 2)
+        self.assertEqual([e['builder'] for e in windows.written], ['win'])
+        self.assertEqual([e['event'] for e in finished.written],
+                         ['buildFinished', 'buildFinished'])
+
+    def test_logChunk(self):
+        request = self.connect()
+        build = FakeBuild(self.linux, 3)
+        step = FakeStep()
+        # nobody wants the logs yet, but they are subscribed to anyway
+        self.assertEqual(self.hub.stepStarted(build, step), self.hub)
+        self.assertEqual(self.hub.logStarted(build, step, FakeLog()),
+                         self.hub)
+        self.hub.logChunk(build, step, FakeLog(), 0, 'before\n')
+
+        # a client that connects in the middle of the log gets the rest
+        logs = self.connect(event=['logChunk'])
+        self.hub.logChunk(build, step, FakeLog(), 0, 'hello\n')
+        self.assertEqual(request.written, [])
+        self.assertEqual(logs.written,
+                         [dict(event='logChunk', builder='linux', number=3,
+                               step='compile', log='stdio', channel=0,
+                               text='hello\n')])
+
+    def test_slow_client(self):
+        request = self.connect()
+        client = request.producer
+        build = FakeBuild(self.linux, 3)
+        client.pauseProducing()
+        self.hub.buildFinished('linux', build, 0)
+        self.assertEqual(request.written, [])
+        client.resumeProducing()
+        self.assertEqual(len(request.written), 1)
+
+        client.pauseProducing()
+        self.hub.buildFinished('linux', build, 0)
+        self.failIf(request.finished)
+        self.hub.buildFinished('linux', build, 0)
+        # too far behind
+        self.failUnless(request.finished)
+        self.assertEqual(self.hub.clients, [])
+
+    def test_disconnect(self):
+        request = self.connect()
+        request.finishDeferred.errback(Exception('connection lost'))
+        self.assertEqual(self.hub.clients, [])
+
+    def test_connect_during_build(self):
+        build = FakeBuild(self.linux, 3)
+        # nobody is listening when the build starts, but its steps must
+        # still be heard about by clients that connect later
+        self.assertEqual(self.hub.buildStarted('linux', build), self.hub)
+        request = self.connect()
+        self.hub.stepFinished(build, FakeStep(), (0, []))
+        self.assertEqual([(e['event'], e['step']) for e in request.written],
+                         [('stepFinished', 'compile')])
@@ -0,0 +1,173 @@
+import os
+import shutil
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.web import http, server
+
+from buildbot.status import builder
+from buildbot.status.web import status_json
+from buildbot.sourcestamp import SourceStamp
+from buildbot.util import json
+
+class FakeRequest:
+    def __init__(self, args={}, headers={}):
+        self.args = dict(args)
+        self.headers = headers
+        self.responseHeaders = {}
+        self.code = http.OK
+        self.path = '/json/thing'
+        self.prepath = ['json', 'thing']
+        self.postpath = []
+        self.producer = None
+        self.written = []
+        self.finished = False
+    def getHeader(self, name):
+        return self.headers.get(name.lower())
+    def setHeader(self, name, value):
+        self.responseHeaders[name.lower()] = value
+    def setResponseCode(self, code):
+        self.code = code
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+    def unregisterProducer(self):
+        self.producer = None
+    def notifyFinish(self):
+        return defer.Deferred()
+    def write(self, data):
+        self.written.append(data)
+    def finish(self):
+        self.finished = True
+
+class FakeStatus:
+    def __init__(self, finished=True):
+        self.finished = finished
+        self.asDictCalls = 0
+        self.version = 0
+    def isFinished(self):
+        return self.finished
+    def asDict(self):
+        self.asDictCalls += 1
+        return {'name': 'x', 'text': [], 'results': 0}
+
+class ThingJsonResource(status_json.JsonResource):
+    def __init__(self, thing):
+        status_json.JsonResource.__init__(self, None)
+        self.thing = thing
+    def asDict(self, request):
+        return status_json.FinishedAsDict(self.thing, self.thing.version)
+    def getVersion(self, request):
+        return self.thing.version
+
+class TestEncodeJson(unittest.TestCase):
+
+    def test_fragments(self):
+        thing = FakeStatus()
+        frag = status_json.FinishedAsDict(thing)
+        self.failUnless(status_json.FinishedAsDict(thing) is frag)
+        self.assertEqual(thing.asDictCalls, 1)
+
+        data = {'b': [frag, 1], 'a': frag}
+        plain = {'b': [thing.asDict(), 1], 'a': thing.asDict()}
+        self.assertEqual(status_json.EncodeJson(data),
+                         json.dumps(plain, sort_keys=True,
+                                    separators=(',',':')))
+        self.assertEqual(status_json.EncodeJson(frag, filtered=True),
+                         '{"name":"x"}')
+        self.assertEqual(sorted(frag.encoded.keys()), [False, True])
+        self.assertEqual(json.loads(status_json.EncodeJson(data, False)),
+                         json.loads(json.dumps(plain)))
+
+    def test_fragment_version(self):
+        thing = FakeStatus()
+        frag = status_json.FinishedAsDict(thing, 1)
+        self.failUnless(status_json.FinishedAsDict(thing, 1) is frag)
+        # e.g. properties were set on the build after it finished
+        frag2 = status_json.FinishedAsDict(thing, 2)
+        self.failIf(frag2 is frag)
+        self.assertEqual(thing.asDictCalls, 2)
+        self.failUnless(status_json.FinishedAsDict(thing, 2) is frag2)
+
+    def test_running_not_cached(self):
+        thing = FakeStatus(finished=False)
+        self.failIf(isinstance(status_json.FinishedAsDict(thing),
+                               status_json.JsonFragment))
+
+class TestJsonResource(unittest.TestCase):
+
+    def test_etag(self):
+        thing = FakeStatus()
+        res = ThingJsonResource(thing)
+        request = FakeRequest()
+        body = res.render_GET(request)
+        self.assertEqual(json.loads(body), thing.asDict())
+        etag = request.responseHeaders['etag']
+
+        request = FakeRequest(headers={'if-none-match': etag})
+        self.assertEqual(res.render_GET(request), '')
+        self.assertEqual(request.code, http.NOT_MODIFIED)
+
+        # a different representation
+        request = FakeRequest(args={'filter': ['1']},
+                              headers={'if-none-match': etag})
+        self.assertNotEqual(res.render_GET(request), '')
+        self.assertNotEqual(request.responseHeaders['etag'], etag)
+
+        thing.version += 1
+        request = FakeRequest(headers={'if-none-match': etag})
+        self.assertNotEqual(res.render_GET(request), '')
+        self.assertEqual(request.code, http.OK)
+
+    def test_no_version_no_etag(self):
+        res = ThingJsonResource(FakeStatus())
+        res.thing.version = None
+        request = FakeRequest()
+        res.render_GET(request)
+        self.failIf('etag' in request.responseHeaders)
+
+    def test_select_streamed(self):
+        root = status_json.JsonResource(None)
+        things = [FakeStatus(), FakeStatus()]
+        root.putChild('a', ThingJsonResource(things[0]))
+        root.putChild('b', ThingJsonResource(things[1]))
+        request = FakeRequest(args={'select': ['b', 'a']})
+        self.assertEqual(root.render_GET(request), server.NOT_DONE_YET)
+        while request.producer:
+            request.producer.resumeProducing()
+        self.failUnless(request.finished)
+        self.assertEqual(len(request.written), 3)
+        self.assertEqual(json.loads(''.join(request.written)),
+                         {'a': things[0].asDict(), 'b': things[1].asDict()})
+        self.failUnless('etag' in request.responseHeaders)
+
+class TestStatusVersions(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('json_basedir')
+        if os.path.isdir(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.bs = builder.BuilderStatus('bldr')
+        self.bs.basedir = self.basedir
+        self.bs.nextBuildNumber = 0
+        self.bs.buildHorizon = None
+        self.bs.logHorizon = None
+
+    def tearDown(self):
+        self.bs.getSummaryStore().close()
+
+    def test_versions(self):
+        v = self.bs.getStatusVersion()
+        b = self.bs.newBuild()
+        b.setSourceStamp(SourceStamp())
+        b.buildStarted(None)
+        self.failUnless(self.bs.getStatusVersion() > v)
+
+        v = b.getStatusVersion()
+        step = b.addStepWithName('compile')
+        step.stepStarted()
+        step.setText(['compiling'])
+        self.failUnless(b.getStatusVersion() > v)
+
+        v = self.bs.getStatusVersion()
+        b.buildFinished()
+        self.failUnless(self.bs.getStatusVersion() > v)
@@ -0,0 +1,176 @@
+from twisted.trial import unittest
+
+from buildbot.status import builder
+from buildbot.status.web import waterfall
+
+def mkevent(start, text):
+    e = builder.Event()
+    e.started = start
+    e.finished = start + 1
+    e.text = [text]
+    return e
+
+class FakeSource:
+    def __init__(self, name, events=[]):
+        self.name = name
+        self.events = list(events) # oldest first
+        self.pulled = 0
+    def getName(self):
+        return self.name
+    def getEvent(self, number):
+        try:
+            return self.events[number]
+        except IndexError:
+            return None
+    def eventGenerator(self, branches=[], categories=[], committers=[],
+                       minTime=0):
+        for i in range(len(self.events) - 1, -1, -1):
+            self.pulled += 1
+            yield self.events[i]
+
+def texts(row):
+    return [[e.getText() for e in cell if e.getText()] for cell in row]
+
+class TestEventTimeline(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = FakeSource('changes')
+        self.b1 = FakeSource('b1', [mkevent(100, 'a'), mkevent(300, 'c')])
+        self.b2 = FakeSource('b2', [mkevent(200, 'b')])
+        self.sources = [self.changes, self.b1, self.b2]
+
+    def makeTimeline(self):
+        return waterfall.EventTimeline(self.sources, [], [], [], True, 0)
+
+    def test_getPage(self):
+        t = self.makeTimeline()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps, [300, 200, 100])
+        self.assertEqual([texts(row) for row in grid],
+                         [[[], [['c']], []],
+                          [[], [], [['b']]],
+                          [[], [['a']], []]])
+        self.assertEqual(sourceEvents, [None, None, None])
+
+    def test_getPage_slices(self):
+        t = self.makeTimeline()
+        timestamps, grid, sourceEvents = t.getPage(250, 0, 0)
+        self.assertEqual(timestamps, [200])
+        # the next older event of b1 (the gap before 'c') is used to fill
+        # its column
+        self.failUnless(isinstance(sourceEvents[1], waterfall.Spacer))
+        self.assertEqual(sourceEvents[1].getTimes(), (101, 300))
+        # only as much was gathered as the page needed
+        self.assertEqual(t.timestamps, [300, 200])
+
+    def test_refresh_keeps_old_rows(self):
+        t = self.makeTimeline()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.b2.events.append(mkevent(400, 'd'))
+        self.b2.pulled = 0
+        t.markDirty(400)
+        t.refresh()
+        timestamps2, grid2, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps2, [400, 300, 200, 100])
+        self.assertEqual(texts(grid2[0]), [[], [], [['d']]])
+        # the older rows were not regenerated..
+        for old, new in zip(grid[1:], grid2[2:]):
+            self.failUnless(old is new)
+        # ..and the new event's source was only read back to the cutoff
+        self.assertEqual(self.b2.pulled, 2)
+
+    def test_refresh_straddling_row(self):
+        self.b2.events = [mkevent(295, 'b')]
+        t = self.makeTimeline()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps, [295, 100])
+        # the first row has events on both sides of the dirty time
+        t.markDirty(298)
+        t.refresh()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps, [295, 100])
+        self.assertEqual(texts(grid[0]), [[], [['c']], [['b']]])
+
+    def test_refresh_notices_builder_events(self):
+        t = self.makeTimeline()
+        t.getPage(1000, 0, 200)
+        # builders add events without any notification
+        self.b1.events.append(mkevent(400, 'd'))
+        t.refresh()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps, [400, 300, 200, 100])
+
+    def test_refresh_beyond_gathered(self):
+        t = self.makeTimeline()
+        t.getPage(1000, 0, 0)
+        self.assertEqual(t.timestamps, [300])
+        self.b2.events.insert(0, mkevent(50, 'z'))
+        t.markDirty(50)
+        t.refresh()
+        timestamps, grid, sourceEvents = t.getPage(1000, 0, 200)
+        self.assertEqual(timestamps, [300, 200, 100, 50])
+
+class FakeStatus:
+    def __init__(self, builders):
+        self.builders = builders
+        self.watchers = []
+    def getBuilderNames(self):
+        return [b.getName() for b in self.builders]
+    def getBuilder(self, name):
+        for b in self.builders:
+            if b.getName() == name:
+                return b
+    def subscribe(self, receiver):
+        self.watchers.append(receiver)
+        for b in self.builders:
+            b.watchers.append(receiver.builderAdded(b.getName(), b))
+    def unsubscribe(self, receiver):
+        self.watchers.remove(receiver)
+
+class FakeBuilder(FakeSource):
+    def __init__(self, name):
+        FakeSource.__init__(self, name)
+        self.watchers = []
+    def unsubscribe(self, receiver):
+        self.watchers.remove(receiver)
+
+class FakeBuild:
+    def __init__(self, start):
+        self.start = start
+    def getTimes(self):
+        return (self.start, None)
+
+class TestEventTimelineCache(unittest.TestCase):
+
+    def test_shared_and_invalidated(self):
+        cache = waterfall.EventTimelineCache()
+        sources = [FakeSource('changes'), FakeSource('b1')]
+        t = cache.getTimeline(sources, [], [], [], False, 0)
+        self.failUnless(cache.getTimeline(sources, [], [], [], False, 0) is t)
+        self.failIf(cache.getTimeline(sources, ['br'], [], [], False, 0) is t)
+
+        self.assertEqual(cache.buildStarted('b1', FakeBuild(123)), cache)
+        cache.stepStarted(FakeBuild(100), None)
+        self.assertEqual(t.dirtyTime, 100)
+
+    def test_evict(self):
+        cache = waterfall.EventTimelineCache()
+        cache.maxTimelines = 2
+        sources = [FakeSource('changes'), FakeSource('b1')]
+        for br in 'abc':
+            cache.getTimeline(sources, [br], [], [], False, 0)
+        self.assertEqual(len(cache.timelines), 2)
+
+    def test_unsubscribe(self):
+        cache = waterfall.EventTimelineCache()
+        b1 = FakeBuilder('b1')
+        status = FakeStatus([b1])
+        cache.subscribe(status)
+        self.assertEqual(b1.watchers, [cache])
+        cache.getTimeline([FakeSource('changes'), b1], [], [], [], False, 0)
+        cache.unsubscribe()
+        self.assertEqual(status.watchers, [])
+        self.assertEqual(b1.watchers, [])
+        self.assertEqual(cache.timelines, {})
+        # unsubscribing twice is harmless
+        cache.unsubscribe()
@@ -1,4 +1,9 @@
 import tempfile, os
+from StringIO import StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 from twisted.trial import unittest
 
 from mock import Mock
@@ -6,7 +11,7 @@ from mock import Mock
 from buildbot.process.properties import Properties
 from buildbot.util import json
 from buildbot.steps.transfer import StringDownload, JSONStringDownload, JSONPropertiesDownload, \
-    FileUpload
+    FileUpload, _FileWriter, _FileReader
 
 class TestFileUpload(unittest.TestCase):
     def setUp(self):
@@ -21,7 +26,7 @@ class TestFileUpload(unittest.TestCase):
         s = FileUpload(slavesrc=__file__, masterdest=self.destfile)
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.12"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -46,12 +51,130 @@ class TestFileUpload(unittest.TestCase):
         self.assertEquals(open(self.destfile, "rb").read(),
                 open(__file__, "rb").read())
 
+    def testWindowedArgs(self):
+        s = FileUpload(slavesrc=__file__, masterdest=self.destfile,
+                       window=4, resume=True)
+        s.build = Mock()
+        s.build.getProperties.return_value = Properties()
+        s.build.getSlaveCommandVersion.return_value = "2.13"
+
+        s.step_status = Mock()
+        s.buildslave = Mock()
+        s.remote = Mock()
+
+        s.start()
+
+        for c in s.remote.method_calls:
+            name, command, args = c
+            commandName = command[3]
+            kwargs = command[-1]
+            if commandName == 'uploadFile':
+                self.assertEquals(kwargs['window'], 4)
+                self.assertEquals(kwargs['resume'], True)
+                writer = kwargs['writer']
+                self.assertEquals(writer.remote_resume(),
+                                  (0, md5("").hexdigest()))
+                data = open(__file__, "rb").read()
+                writer.remote_write(data, 0)
+                writer.remote_close(md5(data).hexdigest())
+                break
+        else:
+            self.assert_(False, "No uploadFile command found")
+
+        self.assertEquals(open(self.destfile, "rb").read(),
+                open(__file__, "rb").read())
+
+class TestFileWriter(unittest.TestCase):
+    def setUp(self):
+        fd, self.destfile = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.destfile)
+
+    def tearDown(self):
+        for f in self.destfile, self.destfile + ".partial":
+            if os.path.exists(f):
+                os.unlink(f)
+
+    def testChecksumMismatch(self):
+        w = _FileWriter(self.destfile, None, None)
+        w.remote_write("some data", 0)
+        self.assertRaises(ValueError, w.remote_close, md5("other").hexdigest())
+        self.failIf(os.path.exists(self.destfile))
+
+    def testResume(self):
+        w = _FileWriter(self.destfile, None, None, resume=True)
+        w.remote_write("0123456789", 0)
+        w.remote_write("abcdef", 10)
+        # the connection is lost: the partial file is kept
+        del w
+        self.failIf(os.path.exists(self.destfile))
+        self.assertEquals(open(self.destfile + ".partial").read(),
+                          "0123456789abcdef")
+
+        w = _FileWriter(self.destfile, None, None, resume=True)
+        self.assertEquals(w.remote_resume(),
+                          (16, md5("0123456789abcdef").hexdigest()))
+        w.remote_write("ghij", 16)
+        w.remote_close(md5("0123456789abcdefghij").hexdigest())
+        self.assertEquals(open(self.destfile).read(), "0123456789abcdefghij")
+        self.failIf(os.path.exists(self.destfile + ".partial"))
+
+    def testResumeChanged(self):
+        w = _FileWriter(self.destfile, None, None, resume=True)
+        w.remote_write("0123456789", 0)
+        del w
+
+        # the file has changed since: the slave sees that the checksum
+        # doesn't match, and starts over
+        w = _FileWriter(self.destfile, None, None, resume=True)
+        self.assertEquals(w.remote_resume(),
+                          (10, md5("0123456789").hexdigest()))
+        w.remote_write("", 0)
+        w.remote_write("abc", 0)
+        w.remote_close(md5("abc").hexdigest())
+        self.assertEquals(open(self.destfile).read(), "abc")
+
+    def testRewind(self):
+        w = _FileWriter(self.destfile, 12, None)
+        w.remote_write("0123456789", 0)
+        # the slave starts over from an earlier offset
+        w.remote_write("xyzXYZ", 6)
+        w.remote_close(md5("012345xyzXYZ").hexdigest())
+        self.assertEquals(open(self.destfile).read(), "012345xyzXYZ")
+
+class TestFileReader(unittest.TestCase):
+    def testOffsets(self):
+        r = _FileReader(StringIO("0123456789" * 3))
+        # reads may be pipelined, and resumed from an offset
+        self.assertEquals(r.remote_read(10, 5), "5678901234")
+        self.assertEquals(r.remote_read(10, 15), "5678901234")
+        self.assertEquals(r.remote_read(10, 25), "56789")
+        self.assertEquals(r.remote_read(10, 35), "")
+        self.assertEquals(r.remote_close(),
+                          md5("0123456789" * 3).hexdigest())
+
+    def testChecksum(self):
+        r = _FileReader(StringIO("0123456789" * 3))
+        # the slave checks the start of its partial file before resuming
+        self.assertEquals(r.remote_checksum(10), md5("0123456789").hexdigest())
+        self.assertEquals(r.remote_read(10, 10), "0123456789")
+        self.assertEquals(r.remote_close(),
+                          md5("0123456789" * 2).hexdigest())
+        r = _FileReader(StringIO("short"))
+        self.assertEquals(r.remote_checksum(10), None)
+
+    def testSequential(self):
+        r = _FileReader(StringIO("hello world"))
+        self.assertEquals(r.remote_read(6), "hello ")
+        self.assertEquals(r.remote_read(6), "world")
+        self.assertEquals(r.remote_close(), md5("hello world").hexdigest())
+
 class TestStringDownload(unittest.TestCase):
     def testBasic(self):
         s = StringDownload("Hello World", "hello.txt")
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.12"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -78,7 +201,7 @@ class TestJSONStringDownload(unittest.TestCase):
         s = JSONStringDownload(msg, "hello.json")
         s.build = Mock()
         s.build.getProperties.return_value = Properties()
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.12"
 
         s.step_status = Mock()
         s.buildslave = Mock()
@@ -106,7 +229,7 @@ class TestJSONPropertiesDownload(unittest.TestCase):
         props = Properties()
         props.setProperty('key1', 'value1', 'test')
         s.build.getProperties.return_value = props
-        s.build.getSlaveCommandVersion.return_value = 1
+        s.build.getSlaveCommandVersion.return_value = "2.12"
         ss = Mock()
         ss.asDict.return_value = dict(revision="12345")
         s.build.getSourceStamp.return_value = ss
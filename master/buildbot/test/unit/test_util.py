@@ -1,4 +1,5 @@
 from twisted.trial import unittest
+from twisted.internet import defer
 
 from buildbot import util
 
@@ -145,6 +146,92 @@ class LRUCache(unittest.TestCase):
         self.lru.add("x", self.x)
         self.assertEqual(self.lru.get("z"), 0)
 
+    def test_counters(self):
+        self.lru.add("a", self.a)
+        self.lru.get("a")
+        self.lru.get("b")
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.add("y", self.y)
+        self.assertEqual((self.lru.hits, self.lru.misses, self.lru.evictions),
+                         (1, 1, 1))
+
+    def test_keys_order(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.get("a")
+        self.assertEqual(self.lru.keys(), ["b", "x", "a"])
+        self.assertEqual(len(self.lru), 3)
+        self.assertTrue("b" in self.lru)
+
+    def test_setMaxSize_shrink(self):
+        self.lru.add("a", self.a)
+        self.lru.add("b", self.b)
+        self.lru.add("x", self.x)
+        self.lru.setMaxSize(1)
+        self.assertEqual(self.lru.keys(), ["x"])
+
+    def test_weight(self):
+        lru = util.LRUCache(max_size=100, max_weight=7, weigh=len)
+        lru.add("a", self.a)
+        lru.add("b", self.b)
+        self.assertEqual(lru.getWeight(), 6)
+        lru.add("c", "C")
+        self.assertEqual(lru.keys(), ["a", "b", "c"])
+        lru.add("d", "D")
+        self.assertEqual(lru.keys(), ["b", "c", "d"])
+        self.assertEqual(lru.getWeight(), 5)
+        # a single item that is too heavy is still kept
+        lru.add("big", "x" * 20)
+        self.assertEqual(lru.keys(), ["big"])
+
+    def test_many_entries(self):
+        lru = util.LRUCache(1000)
+        for i in range(5000):
+            lru.add(i, str(i))
+        self.assertEqual(len(lru), 1000)
+        self.assertEqual(lru.get(4000), "4000")
+        self.assertEqual(lru.get(3999), None)
+        self.assertEqual(lru.evictions, 4000)
+
+    def test_get_or_load_hit(self):
+        self.lru.add("a", self.a)
+        def loader(key):
+            self.fail("should not load")
+        d = self.lru.get_or_load("a", loader)
+        d.addCallback(self.assertEqual, self.a)
+        return d
+
+    def test_get_or_load_collapses_misses(self):
+        calls = []
+        load_d = defer.Deferred()
+        def loader(key):
+            calls.append(key)
+            return load_d
+        d1 = self.lru.get_or_load("a", loader)
+        d2 = self.lru.get_or_load("a", loader)
+        self.assertEqual(calls, ["a"])
+        load_d.callback(self.a)
+        d = defer.gatherResults([d1, d2])
+        def check(res):
+            self.assertEqual(res, [self.a, self.a])
+            self.assertTrue(self.lru.get("a") is self.a)
+        d.addCallback(check)
+        return d
+
+    def test_get_or_load_failure(self):
+        def loader(key):
+            raise RuntimeError("oh no")
+        d = self.lru.get_or_load("a", loader)
+        def cb(res):
+            self.fail("should have failed")
+        def eb(f):
+            f.trap(RuntimeError)
+            self.assertEqual(self.lru.get("a"), None)
+        d.addCallbacks(cb, eb)
+        return d
+
 class none_or_str(unittest.TestCase):
 
     def test_none(self):
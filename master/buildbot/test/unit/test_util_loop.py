@@ -193,6 +193,22 @@ class Loop(unittest.TestCase, TestLoopMixin):
             self.assertEqual(res, [ 'p', 't', 'p', 't', 'p', 't', 'p', 't', 'p', 'p' ])
         return self.whenQuiet(check)
 
+    def test_trigger_processors(self):
+        x, y = self.make_cb('x'), self.make_cb('y')
+        self.loop.add(x)
+        self.loop.add(y)
+        self.loop.trigger_processors([y])
+        def check(res):
+            self.assertEqual(res, ['y'])
+        return self.whenQuiet(check)
+
+    def test_trigger_processors_removed(self):
+        x = self.make_cb('x')
+        self.loop.trigger_processors([x])
+        def check(res):
+            self.assertEqual(res, [])
+        return self.whenQuiet(check)
+
 class DelegateLoop(unittest.TestCase, TestLoopMixin):
 
     def setUp(self):
@@ -215,6 +231,22 @@ class DelegateLoop(unittest.TestCase, TestLoopMixin):
             self.assertEqual(res, [ "here" ])
         return self.whenQuiet(check)
 
+    def test_trigger_processors_during_run(self):
+        def x():
+            self.results.append('x')
+            if len(self.results) == 1:
+                # y hasn't run yet in this pass, so it only runs once; x
+                # has, so it runs again
+                self.loop.trigger_processors([x, y])
+        def y():
+            self.results.append('y')
+        self.loop = loop.DelegateLoop(lambda : [x, y])
+        self.loop.startService()
+        self.loop.trigger()
+        def check(res):
+            self.assertEqual(res, ['x', 'y', 'x'])
+        return self.whenQuiet(check)
+
 class MultiServiceLoop(unittest.TestCase, TestLoopMixin):
 
     def setUp(self):
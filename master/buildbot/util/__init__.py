@@ -1,6 +1,7 @@
 # -*- test-case-name: buildbot.test.test_util -*-
 
 from twisted.python import threadable
+from twisted.internet import defer
 import time, re, string
 
 def naturalSort(l):
@@ -81,40 +82,161 @@ def safeTranslate(str):
 
 class LRUCache:
     """
-    A simple least-recently-used cache, with a fixed maximum size.  Note that
+    A least-recently-used cache, with a fixed maximum size.  Note that
     an item's memory will not necessarily be free if other code maintains a reference
     to it, but this class will "lose track" of it all the same.  Without caution, this
     can lead to duplicate items in memory simultaneously.
+
+    Entries are kept in a dictionary and threaded onto a circular
+    doubly-linked list in order of use, so lookups, additions and evictions
+    all take constant time regardless of the size of the cache.
+
+    By default, the cache holds at most C{max_size} entries.  If a C{weigh}
+    function is given, it is called with each item added, and the cache also
+    evicts entries whenever the sum of their weights (bytes, for example)
+    exceeds C{max_weight}.
+
+    The C{hits}, C{misses} and C{evictions} attributes count what the cache
+    has been doing, and are useful when tuning cache sizes.
     """
 
-    synchronized = ["get", "add"]
+    synchronized = ["get", "add", "keys", "setMaxSize", "setMaxWeight",
+                    "__len__", "_start_load", "_finish_load"]
 
-    def __init__(self, max_size=50):
+    # list node layout
+    PREV, NEXT, KEY, VALUE, WEIGHT = range(5)
+
+    def __init__(self, max_size=50, max_weight=None, weigh=None):
         self._max_size = max_size
-        self._cache = {} # basic LRU cache
-        self._cached_ids = [] # = [LRU .. MRU]
+        self._max_weight = max_weight
+        self._weigh = weigh
+        self._cache = {} # key -> node
+        self._weight = 0
+        # sentinel of the circular list; sentinel[NEXT] is the LRU entry,
+        # and sentinel[PREV] is the MRU entry
+        self._sentinel = s = [None, None, None, None, 0]
+        s[self.PREV] = s[self.NEXT] = s
+        self._loading = {} # key -> list of Deferreds waiting for a load
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _unlink(self, node):
+        node[self.PREV][self.NEXT] = node[self.NEXT]
+        node[self.NEXT][self.PREV] = node[self.PREV]
+
+    def _link_mru(self, node):
+        s = self._sentinel
+        last = s[self.PREV]
+        node[self.PREV] = last
+        node[self.NEXT] = s
+        last[self.NEXT] = node
+        s[self.PREV] = node
+
+    def _evict(self):
+        s = self._sentinel
+        # never evict the most recently used entry, even if it is too heavy
+        # to fit on its own
+        while len(self._cache) > 1 and (
+                len(self._cache) > self._max_size or
+                (self._max_weight is not None
+                 and self._weight > self._max_weight)):
+            node = s[self.NEXT]
+            self._unlink(node)
+            del self._cache[node[self.KEY]]
+            self._weight -= node[self.WEIGHT]
+            self.evictions += 1
 
     def get(self, id):
-        thing = self._cache.get(id, None)
-        if thing is not None:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
-        return thing
+        node = self._cache.get(id)
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._unlink(node)
+        self._link_mru(node)
+        return node[self.VALUE]
     __getitem__ = get
 
     def add(self, id, thing):
-        if id in self._cache:
-            self._cached_ids.remove(id)
-            self._cached_ids.append(id)
+        node = self._cache.get(id)
+        if node is not None:
+            self._unlink(node)
+            self._link_mru(node)
             return
-        while len(self._cached_ids) >= self._max_size:
-            del self._cache[self._cached_ids.pop(0)]
-        self._cache[id] = thing
-        self._cached_ids.append(id)
+        weight = 0
+        if self._weigh is not None:
+            weight = self._weigh(thing)
+        node = [None, None, id, thing, weight]
+        self._cache[id] = node
+        self._weight += weight
+        self._link_mru(node)
+        self._evict()
     __setitem__ = add
 
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, id):
+        # note that this does not count as a use of the entry
+        return id in self._cache
+
+    def keys(self):
+        """Return the cached keys, least-recently used first"""
+        keys = []
+        s = self._sentinel
+        node = s[self.NEXT]
+        while node is not s:
+            keys.append(node[self.KEY])
+            node = node[self.NEXT]
+        return keys
+
+    def getWeight(self):
+        return self._weight
+
     def setMaxSize(self, max_size):
         self._max_size = max_size
+        self._evict()
+
+    def setMaxWeight(self, max_weight):
+        self._max_weight = max_weight
+        self._evict()
+
+    def get_or_load(self, id, loader):
+        """Return a Deferred that fires with the cached value for C{id},
+        calling C{loader(id)} (which may return a value or a Deferred) if it
+        is not in the cache.  Concurrent misses for the same key are
+        collapsed into a single call to the loader.  Values of None are not
+        cached."""
+        thing = self.get(id)
+        if thing is not None:
+            return defer.succeed(thing)
+        d = defer.Deferred()
+        if not self._start_load(id, d):
+            # someone else is already loading this key
+            return d
+        ld = defer.maybeDeferred(loader, id)
+        def done(res):
+            if res is not None:
+                self.add(id, res)
+            for waiter in self._finish_load(id):
+                waiter.callback(res)
+        def failed(f):
+            for waiter in self._finish_load(id):
+                waiter.errback(f)
+        ld.addCallbacks(done, failed)
+        return d
+
+    def _start_load(self, id, d):
+        # returns True if the caller should start loading
+        if id in self._loading:
+            self._loading[id].append(d)
+            return False
+        self._loading[id] = [d]
+        return True
+
+    def _finish_load(self, id):
+        return self._loading.pop(id, [])
 
 threadable.synchronize(LRUCache)
 
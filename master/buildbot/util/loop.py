@@ -54,6 +54,13 @@ relative order of processing functions within a run is not preserved.  If a
 processing function is added to the loop more than once, it will still only be
 called once per run.
 
+When the code ringing the doorbell knows which processing functions have work
+to do, it can ring trigger_processors() instead, and only those functions will
+be run (in the order that get_processors() gives them). The same guarantee
+holds for each of them: each one will be run at least once after the last
+time it was rung for. A function that is rung for while it is waiting to be
+run later in the current run is only run once.
+
 If the Deferred returned by the processing function fires with a number, the
 event loop will call that function again at or after the given time
 (expressed as seconds since epoch). This can be used by processing functions
@@ -96,6 +103,7 @@ class LoopBase(service.MultiService):
         self._everything_needs_to_run = False
         self._wakeup_timer = None
         self._timers = {}
+        self._dirty_processors = set()
         self._when_quiet_waiters = set()
         self._start_timer = None
         self._reactor = reactor # seam for tests to use t.i.t.Clock
@@ -124,6 +132,13 @@ class LoopBase(service.MultiService):
             return
         self._mark_runnable(run_everything=True)
 
+    def trigger_processors(self, processors):
+        # like trigger(), but only the given processors need to be run
+        if not self.running:
+            return
+        self._dirty_processors.update(processors)
+        self._mark_runnable(run_everything=False)
+
     def _mark_runnable(self, run_everything):
         if run_everything:
             self._everything_needs_to_run = True
@@ -143,19 +158,22 @@ class LoopBase(service.MultiService):
             self._everything_needs_to_run = False
             self._timers.clear()
             self._set_wakeup_timer()
+            self._dirty_processors.clear()
             self._remaining = list(self.get_processors())
         else:
             self._remaining = []
+            wanted = self._dirty_processors
+            self._dirty_processors = set()
             now = util.now(self._reactor)
-            all_processors = self.get_processors()
             for p in list(self._timers.keys()):
                 if self._timers[p] <= now:
                     del self._timers[p]
-                    # don't run a processor that was removed while it still
-                    # had a timer running
-                    if p in all_processors:
-                        self._remaining.append(p)
-                # consider sorting by 'when'
+                    wanted.add(p)
+            if wanted:
+                # keep the order of get_processors(), and don't run a
+                # processor that was removed while it was still wanted
+                self._remaining = [p for p in self.get_processors()
+                                   if p in wanted]
         self._loop_next()
 
     def _loop_next(self):
@@ -163,6 +181,7 @@ class LoopBase(service.MultiService):
             return self._loop_done()
         p = self._remaining.pop(0)
         self._timers.pop(p, None)
+        self._dirty_processors.discard(p)
         now = util.now(self._reactor)
         d = defer.maybeDeferred(p)
         d.addCallback(self._set_timer, now, p)
@@ -174,7 +193,7 @@ class LoopBase(service.MultiService):
         eventually(self._loop_next)
 
     def _loop_done(self):
-        if self._everything_needs_to_run:
+        if self._everything_needs_to_run or self._dirty_processors:
             self._loop_start()
             return
         self._loop_running = False
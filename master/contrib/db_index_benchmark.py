@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Measure the latency of the buildmaster's hot buildrequest and scheduler
+queries against a large SQLite state database, before and after the
+version 7 schema upgrade (which adds composite indexes).
+
+usage: db_index_benchmark.py [--requests N] [--builders N] [--basedir DIR]
+
+The database is created from scratch in DIR (default: a temporary
+directory), filled with N buildrequests (default 1,000,000) spread over the
+given number of builders, of which about 0.1% are still pending.
+"""
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from twisted.python import reflect
+
+from buildbot.db import dbspec
+from buildbot.db.schema import manager
+
+def make_db(basedir, version):
+    spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", basedir)
+    sm = manager.DBSchemaManager(spec, basedir)
+    # upgrade to 'version' only, so that the v7 upgrade can be timed
+    sm.get_current_version = lambda: version
+    sm.upgrade(quiet=True)
+    return spec
+
+def fill_db(conn, nrequests, nbuilders):
+    c = conn.cursor()
+    rnd = random.Random(0)
+    nschedulers = 50
+    now = int(time.time())
+    for i in range(nschedulers):
+        c.execute("INSERT INTO schedulers (name, class_name, state)"
+                  " VALUES (?, ?, ?)", ("sched%d" % i, "Scheduler", "{}"))
+    c.execute("INSERT INTO sourcestamps (branch, revision, patchid)"
+              " VALUES (?, ?, ?)", (None, "1234", None))
+
+    bs_rows = []
+    br_rows = []
+    upstream_rows = []
+    sched_change_rows = []
+    ss_change_rows = []
+    per_buildset = 4
+    for bsid in range(1, nrequests / per_buildset + 1):
+        complete = rnd.random() > 0.001
+        bs_rows.append((bsid, 1, "benchmark", now - bsid, int(complete)))
+        for j in range(per_buildset):
+            bn = "builder%d" % rnd.randrange(nbuilders)
+            br_rows.append((bsid, bn, 0, int(complete), now - bsid))
+        upstream_rows.append((bsid, rnd.randrange(1, nschedulers + 1),
+                              int(not complete)))
+        sched_change_rows.append((rnd.randrange(1, nschedulers + 1), bsid, 1))
+        ss_change_rows.append((1 + bsid % 1000, bsid))
+
+    c.executemany("INSERT INTO buildsets"
+                  " (id, sourcestampid, reason, submitted_at, complete)"
+                  " VALUES (?, ?, ?, ?, ?)", bs_rows)
+    c.executemany("INSERT INTO buildrequests"
+                  " (buildsetid, buildername, claimed_at, complete,"
+                  "  submitted_at)"
+                  " VALUES (?, ?, ?, ?, ?)", br_rows)
+    c.executemany("INSERT INTO scheduler_upstream_buildsets"
+                  " (buildsetid, schedulerid, active) VALUES (?, ?, ?)",
+                  upstream_rows)
+    c.executemany("INSERT INTO scheduler_changes"
+                  " (schedulerid, changeid, important) VALUES (?, ?, ?)",
+                  sched_change_rows)
+    c.executemany("INSERT INTO sourcestamp_changes"
+                  " (sourcestampid, changeid) VALUES (?, ?)", ss_change_rows)
+    conn.commit()
+
+QUERIES = [
+    ("get_unclaimed_buildrequests",
+     "SELECT br.id FROM buildrequests AS br, buildsets AS bs"
+     " WHERE br.buildername=? AND br.complete=0"
+     " AND br.buildsetid=bs.id"
+     " AND (br.claimed_at<? OR (br.claimed_by_name=?"
+     "      AND br.claimed_by_incarnation!=?))"
+     " ORDER BY br.priority DESC,bs.submitted_at ASC",
+     lambda i: ("builder%d" % (i % 100), 0, "master", "incarnation")),
+    ("get_pending_brids_for_builder",
+     "SELECT id FROM buildrequests"
+     " WHERE buildername=? AND complete=0 AND claimed_at=0",
+     lambda i: ("builder%d" % (i % 100),)),
+    ("_check_buildset",
+     "SELECT br.complete,br.results FROM buildsets AS bs, buildrequests AS br"
+     " WHERE bs.complete=0 AND br.buildsetid=bs.id AND bs.id=?",
+     lambda i: (1 + i * 7919 % 1000,)),
+    ("scheduler_get_classified_changes",
+     "SELECT changeid, important FROM scheduler_changes WHERE schedulerid=?",
+     lambda i: (1 + i % 50,)),
+    ("scheduler_get_subscribed_buildsets",
+     "SELECT bs.id, bs.sourcestampid, bs.complete, bs.results"
+     " FROM scheduler_upstream_buildsets AS s, buildsets AS bs"
+     " WHERE s.buildsetid=bs.id AND s.schedulerid=? AND s.active=1",
+     lambda i: (1 + i % 50,)),
+    ("_txn_getSourceStampNumbered (changes)",
+     "SELECT changeid FROM sourcestamp_changes WHERE sourcestampid=?",
+     lambda i: (1 + i % 1000,)),
+]
+
+def time_queries(conn, iterations):
+    c = conn.cursor()
+    results = {}
+    for name, q, args in QUERIES:
+        start = time.time()
+        for i in range(iterations):
+            c.execute(q, args(i))
+            c.fetchall()
+        results[name] = (time.time() - start) / iterations
+    return results
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--requests", type="int", default=1000000)
+    parser.add_option("--builders", type="int", default=300)
+    parser.add_option("--iterations", type="int", default=20)
+    parser.add_option("--basedir", default=None)
+    opts, args = parser.parse_args()
+
+    basedir = opts.basedir or tempfile.mkdtemp()
+    try:
+        spec = make_db(basedir, 6)
+        conn = spec.get_sync_connection()
+        print "filling database with %d buildrequests..." % opts.requests
+        fill_db(conn, opts.requests, opts.builders)
+        conn.execute("ANALYZE")
+        before = time_queries(conn, opts.iterations)
+
+        start = time.time()
+        upgrader = reflect.namedModule("buildbot.db.schema.v7").Upgrader(
+                spec.get_dbapi(), conn, basedir, True)
+        upgrader.upgrade()
+        conn.commit()
+        print "v7 upgrade took %.1fs" % (time.time() - start)
+        conn.execute("ANALYZE")
+        after = time_queries(conn, opts.iterations)
+
+        print "%-40s %12s %12s" % ("query", "v6 (ms)", "v7 (ms)")
+        for name, q, args in QUERIES:
+            print "%-40s %12.3f %12.3f" % (name, before[name] * 1000,
+                                           after[name] * 1000)
+    finally:
+        if not opts.basedir:
+            shutil.rmtree(basedir)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,10 @@
 import os.path
+import re
 import sys
 
 from twisted.spread import pb
-from twisted.python import log
-from twisted.internet import reactor, defer, error
+from twisted.python import log, runtime
+from twisted.internet import reactor, defer, error, threads, utils
 from twisted.application import service, internet
 from twisted.cred import credentials
 
@@ -11,6 +12,8 @@ import buildslave
 from buildslave.util import now
 from buildslave.pbutil import ReconnectingPBClientFactory
 from buildslave.commands import registry, base
+from buildslave.commands.utils import getCommand, rmdirRecursive
+from buildslave.mirrors import MirrorCache
 
 class UnknownCommand(pb.Error):
     pass
@@ -37,9 +40,22 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     # when the step is started
     remoteStep = None
 
+    # .reaper is the Bot's DirectoryReaper, which source commands use to
+    # delete old trees in the background
+    reaper = None
+
+    # .mirrors is the Bot's MirrorCache, if it has one
+    mirrors = None
+
     # useful for replacing the reactor in tests
     _reactor = reactor
 
+    # the format in which RunProcess sends output updates: 1 for a dictionary
+    # per log, 2 for framed, interleaved records (see runprocess.py). This
+    # is negotiated with the master for each command.
+    updateFormat = 1
+    maxUpdateFormat = 2
+
     def __init__(self, name):
         #service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
@@ -50,6 +66,8 @@ class SlaveBuilder(pb.Referenceable, service.Service):
     def setServiceParent(self, parent):
         service.Service.setServiceParent(self, parent)
         self.bot = self.parent
+        self.reaper = self.bot.reaper
+        self.mirrors = self.bot.mirrors
         # note that self.parent will go away when the buildmaster's config
         # file changes and this Builder is removed (possibly because it has
         # been changed, so the Builder will be re-added again in a moment).
@@ -119,6 +137,12 @@ class SlaveBuilder(pb.Referenceable, service.Service):
             factory = registry.getFactory(command)
         except KeyError:
             raise UnknownCommand, "unrecognized SlaveCommand '%s'" % command
+
+        # the master tells us which update formats its RemoteCommand can
+        # handle; this is not an argument for the command itself
+        self.updateFormat = min(args.pop('update_format', 1),
+                                self.maxUpdateFormat)
+
         self.command = factory(self, stepId, args)
 
         log.msg(" startCommand:%s [id %s]" % (command,stepId))
@@ -215,17 +239,138 @@ class SlaveBuilder(pb.Referenceable, service.Service):
         self._reactor.stop()
 
 
+class DirectoryReaper(service.Service):
+    """I delete directories in the background. A source command that wants
+    to clobber a tree asks me to reap it: I rename it to NAME.deleting, so
+    that the new checkout can start straight away, and then delete the
+    renamed tree with 'rm -rf' (or rmdirRecursive, in a thread, on
+    non-POSIX platforms). At most maxDeletions trees are deleted at once.
+
+    When I start, I also delete any .deleting directories that a previous
+    run of the buildslave left in the builder directories."""
+
+    maxDeletions = 2
+    deletingSuffix = ".deleting"
+    deletingRE = re.compile(r"\.deleting(\.\d+)?$")
+
+    def __init__(self, basedir, maxDeletions=None):
+        self.basedir = basedir
+        if maxDeletions is not None:
+            self.maxDeletions = maxDeletions
+        self.pending = []
+        self.deleting = []
+        self.idleWaiters = []
+
+    def startService(self):
+        service.Service.startService(self)
+        for path in self.findLeftovers():
+            log.msg("deleting leftover directory %s" % path)
+            self.pending.append(path)
+        self._deleteMore()
+
+    def findLeftovers(self):
+        leftovers = []
+        for builddir in os.listdir(self.basedir):
+            builddir = os.path.join(self.basedir, builddir)
+            if not os.path.isdir(builddir):
+                continue
+            for name in os.listdir(builddir):
+                path = os.path.join(builddir, name)
+                if (self.deletingRE.search(name) and os.path.isdir(path)
+                    and not os.path.islink(path)):
+                    leftovers.append(path)
+        return leftovers
+
+    def reap(self, path):
+        """Move the directory at PATH aside, and delete it in the background.
+        Returns False if it could not be moved, in which case the caller
+        should delete it itself."""
+        if not self.running:
+            return False
+        deadpath = path + self.deletingSuffix
+        n = 0
+        while os.path.exists(deadpath):
+            # an earlier deletion of this directory hasn't finished yet
+            n += 1
+            deadpath = "%s%s.%d" % (path, self.deletingSuffix, n)
+        try:
+            os.rename(path, deadpath)
+        except OSError, e:
+            log.msg("could not move %s aside to delete it: %s" % (path, e))
+            return False
+        self.pending.append(deadpath)
+        self._deleteMore()
+        return True
+
+    def waitUntilIdle(self):
+        """Return a Deferred that fires when there is nothing left to
+        delete."""
+        if not self.pending and not self.deleting:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.idleWaiters.append(d)
+        return d
+
+    def _deleteMore(self):
+        # deletions already under way when we are stopped carry on, but no
+        # new ones are started: whatever is left is found again at startup
+        while (self.running and self.pending
+               and len(self.deleting) < self.maxDeletions):
+            path = self.pending.pop(0)
+            self.deleting.append(path)
+            d = self._delete(path)
+            d.addErrback(log.err, "while deleting %s" % path)
+            d.addBoth(self._deleted, path)
+
+    def _deleted(self, res, path):
+        self.deleting.remove(path)
+        self._deleteMore()
+        if not self.pending and not self.deleting:
+            waiters, self.idleWaiters = self.idleWaiters, []
+            for d in waiters:
+                d.callback(None)
+
+    def _delete(self, path):
+        if runtime.platformType != "posix":
+            return threads.deferToThread(rmdirRecursive, path)
+        d = self._run("rm", ["-rf", path])
+        def check(res, retry):
+            out, err, rc = res
+            if rc == 0:
+                return
+            if retry:
+                # rm -rf fails on subdirectories without write permission,
+                # so fix the permissions and try again
+                d = self._run("chmod", ["-Rf", "u+rwx", path])
+                d.addCallback(lambda _: self._run("rm", ["-rf", path]))
+                d.addCallback(check, False)
+                return d
+            log.msg("could not delete %s: %s" % (path, err))
+        d.addCallback(check, True)
+        return d
+
+    def _run(self, command, args):
+        return utils.getProcessOutputAndValue(getCommand(command), args,
+                                              env=os.environ)
+
 class Bot(pb.Referenceable, service.MultiService):
     """I represent the slave-side bot."""
     usePTY = None
     name = "bot"
 
-    def __init__(self, basedir, usePTY, unicode_encoding=None):
+    def __init__(self, basedir, usePTY, unicode_encoding=None,
+                 mirrorCacheSize=None):
         service.MultiService.__init__(self)
         self.basedir = basedir
         self.usePTY = usePTY
         self.unicode_encoding = unicode_encoding or sys.getfilesystemencoding() or 'ascii'
         self.builders = {}
+        self.reaper = DirectoryReaper(basedir)
+        self.reaper.setServiceParent(self)
+        self.mirrors = None
+        if mirrorCacheSize:
+            self.mirrors = MirrorCache(basedir, mirrorCacheSize)
+            self.mirrors.setServiceParent(self)
 
     def startService(self):
         assert os.path.isdir(self.basedir)
@@ -429,10 +574,15 @@ class BotFactory(ReconnectingPBClientFactory):
 class BuildSlave(service.MultiService):
     def __init__(self, buildmaster_host, port, name, passwd, basedir,
                  keepalive, usePTY, keepaliveTimeout=30, umask=None,
-                 maxdelay=300, unicode_encoding=None):
+                 maxdelay=300, unicode_encoding=None, mirror_cache_size=None):
         log.msg("Creating BuildSlave -- version: %s" % buildslave.version)
         service.MultiService.__init__(self)
-        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding)
+        # mirror_cache_size is given in megabytes
+        mirrorCacheSize = None
+        if mirror_cache_size:
+            mirrorCacheSize = mirror_cache_size * 1024 * 1024
+        bot = Bot(basedir, usePTY, unicode_encoding=unicode_encoding,
+                  mirrorCacheSize=mirrorCacheSize)
         bot.setServiceParent(self)
         self.bot = bot
         if keepalive == 0:
@@ -3,10 +3,9 @@ import os, signal, types, re, traceback
 from stat import ST_CTIME, ST_MTIME, ST_SIZE
 import os
 import sys
-import shutil
 
 from zope.interface import implements
-from twisted.internet import reactor, defer, task
+from twisted.internet import reactor, defer, task, threads
 from twisted.python import log, failure, runtime
 
 from buildslave.interfaces import ISlaveCommand
@@ -17,7 +16,7 @@ from buildslave.commands import utils
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "2.11"
+command_version = "2.13"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -45,6 +44,11 @@ command_version = "2.11"
 #  >= 2.9: add depth arg to SVN class
 #  >= 2.10: CVS can handle 'extra_options' and 'export_options'
 #  >= 2.11: Arch, Bazaar, and Monotone removed
+#  >= 2.12: RunProcess sends output as framed, possibly compressed records
+#           ('frames' and 'frames_z' updates) if the master passes
+#           'update_format' >= 2
+#  >= 2.13: uploadFile, uploadDirectory and downloadFile accept 'window'
+#           (pipelined blocks plus an MD5 checksum) and 'resume'
 
 class Command:
     implements(ISlaveCommand)
@@ -283,8 +287,9 @@ class SourceBaseCommand(Command):
         return d
 
     def maybeClobber(self, d):
-        # do we need to clobber anything?
-        if self.mode in ("copy", "clobber", "export"):
+        # do we need to clobber anything? In copy mode, doCopy brings any
+        # old copy up to date instead.
+        if self.mode in ("clobber", "export"):
             d.addCallback(self.doClobber, self.workdir)
 
     def interrupt(self):
@@ -423,25 +428,15 @@ class SourceBaseCommand(Command):
         return res
 
     def doClobber(self, dummy, dirname, chmodDone=False):
-        # TODO: remove the old tree in the background
-##         workdir = os.path.join(self.builder.basedir, self.workdir)
-##         deaddir = self.workdir + ".deleting"
-##         if os.path.isdir(workdir):
-##             try:
-##                 os.rename(workdir, deaddir)
-##                 # might fail if deaddir already exists: previous deletion
-##                 # hasn't finished yet
-##                 # start the deletion in the background
-##                 # TODO: there was a solaris/NetApp/NFS problem where a
-##                 # process that was still running out of the directory we're
-##                 # trying to delete could prevent the rm-rf from working. I
-##                 # think it stalled the rm, but maybe it just died with
-##                 # permission issues. Try to detect this.
-##                 os.commands("rm -rf %s &" % deaddir)
-##             except:
-##                 # fall back to sequential delete-then-checkout
-##                 pass
         d = os.path.join(self.builder.basedir, dirname)
+        if self.builder.reaper and os.path.isdir(d) and not chmodDone:
+            # move the old tree out of the way and let the reaper delete it,
+            # so the checkout doesn't have to wait. If it can't be moved,
+            # delete it here instead.
+            if self.builder.reaper.reap(d):
+                self.sendStatus({'header': "%s will be deleted in the "
+                                           "background\n" % d})
+                return defer.succeed(0)
         if runtime.platformType != "posix":
             # if we're running on w32, use rmtree instead. It will block,
             # but hopefully it won't take too long.
@@ -490,30 +485,44 @@ class SourceBaseCommand(Command):
         return d
 
     def doCopy(self, res):
-        # now copy tree to workdir
+        # now copy tree to workdir. If an earlier build left a copy there,
+        # only the files that have changed are copied.
         fromdir = os.path.join(self.builder.basedir, self.srcdir)
         todir = os.path.join(self.builder.basedir, self.workdir)
-        if runtime.platformType != "posix":
-            self.sendStatus({'header': "Since we're on a non-POSIX platform, "
-            "we're not going to try to execute cp in a subprocess, but instead "
-            "use shutil.copytree(), which will block until it is complete.  "
-            "fromdir: %s, todir: %s\n" % (fromdir, todir)})
-            shutil.copytree(fromdir, todir)
-            return defer.succeed(0)
+        # the copy happens in a thread, so there is no process to kill
+        self.command = None
+        if os.path.isdir(todir):
+            self.sendStatus({'header': "updating %s from %s\n"
+                                       % (todir, fromdir)})
+            d = self._syncTree(fromdir, todir)
+            d.addErrback(self._syncFailed, fromdir, todir)
+        else:
+            self.sendStatus({'header': "copying %s to %s\n"
+                                       % (fromdir, todir)})
+            d = self._syncTree(fromdir, todir)
+        return d
 
-        if not os.path.exists(os.path.dirname(todir)):
-            os.makedirs(os.path.dirname(todir))
-        if os.path.exists(todir):
-            # I don't think this happens, but just in case..
-            log.msg("cp target '%s' already exists -- cp will not do what you think!" % todir)
+    def _syncTree(self, fromdir, todir):
+        d = threads.deferToThread(utils.syncTree, fromdir, todir,
+                                  interrupted=lambda: self.interrupted)
+        def report(counts):
+            self.sendStatus({'header': "%(copied)d files copied, "
+                             "%(linked)d linked, %(unchanged)d unchanged, "
+                             "%(removed)d removed\n" % counts})
+            return 0
+        d.addCallback(report)
+        return d
 
-        command = ['cp', '-R', '-P', '-p', fromdir, todir]
-        c = runprocess.RunProcess(self.builder, command, self.builder.basedir,
-                         sendRC=False, timeout=self.timeout, maxTime=self.maxTime,
-                         usePTY=False)
-        self.command = c
-        d = c.start()
-        d.addCallback(self._abandonOnFailure)
+    def _syncFailed(self, why, fromdir, todir):
+        why.trap(EnvironmentError)
+        # perhaps the build left something behind that we can't remove.
+        # Clobber the old copy (which knows how to fix permissions), and
+        # make a fresh one.
+        log.err(why, "while updating %s" % todir)
+        self.sendStatus({'header': "could not update %s (%s), making a new "
+                                   "copy\n" % (todir, why.getErrorMessage())})
+        d = self.doClobber(None, self.workdir)
+        d.addCallback(lambda _: self._syncTree(fromdir, todir))
         return d
 
     def doPatch(self, res):
@@ -1,6 +1,7 @@
 import os
 
 from twisted.internet import defer
+from twisted.python import log
 
 from buildslave.commands.base import SourceBaseCommand
 from buildslave import runprocess
@@ -18,6 +19,10 @@ class Git(SourceBaseCommand):
                                submodules. Default: False.
     ['ignore_ignores']:        ignore ignores when purging changes.
     ['reference'] (optional):  use this reference repository to fetch objects
+
+    If the slave has a MirrorCache, the repository is fetched into its mirror
+    first, and then from there into the source directory, which borrows the
+    mirror's objects.
     """
 
     header = "git operation"
@@ -120,9 +125,45 @@ class Git(SourceBaseCommand):
         return self._didClean(None)
 
     def _doFetch(self, dummy):
+        if not self.builder.mirrors:
+            return self._fetchFrom(self.repourl)
+        # bring the slave's mirror of the repository up to date, and fetch
+        # from that instead
+        self.sendStatus({"header": "updating mirror of %s\n" % self.repourl})
+        d = self.builder.mirrors.getMirror(self.repourl, self.revision)
+        def useMirror(mirrorpath):
+            self._addAlternate(os.path.join(mirrorpath, 'objects'))
+            self.builder.mirrors.addBorrower(mirrorpath,
+                            os.path.join(self._fullSrcdir(), '.git'))
+            return mirrorpath
+        def noMirror(why):
+            log.err(why, "while updating mirror of %s" % self.repourl)
+            self.sendStatus({"header": "could not update the mirror (%s), "
+                             "fetching directly\n" % why.getErrorMessage()})
+            return self.repourl
+        # a failure to borrow from the mirror falls back to a direct fetch
+        # too
+        d.addCallback(useMirror)
+        d.addErrback(noMirror)
+        d.addCallback(self._fetchFrom)
+        return d
+
+    def _addAlternate(self, objects):
+        git_alts_path = os.path.join(self._fullSrcdir(), '.git', 'objects',
+                                     'info', 'alternates')
+        alternates = []
+        if os.path.exists(git_alts_path):
+            alternates = open(git_alts_path).read().splitlines()
+        if objects not in alternates:
+            alternates.append(objects)
+            git_alts_file = open(git_alts_path, 'w')
+            git_alts_file.write('\n'.join(alternates) + '\n')
+            git_alts_file.close()
+
+    def _fetchFrom(self, url):
         # The plus will make sure the repo is moved to the branch's
         # head even if it is not a simple "fast-forward"
-        command = ['fetch', '-t', self.repourl, '+%s' % self.branch]
+        command = ['fetch', '-t', url, '+%s' % self.branch]
         # If the 'progress' option is set, tell git fetch to output
         # progress information to the log. This can solve issues with
         # long fetches killed due to lack of output, but only works
@@ -1,6 +1,11 @@
 import os, tarfile, tempfile
+try:
+    from hashlib import md5
+except ImportError:
+    # For Python 2.4 compatibility
+    from md5 import md5
 
-from twisted.python import log
+from twisted.python import log, runtime, failure
 from twisted.internet import defer
 
 from buildslave.commands.base import Command, command_version
@@ -15,6 +20,12 @@ class SlaveFileUploadCommand(Command):
         - ['writer']:    RemoteReference to a transfer._FileWriter object
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
+        - ['window']:    (optional) number of blocks to send before waiting
+                         for the first one to be acknowledged; if given, an
+                         MD5 checksum is sent along with the final close
+        - ['resume']:    (optional) ask the writer how much it already has
+                         and continue from there, if that much matches the
+                         start of the file
     """
     debug = False
 
@@ -24,6 +35,8 @@ class SlaveFileUploadCommand(Command):
         self.writer = args['writer']
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
+        self.window = args.get('window')
+        self.resume = args.get('resume', False)
         self.stderr = None
         self.rc = 0
 
@@ -48,21 +61,121 @@ class SlaveFileUploadCommand(Command):
 
         self.sendStatus({'header': "sending %s" % self.path})
 
-        d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        d = self._startTransfer()
         def _close(res):
             # close the file
             self.fp = None
 
             # call close, but pass through any errors from _loop
-            d1 = self.writer.callRemote("close")
-            d1.addErrback(log.err)
+            d1 = self._callClose("close")
             d1.addCallback(lambda ignored: res)
             return d1
         d.addBoth(_close)
         d.addBoth(self.finished)
         return d
 
+    def _startTransfer(self):
+        d = defer.Deferred()
+        if not self.window:
+            self._reactor.callLater(0, self._loop, d)
+            return d
+
+        self.md5 = md5()
+        self.offset = 0
+        self.outstanding = 0
+        self.eof = False
+        self.failure = None
+        self.filling = False
+        if self.resume and self.fp is not None:
+            d1 = self.writer.callRemote("resume")
+            d1.addCallback(self._skipTo)
+            d1.addCallbacks(lambda _: self._fillWindow(d), d.errback)
+        else:
+            self._reactor.callLater(0, self._fillWindow, d)
+        return d
+
+    def _callClose(self, method):
+        if self.window:
+            d = self.writer.callRemote(method, self.md5.hexdigest())
+        else:
+            d = self.writer.callRemote(method)
+        def _failed(why):
+            log.err(why, "while closing the remote file")
+            if self.stderr is None:
+                self.stderr = "Upload of '%s' failed: %s" % (
+                                self.path, why.getErrorMessage())
+                self.rc = 1
+        d.addErrback(_failed)
+        return d
+
+    def _skipTo(self, res):
+        """Skip (but checksum) the first bytes of the file, which the writer
+        already has. RES is the writer's (offset, checksum) of what it has;
+        if that is not the start of this file (e.g. it is left over from an
+        older version of it), start over from the beginning."""
+        offset, checksum = res
+        if self.debug:
+            log.msg('SlaveFileUploadCommand: resuming at %d' % offset)
+        while self.offset < offset:
+            data = self.fp.read(min(offset - self.offset, 64*1024))
+            if not data:
+                break
+            self.md5.update(data)
+            self.offset += len(data)
+        if self.offset != offset or self.md5.hexdigest() != checksum:
+            if self.debug:
+                log.msg('SlaveFileUploadCommand: cannot resume, restarting')
+            self.fp.seek(0)
+            self.md5 = md5()
+            self.offset = 0
+            # have the writer throw away what it has, even if there turns
+            # out to be nothing to send
+            return self.writer.callRemote('write', '', 0)
+        if self.remaining is not None:
+            self.remaining = max(0, self.remaining - self.offset)
+
+    def _fillWindow(self, fire_when_done):
+        """Send blocks until there are self.window of them in flight; when
+        the last one has been acknowledged, fire FIRE_WHEN_DONE."""
+        # replies that arrive synchronously re-enter here; let the outermost
+        # call do the work
+        if self.filling:
+            return
+        self.filling = True
+        while (self.outstanding < self.window and not self.eof
+               and self.failure is None):
+            if self.interrupted or self.fp is None:
+                self.eof = True
+                break
+            data = self._readBlock()
+            if not data:
+                self.eof = True
+                break
+            self.md5.update(data)
+            d = self.writer.callRemote('write', data, self.offset)
+            self.offset += len(data)
+            self.outstanding += 1
+            d.addCallbacks(self._acked, self._nacked,
+                           callbackArgs=(fire_when_done,),
+                           errbackArgs=(fire_when_done,))
+        self.filling = False
+
+        if self.outstanding == 0 and (self.eof or self.failure is not None):
+            if self.failure is not None:
+                fire_when_done.errback(self.failure)
+            else:
+                fire_when_done.callback(None)
+
+    def _acked(self, res, fire_when_done):
+        self.outstanding -= 1
+        self._fillWindow(fire_when_done)
+
+    def _nacked(self, why, fire_when_done):
+        self.outstanding -= 1
+        if self.failure is None:
+            self.failure = why
+        self._fillWindow(fire_when_done)
+
     def _loop(self, fire_when_done):
         d = defer.maybeDeferred(self._writeBlock)
         def _done(finished):
@@ -83,6 +196,17 @@ class SlaveFileUploadCommand(Command):
                 log.msg('SlaveFileUploadCommand._writeBlock(): end')
             return True
 
+        data = self._readBlock()
+        if len(data) == 0:
+            log.msg("EOF: callRemote(close)")
+            return True
+
+        d = self.writer.callRemote('write', data)
+        d.addCallback(lambda res: False)
+        return d
+
+    def _readBlock(self):
+        """Read the next block of data, within the limits of maxsize"""
         length = self.blocksize
         if self.remaining is not None and length > self.remaining:
             length = self.remaining
@@ -97,18 +221,13 @@ class SlaveFileUploadCommand(Command):
             data = self.fp.read(length)
 
         if self.debug:
-            log.msg('SlaveFileUploadCommand._writeBlock(): '+
+            log.msg('SlaveFileUploadCommand._readBlock(): '+
                     'allowed=%d readlen=%d' % (length, len(data)))
-        if len(data) == 0:
-            log.msg("EOF: callRemote(close)")
-            return True
 
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
-        d = self.writer.callRemote('write', data)
-        d.addCallback(lambda res: False)
-        return d
+        return data
 
     def interrupt(self):
         if self.debug:
@@ -142,6 +261,7 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['compress']:  one of [None, 'bz2', 'gz']
+        - ['window']:    (optional) as for SlaveFileUploadCommand
     """
     debug = False
 
@@ -152,6 +272,9 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
         self.compress = args['compress']
+        self.window = args.get('window')
+        # the archive is rebuilt every time, so there is nothing to resume
+        self.resume = False
         self.stderr = None
         self.rc = 0
 
@@ -184,12 +307,10 @@ class SlaveDirectoryUploadCommand(SlaveFileUploadCommand):
 
         self.sendStatus({'header': "sending %s" % self.path})
 
-        d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        d = self._startTransfer()
         def unpack(res):
             # unpack the archive, but pass through any errors from _loop
-            d1 = self.writer.callRemote("unpack")
-            d1.addErrback(log.err)
+            d1 = self._callClose("unpack")
             d1.addCallback(lambda ignored: res)
             return d1
         d.addCallback(unpack)
@@ -219,6 +340,14 @@ class SlaveFileDownloadCommand(Command):
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
         - ['mode']:      access mode for the new file
+        - ['window']:    (optional) number of blocks to request before the
+                         first one arrives; if given, the file is written to
+                         '<slavedest>.partial', checked against the reader's
+                         MD5 checksum, and then renamed into place
+        - ['resume']:    (optional) continue from an existing
+                         '<slavedest>.partial' if the reader's checksum shows
+                         it is the start of the file, and keep it if the
+                         transfer does not finish
     """
     debug = False
 
@@ -226,9 +355,12 @@ class SlaveFileDownloadCommand(Command):
         self.workdir = args['workdir']
         self.filename = args['slavedest']
         self.reader = args['reader']
-        self.bytes_remaining = args['maxsize']
+        self.maxsize = args['maxsize']
+        self.bytes_remaining = self.maxsize
         self.blocksize = args['blocksize']
         self.mode = args['mode']
+        self.window = args.get('window')
+        self.resume = args.get('resume', False)
         self.stderr = None
         self.rc = 0
 
@@ -246,7 +378,10 @@ class SlaveFileDownloadCommand(Command):
             os.makedirs(dirname)
 
         try:
-            self.fp = open(self.path, 'wb')
+            if self.window:
+                self._openPartial()
+            else:
+                self.fp = open(self.path, 'wb')
             if self.debug:
                 log.msg("Opened '%s' for download" % self.path)
             if self.mode is not None:
@@ -257,7 +392,7 @@ class SlaveFileDownloadCommand(Command):
                 # is possible to call os.umask() before and after the open()
                 # call, but cleaning up from exceptions properly is more of a
                 # nuisance that way).
-                os.chmod(self.path, self.mode)
+                os.chmod(self.fp.name, self.mode)
         except IOError:
             # TODO: this still needs cleanup
             self.fp = None
@@ -267,10 +402,19 @@ class SlaveFileDownloadCommand(Command):
                 log.msg("Cannot open file '%s' for download" % self.path)
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.window and self.fp is not None and self.written:
+            d1 = self.reader.callRemote('checksum', self.written)
+            d1.addBoth(self._checkPartial)
+            d1.addCallbacks(lambda _: self._fillWindow(d), d.errback)
+        elif self.window:
+            self._reactor.callLater(0, self._fillWindow, d)
+        else:
+            self._reactor.callLater(0, self._loop, d)
         def _close(res):
             # close the file, but pass through any errors from _loop
             d1 = self.reader.callRemote('close')
+            if self.window:
+                d1.addCallback(self._checkAndRename)
             d1.addErrback(log.err)
             d1.addCallback(lambda ignored: res)
             return d1
@@ -278,6 +422,135 @@ class SlaveFileDownloadCommand(Command):
         d.addBoth(self.finished)
         return d
 
+    def _openPartial(self):
+        self.partial = self.path + ".partial"
+        self.md5 = md5()
+        self.written = 0
+        if self.resume and os.path.exists(self.partial):
+            self.fp = open(self.partial, 'r+b')
+            while True:
+                data = self.fp.read(64*1024)
+                if not data:
+                    break
+                self.md5.update(data)
+                self.written += len(data)
+            if self.bytes_remaining is not None:
+                self.bytes_remaining = max(0,
+                                    self.bytes_remaining - self.written)
+        else:
+            self.fp = open(self.partial, 'wb')
+        self.next_offset = self.written
+        # blocks that arrived ahead of a missing one, keyed by offset
+        self.pending = {}
+        self.outstanding = 0
+        self.eof = False
+        self.failure = None
+        self.filling = False
+
+    def _checkPartial(self, checksum):
+        """Start over if the existing partial file is not the start of the
+        file being downloaded (e.g. it is left over from an older version of
+        it), according to the reader's CHECKSUM of the same number of bytes.
+        """
+        if checksum == self.md5.hexdigest():
+            return
+        if isinstance(checksum, failure.Failure):
+            log.err(checksum, "while checking '%s'" % self.partial)
+        if self.debug:
+            log.msg('SlaveFileDownloadCommand: cannot resume, restarting')
+        self.fp.seek(0)
+        self.fp.truncate()
+        self.md5 = md5()
+        self.written = self.next_offset = 0
+        self.bytes_remaining = self.maxsize
+
+    def _fillWindow(self, fire_when_done):
+        """Request blocks until there are self.window of them in flight;
+        when the last one has arrived, fire FIRE_WHEN_DONE."""
+        # replies that arrive synchronously re-enter here; let the outermost
+        # call do the work
+        if self.filling:
+            return
+        self.filling = True
+        while (self.outstanding < self.window and not self.eof
+               and self.failure is None):
+            if self.interrupted or self.fp is None:
+                self.eof = True
+                break
+            length = self.blocksize
+            if self.bytes_remaining is not None:
+                limit = self.written + self.bytes_remaining - self.next_offset
+                if length > limit:
+                    length = limit
+            if length <= 0:
+                # do not stop yet: a block in flight may still turn out to
+                # be short, which would mean the file fits after all
+                if self.outstanding:
+                    break
+                if self.stderr is None and self.bytes_remaining is not None:
+                    self.stderr = "Maximum filesize reached, truncating " \
+                                  "file '%s'" % self.path
+                    self.rc = 1
+                self.eof = True
+                break
+            offset = self.next_offset
+            self.next_offset += length
+            self.outstanding += 1
+            d = self.reader.callRemote('read', length, offset)
+            d.addCallbacks(self._gotBlock, self._readFailed,
+                           callbackArgs=(offset, length, fire_when_done),
+                           errbackArgs=(fire_when_done,))
+        self.filling = False
+
+        if self.outstanding == 0 and (self.eof or self.failure is not None):
+            if self.failure is not None:
+                fire_when_done.errback(self.failure)
+            else:
+                fire_when_done.callback(None)
+
+    def _gotBlock(self, data, offset, length, fire_when_done):
+        self.outstanding -= 1
+        if self.fp is not None:
+            self.pending[offset] = data
+            while self.written in self.pending:
+                block = self.pending.pop(self.written)
+                self.fp.write(block)
+                self.md5.update(block)
+                self.written += len(block)
+                if self.bytes_remaining is not None:
+                    self.bytes_remaining -= len(block)
+        if len(data) < length:
+            # short read: the end of the file is at offset+len(data), and any
+            # blocks requested beyond that will come back empty
+            self.eof = True
+        self._fillWindow(fire_when_done)
+
+    def _readFailed(self, why, fire_when_done):
+        self.outstanding -= 1
+        if self.failure is None:
+            self.failure = why
+        self._fillWindow(fire_when_done)
+
+    def _checkAndRename(self, checksum):
+        if self.fp is None:
+            return
+        self.fp.close()
+        self.fp = None
+        if self.interrupted or self.failure is not None:
+            if not self.resume:
+                os.remove(self.partial)
+            return
+        if checksum != self.md5.hexdigest():
+            os.remove(self.partial)
+            self.stderr = "Checksum mismatch downloading '%s': master " \
+                          "sent %s, slave received %s" % (
+                              self.path, checksum, self.md5.hexdigest())
+            self.rc = 1
+            return
+        if runtime.platformType == 'win32' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.partial, self.path)
+
     def _loop(self, fire_when_done):
         d = defer.maybeDeferred(self._readBlock)
         def _done(finished):
@@ -1,9 +1,18 @@
 import os
+import sys
+import stat
+import shutil
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from twisted.python import log
 from twisted.python.procutils import which
 from twisted.python import runtime
 
+from buildslave.exceptions import AbandonChain
+
 def getCommand(name):
     possibles = which(name)
     if not possibles:
@@ -67,5 +76,134 @@ if runtime.platformType  == 'win32':
         os.rmdir(dir)
 else:
     # use rmtree on POSIX
-    import shutil
     rmdirRecursive = shutil.rmtree
+
+# the files under these directories are never modified in place by their
+# VCS (git objects are immutable, and Mercurial breaks hard links before it
+# writes to a file), so copies of a tree can share them with hard links
+IMMUTABLE_DIRS = [
+    os.path.join('.git', 'objects'),
+    os.path.join('.hg', 'store'),
+]
+
+# from linux/fs.h: make the destination file share the source's data blocks
+FICLONE = 0x40049409
+
+def _reflink(fsrc, fdst):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError):
+        # not supported by this filesystem, or across filesystems
+        return False
+    return True
+
+def copyFile(src, dst):
+    """Copy the file SRC to DST, along with its mode and times. Where the
+    filesystem supports it (btrfs, xfs), the copy is a reflink that shares
+    the source's data blocks until one of them is written to."""
+    fsrc = open(src, 'rb')
+    try:
+        fdst = open(dst, 'wb')
+        try:
+            if not _reflink(fsrc, fdst):
+                shutil.copyfileobj(fsrc, fdst, 1024*1024)
+        finally:
+            fdst.close()
+    finally:
+        fsrc.close()
+    shutil.copystat(src, dst)
+
+def _removePath(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        rmdirRecursive(path)
+    else:
+        if os.name == 'nt':
+            os.chmod(path, 0600)
+        os.remove(path)
+
+def syncTree(fromdir, todir, immutableDirs=IMMUTABLE_DIRS, interrupted=None):
+    """Make TODIR a copy of FROMDIR, like 'rsync -a --delete' would: files
+    in TODIR that already match their source by size and mtime are left
+    alone, the rest are copied, and anything not in FROMDIR is removed.
+    Files under IMMUTABLE_DIRS are hard-linked rather than copied where
+    possible.
+
+    This blocks, so run it in a thread. If INTERRUPTED is given, it is
+    called before each file, and AbandonChain is raised if it returns True.
+
+    Returns a dictionary counting the files that were copied, linked,
+    unchanged and removed."""
+    counts = dict(copied=0, linked=0, unchanged=0, removed=0)
+    parent = os.path.dirname(todir)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+    _syncDir(fromdir, todir, '', immutableDirs, interrupted, counts)
+    return counts
+
+def _syncDir(src, dst, relpath, immutableDirs, interrupted, counts):
+    if os.path.islink(dst) or (os.path.exists(dst) and
+                               not os.path.isdir(dst)):
+        _removePath(dst)
+        counts['removed'] += 1
+    if not os.path.isdir(dst):
+        os.mkdir(dst)
+
+    names = os.listdir(src)
+    wanted = dict.fromkeys(names)
+    for name in os.listdir(dst):
+        if name not in wanted:
+            _removePath(os.path.join(dst, name))
+            counts['removed'] += 1
+
+    immutable = False
+    for d in immutableDirs:
+        if relpath == d or relpath.startswith(d + os.sep):
+            immutable = True
+
+    for name in names:
+        if interrupted and interrupted():
+            raise AbandonChain(1)
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        st = os.lstat(s)
+        try:
+            dt = os.lstat(d)
+        except OSError:
+            dt = None
+
+        if stat.S_ISLNK(st.st_mode):
+            target = os.readlink(s)
+            if dt and stat.S_ISLNK(dt.st_mode) and os.readlink(d) == target:
+                counts['unchanged'] += 1
+                continue
+            if dt:
+                _removePath(d)
+            os.symlink(target, d)
+            counts['copied'] += 1
+        elif stat.S_ISDIR(st.st_mode):
+            _syncDir(s, d, os.path.join(relpath, name), immutableDirs,
+                     interrupted, counts)
+        elif stat.S_ISREG(st.st_mode):
+            if (dt and stat.S_ISREG(dt.st_mode)
+                and dt.st_size == st.st_size
+                and int(dt.st_mtime) == int(st.st_mtime)):
+                counts['unchanged'] += 1
+                continue
+            # never write into an existing file: it may be a hard link
+            # to the source
+            if dt:
+                _removePath(d)
+            if immutable and hasattr(os, 'link'):
+                try:
+                    os.link(s, d)
+                    counts['linked'] += 1
+                    continue
+                except OSError:
+                    pass # probably a different filesystem
+            copyFile(s, d)
+            counts['copied'] += 1
+        else:
+            log.msg("syncTree: skipping special file %s" % s)
+    shutil.copystat(src, dst)
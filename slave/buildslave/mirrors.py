@@ -0,0 +1,275 @@
+"""
+A slave-wide cache of bare git mirrors, shared by the builders' checkouts
+"""
+
+import os
+import re
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+from twisted.python import log, failure
+from twisted.internet import defer, threads, utils
+from twisted.application import service
+
+from buildslave.commands.utils import getCommand, rmdirRecursive
+
+class Mirror:
+    """The bare mirror of a single repository."""
+
+    def __init__(self, repourl, path):
+        self.repourl = repourl
+        self.path = path
+        # Deferreds waiting for the fetch that is under way, and for the
+        # one that will start when it is done
+        self.fetching = None
+        self.nextFetch = None
+
+    def isBusy(self):
+        return self.fetching is not None
+
+class MirrorCache(service.Service):
+    """I keep bare mirrors of the git repositories that this slave's builders
+    check out, in BASEDIR/mirrors. Before a checkout fetches, it asks me for
+    the mirror of its repository. I bring the mirror up to date (unless it
+    already has the revision that was asked for), and the checkout then
+    fetches from the mirror, borrowing its objects through
+    .git/objects/info/alternates. So a repository is only fetched over the
+    network once, however many builders use it.
+
+    Requests that arrive while a mirror is being fetched all wait for the
+    single fetch that follows it, rather than starting one each.
+
+    If maxSize (in bytes) is set, then after each fetch the mirrors that
+    have been used least recently are deleted until they fit. The checkouts
+    that borrow from a mirror are repacked to hold their own objects before
+    it is deleted. A mirror that has been used within minIdle seconds is
+    never deleted.
+    """
+
+    minIdle = 3600
+    expiring = False
+
+    def __init__(self, basedir, maxSize=None):
+        self.basedir = os.path.join(basedir, "mirrors")
+        self.maxSize = maxSize
+        self.mirrors = {}
+
+    def getMirror(self, repourl, revision=None):
+        """Bring the mirror of REPOURL up to date, and return a Deferred that
+        fires with its path. If REVISION is given and the mirror already has
+        it, nothing is fetched."""
+        mirror = self.mirrors.get(repourl)
+        if mirror is None:
+            mirror = Mirror(repourl, self.getMirrorPath(repourl))
+            self.mirrors[repourl] = mirror
+        self._touch(mirror)
+
+        if revision and os.path.isdir(mirror.path) and not mirror.isBusy():
+            d = self._runGit(mirror.path,
+                             ['cat-file', '-e', '%s^{commit}' % revision])
+            def check(res):
+                out, err, rc = res
+                if rc == 0:
+                    return mirror.path
+                return self._update(mirror)
+            d.addCallback(check)
+            return d
+        return self._update(mirror)
+
+    def getMirrorPath(self, repourl):
+        name = re.sub(r'[^\w.-]', '_', repourl.rstrip('/').split('/')[-1])
+        if name.endswith('.git'):
+            name = name[:-4]
+        return os.path.join(self.basedir,
+                            "%s-%s.git" % (name, md5(repourl).hexdigest()[:8]))
+
+    def addBorrower(self, mirrorpath, gitdir):
+        """Record that the repository at GITDIR borrows objects from the
+        mirror at MIRRORPATH, so that it can be made independent of the
+        mirror before the mirror is deleted."""
+        borrowers = os.path.join(mirrorpath, "buildbot-borrowers")
+        gitdir = os.path.abspath(gitdir)
+        if os.path.exists(borrowers):
+            if gitdir in open(borrowers).read().splitlines():
+                return
+        f = open(borrowers, "a")
+        f.write(gitdir + "\n")
+        f.close()
+
+    def _touch(self, mirror):
+        if os.path.isdir(mirror.path):
+            os.utime(mirror.path, None)
+
+    def _update(self, mirror):
+        d = defer.Deferred()
+        if mirror.fetching is None:
+            mirror.fetching = [d]
+            self._startFetch(mirror)
+        else:
+            # the fetch under way may have started before the revision we
+            # want was pushed, so wait for the next one
+            if mirror.nextFetch is None:
+                mirror.nextFetch = []
+            mirror.nextFetch.append(d)
+        return d
+
+    def _startFetch(self, mirror):
+        d = self._fetch(mirror)
+        d.addCallback(lambda _: mirror.path)
+        d.addBoth(self._fetched, mirror)
+
+    def _fetched(self, res, mirror):
+        waiters, mirror.fetching = mirror.fetching, None
+        if mirror.nextFetch is not None:
+            mirror.fetching, mirror.nextFetch = mirror.nextFetch, None
+            self._startFetch(mirror)
+        for d in waiters:
+            if isinstance(res, failure.Failure):
+                d.errback(res)
+            else:
+                d.callback(res)
+        if not isinstance(res, failure.Failure) and self.maxSize:
+            d = self.expire()
+            d.addErrback(log.err, "while expiring git mirrors")
+
+    def _fetch(self, mirror):
+        if os.path.isdir(mirror.path):
+            log.msg("updating mirror of %s" % mirror.repourl)
+            d = self._runGit(mirror.path, ['fetch', '--quiet', '--prune',
+                                           'origin'])
+            d.addCallback(self._checkRC, "fetch", mirror)
+            return d
+
+        log.msg("creating mirror of %s in %s" % (mirror.repourl, mirror.path))
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        tmppath = mirror.path + ".tmp"
+        if os.path.exists(tmppath):
+            rmdirRecursive(tmppath)
+        d = self._runGit(self.basedir, ['clone', '--mirror', '--quiet',
+                                        mirror.repourl, tmppath])
+        d.addCallback(self._checkRC, "clone", mirror)
+        # checkouts borrow objects from the mirror, so it must never prune
+        # objects that aren't reachable from its own refs
+        d.addCallback(lambda _: self._runGit(tmppath,
+                            ['config', 'gc.pruneExpire', 'never']))
+        d.addCallback(self._checkRC, "config", mirror)
+        d.addCallback(lambda _: os.rename(tmppath, mirror.path))
+        return d
+
+    def _checkRC(self, res, what, mirror):
+        out, err, rc = res
+        if rc != 0:
+            raise RuntimeError("git %s of %s failed: %s"
+                               % (what, mirror.repourl, err.strip()))
+        return res
+
+    def _runGit(self, path, args):
+        return utils.getProcessOutputAndValue(getCommand("git"), args,
+                                              env=os.environ, path=path)
+
+    # expiry
+
+    def expire(self):
+        """Delete the least recently used mirrors, until the rest fit in
+        maxSize."""
+        if self.expiring:
+            return defer.succeed(None)
+        self.expiring = True
+        d = threads.deferToThread(self._findExpired)
+        def dissociate(expired):
+            dl = []
+            for path in expired:
+                d = self._dissociateBorrowers(path)
+                d.addCallback(lambda _, path=path: self._deleteMirror(path))
+                dl.append(d)
+            return defer.DeferredList(dl, fireOnOneErrback=True,
+                                      consumeErrors=True)
+        d.addCallback(dissociate)
+        def done(res):
+            self.expiring = False
+            return res
+        d.addBoth(done)
+        return d
+
+    def _findExpired(self):
+        if not os.path.isdir(self.basedir):
+            return []
+        busy = [ m.path for m in self.mirrors.values() if m.isBusy() ]
+        mirrors = []
+        total = 0
+        for name in os.listdir(self.basedir):
+            path = os.path.join(self.basedir, name)
+            if not name.endswith(".git") or not os.path.isdir(path):
+                continue
+            size = _dirSize(path)
+            total += size
+            mirrors.append((os.path.getmtime(path), path, size))
+        mirrors.sort()
+        expired = []
+        idleSince = time.time() - self.minIdle
+        for mtime, path, size in mirrors:
+            if total <= self.maxSize:
+                break
+            if mtime > idleSince or path in busy:
+                continue
+            expired.append(path)
+            total -= size
+        return expired
+
+    def _dissociateBorrowers(self, mirrorpath):
+        borrowers = os.path.join(mirrorpath, "buildbot-borrowers")
+        if not os.path.exists(borrowers):
+            return defer.succeed(None)
+        objects = os.path.join(mirrorpath, "objects")
+        dl = []
+        for gitdir in open(borrowers).read().splitlines():
+            alternates = os.path.join(gitdir, "objects", "info", "alternates")
+            if not os.path.exists(alternates):
+                continue
+            lines = open(alternates).read().splitlines()
+            if objects not in lines:
+                continue
+            # without -l, repack copies in the objects that are borrowed
+            d = self._runGit(gitdir, ['repack', '-a', '-d', '-q'])
+            d.addCallback(self._removeAlternate, gitdir, alternates, objects)
+            dl.append(d)
+        return defer.DeferredList(dl, fireOnOneErrback=True,
+                                  consumeErrors=True)
+
+    def _removeAlternate(self, res, gitdir, alternates, objects):
+        out, err, rc = res
+        if rc != 0:
+            raise RuntimeError("could not repack %s: %s" % (gitdir, err))
+        lines = [ l for l in open(alternates).read().splitlines()
+                  if l != objects ]
+        if lines:
+            open(alternates, "w").write("\n".join(lines) + "\n")
+        else:
+            os.remove(alternates)
+
+    def _deleteMirror(self, path):
+        # it may have been used while its borrowers were being repacked
+        for repourl, mirror in self.mirrors.items():
+            if mirror.path == path and mirror.isBusy():
+                return
+        if os.path.getmtime(path) > time.time() - self.minIdle:
+            return
+        log.msg("deleting unused git mirror %s" % path)
+        for repourl, mirror in self.mirrors.items():
+            if mirror.path == path:
+                del self.mirrors[repourl]
+        return threads.deferToThread(rmdirRecursive, path)
+
+def _dirSize(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return size
@@ -9,21 +9,112 @@ import types
 import re
 import traceback
 import stat
+import struct
+import zlib
 from collections import deque
 
 from twisted.python import runtime, log
+from twisted.python.filepath import FilePath
 from twisted.internet import reactor, defer, protocol, task
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # not Linux, or too old a Twisted
+    inotify = None
 
 from buildslave import util
 from buildslave.exceptions import AbandonChain
 
+class InotifyDispatcher:
+    """I share a single inotify file descriptor between all of the
+    LogFileWatchers. I watch the directories that their logfiles live in,
+    rather than the files themselves, so that I hear about logfiles being
+    created, replaced or deleted, and pass each event on to the watchers of
+    the file it names. The inotify descriptor is closed when the last
+    watcher goes away."""
+
+    if inotify:
+        FILE_EVENTS = (inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE |
+                       inotify.IN_CREATE | inotify.IN_DELETE |
+                       inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO)
+        DIR_EVENTS = inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF
+
+    def __init__(self):
+        self.notifier = None
+        self.watchers = {} # directory -> list of LogFileWatchers
+        self.watched = set() # directories the notifier is watching
+
+    def add(self, watcher):
+        """Start passing events for the watcher's logfile to it. Returns
+        False if that isn't possible, in which case the watcher will have to
+        poll."""
+        if not inotify:
+            return False
+        dirname = os.path.dirname(os.path.abspath(watcher.logfile))
+        try:
+            if self.notifier is None:
+                self.notifier = inotify.INotify()
+                self.notifier.startReading()
+            if dirname not in self.watched:
+                self.notifier.watch(FilePath(dirname),
+                                    mask=self.FILE_EVENTS | self.DIR_EVENTS,
+                                    callbacks=[self._notify])
+                self.watched.add(dirname)
+        except Exception, e:
+            log.msg("unable to watch %s with inotify, polling instead: %s"
+                    % (dirname, e))
+            self._closeIfUnused()
+            return False
+        self.watchers.setdefault(dirname, []).append(watcher)
+        return True
+
+    def remove(self, watcher):
+        dirname = os.path.dirname(os.path.abspath(watcher.logfile))
+        watchers = self.watchers.get(dirname, [])
+        if watcher in watchers:
+            watchers.remove(watcher)
+            if not watchers:
+                del self.watchers[dirname]
+        self._closeIfUnused()
+
+    def _closeIfUnused(self):
+        if self.notifier is not None and not self.watchers:
+            self.notifier.loseConnection()
+            self.notifier = None
+            self.watched.clear()
+
+    def _notify(self, watchpoint, filepath, mask):
+        dirname = watchpoint.path.path
+        if mask & self.DIR_EVENTS and filepath == watchpoint.path:
+            # the directory itself has gone away, so there will be no more
+            # events for the files in it. Make their watchers poll until
+            # the directory comes back.
+            self.watched.discard(dirname)
+            for w in self.watchers.pop(dirname, []):
+                w.fallBackToPolling()
+            self._closeIfUnused()
+            return
+        basename = filepath.basename()
+        for w in self.watchers.get(dirname, [])[:]:
+            # a watcher may be stopped by an earlier event in this batch
+            if w.basename == basename and w.watching:
+                w.poll()
+
+_inotifyDispatcher = InotifyDispatcher()
+
 class LogFileWatcher:
     POLL_INTERVAL = 2
+    # with inotify, polling is only a safety net in case events are lost
+    INOTIFY_POLL_INTERVAL = 30
+    READ_SIZE = 65536
+
+    useInotify = True
 
     def __init__(self, command, name, logfile, follow=False):
         self.command = command
         self.name = name
         self.logfile = logfile
+        self.basename = os.path.basename(logfile)
 
         log.msg("LogFileWatcher created to watch %s" % logfile)
         # we are created before the ShellCommand starts. If the logfile we're
@@ -36,17 +127,37 @@ class LogFileWatcher:
         # added since we started watching
         self.follow = follow
 
-        # every 2 seconds we check on the file again
+        # when inotify is available, we hear about changes to the file as
+        # they happen. Otherwise we check on the file every 2 seconds.
+        self.watching = False
         self.poller = task.LoopingCall(self.poll)
 
     def start(self):
-        self.poller.start(self.POLL_INTERVAL).addErrback(self._cleanupPoll)
+        interval = self.POLL_INTERVAL
+        if self.useInotify and _inotifyDispatcher.add(self):
+            self.watching = True
+            interval = self.INOTIFY_POLL_INTERVAL
+        self._startPolling(interval)
+
+    def _startPolling(self, interval):
+        self.poller.start(interval).addErrback(self._cleanupPoll)
 
     def _cleanupPoll(self, err):
         log.err(err, msg="Polling error")
         self.poller = None
 
+    def fallBackToPolling(self):
+        """inotify can no longer tell us about changes to the file, so go
+        back to polling it."""
+        self.watching = False
+        if self.poller is not None and self.poller.running:
+            self.poller.stop()
+            self._startPolling(self.POLL_INTERVAL)
+
     def stop(self):
+        if self.watching:
+            _inotifyDispatcher.remove(self)
+            self.watching = False
         self.poll()
         if self.poller is not None:
             self.poller.stop()
@@ -77,9 +188,36 @@ class LogFileWatcher:
             if self.follow:
                 self.f.seek(s[2], 0)
             self.started = True
+        self.readFile()
+
+        # see if the file has been truncated, or replaced by a new one
+        try:
+            s = os.stat(self.logfile)
+        except OSError:
+            return # deleted: wait and see if it comes back
+        fs = os.fstat(self.f.fileno())
+        if (s.st_dev, s.st_ino) != (fs.st_dev, fs.st_ino):
+            # the file was rotated. We've read the rest of the old one, so
+            # carry on with the new one, from its start
+            try:
+                f = open(self.logfile, "rb")
+            except IOError:
+                return
+            log.msg("LogFileWatcher: %s was replaced, reopening it"
+                    % self.logfile)
+            self.f.close()
+            self.f = f
+            self.readFile()
+        elif s.st_size < self.f.tell():
+            log.msg("LogFileWatcher: %s was truncated, reading it from the "
+                    "start" % self.logfile)
+            self.f.seek(0, 0)
+            self.readFile()
+
+    def readFile(self):
         self.f.seek(self.f.tell(), 0)
         while True:
-            data = self.f.read(10000)
+            data = self.f.read(self.READ_SIZE)
             if not data:
                 return
             self.command.addLogfile(self.name, data)
@@ -169,6 +307,16 @@ class RunProcess:
     BUFFER_SIZE = 64*1024
     BUFFER_TIMEOUT = 5
 
+    # In update format 2, framed records of at least this many bytes are
+    # zlib-compressed before they are sent (if that makes them smaller). Set
+    # to None to never compress.
+    COMPRESS_THRESHOLD = 4*1024
+
+    # the header of each framed record: kind, length of the log name, length
+    # of the data.  See buildbot.process.buildstep.LoggedRemoteCommand.
+    FRAME_HEADER = ">cHI"
+    FRAME_KINDS = {'stdout': 'o', 'stderr': 'e', 'header': 'h'}
+
     # For sending elapsed time:
     startTime = None
     elapsedTime = None
@@ -504,6 +652,77 @@ class RunProcess:
         """
         Send all the content in our buffers.
         """
+        if self.builder.updateFormat >= 2:
+            self._sendFramedBuffers()
+        else:
+            self._sendDictBuffers()
+        self.buflen = 0
+        if self.buftimer:
+            if self.buftimer.active():
+                self.buftimer.cancel()
+            self.buftimer = None
+
+    def _frameRecord(self, logname, data):
+        if isinstance(logname, tuple):
+            kind, name = 'l', logname[1]
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+        else:
+            kind, name = self.FRAME_KINDS[logname], ''
+        return struct.pack(self.FRAME_HEADER, kind, len(name),
+                           len(data)) + name + data
+
+    def _sendFrames(self, frames):
+        frames = "".join(frames)
+        if (self.COMPRESS_THRESHOLD is not None
+            and len(frames) >= self.COMPRESS_THRESHOLD):
+            compressed = zlib.compress(frames)
+            if len(compressed) < len(frames):
+                self.sendStatus({'frames_z': compressed})
+                return
+        self.sendStatus({'frames': frames})
+
+    def _sendFramedBuffers(self):
+        """
+        Send the buffers as a sequence of framed (logname, data) records.
+        Unlike a dictionary, this keeps output from different logs in order
+        in a single message. Consecutive output for the same log is
+        coalesced into one record.
+        """
+        frames = []
+        msg_size = 0
+        lastlog = None
+        logdata = []
+        while self.buffered:
+            logname, data = self.buffered.popleft()
+            if logname != lastlog and logdata:
+                frames.append(self._frameRecord(lastlog, "".join(logdata)))
+                logdata = []
+            lastlog = logname
+
+            # Chunkify the log data to make sure we're not sending more than
+            # CHUNK_LIMIT at a time
+            for chunk in self._chunkForSend(data):
+                if len(chunk) == 0: continue
+                logdata.append(chunk)
+                msg_size += len(chunk)
+                if msg_size >= self.CHUNK_LIMIT:
+                    frames.append(self._frameRecord(logname,
+                                                    "".join(logdata)))
+                    self._sendFrames(frames)
+                    frames = []
+                    logdata = []
+                    msg_size = 0
+        if logdata:
+            frames.append(self._frameRecord(lastlog, "".join(logdata)))
+        if frames:
+            self._sendFrames(frames)
+
+    def _sendDictBuffers(self):
+        """
+        Send the buffers as dictionaries mapping logname to data, for
+        masters that don't understand framed updates.
+        """
         msg = {}
         msg_size = 0
         lastlog = None
@@ -516,9 +735,8 @@ class RunProcess:
             # out the message so far.  This is because the message is
             # transferred as a dictionary, which makes the ordering of keys
             # unspecified, and makes it impossible to interleave data from
-            # different logs.  A future enhancement could be to change the
-            # master to support a list of (logname, data) tuples instead of a
-            # dictionary.
+            # different logs.  Newer masters accept framed updates instead;
+            # see _sendFramedBuffers.
             # On our first pass through this loop lastlog is None
             if lastlog is None:
                 lastlog = logname
@@ -544,13 +762,8 @@ class RunProcess:
                     msg = {}
                     logdata = msg.setdefault(logname, [])
                     msg_size = 0
-        self.buflen = 0
         if logdata:
             self._sendMessage(msg)
-        if self.buftimer:
-            if self.buftimer.active():
-                self.buftimer.cancel()
-            self.buftimer = None
 
     def _addToBuffers(self, logname, data):
         """
@@ -172,6 +172,7 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
 
         # get a SlaveBuilder object from the bot and wrap it as a fake remote
         builders = self.bot.remote_setBuilderList([('sb', 'sb')])
+        self.slavebuilder = builders['sb']
         self.sb = FakeRemote(builders['sb'])
 
         self.setUpCommand()
@@ -236,6 +237,27 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_startCommand_updateFormat(self):
+        st = FakeStep()
+        self.patch_runprocess(
+            Expect([ 'echo', 'hello' ], os.path.join(self.basedir, 'sb', 'workdir'))
+            + { 'rc' : 0 }
+            + 0,
+        )
+
+        d = self.sb.callRemote("startCommand", FakeRemote(st),
+                               "13", "shell", dict(
+                                         command=[ 'echo', 'hello' ],
+                                         workdir='workdir',
+                                         update_format=3,
+                                     ))
+        d.addCallback(lambda _ : st.wait_for_finish())
+        def check(_):
+            # we only know about format 2
+            self.assertEqual(self.slavebuilder.updateFormat, 2)
+        d.addCallback(check)
+        return d
+
     def test_startCommand_interruptCommand(self):
         # set up a fake step to receive updates
         st = FakeStep()
@@ -303,3 +325,58 @@ class TestSlaveBuilder(command.CommandTestMixin, unittest.TestCase):
             self.assertTrue(isinstance(st.actions[0][1], failure.Failure))
         d.addCallback(check)
         return d
+
+class TestDirectoryReaper(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath("reaper")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.builddir = os.path.join(self.basedir, "bld")
+        os.makedirs(self.builddir)
+        self.reaper = bot.DirectoryReaper(self.basedir, maxDeletions=1)
+
+    def tearDown(self):
+        if not self.reaper.running:
+            return
+        d = self.reaper.waitUntilIdle()
+        d.addCallback(lambda _ : self.reaper.stopService())
+        return d
+
+    def makeTree(self, name):
+        path = os.path.join(self.builddir, name)
+        os.makedirs(os.path.join(path, "sub"))
+        open(os.path.join(path, "sub", "file"), "w").write("x")
+        return path
+
+    def test_reap(self):
+        self.reaper.startService()
+        workdir = self.makeTree("workdir")
+        self.assertTrue(self.reaper.reap(workdir))
+        self.assertFalse(os.path.exists(workdir))
+        # a second clobber before the first deletion has finished
+        self.makeTree("workdir")
+        self.assertTrue(self.reaper.reap(workdir))
+        self.assertEqual(self.reaper.deleting, [workdir + ".deleting"])
+        self.assertEqual(self.reaper.pending, [workdir + ".deleting.1"])
+        d = self.reaper.waitUntilIdle()
+        def check(_):
+            self.assertEqual(os.listdir(self.builddir), [])
+        d.addCallback(check)
+        return d
+
+    def test_leftovers(self):
+        self.makeTree("workdir.deleting")
+        self.makeTree("source.deleting.2")
+        self.makeTree("keepme")
+        self.reaper.startService()
+        d = self.reaper.waitUntilIdle()
+        def check(_):
+            self.assertEqual(os.listdir(self.builddir), ["keepme"])
+        d.addCallback(check)
+        return d
+
+    def test_not_running(self):
+        workdir = self.makeTree("workdir")
+        self.assertFalse(self.reaper.reap(workdir))
+        self.assertTrue(os.path.exists(workdir))
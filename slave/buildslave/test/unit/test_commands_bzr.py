@@ -35,9 +35,6 @@ class TestBzr(SourceCommandTestMixin, unittest.TestCase):
             branch-nick: bzr.dev
         """)
         expects = [
-            Expect([ 'clobber', 'workdir' ],
-                self.basedir)
-                + 0,
             Expect([ 'clobber', 'source' ],
                 self.basedir)
                 + 0,
@@ -28,9 +28,6 @@ class TestCVS(SourceCommandTestMixin, unittest.TestCase):
 
         exp_environ = dict(PWD='.', LC_MESSAGES='C')
         expects = [
-            Expect([ 'clobber', 'workdir' ],
-                self.basedir)
-                + 0,
             Expect([ 'clobber', 'source' ],
                 self.basedir)
                 + 0,
@@ -27,9 +27,6 @@ class TestDarcs(SourceCommandTestMixin, unittest.TestCase):
 
         exp_environ = dict(PWD='.', LC_MESSAGES='C')
         expects = [
-            Expect([ 'clobber', 'workdir' ],
-                self.basedir)
-                + 0,
             Expect([ 'clobber', 'source' ],
                 self.basedir)
                 + 0,
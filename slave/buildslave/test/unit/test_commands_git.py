@@ -2,6 +2,7 @@ import os
 
 from twisted.trial import unittest
 from twisted.python import runtime
+from twisted.internet import defer
 
 from buildslave.test.fake.runprocess import Expect
 from buildslave.test.util.sourcecommand import SourceCommandTestMixin
@@ -27,9 +28,6 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
 
         exp_environ = dict(PWD='.', LC_MESSAGES='C')
         expects = [
-            Expect([ 'clobber', 'workdir' ],
-                self.basedir)
-                + 0,
             Expect([ 'clobber', 'source' ],
                 self.basedir)
                 + 0,
@@ -70,3 +68,27 @@ class TestGit(SourceCommandTestMixin, unittest.TestCase):
         d.addCallback(self.check_sourcedata, "git://github.com/djmitche/buildbot.git master\n")
         return d
 
+
+    def test_mirror_failure_fetches_directly(self):
+        self.make_command(git.Git, dict(
+            workdir='workdir',
+            mode='update',
+            revision=None,
+            repourl='git://github.com/djmitche/buildbot.git',
+        ))
+        class FakeMirrors:
+            def getMirror(self, repourl, revision):
+                return defer.succeed('/no/such/mirror')
+        self.builder.mirrors = FakeMirrors()
+        self.cmd.srcdir = 'source'
+        fetched = []
+        self.cmd._fetchFrom = fetched.append
+        # there is no .git to add the mirror's objects to, so borrowing
+        # from the mirror fails
+        d = self.cmd._doFetch(None)
+        def check(_):
+            self.assertEqual(fetched,
+                             ['git://github.com/djmitche/buildbot.git'])
+            self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        d.addCallback(check)
+        return d
@@ -53,9 +53,6 @@ View:
 \t//mydepot/myproj/mytrunk/... //buildbot_test_10/source/...
 """ % self.basedir
         expects = [
-            Expect([ 'clobber', 'workdir' ],
-                self.basedir)
-                + 0,
             Expect([ 'clobber', 'source' ],
                 self.basedir)
                 + 0,
@@ -3,6 +3,10 @@ import sys
 import shutil
 import tarfile
 import StringIO
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
 
 from twisted.trial import unittest
 from twisted.internet import task, defer, reactor
@@ -32,9 +36,28 @@ class FakeMasterMethods(object):
         self.read = False
         self.data = ''
 
-    def remote_write(self, data):
+        # for windowed transfers
+        self.resume_data = '' # what the writer already has
+        self.checksum = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def remote_resume(self):
+        self.add_update('resume')
+        return (len(self.resume_data), md5(self.resume_data).hexdigest())
+
+    def remote_checksum(self, length):
+        self.add_update('checksum %d' % length)
+        if len(self.data) < length:
+            return None
+        return md5(self.data[:length]).hexdigest()
+
+    def remote_write(self, data, offset=None):
         if self.count_writes:
-            self.add_update('write %d' % len(data))
+            if offset is None:
+                self.add_update('write %d' % len(data))
+            else:
+                self.add_update('write %d@%d' % (len(data), offset))
         elif not self.written:
             self.add_update('write(s)')
             self.written = True
@@ -47,29 +70,45 @@ class FakeMasterMethods(object):
             reactor.callLater(0.01, d.callback, None)
             return d
 
-    def remote_read(self, length):
+    def remote_read(self, length, offset=None):
         if self.count_reads:
-            self.add_update('read %d' % length)
+            if offset is None:
+                self.add_update('read %d' % length)
+            else:
+                self.add_update('read %d@%d' % (length, offset))
         elif not self.read:
             self.add_update('read(s)')
             self.read = True
 
-        if not self.data:
+        if offset is not None:
+            # windowed reads leave the data in place
+            slice = self.data[offset:offset+length]
+        elif not self.data:
             return ''
-
-        slice, self.data = self.data[:length], self.data[length:]
+        else:
+            slice, self.data = self.data[:length], self.data[length:]
         if self.delay_read:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
             d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, slice)
+            def fire(_):
+                self.in_flight -= 1
+                return slice
+            d.addCallback(fire)
+            reactor.callLater(0.01, d.callback, None)
             return d
         else:
             return slice
 
-    def remote_unpack(self):
+    def remote_unpack(self, checksum=None):
         self.add_update('unpack')
+        self.checksum = checksum
 
-    def remote_close(self):
+    def remote_close(self, checksum=None):
         self.add_update('close')
+        if checksum is not None:
+            self.checksum = checksum
+        return self.checksum
 
 class TestUploadFile(CommandTestMixin, unittest.TestCase):
 
@@ -194,6 +233,89 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+    def test_windowed(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            window=4,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    {'header': 'sending %s' % self.datafile},
+                    'write 64@0', 'write 64@64', 'write 52@128', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.checksum,
+                             md5(self.fakemaster.data).hexdigest())
+        d.addCallback(check)
+        return d
+
+    def test_resume(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.resume_data = open(self.datafile, "rb").read()[:100]
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            window=4,
+            resume=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    {'header': 'sending %s' % self.datafile},
+                    'resume', 'write 64@100', 'write 16@164', 'close',
+                    {'rc': 0}
+                ])
+            # the checksum covers the whole file, not just what was sent
+            self.assertEqual(self.fakemaster.checksum,
+                    md5(open(self.datafile, "rb").read()).hexdigest())
+        d.addCallback(check)
+        return d
+
+    def test_resume_changed(self):
+        # the writer has the start of an older version of the file
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.resume_data = "this was other data\n" * 5
+
+        self.make_command(transfer.SlaveFileUploadCommand, dict(
+            workdir='workdir',
+            slavesrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            window=4,
+            resume=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    {'header': 'sending %s' % self.datafile},
+                    'resume', 'write 0@0', 'write 64@0', 'write 64@64',
+                    'write 52@128', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.checksum,
+                    md5(open(self.datafile, "rb").read()).hexdigest())
+        d.addCallback(check)
+        return d
+
 class TestSlaveDirectoryUpload(CommandTestMixin, unittest.TestCase):
 
     def setUp(self):
@@ -423,3 +545,123 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         dl.addCallback(check)
         return dl
 
+    def test_windowed(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = '1234' * 13
+        self.fakemaster.checksum = md5(test_data).hexdigest()
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=None,
+            window=3,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # the end of the file is only discovered when the short block
+            # at 48 arrives, by which time two more reads are in flight
+            self.assertEqual(self.get_updates(), [
+                    'read 16@0', 'read 16@16', 'read 16@32', 'read 16@48',
+                    'read 16@64', 'read 16@80', 'close',
+                    {'rc': 0}
+                ])
+            self.assertEqual(self.fakemaster.max_in_flight, 3)
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+            self.assertFalse(os.path.exists(datafile + ".partial"))
+        d.addCallback(check)
+        return d
+
+    def test_windowed_checksum_mismatch(self):
+        self.fakemaster.data = '1234' * 13
+        self.fakemaster.checksum = md5('something else').hexdigest()
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=None,
+            window=3,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            datafile = os.path.join(self.basedir, '.', 'data')
+            updates = self.get_updates()
+            self.assertEqual(updates[-1]['rc'], 1)
+            self.assertTrue(updates[-1]['stderr'].startswith(
+                    "Checksum mismatch downloading '%s'" % datafile))
+            self.assertFalse(os.path.exists(datafile))
+            self.assertFalse(os.path.exists(datafile + ".partial"))
+        d.addCallback(check)
+        return d
+
+    def test_windowed_resume(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = 'tenchars--' * 5
+        self.fakemaster.checksum = md5(test_data).hexdigest()
+        open(os.path.join(self.basedir, 'data.partial'), 'wb').write(
+                test_data[:30])
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=16,
+            mode=None,
+            window=3,
+            resume=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    'checksum 30', 'read 16@30', 'read 16@46', 'close',
+                    {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_resume_changed(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data = 'tenchars--' * 5
+        self.fakemaster.checksum = md5(test_data).hexdigest()
+        # left over from a download of an older version of the file
+        open(os.path.join(self.basedir, 'data.partial'), 'wb').write(
+                'old chars-' * 4)
+
+        self.make_command(transfer.SlaveFileDownloadCommand, dict(
+            workdir='.',
+            slavedest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            window=3,
+            resume=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertEqual(self.get_updates(), [
+                    'checksum 40', 'read 32@0', 'read 32@32', 'close',
+                    {'rc': 0}
+                ])
+            datafile = os.path.join(self.basedir, 'data')
+            self.assertEqual(open(datafile).read(), test_data)
+        d.addCallback(check)
+        return d
@@ -6,6 +6,7 @@ from twisted.python import runtime
 import twisted.python.procutils
 
 from buildslave.commands import utils
+from buildslave.exceptions import AbandonChain
 
 class GetCommand(unittest.TestCase):
 
@@ -116,3 +117,67 @@ class RmdirRecursive(unittest.TestCase):
             os.rmdir("noperms")
 
         self.assertFalse(os.path.exists(self.target))
+
+class SyncTree(unittest.TestCase):
+
+    def setUp(self):
+        self.src = os.path.abspath("synctree-src")
+        self.dst = os.path.abspath("synctree-dst")
+        for d in self.src, self.dst:
+            if os.path.exists(d):
+                shutil.rmtree(d)
+        os.makedirs(os.path.join(self.src, "d"))
+        os.makedirs(os.path.join(self.src, ".git", "objects", "ab"))
+        self.write(self.src, "a", "aaa")
+        self.write(self.src, "d/b", "bbb")
+        self.write(self.src, ".git/objects/ab/cdef", "object")
+
+    def tearDown(self):
+        for d in self.src, self.dst:
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+    def write(self, base, name, data):
+        open(os.path.join(base, name), "w").write(data)
+
+    def read(self, base, name):
+        return open(os.path.join(base, name)).read()
+
+    def test_copy(self):
+        counts = utils.syncTree(self.src, self.dst)
+        self.assertEqual(self.read(self.dst, "a"), "aaa")
+        self.assertEqual(self.read(self.dst, "d/b"), "bbb")
+        self.assertEqual(self.read(self.dst, ".git/objects/ab/cdef"),
+                         "object")
+        self.assertEqual(int(os.path.getmtime(os.path.join(self.dst, "a"))),
+                         int(os.path.getmtime(os.path.join(self.src, "a"))))
+        if hasattr(os, 'link'):
+            self.assertEqual(counts, dict(copied=2, linked=1, unchanged=0,
+                                          removed=0))
+            self.assertTrue(os.path.samefile(
+                os.path.join(self.src, ".git/objects/ab/cdef"),
+                os.path.join(self.dst, ".git/objects/ab/cdef")))
+
+    def test_incremental(self):
+        utils.syncTree(self.src, self.dst)
+        # the source changes, and the build leaves some droppings
+        self.write(self.src, "a", "a changed")
+        self.write(self.dst, "d/b.o", "object code")
+        os.mkdir(os.path.join(self.dst, "build"))
+        counts = utils.syncTree(self.src, self.dst)
+        self.assertEqual(self.read(self.dst, "a"), "a changed")
+        self.assertEqual(sorted(os.listdir(self.dst)), [".git", "a", "d"])
+        self.assertEqual(os.listdir(os.path.join(self.dst, "d")), ["b"])
+        self.assertEqual(counts, dict(copied=1, linked=0, unchanged=2,
+                                      removed=2))
+
+    def test_symlinks(self):
+        if runtime.platformType  == 'win32':
+            raise unittest.SkipTest("no symlinks on this platform")
+        os.symlink("d/b", os.path.join(self.src, "link"))
+        utils.syncTree(self.src, self.dst)
+        self.assertEqual(os.readlink(os.path.join(self.dst, "link")), "d/b")
+
+    def test_interrupted(self):
+        self.assertRaises(AbandonChain, lambda :
+                utils.syncTree(self.src, self.dst, interrupted=lambda : True))
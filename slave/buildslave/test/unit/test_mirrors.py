@@ -0,0 +1,104 @@
+import os
+import shutil
+import subprocess
+
+from twisted.trial import unittest
+from twisted.python import procutils
+
+from buildslave import mirrors
+
+def git(path, *args):
+    p = subprocess.Popen(['git'] + list(args), cwd=path,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    return out.strip()
+
+class TestMirrorCache(unittest.TestCase):
+
+    def setUp(self):
+        if not procutils.which('git'):
+            raise unittest.SkipTest("git is not installed")
+        self.basedir = os.path.abspath("mirrors")
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        self.origin = os.path.join(self.basedir, "origin")
+        os.makedirs(self.origin)
+        git(self.origin, 'init', '-q')
+        git(self.origin, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        self.commit('one')
+        self.cache = mirrors.MirrorCache(self.basedir)
+
+        self.fetches = 0
+        fetch = self.cache._fetch
+        def counting_fetch(mirror):
+            self.fetches += 1
+            return fetch(mirror)
+        self.cache._fetch = counting_fetch
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def commit(self, data):
+        open(os.path.join(self.origin, "file"), "w").write(data)
+        git(self.origin, 'add', 'file')
+        git(self.origin, '-c', 'user.name=test', '-c', 'user.email=test@test',
+            'commit', '-q', '-m', data)
+        return git(self.origin, 'rev-parse', 'HEAD')
+
+    def test_coalesced(self):
+        dl = [ self.cache.getMirror(self.origin) for i in range(3) ]
+        d = dl[0]
+        for other in dl[1:]:
+            d.addCallback(lambda _, other=other: other)
+        def check(path):
+            # one fetch for the first request, and one shared by the others
+            self.assertEqual(self.fetches, 2)
+            self.assertEqual(path, self.cache.getMirrorPath(self.origin))
+            self.assertEqual(git(path, 'config', 'gc.pruneExpire'), 'never')
+        d.addCallback(check)
+        return d
+
+    def test_revision(self):
+        d = self.cache.getMirror(self.origin)
+        d.addCallback(lambda _ : self.cache.getMirror(self.origin,
+                                git(self.origin, 'rev-parse', 'HEAD')))
+        def checkPresent(_):
+            # it already had that revision
+            self.assertEqual(self.fetches, 1)
+            return self.cache.getMirror(self.origin, self.commit('two'))
+        d.addCallback(checkPresent)
+        def checkFetched(path):
+            self.assertEqual(self.fetches, 2)
+            self.assertEqual(git(path, 'rev-parse', 'HEAD'),
+                             git(self.origin, 'rev-parse', 'HEAD'))
+        d.addCallback(checkFetched)
+        return d
+
+    def test_expire(self):
+        checkout = os.path.join(self.basedir, "checkout")
+        os.makedirs(checkout)
+        git(checkout, 'init', '-q')
+        d = self.cache.getMirror(self.origin)
+        def borrow(path):
+            self.mirrorpath = path
+            gitdir = os.path.join(checkout, '.git')
+            open(os.path.join(gitdir, 'objects', 'info', 'alternates'),
+                 'w').write(os.path.join(path, 'objects') + '\n')
+            self.cache.addBorrower(path, gitdir)
+            git(checkout, 'fetch', '-q', path, 'master:refs/heads/mirrored')
+            self.cache.maxSize = 1
+            self.cache.minIdle = -1
+            return self.cache.expire()
+        d.addCallback(borrow)
+        def check(_):
+            self.assertFalse(os.path.exists(self.mirrorpath))
+            self.assertFalse(os.path.exists(os.path.join(checkout, '.git',
+                                    'objects', 'info', 'alternates')))
+            # the checkout has its own copy of the objects now
+            git(checkout, 'fsck')
+            self.assertEqual(git(checkout, 'cat-file', '-p',
+                                 'mirrored:file'), 'one')
+        d.addCallback(check)
+        return d
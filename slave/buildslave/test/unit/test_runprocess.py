@@ -1,10 +1,11 @@
 import sys
 import re
 import os
+import zlib
 
 import twisted
 from twisted.trial import unittest
-from twisted.internet import task, defer
+from twisted.internet import task, defer, reactor
 from twisted.python import runtime
 
 from buildslave.test.util.misc import nl
@@ -269,6 +270,36 @@ class TestLogging(unittest.TestCase):
         s._addToBuffers('stdout', data)
         self.failUnlessEqual(len(b.updates), 1)
 
+    def testSendFramedInterleaved(self):
+        basedir = "test_slave_commands_base.logging.sendFramedInterleaved"
+        b = FakeSlaveBuilder(False, basedir)
+        b.updateFormat = 2
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+        s._addToBuffers('stdout', 'hello ')
+        s._addToBuffers('stdout', 'there ')
+        s._addToBuffers('stderr', 'DIEEEEEEE')
+        s._addToBuffers(('log', 'foo'), 'logdata')
+        s._addToBuffers('stdout', 'world')
+        s._sendBuffers()
+        self.failUnlessEqual(b.updates, [
+            {'frames': "o\x00\x00\x00\x00\x00\x0chello there "
+                       "e\x00\x00\x00\x00\x00\x09DIEEEEEEE"
+                       "l\x00\x03\x00\x00\x00\x07foologdata"
+                       "o\x00\x00\x00\x00\x00\x05world"},
+            ])
+
+    def testSendFramedCompressed(self):
+        basedir = "test_slave_commands_base.logging.sendFramedCompressed"
+        b = FakeSlaveBuilder(False, basedir)
+        b.updateFormat = 2
+        s = runprocess.RunProcess(b, stdoutCommand('hello'), basedir)
+        data = "x" * (runprocess.RunProcess.CHUNK_LIMIT * 3 / 2)
+        s._addToBuffers('stdout', data)
+        s._sendBuffers()
+        self.failUnlessEqual(len(b.updates), 2)
+        frames = "".join([zlib.decompress(u['frames_z']) for u in b.updates])
+        self.failUnlessEqual(len(frames), len(data) + 2 * 7)
+
 class TestLogFileWatcher(unittest.TestCase):
     def makeRP(self):
         b = FakeSlaveBuilder(False, 'base')
@@ -289,3 +320,75 @@ class TestLogFileWatcher(unittest.TestCase):
         st = lf.statFile()
         self.assertEqual(st and st[2], 2, "statfile.log exists and size is correct")
         os.remove('statfile.log')
+
+class FakeLogCommand:
+    def __init__(self):
+        self.data = []
+        self.waiter = None
+    def addLogfile(self, name, data):
+        self.data.append(data)
+        if self.waiter:
+            d, self.waiter = self.waiter, None
+            # let the watcher finish what it's doing first
+            reactor.callLater(0, d.callback, None)
+    def waitForData(self):
+        self.waiter = defer.Deferred()
+        return self.waiter
+
+class TestLogFileWatcherChanges(unittest.TestCase):
+    def setUp(self):
+        self.basedir = os.path.abspath('logfilewatcher')
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        self.logfile = os.path.join(self.basedir, 'test.log')
+        if os.path.exists(self.logfile):
+            os.remove(self.logfile)
+        self.cmd = FakeLogCommand()
+        self.lf = runprocess.LogFileWatcher(self.cmd, 'test', self.logfile)
+
+    def write(self, data, mode='ab'):
+        f = open(self.logfile, mode)
+        f.write(data)
+        f.close()
+
+    def test_truncated(self):
+        self.write('one\n')
+        self.lf.poll()
+        self.write('2\n', 'wb')
+        self.lf.poll()
+        self.assertEqual(''.join(self.cmd.data), 'one\n2\n')
+
+    def test_replaced(self):
+        self.write('one\n')
+        self.lf.poll()
+        os.rename(self.logfile, self.logfile + '.old')
+        self.write('two\n')
+        self.lf.poll()
+        self.assertEqual(''.join(self.cmd.data), 'one\ntwo\n')
+        self.lf.f.close()
+
+    def test_inotify(self):
+        if not runprocess.inotify:
+            raise unittest.SkipTest("inotify is not available")
+        # the watcher must not depend on the poller to see the change
+        self.lf.INOTIFY_POLL_INTERVAL = 3600
+        self.lf.start()
+        self.failUnless(self.lf.watching)
+        d = self.cmd.waitForData()
+        self.write('hello\n')
+        def check(_):
+            self.assertEqual(''.join(self.cmd.data), 'hello\n')
+            self.lf.stop()
+            self.failIf(self.lf.watching)
+            self.assertEqual(runprocess._inotifyDispatcher.notifier, None)
+        d.addCallback(check)
+        return d
+    test_inotify.timeout = 10
+
+    def test_polling_fallback(self):
+        self.lf.useInotify = False
+        self.lf.start()
+        self.failIf(self.lf.watching)
+        self.write('hello\n')
+        self.lf.stop()
+        self.assertEqual(''.join(self.cmd.data), 'hello\n')